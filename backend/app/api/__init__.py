@@ -1,20 +1,71 @@
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Dict, Any, Tuple
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from fastapi.responses import Response, StreamingResponse
+from google.api_core.exceptions import FailedPrecondition
 from google.cloud import firestore
 from app.core.firebase import get_db
 from app.core.auth import get_current_user
 from app.core.audit import get_audit_logger
+from app.core.indexes import index_fallback_counts, record_index_fallback
+from app.core.money import ITEM_AMOUNTS, Money, Quantity, Rate, value_of, with_units
 from app.services.inventory import InventoryService
-from app.services.customers import get_customers_service
+from app.services.accounting import AccountingService
+from app.services.customers import (
+    CUSTOMER_SUMMARY_TOTALS,
+    EMPTY_CUSTOMER_SUMMARY,
+    get_customers_service,
+)
 from app.services.invoices import get_invoice_service
 from app.services.users import get_users_service
+from app.services.stock_snapshots import get_stock_snapshot_service
+from app.services.ar_aging import OPEN_PAYMENT_STATUSES, get_ar_aging_service
+from app.services.numbering import get_numbering_service
+from app.services.integrity import get_integrity_service
+from app.services.returns import get_return_service
+from app.services.transfers import get_transfer_service
+from app.services.amount_migration import get_amount_migration_service
+from app.services.gl_outbox import get_gl_outbox_service
+from app.services.account_ledger import get_account_ledger_service
+from app.services.fiscal import get_fiscal_service
+from app.services.gl_cube import get_gl_cube_service
+from app.services.gl_snapshots import day_key, get_gl_snapshot_service
+from app.services.ledger_watermark import get_ledger_watermark_service
+from app.services.report_cache import MISS, get_report_cache
+from app.services.reporting import ReportingService, csv_lines, ndjson_lines
+from app.services.stock_levels import (
+    DEFAULT_WAREHOUSE,
+    StockLevelService,
+    get_stock_level_service,
+)
+from app.services.rendering import (
+    BATCH_OUTPUTS,
+    FORMATS as RENDER_FORMATS,
+    etag_matches,
+    get_batch_renderer,
+    get_invoice_renderer,
+    invalidate_company_branding,
+)
+from app.services.customer_search import (
+    DEFAULT_SEARCH_LIMIT,
+    build_search_fields,
+    find_customers_by_phone,
+    reindex_customers,
+    search_customers,
+)
 from app.schemas.customers import CustomerCreate
 from app.schemas.invoices import InvoiceCreate
 from app.schemas.erp import EmployeeCreate
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Firestore caps a single transaction/batch at 500 writes.
+FIRESTORE_WRITE_LIMIT = 500
 
 
 def _decimal_to_str(value: Decimal) -> str:
@@ -104,7 +155,8 @@ def _consume_cost_layers_fifo(db, company_id: str, product_id: str, quantity: De
         docs = list(
             query.order_by("created_at", direction=firestore.Query.ASCENDING).stream()
         )
-    except Exception:
+    except FailedPrecondition as e:
+        record_index_fallback("_consume_cost_layers_fifo", e)
         docs = list(query.stream())
         docs.sort(key=lambda d: str(d.to_dict().get("created_at") or ""))
 
@@ -135,6 +187,123 @@ def _consume_cost_layers_fifo(db, company_id: str, product_id: str, quantity: De
         )
 
 
+def _parse_iso_datetime(value: Optional[str]) -> Optional[datetime]:
+    """Parse an ISO date/datetime query parameter (naive values are UTC)."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+# Stock ledger totals (balance, cumulative in, cumulative out) kept on each item
+# and stamped on every stock_adjustments row after that movement.
+LEDGER_TOTAL_FIELDS = ("ledger_qty", "ledger_in_qty", "ledger_out_qty")
+RUNNING_TOTAL_FIELDS = ("running_qty", "running_in_qty", "running_out_qty")
+
+
+def _sum_legacy_adjustments(
+    db, company_id: str, product_id: str, before: Optional[datetime] = None
+) -> Tuple[Decimal, Decimal]:
+    """Total (in, out) quantity of adjustments written before running totals existed."""
+    query = (
+        db.collection("stock_adjustments")
+        .where("company_id", "==", company_id)
+        .where("product_id", "==", product_id)
+    )
+    if before is not None:
+        query = query.where("created_at", "<", before)
+
+    in_qty, out_qty = Decimal("0"), Decimal("0")
+    for doc in query.select(["quantity_change"]).stream():
+        qty = _safe_decimal((doc.to_dict() or {}).get("quantity_change", 0))
+        if qty > 0:
+            in_qty += qty
+        else:
+            out_qty -= qty
+    return in_qty, out_qty
+
+
+def _ledger_totals_at(
+    db,
+    company_id: str,
+    product_id: str,
+    at: datetime,
+    inclusive: bool = False,
+) -> Tuple[Decimal, Decimal, Decimal]:
+    """Ledger (balance, total in, total out) of a product just before (or at) a point in time.
+
+    Reads the running totals stamped on the latest adjustment in range, so the
+    cost is one document regardless of how much history the product has.
+    """
+    query = (
+        db.collection("stock_adjustments")
+        .where("company_id", "==", company_id)
+        .where("product_id", "==", product_id)
+        .where("created_at", "<=" if inclusive else "<", at)
+        .order_by("created_at", direction=firestore.Query.DESCENDING)
+        .limit(1)
+    )
+    docs = list(query.stream())
+    if not docs:
+        return Decimal("0"), Decimal("0"), Decimal("0")
+
+    data = docs[0].to_dict() or {}
+    if all(data.get(field) is not None for field in RUNNING_TOTAL_FIELDS):
+        return tuple(_safe_decimal(data.get(field)) for field in RUNNING_TOTAL_FIELDS)
+
+    # Legacy row: fall back to summing the history up to this point.
+    in_qty, out_qty = _sum_legacy_adjustments(db, company_id, product_id, data.get("created_at"))
+    qty = _safe_decimal(data.get("quantity_change", 0))
+    if qty > 0:
+        in_qty += qty
+    else:
+        out_qty -= qty
+    return in_qty - out_qty, in_qty, out_qty
+
+
+def _write_stock_adjustment(db, product_ref, adjustment: Dict[str, Any]):
+    """Append a stock_adjustments row stamped with the product's running totals.
+
+    The balance and the cumulative in/out quantities live on the item
+    (``LEDGER_TOTAL_FIELDS``) and are advanced in the same transaction as the
+    adjustment write, so ``running_qty``, ``running_in_qty`` and
+    ``running_out_qty`` on each row are the ledger totals after that movement.
+    """
+    adjustment_ref = db.collection("stock_adjustments").document()
+    quantity_change = _safe_decimal(adjustment.get("quantity_change", 0))
+
+    @firestore.transactional
+    def _append(transaction):
+        snapshot = product_ref.get(transaction=transaction)
+        product_data = snapshot.to_dict() or {}
+        if all(product_data.get(field) is not None for field in LEDGER_TOTAL_FIELDS):
+            balance, in_qty, out_qty = (
+                _safe_decimal(product_data.get(field)) for field in LEDGER_TOTAL_FIELDS
+            )
+        else:
+            # First write since running totals were introduced: seed from history.
+            in_qty, out_qty = _sum_legacy_adjustments(
+                db, adjustment.get("company_id"), product_ref.id
+            )
+            balance = in_qty - out_qty
+
+        if quantity_change > 0:
+            in_qty += quantity_change
+        else:
+            out_qty -= quantity_change
+        totals = [_decimal_to_str(value) for value in (balance + quantity_change, in_qty, out_qty)]
+        transaction.update(product_ref, dict(zip(LEDGER_TOTAL_FIELDS, totals)))
+        transaction.set(adjustment_ref, {**adjustment, **dict(zip(RUNNING_TOTAL_FIELDS, totals))})
+
+    _append(db.transaction())
+    return adjustment_ref
+
+
 # ===================== DASHBOARD =====================
 @router.get("/dashboard/stats")
 def get_dashboard_stats(user: dict = Depends(get_current_user)):
@@ -169,9 +338,10 @@ def get_dashboard_stats(user: dict = Depends(get_current_user)):
         )
 
         try:
-            sales_docs = sales_query.stream()
-        except Exception:
+            sales_docs = list(sales_query.stream())
+        except FailedPrecondition as e:
             # Fallback for environments where indexes are not available yet.
+            record_index_fallback("GET /dashboard/stats", e)
             sales_docs = (
                 db.collection("invoices")
                 .where("company_id", "==", company_id)
@@ -195,22 +365,29 @@ def get_dashboard_stats(user: dict = Depends(get_current_user)):
         items_docs = (
             db.collection("items")
             .where("company_id", "==", company_id)
-            .select(["current_qty", "current_wac", "min_stock_level"])
+            .select(
+                [
+                    "current_qty",
+                    "current_qty_units",
+                    "current_wac",
+                    "current_wac_units",
+                    "min_stock_level",
+                ]
+            )
             .stream()
         )
-        total_stock_value = Decimal("0")
+        total_stock_value = Money()
         total_items = 0
         low_stock_count = 0
 
         for doc in items_docs:
             data = doc.to_dict() or {}
-            qty = _safe_decimal(data.get("current_qty", 0))
-            cost = _safe_decimal(data.get("current_wac", 0))
-            total_stock_value += qty * cost
+            qty = Quantity.read(data, "current_qty")
+            total_stock_value += value_of(qty, Rate.read(data, "current_wac"))
             total_items += 1
 
-            min_stock = _safe_decimal(data.get("min_stock_level", 0))
-            if min_stock > 0 and qty <= min_stock:
+            min_stock = Quantity.parse(data.get("min_stock_level"))
+            if min_stock.units > 0 and qty <= min_stock:
                 low_stock_count += 1
 
         # Get pending transfers
@@ -290,8 +467,9 @@ def get_recent_sales(limit: int = 10, user: dict = Depends(get_current_user)):
             .stream()
         )
         docs = list(docs)
-    except Exception:
+    except FailedPrecondition as e:
         # Fallback when an index is missing: load and sort in memory.
+        record_index_fallback("GET /dashboard/recent-sales", e)
         docs = list(
             db.collection("invoices")
             .where("company_id", "==", company_id)
@@ -445,7 +623,8 @@ def get_dashboard_insights(user: dict = Depends(get_current_user)):
                 .select(["items", "created_at"])
                 .stream()
             )
-        except Exception:
+        except FailedPrecondition as e:
+            record_index_fallback("GET /dashboard/insights", e)
             invoice_docs = list(
                 db.collection("invoices")
                 .where("company_id", "==", company_id)
@@ -611,7 +790,7 @@ def create_product(data: dict, user: dict = Depends(get_current_user)):
                 detail="Selling price cannot be lower than cost price",
             )
 
-        product_data = {
+        product_data = with_units({
             "company_id": company_id,
             "name": data.get("name"),
             "name_ar": data.get("name_ar", ""),
@@ -629,7 +808,7 @@ def create_product(data: dict, user: dict = Depends(get_current_user)):
             "expiry_tracking": data.get("expiry_tracking", False),
             "created_at": firestore.SERVER_TIMESTAMP,
             "created_by": user.get("uid"),
-        }
+        }, ITEM_AMOUNTS)
 
         doc_ref = db.collection("items").document()
         doc_ref.set(product_data)
@@ -697,7 +876,8 @@ def list_product_adjustments(
             .stream()
         )
         docs = list(docs)
-    except Exception:
+    except FailedPrecondition as e:
+        record_index_fallback("GET /products/adjustments", e)
         docs = list(query.stream())
         docs.sort(key=lambda d: d.to_dict().get("created_at") or "", reverse=True)
         docs = docs[:limit]
@@ -739,7 +919,8 @@ def list_product_inbound(limit: int = 100, user: dict = Depends(get_current_user
             .stream()
         )
         docs = list(docs)
-    except Exception:
+    except FailedPrecondition as e:
+        record_index_fallback("GET /products/inbound", e)
         docs = list(query.stream())
         docs.sort(key=lambda d: d.to_dict().get("created_at") or "", reverse=True)
         docs = docs[:limit]
@@ -810,7 +991,12 @@ def create_product_inbound(data: dict, user: dict = Depends(get_current_user)):
     if update_cost_price:
         update_fields["cost_price"] = str(unit_cost)
 
-    product_ref.update(update_fields)
+    batch = db.batch()
+    batch.update(product_ref, with_units(update_fields, ITEM_AMOUNTS))
+    get_stock_level_service(company_id).record(
+        batch, product_id, data.get("warehouse_id"), qty, data.get("batch_number")
+    )
+    batch.commit()
     _upsert_cost_layer(db, company_id, product_id, unit_cost, qty)
 
     inbound_data = {
@@ -836,8 +1022,9 @@ def create_product_inbound(data: dict, user: dict = Depends(get_current_user)):
     inbound_ref = db.collection("stock_inbound").document()
     inbound_ref.set(inbound_data)
 
-    adjustment_ref = db.collection("stock_adjustments").document()
-    adjustment_ref.set(
+    _write_stock_adjustment(
+        db,
+        product_ref,
         {
             "company_id": company_id,
             "product_id": product_id,
@@ -847,13 +1034,15 @@ def create_product_inbound(data: dict, user: dict = Depends(get_current_user)):
             "new_qty": str(new_qty),
             "reason": f"inbound_{reason}",
             "notes": notes,
+            "warehouse_id": data.get("warehouse_id") or DEFAULT_WAREHOUSE,
+            "batch_number": data.get("batch_number") or None,
             "unit_cost": str(unit_cost),
             "total_cost": str(qty * unit_cost),
             "supplier_id": supplier_id or None,
             "supplier_name": supplier_name,
             "created_by": user.get("uid"),
             "created_at": firestore.SERVER_TIMESTAMP,
-        }
+        },
     )
 
     return {
@@ -930,9 +1119,17 @@ def get_product_ledger(
     product_id: str,
     from_date: Optional[str] = None,
     to_date: Optional[str] = None,
+    limit: int = Query(200, ge=1, le=1000),
+    cursor: Optional[str] = None,
     user: dict = Depends(get_current_user),
 ):
-    """Get running stock ledger for one product."""
+    """Get running stock ledger for one product.
+
+    The date window is applied by the query, one page at a time. Opening and
+    closing quantities and the in/out totals cover the whole window on every
+    page: they are differences of the running totals stamped on each
+    adjustment, so they cost a few reads regardless of the window or history.
+    """
     db = get_db()
     company_id = user.get("company_id")
 
@@ -941,66 +1138,92 @@ def get_product_ledger(
         raise HTTPException(status_code=404, detail="Product not found")
 
     product_data = product_doc.to_dict()
+    if product_data.get("company_id") != company_id:
+        raise HTTPException(status_code=403, detail="Unauthorized product access")
+
+    start_at = _parse_iso_datetime(from_date)
+    end_at = _parse_iso_datetime(to_date)
 
     query = (
         db.collection("stock_adjustments")
         .where("company_id", "==", company_id)
         .where("product_id", "==", product_id)
     )
-
-    docs = list(query.stream())
-    rows = []
-    for doc in docs:
-        data = {"id": doc.id, **doc.to_dict()}
-        created = data.get("created_at")
-        if hasattr(created, "isoformat"):
-            data["created_at"] = created.isoformat()
+    if start_at:
+        query = query.where("created_at", ">=", start_at)
+    if end_at:
+        query = query.where("created_at", "<=", end_at)
+    query = query.order_by("created_at", direction=firestore.Query.ASCENDING)
+
+    cursor_doc = None
+    if cursor:
+        cursor_doc = db.collection("stock_adjustments").document(cursor).get()
+        if not cursor_doc.exists:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.start_after(cursor_doc)
+
+    docs = list(query.limit(limit + 1).stream())
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+
+    if start_at:
+        opening_qty, opening_in, opening_out = _ledger_totals_at(db, company_id, product_id, start_at)
+    else:
+        opening_qty, opening_in, opening_out = Decimal("0"), Decimal("0"), Decimal("0")
+    if cursor_doc is not None:
+        cursor_data = cursor_doc.to_dict() or {}
+        if cursor_data.get("running_qty") is not None:
+            running = _safe_decimal(cursor_data.get("running_qty"))
         else:
-            data["created_at"] = str(created or "")
-        rows.append(data)
-
-    rows.sort(key=lambda r: r.get("created_at") or "")
-
-    def _in_window(iso_value: str) -> bool:
-        if from_date and iso_value < from_date:
-            return False
-        if to_date and iso_value > to_date:
-            return False
-        return True
+            running, _, _ = _ledger_totals_at(
+                db, company_id, product_id, cursor_data.get("created_at"), inclusive=True
+            )
+    else:
+        running = opening_qty
 
-    opening_qty = Decimal("0")
-    in_qty = Decimal("0")
-    out_qty = Decimal("0")
+    page_in = Decimal("0")
+    page_out = Decimal("0")
     movements = []
-    running = Decimal("0")
+    for doc in docs:
+        row = doc.to_dict() or {}
+        qty = _safe_decimal(row.get("quantity_change", 0))
+        created = row.get("created_at")
+        created_at = created.isoformat() if hasattr(created, "isoformat") else str(created or "")
 
-    for row in rows:
-        qty = Decimal(str(row.get("quantity_change", 0)))
-        created_at = str(row.get("created_at") or "")
+        if qty > 0:
+            page_in += qty
+        else:
+            page_out += abs(qty)
 
-        if from_date and created_at < from_date:
-            opening_qty += qty
-            continue
+        if row.get("running_qty") is not None:
+            running = _safe_decimal(row.get("running_qty"))
+        else:
+            running += qty
 
-        if _in_window(created_at):
-            if qty > 0:
-                in_qty += qty
-            else:
-                out_qty += abs(qty)
+        movements.append(
+            {
+                "id": doc.id,
+                "created_at": created_at,
+                "quantity_change": str(qty),
+                "reason": row.get("reason", ""),
+                "notes": row.get("notes", ""),
+                "running_qty": str(running),
+            }
+        )
 
-            running += qty
-            movements.append(
-                {
-                    "id": row.get("id"),
-                    "created_at": created_at,
-                    "quantity_change": str(qty),
-                    "reason": row.get("reason", ""),
-                    "notes": row.get("notes", ""),
-                    "running_qty": str(opening_qty + running),
-                }
+    if cursor_doc is None and not has_more:
+        # This page is the whole window.
+        closing_qty, in_qty, out_qty = running, page_in, page_out
+    else:
+        if not end_at and all(product_data.get(field) is not None for field in LEDGER_TOTAL_FIELDS):
+            closing_qty, closing_in, closing_out = (
+                _safe_decimal(product_data.get(field)) for field in LEDGER_TOTAL_FIELDS
             )
-
-    closing_qty = opening_qty + in_qty - out_qty
+        else:
+            closing_qty, closing_in, closing_out = _ledger_totals_at(
+                db, company_id, product_id, end_at or datetime.now(timezone.utc), inclusive=True
+            )
+        in_qty, out_qty = closing_in - opening_in, closing_out - opening_out
 
     return {
         "product": {
@@ -1016,6 +1239,8 @@ def get_product_ledger(
         "out_qty": str(out_qty),
         "closing_qty": str(closing_qty),
         "movements": movements,
+        "next_cursor": movements[-1]["id"] if has_more else None,
+        "has_more": has_more,
     }
 
 
@@ -1052,11 +1277,14 @@ def update_product(product_id: str, data: dict, user: dict = Depends(get_current
             detail="Selling price cannot be lower than cost price",
         )
 
-    update_fields = {
-        k: v
-        for k, v in data.items()
-        if k not in ["id", "created_at", "created_by", "company_id"]
-    }
+    update_fields = with_units(
+        {
+            k: v
+            for k, v in data.items()
+            if k not in ["id", "created_at", "created_by", "company_id"]
+        },
+        ITEM_AMOUNTS,
+    )
     update_fields["updated_at"] = firestore.SERVER_TIMESTAMP
     update_fields["updated_by"] = user.get("uid")
 
@@ -1098,9 +1326,11 @@ def adjust_stock(
     quantity: float,
     reason: str,
     notes: Optional[str] = None,
+    warehouse_id: Optional[str] = None,
+    batch_number: Optional[str] = None,
     user: dict = Depends(get_current_user),
 ):
-    """Adjust stock quantity (positive or negative)."""
+    """Adjust stock quantity (positive or negative) in one warehouse (default "main")."""
     db = get_db()
     company_id = user.get("company_id")
 
@@ -1123,10 +1353,19 @@ def adjust_stock(
             status_code=400, detail="Adjustment would result in negative stock"
         )
 
-    # Update product quantity
-    doc_ref.update(
-        {"current_qty": str(new_qty), "updated_at": firestore.SERVER_TIMESTAMP}
+    # Update product quantity and the warehouse level together
+    batch = db.batch()
+    batch.update(
+        doc_ref,
+        with_units(
+            {"current_qty": str(new_qty), "updated_at": firestore.SERVER_TIMESTAMP},
+            ITEM_AMOUNTS,
+        ),
+    )
+    get_stock_level_service(company_id).record(
+        batch, product_id, warehouse_id, qty_delta, batch_number
     )
+    batch.commit()
 
     if qty_delta < 0:
         _consume_cost_layers_fifo(db, company_id, product_id, abs(qty_delta))
@@ -1137,8 +1376,9 @@ def adjust_stock(
         _upsert_cost_layer(db, company_id, product_id, layer_cost, qty_delta)
 
     # Log the adjustment
-    adjustment_ref = db.collection("stock_adjustments").document()
-    adjustment_ref.set(
+    adjustment_ref = _write_stock_adjustment(
+        db,
+        doc_ref,
         {
             "company_id": company_id,
             "product_id": product_id,
@@ -1148,9 +1388,11 @@ def adjust_stock(
             "new_qty": str(new_qty),
             "reason": reason,
             "notes": notes or "",
+            "warehouse_id": warehouse_id or DEFAULT_WAREHOUSE,
+            "batch_number": batch_number or None,
             "created_by": user.get("uid"),
             "created_at": firestore.SERVER_TIMESTAMP,
-        }
+        },
     )
 
     return {
@@ -1182,6 +1424,13 @@ def get_product_batches(product_id: str, user: dict = Depends(get_current_user))
     return results
 
 
+@router.get("/products/{product_id}/locations")
+def get_product_locations(product_id: str, user: dict = Depends(get_current_user)):
+    """On-hand quantity of a product per warehouse and batch."""
+    company_id = user.get("company_id")
+    return get_stock_level_service(company_id).item_locations(product_id)
+
+
 @router.post("/products/{product_id}/batches")
 def create_batch(product_id: str, data: dict, user: dict = Depends(get_current_user)):
     """Create a new batch for a product."""
@@ -1206,18 +1455,266 @@ def create_batch(product_id: str, data: dict, user: dict = Depends(get_current_u
 
 
 # ===================== RECEIVING (Goods Receipt) =====================
+def _chunk_receipt_products(
+    product_ids: List[str], write_keys: Dict[str, List[Any]]
+) -> List[List[str]]:
+    """Split products so each chunk's writes fit in one transaction.
+
+    Each product costs one item update plus one write per entry in
+    ``write_keys`` (its cost layers, stock levels and stock ledger rows); one
+    slot per chunk is reserved for the receipt document.
+    """
+    chunks: List[List[str]] = []
+    current: List[str] = []
+    writes = 1
+    for product_id in product_ids:
+        product_writes = 1 + len(write_keys[product_id])
+        if current and writes + product_writes > FIRESTORE_WRITE_LIMIT:
+            chunks.append(current)
+            current = []
+            writes = 1
+        current.append(product_id)
+        writes += product_writes
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _apply_receipt_chunk(
+    db,
+    company_id: str,
+    receipt_ref,
+    receipt_data: Dict[str, Any],
+    product_ids: List[str],
+    received: Dict[str, Dict[str, Decimal]],
+    layer_qty: Dict[str, Dict[str, Decimal]],
+    level_deltas: Dict[str, Dict[tuple, Decimal]],
+    chunk_index: int,
+    chunk_count: int,
+):
+    """Apply one chunk of a goods receipt atomically (items, layers, levels, receipt).
+
+    The receipt is re-read first and the chunk skipped (returns False) when it
+    was already applied, so an interrupted receipt can be received again.
+    """
+    levels = get_stock_level_service(company_id)
+
+    @firestore.transactional
+    def _apply(transaction):
+        # PHASE 1: reads (the receipt, items via one get_all, layers via batched "in" queries)
+        current = receipt_ref.get(transaction=transaction)
+        if current.exists and (
+            current.get("status") == "received"
+            or (current.get("chunks_applied") or 0) > chunk_index
+        ):
+            return False
+
+        item_refs = [db.collection("items").document(pid) for pid in product_ids]
+        snapshots = {
+            snap.id: snap for snap in db.get_all(item_refs, transaction=transaction)
+        }
+
+        existing_layers: Dict[tuple, Any] = {}
+        for start in range(0, len(product_ids), 30):
+            layer_query = (
+                db.collection("stock_cost_layers")
+                .where("company_id", "==", company_id)
+                .where("product_id", "in", product_ids[start : start + 30])
+            )
+            for layer_doc in layer_query.get(transaction=transaction):
+                layer = layer_doc.to_dict() or {}
+                key = (layer.get("product_id"), str(layer.get("unit_cost")))
+                existing_layers.setdefault(key, layer_doc)
+
+        # PHASE 2: compute in memory
+        item_updates = {}
+        rates: Dict[str, tuple] = {}
+        for product_id in product_ids:
+            snap = snapshots.get(product_id)
+            if snap is None or not snap.exists:
+                raise HTTPException(
+                    status_code=400, detail=f"Product {product_id} not found"
+                )
+            product_data = snap.to_dict() or {}
+            if product_data.get("company_id") != company_id:
+                raise HTTPException(
+                    status_code=403, detail="Unauthorized product access"
+                )
+
+            current_qty = _safe_decimal(product_data.get("current_qty", 0))
+            current_wac = _safe_decimal(product_data.get("current_wac", 0))
+            line = received[product_id]
+
+            new_qty = current_qty + line["quantity"]
+            total_value = (current_qty * current_wac) + line["value"]
+            new_wac = total_value / new_qty if new_qty > 0 else Decimal("0")
+            rates[product_id] = (line["value"] / line["quantity"], new_wac)
+            item_updates[product_id] = with_units(
+                {
+                    "current_qty": str(new_qty),
+                    "current_wac": str(new_wac),
+                    "total_value": str(total_value),
+                    "updated_at": firestore.SERVER_TIMESTAMP,
+                },
+                ITEM_AMOUNTS,
+            )
+
+        # PHASE 3: writes
+        for product_id, update in item_updates.items():
+            transaction.update(db.collection("items").document(product_id), update)
+
+            for cost_str, qty in layer_qty[product_id].items():
+                layer_doc = existing_layers.get((product_id, cost_str))
+                if layer_doc is not None:
+                    layer = layer_doc.to_dict() or {}
+                    transaction.update(
+                        layer_doc.reference,
+                        {
+                            "qty_on_hand": _decimal_to_str(
+                                _safe_decimal(layer.get("qty_on_hand", 0)) + qty
+                            ),
+                            "qty_received_total": _decimal_to_str(
+                                _safe_decimal(layer.get("qty_received_total", 0)) + qty
+                            ),
+                            "updated_at": firestore.SERVER_TIMESTAMP,
+                        },
+                    )
+                else:
+                    transaction.set(
+                        db.collection("stock_cost_layers").document(),
+                        {
+                            "company_id": company_id,
+                            "product_id": product_id,
+                            "unit_cost": cost_str,
+                            "qty_on_hand": _decimal_to_str(qty),
+                            "qty_received_total": _decimal_to_str(qty),
+                            "created_at": firestore.SERVER_TIMESTAMP,
+                            "updated_at": firestore.SERVER_TIMESTAMP,
+                        },
+                    )
+
+            levels.apply(transaction, level_deltas[product_id])
+            levels.record_ledger(
+                transaction, level_deltas[product_id], rates, receipt_ref.id, "GRN"
+            )
+
+        is_last = chunk_index == chunk_count - 1
+        if chunk_index == 0:
+            transaction.set(
+                receipt_ref,
+                {
+                    **receipt_data,
+                    "status": "received" if is_last else "receiving",
+                    "chunks_applied": 1,
+                    "chunk_count": chunk_count,
+                },
+            )
+        else:
+            transaction.update(
+                receipt_ref,
+                {
+                    "status": "received" if is_last else "receiving",
+                    "chunks_applied": chunk_index + 1,
+                },
+            )
+        return True
+
+    return _apply(db.transaction())
+
+
+def _receive_goods(db, company_id: str, receipt_ref, receipt_data: Dict[str, Any]) -> int:
+    """Apply a goods receipt chunk by chunk; returns the number of chunks.
+
+    Chunks already applied are skipped, so calling this again with the stored
+    receipt completes one left in "receiving" by a failed chunk. Lines are
+    validated before anything is written.
+    """
+    received: Dict[str, Dict[str, Decimal]] = {}
+    layer_qty: Dict[str, Dict[str, Decimal]] = {}
+    level_deltas: Dict[str, Dict[tuple, Decimal]] = {}
+    for item in receipt_data.get("items", []):
+        product_id = item.get("product_id")
+        quantity = _safe_decimal(item.get("quantity", 0))
+        cost_price = _safe_decimal(item.get("cost_price", 0))
+        if not product_id:
+            raise HTTPException(status_code=400, detail="Product is required")
+        if quantity <= 0:
+            raise HTTPException(
+                status_code=400, detail="Quantity must be greater than zero"
+            )
+        if cost_price < 0:
+            raise HTTPException(status_code=400, detail="Unit cost cannot be negative")
+
+        totals = received.setdefault(
+            product_id, {"quantity": Decimal("0"), "value": Decimal("0")}
+        )
+        totals["quantity"] += quantity
+        totals["value"] += quantity * cost_price
+
+        layers = layer_qty.setdefault(product_id, {})
+        cost_str = _decimal_to_str(cost_price)
+        layers[cost_str] = layers.get(cost_str, Decimal("0")) + quantity
+
+        # Lines may name their own warehouse; otherwise the receipt's (or "main")
+        StockLevelService.add(
+            level_deltas.setdefault(product_id, {}),
+            StockLevelService.key(
+                product_id,
+                item.get("warehouse_id") or receipt_data.get("warehouse_id"),
+                item.get("batch_number"),
+            ),
+            quantity,
+        )
+
+    product_ids = list(received.keys())
+    chunks = _chunk_receipt_products(
+        product_ids,
+        {
+            pid: list(layer_qty[pid]) + list(level_deltas[pid]) * 2
+            for pid in product_ids
+        },
+    ) or [[]]
+    for index, chunk in enumerate(chunks):
+        _apply_receipt_chunk(
+            db,
+            company_id,
+            receipt_ref,
+            receipt_data,
+            chunk,
+            received,
+            layer_qty,
+            level_deltas,
+            index,
+            len(chunks),
+        )
+    return len(chunks)
+
+
 @router.post("/receiving")
 def create_goods_receipt(data: dict, user: dict = Depends(get_current_user)):
-    """Create a goods receipt (add stock to warehouse)."""
+    """Create a goods receipt (add stock to warehouse).
+
+    Products are prefetched with one get_all, duplicate lines are aggregated
+    and the new quantity/WAC is computed in memory. Items, cost layers and the
+    receipt commit in one transaction; receipts too large for a single
+    transaction are applied in chunks, with the receipt left in "receiving"
+    until the last chunk commits; if a chunk fails, POST
+    /receiving/{id}/resume applies the rest.
+    """
+    started = time.perf_counter()
     db = get_db()
     company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
 
+    lines = data.get("items", [])
     receipt_data = {
         "company_id": company_id,
         "receipt_number": data.get("receipt_number"),
         "supplier_id": data.get("supplier_id"),
         "supplier_name": data.get("supplier_name"),
-        "items": data.get("items", []),
+        "warehouse_id": data.get("warehouse_id") or DEFAULT_WAREHOUSE,
+        "items": lines,
         "total_cost": str(data.get("total_cost", 0)),
         "notes": data.get("notes", ""),
         "status": "received",
@@ -1226,36 +1723,61 @@ def create_goods_receipt(data: dict, user: dict = Depends(get_current_user)):
     }
 
     doc_ref = db.collection("goods_receipts").document()
-    doc_ref.set(receipt_data)
+    try:
+        chunk_count = _receive_goods(db, company_id, doc_ref, receipt_data)
+    except Exception as e:
+        if not doc_ref.get().exists:
+            raise
+        logger.exception("Goods receipt %s left in receiving", doc_ref.id)
+        detail = e.detail if isinstance(e, HTTPException) else "Receipt failed part-way"
+        raise HTTPException(
+            status_code=e.status_code if isinstance(e, HTTPException) else 500,
+            detail=f"{detail}; receipt {doc_ref.id} is partially received, "
+            f"retry with POST /receiving/{doc_ref.id}/resume",
+        )
 
-    # Update stock for each item
-    for item in data.get("items", []):
-        product_id = item.get("product_id")
-        quantity = Decimal(str(item.get("quantity", 0)))
-        cost_price = Decimal(str(item.get("cost_price", 0)))
+    latency_ms = (time.perf_counter() - started) * 1000
+    latency_per_line_ms = latency_ms / len(lines) if lines else latency_ms
+    logger.info(
+        "Goods receipt %s | lines=%d chunks=%d latency_ms=%.1f per_line_ms=%.2f",
+        doc_ref.id,
+        len(lines),
+        chunk_count,
+        latency_ms,
+        latency_per_line_ms,
+    )
 
-        product_ref = db.collection("items").document(product_id)
-        product_doc = product_ref.get()
+    safe_response = receipt_data.copy()
+    safe_response["created_at"] = datetime.now().isoformat()
+    return {
+        "id": doc_ref.id,
+        **safe_response,
+        "line_count": len(lines),
+        "latency_ms": round(latency_ms, 2),
+        "latency_per_line_ms": round(latency_per_line_ms, 3),
+    }
 
-        if product_doc.exists:
-            product_data = product_doc.to_dict()
-            current_qty = Decimal(str(product_data.get("current_qty", 0)))
-            current_wac = Decimal(str(product_data.get("current_wac", 0)))
 
-            # Calculate new WAC
-            total_value = (current_qty * current_wac) + (quantity * cost_price)
-            new_qty = current_qty + quantity
-            new_wac = total_value / new_qty if new_qty > 0 else Decimal("0")
+@router.post("/receiving/{receipt_id}/resume")
+def resume_goods_receipt(receipt_id: str, user: dict = Depends(get_current_user)):
+    """Finish a goods receipt left in "receiving"; chunks already applied are skipped."""
+    db = get_db()
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
 
-            product_ref.update(
-                {
-                    "current_qty": str(new_qty),
-                    "current_wac": str(new_wac),
-                    "total_value": str(total_value),
-                }
-            )
+    receipt_ref = db.collection("goods_receipts").document(receipt_id)
+    snap = receipt_ref.get()
+    if not snap.exists or snap.get("company_id") != company_id:
+        raise HTTPException(status_code=404, detail="Goods receipt not found")
+    receipt = snap.to_dict()
+    if receipt.get("status") != "receiving":
+        raise HTTPException(
+            status_code=400, detail=f"Goods receipt is {receipt.get('status')}, not receiving"
+        )
 
-    return {"id": doc_ref.id, **receipt_data}
+    chunk_count = _receive_goods(db, company_id, receipt_ref, receipt)
+    return {"id": receipt_id, "status": "received", "chunks": chunk_count}
 
 
 @router.get("/receiving")
@@ -1280,184 +1802,720 @@ def list_goods_receipts(limit: int = 50, user: dict = Depends(get_current_user))
     return results
 
 
-# ===================== CUSTOMERS =====================
-@router.get("/customers")
-def list_customers(
-    search: Optional[str] = None,
-    has_balance: bool = False,
+# ===================== INVENTORY SNAPSHOTS =====================
+@router.post("/inventory/snapshots")
+def create_stock_snapshot(
+    year: Optional[int] = None,
+    month: Optional[int] = Query(None, ge=1, le=12),
     user: dict = Depends(get_current_user),
 ):
-    """List all customers."""
-    try:
-        db = get_db()
-        company_id = user.get("company_id")
+    """Write month-end stock snapshots (defaults to the previous month).
 
-        if not company_id:
-            return []
+    Intended to be triggered by a scheduler shortly after each month end.
+    """
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
 
-        docs = db.collection("customers").where("company_id", "==", company_id).stream()
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
 
-        results = []
-        for doc in docs:
-            data = {"id": doc.id, **doc.to_dict()}
+    if year is None or month is None:
+        last_month = datetime.now().replace(day=1) - timedelta(days=1)
+        year = year or last_month.year
+        month = month or last_month.month
 
-            # Apply search filter
-            if search:
-                search_lower = search.lower()
-                name = (
-                    f"{data.get('first_name', '')} {data.get('last_name', '')}".lower()
-                )
-                phone = str(data.get("phone") or "").lower()
-                if search_lower not in name and search_lower not in phone:
-                    continue
+    service = get_stock_snapshot_service(company_id)
+    return service.take_snapshot(year, month)
 
-            # Apply balance filter
-            if has_balance:
-                balance = Decimal(str(data.get("balance", 0)))
-                if balance <= 0:
-                    continue
 
-            results.append(data)
+@router.get("/inventory/valuation/as-of")
+def get_stock_valuation_as_of(
+    as_of: str,
+    product_id: Optional[str] = None,
+    user: dict = Depends(get_current_user),
+):
+    """Stock quantity, value and WAC per product as of a date."""
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
 
-        return results
-    except Exception as e:
-        print(f"Error listing customers: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    service = get_stock_snapshot_service(company_id)
+    return service.get_valuation_as_of(_parse_iso_datetime(as_of), product_id)
 
 
-@router.post("/customers")
-def create_customer(data: dict, user: dict = Depends(get_current_user)):
-    """Create a new customer."""
-    try:
-        db = get_db()
-        company_id = user.get("company_id")
+# ===================== CHART OF ACCOUNTS =====================
+def _account_error(e: ValueError) -> HTTPException:
+    status = 404 if str(e) == "Account not found" else 400
+    return HTTPException(status_code=status, detail=str(e))
 
-        if not company_id:
-            raise HTTPException(status_code=400, detail="Company ID not found")
 
-        # Validate required fields
-        if not data.get("first_name"):
-            raise HTTPException(status_code=400, detail="First name is required")
-        if not data.get("phone"):
-            raise HTTPException(status_code=400, detail="Phone number is required")
+@router.get("/accounting/accounts")
+def list_accounts(type: Optional[str] = None, user: dict = Depends(get_current_user)):
+    """Chart of accounts with balances, optionally of one type."""
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
 
-        customer_data = {
-            "company_id": company_id,
-            "first_name": data.get("first_name"),
-            "last_name": data.get("last_name"),
-            "phone": data.get("phone"),
-            "email": data.get("email", ""),
-            "address": data.get("address", ""),
-            "balance": "0.00",
-            "total_purchases": "0.00",
-            "created_at": firestore.SERVER_TIMESTAMP,
-            "created_by": user.get("uid"),
-        }
+    return AccountingService().get_accounts(company_id, type)
 
-        doc_ref = db.collection("customers").document()
-        doc_ref.set(customer_data)
 
-        safe_response = customer_data.copy()
-        safe_response["created_at"] = datetime.now().isoformat()
+@router.post("/accounting/accounts")
+def create_account(data: dict, user: dict = Depends(get_current_user)):
+    """Add an account to the chart of accounts."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
 
-        return {"id": doc_ref.id, **safe_response}
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"Error creating customer: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
 
+    try:
+        return AccountingService().create_account(company_id, data)
+    except ValueError as e:
+        raise _account_error(e)
 
-@router.get("/customers/{customer_id}")
-def get_customer(customer_id: str, user: dict = Depends(get_current_user)):
-    """Get customer details with purchase history."""
-    db = get_db()
-    doc = db.collection("customers").document(customer_id).get()
 
-    if not doc.exists:
-        raise HTTPException(status_code=404, detail="Customer not found")
+@router.put("/accounting/accounts/{account_id}")
+def update_account(account_id: str, data: dict, user: dict = Depends(get_current_user)):
+    """Rename, recode, re-parent or (de)activate an account."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
 
-    customer_data = {"id": doc.id, **doc.to_dict()}
     company_id = user.get("company_id")
-    if customer_data.get("company_id") != company_id:
-        raise HTTPException(status_code=403, detail="Unauthorized customer access")
-    for key in ["created_at", "updated_at"]:
-        if key in customer_data and hasattr(customer_data[key], "isoformat"):
-            customer_data[key] = customer_data[key].isoformat()
-        elif key in customer_data and customer_data[key] is not None:
-            customer_data[key] = str(customer_data[key])
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
 
-    # Get purchase history
-    invoice_query = (
-        db.collection("invoices")
-        .where("company_id", "==", company_id)
-        .where("customer_id", "==", customer_id)
+    try:
+        return AccountingService().update_account(company_id, account_id, data)
+    except ValueError as e:
+        raise _account_error(e)
+
+
+@router.delete("/accounting/accounts/{account_id}")
+def deactivate_account(account_id: str, user: dict = Depends(get_current_user)):
+    """Deactivate an account; posted history keeps referring to it, so it is never deleted."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    try:
+        return AccountingService().deactivate_account(company_id, account_id)
+    except ValueError as e:
+        raise _account_error(e)
+
+
+# ===================== FISCAL PERIODS / TRIAL BALANCE =====================
+def _period_or_previous_month(year: Optional[int], month: Optional[int]):
+    if year is None or month is None:
+        last_month = datetime.now().replace(day=1) - timedelta(days=1)
+        year = year or last_month.year
+        month = month or last_month.month
+    return year, month
+
+
+@router.post("/accounting/periods/close")
+def close_fiscal_period(
+    year: Optional[int] = None,
+    month: Optional[int] = Query(None, ge=1, le=12),
+    user: dict = Depends(get_current_user),
+):
+    """Close a month (defaults to the previous one) and snapshot its GL balances."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    year, month = _period_or_previous_month(year, month)
+    try:
+        period_id = get_fiscal_service(user.get("uid"), company_id).close_period(year, month)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"id": period_id, "status": "CLOSED"}
+
+
+@router.post("/accounting/periods/reopen")
+def reopen_fiscal_period(
+    year: int,
+    month: int = Query(..., ge=1, le=12),
+    user: dict = Depends(get_current_user),
+):
+    """Reopen a closed month; its balance snapshots (and later ones) are dropped."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    try:
+        period_id = get_fiscal_service(user.get("uid"), company_id).reopen_period(year, month)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"id": period_id, "status": "OPEN"}
+
+
+async def _cached_report(
+    company_id: str, report: str, params: dict, compute, account_id: Optional[str] = None
+):
+    """
+    Serve a report from the cache while the ledger watermark (the company's,
+    or only ``account_id``'s) is unchanged; otherwise compute and store it.
+    """
+    watermark = get_ledger_watermark_service(company_id).token(account_id)
+    # Reports defaulting to "today" must not outlive the day
+    params = {**params, "today": day_key()}
+    cache = get_report_cache()
+    result = cache.get(company_id, report, params, watermark)
+    if result is MISS:
+        result = await compute()
+        cache.put(company_id, report, params, watermark, result)
+    return result
+
+
+def _invalidate_reports(company_id: str):
+    """After rebuilding derived GL data: no cached report may outlive it."""
+    get_ledger_watermark_service(company_id).bump_epoch()
+    get_report_cache().invalidate(company_id)
+
+
+@router.get("/reports/trial-balance")
+async def get_trial_balance(
+    as_of: Optional[str] = None,
+    user: dict = Depends(get_current_user),
+):
+    """Trial balance: current balances, or as of the end of a day (as_of=YYYY-MM-DD)."""
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    as_of_date = _parse_iso_datetime(as_of)
+    return await _cached_report(
+        company_id,
+        "trial_balance",
+        {"as_of": as_of},
+        lambda: ReportingService().get_trial_balance(company_id, as_of_date),
     )
+
+
+@router.post("/reports/gl-daily/rebuild")
+def rebuild_gl_daily_balances(user: dict = Depends(get_current_user)):
+    """Recompute daily GL buckets from the account ledger (backfill; run while posting is quiet)."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    result = get_gl_snapshot_service(company_id).rebuild()
+    _invalidate_reports(company_id)
+    return result
+
+
+# ===================== FINANCIAL STATEMENTS =====================
+@router.get("/reports/income-statement")
+async def get_income_statement(
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    user: dict = Depends(get_current_user),
+):
+    """P&L: lifetime balances, or the movements between from_date and to_date."""
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    start_at, end_at = _parse_iso_datetime(from_date), _parse_iso_datetime(to_date)
     try:
-        invoice_docs = invoice_query.order_by(
-            "issue_date", direction=firestore.Query.DESCENDING
-        ).stream()
-        invoice_docs = list(invoice_docs)
-    except Exception:
-        invoice_docs = list(invoice_query.stream())
-        invoice_docs.sort(
-            key=lambda d: (
-                d.to_dict().get("issue_date") or d.to_dict().get("created_at") or ""
-            ),
-            reverse=True,
+        return await _cached_report(
+            company_id,
+            "income_statement",
+            {"from_date": from_date, "to_date": to_date},
+            lambda: ReportingService().get_income_statement(company_id, start_at, end_at),
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/reports/income-statement/comparative")
+async def get_comparative_income_statement(
+    from_period: str,
+    to_period: str,
+    user: dict = Depends(get_current_user),
+):
+    """P&L with one column per month (from_period/to_period as YYYY-MM, at most 24)."""
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    try:
+        return await _cached_report(
+            company_id,
+            "comparative_income_statement",
+            {"from_period": from_period, "to_period": to_period},
+            lambda: ReportingService().get_comparative_income_statement(company_id, from_period, to_period),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/reports/balance-sheet")
+async def get_balance_sheet(
+    as_of: Optional[str] = None,
+    user: dict = Depends(get_current_user),
+):
+    """Balance sheet at the end of as_of (default today)."""
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    as_of_date = _parse_iso_datetime(as_of)
+    return await _cached_report(
+        company_id,
+        "balance_sheet",
+        {"as_of": as_of},
+        lambda: ReportingService().get_balance_sheet(company_id, as_of_date),
+    )
+
+
+@router.get("/reports/cash-flow")
+async def get_cash_flow(
+    from_date: str,
+    to_date: str,
+    user: dict = Depends(get_current_user),
+):
+    """Cash-flow statement (indirect method) between from_date and to_date."""
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    start_at, end_at = _parse_iso_datetime(from_date), _parse_iso_datetime(to_date)
+    try:
+        return await _cached_report(
+            company_id,
+            "cash_flow",
+            {"from_date": from_date, "to_date": to_date},
+            lambda: ReportingService().get_cash_flow(company_id, start_at, end_at),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# Streamed ledger formats (format=json returns one document)
+LEDGER_STREAM_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _ledger_stream_response(events, output: str, filename: str) -> StreamingResponse:
+    body = csv_lines(events) if output == "csv" else ndjson_lines(events)
+    return StreamingResponse(
+        body,
+        media_type=LEDGER_STREAM_FORMATS[output],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{output}"'},
+    )
+
+
+@router.get("/reports/general-ledger/{account_id}")
+async def get_general_ledger(
+    account_id: str,
+    from_date: str,
+    to_date: str,
+    format: str = "json",
+    user: dict = Depends(get_current_user),
+):
+    """
+    General ledger of one account. format=ndjson|csv streams the opening
+    balance, the date-ordered lines with a running balance, then totals.
+    """
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+    if format != "json" and format not in LEDGER_STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be json, ndjson or csv")
+
+    start_at, end_at = _parse_iso_datetime(from_date), _parse_iso_datetime(to_date)
+    service = ReportingService()
+    try:
+        if format == "json":
+            return await _cached_report(
+                company_id,
+                "general_ledger",
+                {"account_id": account_id, "from_date": from_date, "to_date": to_date},
+                lambda: service.get_general_ledger(company_id, account_id, start_at, end_at),
+                account_id=account_id,
+            )
+        events = service.stream_general_ledger(company_id, account_id, start_at, end_at)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return _ledger_stream_response(events, format, f"gl-{account_id}-{from_date}-{to_date}")
+
+
+@router.get("/customers/{customer_id}/statement")
+async def get_customer_statement(
+    customer_id: str,
+    from_date: str,
+    to_date: str,
+    format: str = "json",
+    user: dict = Depends(get_current_user),
+):
+    """Customer statement on the linked AR account; format=ndjson|csv streams it."""
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+    if format != "json" and format not in LEDGER_STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be json, ndjson or csv")
+
+    start_at, end_at = _parse_iso_datetime(from_date), _parse_iso_datetime(to_date)
+    service = ReportingService()
+    try:
+        if format == "json":
+            # Keyed on the customer's AR account: only its postings invalidate it
+            customer = get_db().collection("customers").document(customer_id).get()
+            ar_account_id = (customer.to_dict() or {}).get("ar_account_id") if customer.exists else None
+            return await _cached_report(
+                company_id,
+                "customer_statement",
+                {"customer_id": customer_id, "from_date": from_date, "to_date": to_date},
+                lambda: service.get_customer_statement(company_id, customer_id, start_at, end_at),
+                account_id=ar_account_id,
+            )
+        events = service.stream_customer_statement(company_id, customer_id, start_at, end_at)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _ledger_stream_response(events, format, f"statement-{customer_id}-{from_date}-{to_date}")
+
+
+@router.post("/reports/gl-periods/rebuild")
+def rebuild_gl_period_cube(user: dict = Depends(get_current_user)):
+    """Recompute the (account, month) cube from the daily GL buckets (run after gl-daily/rebuild)."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    result = get_gl_cube_service(company_id).rebuild()
+    _invalidate_reports(company_id)
+    return result
+
+
+# ===================== CUSTOMERS =====================
+@router.get("/customers")
+def list_customers(
+    search: Optional[str] = None,
+    has_balance: bool = False,
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=100),
+    user: dict = Depends(get_current_user),
+):
+    """List all customers, or look them up by phone, name prefix or email."""
+    try:
+        db = get_db()
+        company_id = user.get("company_id")
+
+        if not company_id:
+            return []
+
+        def owes(data):
+            return Decimal(str(data.get("balance", 0))) > 0
+
+        if search:
+            # Indexed lookup on normalized search_keys; see /customers/reindex-search
+            docs = search_customers(db, company_id, search, limit, owes if has_balance else None)
+        else:
+            docs = db.collection("customers").where("company_id", "==", company_id).stream()
+
+        results = []
+        for doc in docs:
+            data = {"id": doc.id, **doc.to_dict()}
+            data.pop("search_keys", None)
+
+            # Apply balance filter
+            if has_balance and not owes(data):
+                continue
+
+            results.append(data)
+
+        return results
+    except Exception as e:
+        print(f"Error listing customers: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/customers")
+def create_customer(data: dict, user: dict = Depends(get_current_user)):
+    """Create a new customer."""
+    try:
+        db = get_db()
+        company_id = user.get("company_id")
+
+        if not company_id:
+            raise HTTPException(status_code=400, detail="Company ID not found")
+
+        # Validate required fields
+        if not data.get("first_name"):
+            raise HTTPException(status_code=400, detail="First name is required")
+        if not data.get("phone"):
+            raise HTTPException(status_code=400, detail="Phone number is required")
+
+        if find_customers_by_phone(db, company_id, data.get("phone")):
+            raise HTTPException(
+                status_code=409, detail="A customer with this phone already exists"
+            )
+
+        customer_data = {
+            "company_id": company_id,
+            "first_name": data.get("first_name"),
+            "last_name": data.get("last_name"),
+            "phone": data.get("phone"),
+            "email": data.get("email", ""),
+            "address": data.get("address", ""),
+            "balance": "0.00",
+            "total_purchases": "0.00",
+            **EMPTY_CUSTOMER_SUMMARY,
+            "created_at": firestore.SERVER_TIMESTAMP,
+            "created_by": user.get("uid"),
+        }
+        customer_data.update(build_search_fields(customer_data))
+
+        doc_ref = db.collection("customers").document()
+        doc_ref.set(customer_data)
+
+        safe_response = customer_data.copy()
+        safe_response.pop("search_keys", None)
+        safe_response["created_at"] = datetime.now().isoformat()
+
+        return {"id": doc_ref.id, **safe_response}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error creating customer: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 
-    purchases = []
-    total_invoiced = Decimal("0")
-    total_paid_on_invoices = Decimal("0")
-    for inv_doc in invoice_docs:
-        inv_data = {"id": inv_doc.id, **inv_doc.to_dict()}
-        total_invoiced += _safe_decimal(inv_data.get("total_amount", 0))
-        total_paid_on_invoices += _safe_decimal(inv_data.get("amount_paid", 0))
-        for key in ["created_at", "issue_date"]:
-            if key in inv_data and hasattr(inv_data[key], "isoformat"):
-                inv_data[key] = inv_data[key].isoformat()
-        purchases.append(inv_data)
-
-    payment_query = (
-        db.collection("customer_payments")
+CUSTOMER_HISTORY_LIMIT = 50
+CUSTOMER_SUMMARY_TIMESTAMPS = ("last_invoice_at", "last_payment_at", "last_activity_at")
+
+
+def _isoformat_fields(data: Dict[str, Any], keys) -> Dict[str, Any]:
+    for key in keys:
+        if key in data and hasattr(data[key], "isoformat"):
+            data[key] = data[key].isoformat()
+        elif key in data and data[key] is not None:
+            data[key] = str(data[key])
+    return data
+
+
+def _customer_history_page(
+    db,
+    collection: str,
+    company_id: str,
+    customer_id: str,
+    order_field: str,
+    limit: int,
+    cursor: Optional[str] = None,
+):
+    """One page of a customer's invoices or payments, newest first."""
+    query = (
+        db.collection(collection)
         .where("company_id", "==", company_id)
         .where("customer_id", "==", customer_id)
+        .order_by(order_field, direction=firestore.Query.DESCENDING)
     )
-    try:
-        payment_docs = payment_query.order_by(
-            "created_at", direction=firestore.Query.DESCENDING
-        ).stream()
-        payment_docs = list(payment_docs)
-    except Exception:
-        payment_docs = list(payment_query.stream())
-        payment_docs.sort(
-            key=lambda d: d.to_dict().get("created_at") or "",
-            reverse=True,
+    if cursor:
+        cursor_doc = db.collection(collection).document(cursor).get()
+        if not cursor_doc.exists:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.start_after(cursor_doc)
+
+    docs = list(query.limit(limit + 1).stream())
+    has_more = len(docs) > limit
+
+    rows = [
+        _isoformat_fields({"id": doc.id, **doc.to_dict()}, ("created_at", "issue_date"))
+        for doc in docs[:limit]
+    ]
+    return rows, rows[-1]["id"] if has_more else None
+
+
+def _customer_summary_update(
+    customer_data: Dict[str, Any],
+    invoiced: Optional[Decimal] = None,
+    paid_on_invoices: Decimal = Decimal("0"),
+    manual_payment: Optional[Decimal] = None,
+    invoice_count: int = 1,
+) -> Dict[str, Any]:
+    """
+    Counter fields to merge into a customer write in the same transaction or
+    batch as the invoice or payment. Totals are Increments of Money units, so
+    nothing here depends on the customer's current totals.
+
+    Customers without unit counters (created before them) get nothing here;
+    their summary is rebuilt from history the first time the detail page is
+    opened.
+    """
+    if "total_invoiced_units" not in customer_data:
+        return {}
+
+    now = datetime.now(timezone.utc)
+    update = {
+        "total_invoiced_units": firestore.Increment(Money.parse(invoiced or 0).units),
+        "total_paid_on_invoices_units": firestore.Increment(
+            Money.parse(paid_on_invoices).units
+        ),
+        "last_activity_at": now,
+    }
+    if invoiced is not None:
+        update["invoice_count"] = firestore.Increment(invoice_count)
+        update["last_invoice_at"] = now
+    if manual_payment is not None:
+        update["total_manual_payments_units"] = firestore.Increment(
+            Money.parse(manual_payment).units
+        )
+        update["payment_count"] = firestore.Increment(1)
+        update["last_payment_at"] = now
+    return update
+
+
+def _rebuild_customer_summary(db, company_id: str, customer_ref) -> Dict[str, Any]:
+    """Recompute the summary counters from history and store them on the customer.
+
+    Runs in one transaction with the customer and its history reads, so an
+    invoice or payment committing meanwhile either lands in the history read
+    or retries against the rebuilt counters. A customer rebuilt by a
+    concurrent request is returned as stored.
+    """
+
+    @firestore.transactional
+    def _execute(transaction):
+        stored = customer_ref.get(transaction=transaction).to_dict() or {}
+        if "total_invoiced_units" in stored:
+            return {key: stored.get(key) for key in EMPTY_CUSTOMER_SUMMARY}
+
+        summary = dict(EMPTY_CUSTOMER_SUMMARY)
+        last_invoice_at = None
+        last_payment_at = None
+
+        invoice_docs = (
+            db.collection("invoices")
+            .where("company_id", "==", company_id)
+            .where("customer_id", "==", customer_ref.id)
+            .select(["total_amount", "amount_paid", "created_at"])
+            .get(transaction=transaction)
+        )
+        for doc in invoice_docs:
+            data = doc.to_dict()
+            summary["invoice_count"] += 1
+            summary["total_invoiced_units"] += Money.parse(data.get("total_amount")).units
+            summary["total_paid_on_invoices_units"] += Money.parse(data.get("amount_paid")).units
+            created_at = data.get("created_at")
+            if hasattr(created_at, "isoformat") and (
+                last_invoice_at is None or created_at > last_invoice_at
+            ):
+                last_invoice_at = created_at
+
+        payment_docs = (
+            db.collection("customer_payments")
+            .where("company_id", "==", company_id)
+            .where("customer_id", "==", customer_ref.id)
+            .select(["amount", "created_at"])
+            .get(transaction=transaction)
+        )
+        for doc in payment_docs:
+            data = doc.to_dict()
+            summary["payment_count"] += 1
+            summary["total_manual_payments_units"] += Money.parse(data.get("amount")).units
+            created_at = data.get("created_at")
+            if hasattr(created_at, "isoformat") and (
+                last_payment_at is None or created_at > last_payment_at
+            ):
+                last_payment_at = created_at
+
+        activity = [at for at in (last_invoice_at, last_payment_at) if at]
+        summary.update(
+            {
+                "last_invoice_at": last_invoice_at,
+                "last_payment_at": last_payment_at,
+                "last_activity_at": max(activity) if activity else None,
+            }
+        )
+        # Drop the string totals of the old read-modify-write counters
+        transaction.update(
+            customer_ref,
+            {**summary, **{name: firestore.DELETE_FIELD for name in CUSTOMER_SUMMARY_TOTALS}},
+        )
+        return summary
+
+    return _execute(db.transaction())
+
+
+@router.get("/customers/{customer_id}")
+def get_customer(
+    customer_id: str,
+    limit: int = Query(CUSTOMER_HISTORY_LIMIT, ge=1, le=200),
+    invoice_cursor: Optional[str] = None,
+    payment_cursor: Optional[str] = None,
+    user: dict = Depends(get_current_user),
+):
+    """Get customer details with one page of purchase and payment history.
+
+    The header totals are counters kept on the customer document at write
+    time; the customer read and both history pages run concurrently.
+    """
+    db = get_db()
+    company_id = user.get("company_id")
+    customer_ref = db.collection("customers").document(customer_id)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        doc_future = pool.submit(customer_ref.get)
+        invoices_future = pool.submit(
+            _customer_history_page,
+            db, "invoices", company_id, customer_id, "issue_date", limit, invoice_cursor,
         )
+        payments_future = pool.submit(
+            _customer_history_page,
+            db, "customer_payments", company_id, customer_id, "created_at", limit,
+            payment_cursor,
+        )
+
+        doc = doc_future.result()
+        if not doc.exists:
+            raise HTTPException(status_code=404, detail="Customer not found")
 
-    payments = []
-    total_manual_payments = Decimal("0")
-    for pay_doc in payment_docs:
-        pay_data = {"id": pay_doc.id, **pay_doc.to_dict()}
-        total_manual_payments += _safe_decimal(pay_data.get("amount", 0))
-        if "created_at" in pay_data and hasattr(pay_data["created_at"], "isoformat"):
-            pay_data["created_at"] = pay_data["created_at"].isoformat()
-        payments.append(pay_data)
+        customer_data = {"id": doc.id, **doc.to_dict()}
+        if customer_data.get("company_id") != company_id:
+            raise HTTPException(status_code=403, detail="Unauthorized customer access")
+
+        purchases, next_invoice_cursor = invoices_future.result()
+        payments, next_payment_cursor = payments_future.result()
+
+    if "total_invoiced_units" not in customer_data:
+        customer_data.update(_rebuild_customer_summary(db, company_id, customer_ref))
+
+    customer_data.pop("search_keys", None)
+    _isoformat_fields(
+        customer_data, ("created_at", "updated_at") + CUSTOMER_SUMMARY_TIMESTAMPS
+    )
 
     current_balance = _safe_decimal(customer_data.get("balance", 0))
     customer_data["summary"] = {
-        "invoice_count": len(purchases),
-        "total_invoiced": str(total_invoiced),
-        "total_paid_on_invoices": str(total_paid_on_invoices),
-        "total_manual_payments": str(total_manual_payments),
+        "invoice_count": customer_data.get("invoice_count", 0),
+        "payment_count": customer_data.get("payment_count", 0),
+        **{name: str(Money.read(customer_data, name)) for name in CUSTOMER_SUMMARY_TOTALS},
         "outstanding": str(current_balance if current_balance > 0 else Decimal("0")),
         "credit_available": str(
             abs(current_balance) if current_balance < 0 else Decimal("0")
         ),
+        "last_activity_at": customer_data.get("last_activity_at"),
     }
     customer_data["purchases"] = purchases
     customer_data["payments"] = payments
+    customer_data["next_invoice_cursor"] = next_invoice_cursor
+    customer_data["next_payment_cursor"] = next_payment_cursor
 
     return customer_data
 
@@ -1474,6 +2532,11 @@ def update_customer(
     if not doc.exists:
         raise HTTPException(status_code=404, detail="Customer not found")
 
+    current = doc.to_dict() or {}
+    company_id = user.get("company_id")
+    if current.get("company_id") != company_id:
+        raise HTTPException(status_code=403, detail="Unauthorized customer access")
+
     update_fields = {
         k: v
         for k, v in data.items()
@@ -1485,13 +2548,45 @@ def update_customer(
             "company_id",
             "balance",
             "total_purchases",
+            "phone_e164",
+            "search_keys",
+            *EMPTY_CUSTOMER_SUMMARY.keys(),
+            *CUSTOMER_SUMMARY_TOTALS,
         ]
     }
+
+    if "phone" in update_fields:
+        duplicates = find_customers_by_phone(db, company_id, update_fields["phone"])
+        if any(dup.id != customer_id for dup in duplicates):
+            raise HTTPException(
+                status_code=409, detail="A customer with this phone already exists"
+            )
+
+    search_fields = build_search_fields({**current, **update_fields})
     update_fields["updated_at"] = firestore.SERVER_TIMESTAMP
 
-    doc_ref.update(update_fields)
+    doc_ref.update({**update_fields, **search_fields})
+
+    return {
+        "id": customer_id,
+        **update_fields,
+        "phone_e164": search_fields["phone_e164"],
+        "updated_at": datetime.now().isoformat(),
+    }
 
-    return {"id": customer_id, **update_fields}
+
+@router.post("/customers/reindex-search")
+def reindex_customer_search(user: dict = Depends(get_current_user)):
+    """Backfill normalized phone and search keys on existing customers (admin)."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    updated = reindex_customers(get_db(), company_id)
+    return {"status": "success", "updated": updated}
 
 
 @router.delete("/customers/{customer_id}")
@@ -1516,6 +2611,33 @@ def delete_customer(customer_id: str, user: dict = Depends(get_current_user)):
     return {"status": "success"}
 
 
+def _invoice_due_amount(invoice: Dict[str, Any]) -> Decimal:
+    """Outstanding amount of an invoice (stored due_amount, derived for older rows)."""
+    if invoice.get("due_amount") is not None:
+        return _safe_decimal(invoice.get("due_amount"))
+    total = _safe_decimal(invoice.get("total_amount", 0))
+    paid_cash = _safe_decimal(invoice.get("amount_paid", 0))
+    credit_applied = _safe_decimal(invoice.get("credit_applied", 0))
+    return total - paid_cash - credit_applied
+
+
+def _open_invoices_query(db, company_id: str, customer_id: str):
+    """A customer's unpaid and partially paid invoices, oldest first.
+
+    Bounded so every allocation (one invoice update each) fits in a single
+    transaction alongside the payment record, the customer update and the
+    two aging documents.
+    """
+    return (
+        db.collection("invoices")
+        .where("company_id", "==", company_id)
+        .where("customer_id", "==", customer_id)
+        .where("payment_status", "in", OPEN_PAYMENT_STATUSES)
+        .order_by("issue_date", direction=firestore.Query.ASCENDING)
+        .limit(FIRESTORE_WRITE_LIMIT - 4)
+    )
+
+
 @router.post("/customers/{customer_id}/payment")
 async def add_customer_payment(
     customer_id: str,
@@ -1550,95 +2672,106 @@ async def add_customer_payment(
     if body_notes is not None:
         notes = body_notes
 
-    customer_ref = db.collection("customers").document(customer_id)
-    customer_doc = customer_ref.get()
-
-    if not customer_doc.exists:
-        raise HTTPException(status_code=404, detail="Customer not found")
-
-    customer_data = customer_doc.to_dict()
-    current_balance = _safe_decimal(customer_data.get("balance", 0))
     payment_amount = _safe_decimal(final_amount)
     if payment_amount <= 0:
         raise HTTPException(
             status_code=400, detail="Payment amount must be greater than zero"
         )
 
-    # Reduce balance
-    new_balance = current_balance - payment_amount
+    customer_ref = db.collection("customers").document(customer_id)
+    payment_ref = db.collection("customer_payments").document()
+    aging = get_ar_aging_service(company_id)
 
-    customer_ref.update(
-        {"balance": str(new_balance), "updated_at": firestore.SERVER_TIMESTAMP}
-    )
+    @firestore.transactional
+    def _execute(transaction):
+        customer_doc = customer_ref.get(transaction=transaction)
+        if not customer_doc.exists:
+            raise HTTPException(status_code=404, detail="Customer not found")
 
-    # Record payment
-    payment_ref = db.collection("customer_payments").document()
-    payment_ref.set(
-        {
-            "company_id": company_id,
-            "customer_id": customer_id,
-            "customer_name": f"{customer_data.get('first_name', '')} {customer_data.get('last_name', '')}",
-            "amount": str(payment_amount),
-            "payment_method": payment_method,
-            "notes": notes or "",
-            "previous_balance": str(current_balance),
-            "new_balance": str(new_balance),
-            "created_by": user.get("uid"),
-            "created_at": firestore.SERVER_TIMESTAMP,
-        }
-    )
+        customer_data = customer_doc.to_dict()
+        if customer_data.get("company_id") != company_id:
+            raise HTTPException(status_code=403, detail="Unauthorized customer access")
 
-    # Allocate payment to oldest open invoices and close fully paid ones
-    remaining_payment = payment_amount
-    invoice_query = (
-        db.collection("invoices")
-        .where("company_id", "==", company_id)
-        .where("customer_id", "==", customer_id)
-    )
-    try:
-        invoice_docs = list(
-            invoice_query.order_by(
-                "issue_date", direction=firestore.Query.ASCENDING
-            ).stream()
-        )
-    except Exception:
-        invoice_docs = list(invoice_query.stream())
-        invoice_docs.sort(
-            key=lambda d: d.to_dict().get("issue_date")
-            or d.to_dict().get("created_at")
-            or ""
+        open_invoices = _open_invoices_query(db, company_id, customer_id).get(
+            transaction=transaction
         )
 
-    for inv_doc in invoice_docs:
-        if remaining_payment <= 0:
-            break
+        # Allocate payment to oldest open invoices and close fully paid ones
+        remaining_payment = payment_amount
+        invoice_updates = []
+        aging_deltas: Dict[str, Dict[str, Decimal]] = {}
+        for inv_doc in open_invoices:
+            if remaining_payment <= 0:
+                break
+
+            inv = inv_doc.to_dict()
+            due = _invoice_due_amount(inv)
+            if due <= 0:
+                continue
 
-        inv = inv_doc.to_dict()
-        total = _safe_decimal(inv.get("total_amount", 0))
-        paid_cash = _safe_decimal(inv.get("amount_paid", 0))
-        credit_applied = _safe_decimal(inv.get("credit_applied", 0))
-        already_effective = paid_cash + credit_applied
-        due = total - already_effective
-        if due <= 0:
-            continue
+            paid_cash = _safe_decimal(inv.get("amount_paid", 0))
+            credit_applied = _safe_decimal(inv.get("credit_applied", 0))
+            add_paid = remaining_payment if remaining_payment <= due else due
+            new_amount_paid = paid_cash + add_paid
+            new_effective_paid = new_amount_paid + credit_applied
+            new_due = due - add_paid
+            new_payment_status = "paid" if new_due <= 0 else "partial"
+
+            update_payload = {
+                "amount_paid": _decimal_to_str(new_amount_paid),
+                "effective_paid": _decimal_to_str(new_effective_paid),
+                "due_amount": _decimal_to_str(max(new_due, Decimal("0"))),
+                "payment_status": new_payment_status,
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            }
+            if new_payment_status == "paid":
+                update_payload["status"] = "closed"
+            update_payload.update(
+                aging.plan_reduction(aging_deltas, customer_id, inv, add_paid)
+            )
 
-        add_paid = remaining_payment if remaining_payment <= due else due
-        new_amount_paid = paid_cash + add_paid
-        new_effective_paid = new_amount_paid + credit_applied
-        new_due = total - new_effective_paid
-        new_payment_status = "paid" if new_due <= 0 else "partial"
+            invoice_updates.append((inv_doc.reference, update_payload))
+            remaining_payment -= add_paid
 
-        update_payload = {
-            "amount_paid": _decimal_to_str(new_amount_paid),
-            "effective_paid": _decimal_to_str(new_effective_paid),
-            "payment_status": new_payment_status,
-            "updated_at": firestore.SERVER_TIMESTAMP,
-        }
-        if new_payment_status == "paid":
-            update_payload["status"] = "closed"
+        # Reduce balance
+        current_balance = _safe_decimal(customer_data.get("balance", 0))
+        new_balance = current_balance - payment_amount
+
+        transaction.set(
+            payment_ref,
+            {
+                "company_id": company_id,
+                "customer_id": customer_id,
+                "customer_name": f"{customer_data.get('first_name', '')} {customer_data.get('last_name', '')}",
+                "amount": str(payment_amount),
+                "payment_method": payment_method,
+                "notes": notes or "",
+                "previous_balance": str(current_balance),
+                "new_balance": str(new_balance),
+                "allocated_invoice_ids": [ref.id for ref, _ in invoice_updates],
+                "unallocated_amount": _decimal_to_str(remaining_payment),
+                "created_by": user.get("uid"),
+                "created_at": firestore.SERVER_TIMESTAMP,
+            },
+        )
+        for invoice_ref, update_payload in invoice_updates:
+            transaction.update(invoice_ref, update_payload)
+        aging.apply_many(transaction, aging_deltas)
+        transaction.update(
+            customer_ref,
+            {
+                "balance": str(new_balance),
+                **_customer_summary_update(
+                    customer_data,
+                    paid_on_invoices=payment_amount - remaining_payment,
+                    manual_payment=payment_amount,
+                ),
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            },
+        )
+        return new_balance
 
-        db.collection("invoices").document(inv_doc.id).update(update_payload)
-        remaining_payment -= add_paid
+    new_balance = _execute(db.transaction())
 
     return {
         "id": payment_ref.id,
@@ -1648,6 +2781,74 @@ async def add_customer_payment(
     }
 
 
+# ===================== RECEIVABLES AGING =====================
+@router.get("/reports/ar-aging")
+def get_ar_aging_report(
+    limit: int = Query(100, ge=1, le=500),
+    user: dict = Depends(get_current_user),
+):
+    """Company receivables by aging bucket plus the largest customer balances."""
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    return get_ar_aging_service(company_id).get_report(limit)
+
+
+@router.get("/customers/{customer_id}/aging")
+def get_customer_aging(customer_id: str, user: dict = Depends(get_current_user)):
+    """Receivables aging buckets for one customer."""
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    return get_ar_aging_service(company_id).get_customer_aging(customer_id)
+
+
+@router.post("/reports/ar-aging/age")
+def run_ar_aging(user: dict = Depends(get_current_user)):
+    """Move open invoices into older buckets as their due dates pass.
+
+    Intended to be triggered by a scheduler once a night.
+    """
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    return get_ar_aging_service(company_id).age()
+
+
+@router.post("/reports/ar-aging/rebuild")
+def rebuild_ar_aging(user: dict = Depends(get_current_user)):
+    """Recompute aging buckets from open invoices (initial backfill or repair)."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    return get_ar_aging_service(company_id).rebuild()
+
+
+@router.post("/reports/account-ledger/rebuild")
+def rebuild_account_ledger(user: dict = Depends(get_current_user)):
+    """Write per-account ledger rows for journal entries posted before the ledger existed."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    result = get_account_ledger_service(company_id).rebuild()
+    _invalidate_reports(company_id)
+    return result
+
+
 # ===================== SALES / INVOICES =====================
 @router.get("/sales/invoices")
 @router.get("/invoices")
@@ -1679,7 +2880,8 @@ def list_invoices(
                 "issue_date", direction=firestore.Query.DESCENDING
             ).stream()
             docs = list(docs)
-        except Exception:
+        except FailedPrecondition as e:
+            record_index_fallback("GET /invoices", e)
             docs = list(query.stream())
             docs.sort(
                 key=lambda d: (
@@ -1706,12 +2908,209 @@ def list_invoices(
                     if to_date and created_str > to_date:
                         continue
 
-            results.append(data)
+            results.append(data)
+
+        return results
+    except Exception as e:
+        print(f"Error listing invoices: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Contention on the customer or counter document aborts the transaction;
+# the client library retries it with backoff up to this many attempts.
+INVOICE_TX_MAX_ATTEMPTS = 5
+
+
+def _load_cost_layers(layer_docs: List[Any]) -> List[Dict[str, Any]]:
+    """In-memory FIFO layers for one product, oldest first."""
+    layers = []
+    for doc in layer_docs:
+        data = doc.to_dict() or {}
+        layers.append(
+            {
+                "ref": doc.reference,
+                "unit_cost": str(data.get("unit_cost")),
+                "qty_on_hand": _safe_decimal(data.get("qty_on_hand", 0)),
+                "qty_received_total": _safe_decimal(data.get("qty_received_total", 0)),
+                "created_at": data.get("created_at"),
+                "dirty": False,
+            }
+        )
+    layers.sort(key=lambda layer: str(layer["created_at"] or ""))
+    return layers
+
+
+def _consume_cost_layers(
+    layers: List[Dict[str, Any]],
+    current_qty: Decimal,
+    current_wac: Decimal,
+    quantity: Decimal,
+) -> List[Dict[str, str]]:
+    """Take ``quantity`` off the layers in place, oldest first.
+
+    Stock recorded before cost layers existed is first backfilled as a layer at
+    the current WAC. Returns what was taken from each layer, so a return can
+    restore it at the same cost.
+    """
+    missing = current_qty - sum(layer["qty_on_hand"] for layer in layers)
+    if missing > 0:
+        cost_str = _decimal_to_str(current_wac)
+        backfill = next((l for l in layers if l["unit_cost"] == cost_str), None)
+        if backfill is None:
+            backfill = {
+                "ref": None,
+                "unit_cost": cost_str,
+                "qty_on_hand": Decimal("0"),
+                "qty_received_total": Decimal("0"),
+                "created_at": None,
+                "dirty": False,
+            }
+            layers.append(backfill)
+        backfill["qty_on_hand"] += missing
+        backfill["qty_received_total"] += missing
+        backfill["dirty"] = True
+
+    taken = []
+    remaining = quantity
+    for layer in layers:
+        if remaining <= 0:
+            break
+        if layer["qty_on_hand"] <= 0:
+            continue
+        take = min(layer["qty_on_hand"], remaining)
+        layer["qty_on_hand"] -= take
+        layer["dirty"] = True
+        remaining -= take
+        taken.append(
+            {
+                "layer_id": layer["ref"].id if layer["ref"] is not None else None,
+                "unit_cost": layer["unit_cost"],
+                "qty": _decimal_to_str(take),
+            }
+        )
+    return taken
+
+
+def _cost_layer_writes(layers: List[Dict[str, Any]], product_id: str) -> List[tuple]:
+    """(layer_ref, fields) pairs for changed layers; a ``None`` ref means a new layer document."""
+    writes = []
+    for layer in layers:
+        if not layer["dirty"]:
+            continue
+        fields = {
+            "qty_on_hand": _decimal_to_str(layer["qty_on_hand"]),
+            "qty_received_total": _decimal_to_str(layer["qty_received_total"]),
+        }
+        if layer["ref"] is None:
+            fields["product_id"] = product_id
+            fields["unit_cost"] = layer["unit_cost"]
+        writes.append((layer["ref"], fields))
+    return writes
+
+
+def _plan_sale_layers(
+    product_id: str,
+    layer_docs: List[Any],
+    current_qty: Decimal,
+    current_wac: Decimal,
+    quantity: Decimal,
+) -> tuple:
+    """FIFO layer consumption for one product, computed in memory.
+
+    Returns the layer writes and what was taken from each layer.
+    """
+    layers = _load_cost_layers(layer_docs)
+    taken = _consume_cost_layers(layers, current_qty, current_wac, quantity)
+    return _cost_layer_writes(layers, product_id), taken
+
+
+def _write_cost_layers(transaction, db, company_id: str, layer_writes: List[tuple]):
+    for layer_ref, layer_data in layer_writes:
+        if layer_ref is None:
+            transaction.set(
+                db.collection("stock_cost_layers").document(),
+                {
+                    "company_id": company_id,
+                    **layer_data,
+                    "created_at": firestore.SERVER_TIMESTAMP,
+                    "updated_at": firestore.SERVER_TIMESTAMP,
+                },
+            )
+        else:
+            transaction.update(
+                layer_ref, {**layer_data, "updated_at": firestore.SERVER_TIMESTAMP}
+            )
+
+
+def _invoice_settlement(
+    current_balance: Decimal, total_amount: Decimal, amount_paid: Decimal
+) -> Dict[str, Any]:
+    """Customer credit applied to a new invoice, what is still due, and its payment status."""
+    available_credit = abs(current_balance) if current_balance < 0 else Decimal("0")
+    credit_applied = (
+        available_credit if available_credit <= total_amount else total_amount
+    )
+    effective_paid = amount_paid + credit_applied
+    due_amount = max(total_amount - effective_paid, Decimal("0"))
+
+    payment_status = "unpaid"
+    if effective_paid >= total_amount:
+        payment_status = "paid"
+    elif effective_paid > 0:
+        payment_status = "partial"
+
+    return {
+        "credit_applied": credit_applied,
+        "effective_paid": effective_paid,
+        "due_amount": due_amount,
+        "payment_status": payment_status,
+    }
+
+
+def _invoice_document(
+    data: dict,
+    user: dict,
+    company_id: str,
+    invoice_number: Optional[str],
+    issue_date: str,
+    settlement: Dict[str, Any],
+    aging,
+) -> Dict[str, Any]:
+    """Fields of a new invoice document built from a create payload."""
+    # Store creator info
+    creator_role = user.get("role", "staff").capitalize()
+    created_by_display = "Admin" if user.get("role") == "admin" else creator_role
+    payment_status = settlement["payment_status"]
 
-        return results
-    except Exception as e:
-        print(f"Error listing invoices: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "company_id": company_id,
+        "invoice_number": invoice_number,
+        "customer_id": data.get("customer_id"),
+        "customer_name": data.get("customer_name"),
+        "customer_phone": data.get("customer_phone", ""),
+        "items": data.get("items", []),
+        "subtotal": str(data.get("subtotal", 0)),
+        "discount": str(data.get("discount", 0)),
+        "tax": str(data.get("tax", 0)),
+        "total_amount": str(Decimal(str(data.get("total_amount", 0)))),
+        "amount_paid": str(Decimal(str(data.get("amount_paid", 0)))),
+        "credit_applied": str(settlement["credit_applied"]),
+        "effective_paid": str(settlement["effective_paid"]),
+        "due_amount": str(settlement["due_amount"]),
+        "payment_status": payment_status,
+        "payment_method": data.get("payment_method", "cash"),
+        "warehouse_id": data.get("warehouse_id") or DEFAULT_WAREHOUSE,
+        "notes": data.get("notes", ""),
+        "status": "closed"
+        if payment_status == "paid"
+        else data.get("status", "issued"),
+        "issue_date": issue_date,
+        "due_date": data.get("due_date"),
+        "created_by": created_by_display,
+        "created_by_uid": user.get("uid"),
+        "created_at": firestore.SERVER_TIMESTAMP,
+        **aging.invoice_fields(settlement["due_amount"], data.get("due_date"), issue_date),
+    }
 
 
 @router.post("/sales/invoices")
@@ -1730,171 +3129,208 @@ def create_invoice(data: dict, user: dict = Depends(get_current_user)):
         if not data.get("items") or len(data.get("items", [])) == 0:
             raise HTTPException(status_code=400, detail="At least one item is required")
 
-        # Validate stock availability
+        # Validate lines and aggregate quantity per product (and per stock level)
+        warehouse_id = data.get("warehouse_id")
+        ordered: Dict[str, Decimal] = {}
+        level_deltas: Dict[tuple, Decimal] = {}
         for item in data.get("items", []):
             product_id = item.get("product_id")
-            quantity = Decimal(str(item.get("quantity", 0)))
-            unit_price = Decimal(str(item.get("price", 0)))
-
-            product_ref = db.collection("items").document(product_id)
-            product_doc = product_ref.get()
-
-            if not product_doc.exists:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Product {item.get('product_name')} not found",
-                )
-
-            product_data = product_doc.to_dict()
-            current_qty = Decimal(str(product_data.get("current_qty", 0)))
-            cost_price = Decimal(str(product_data.get("cost_price", 0)))
-
-            if unit_price < cost_price:
-                raise HTTPException(
-                    status_code=400,
-                    detail=(
-                        f"Selling price cannot be less than cost for {item.get('product_name')}. "
-                        f"Cost: {cost_price}, Price: {unit_price}"
-                    ),
-                )
-
-            if quantity > current_qty:
+            if not product_id:
+                raise HTTPException(status_code=400, detail="Each item needs a product_id")
+            quantity = _safe_decimal(item.get("quantity", 0))
+            if quantity <= 0:
                 raise HTTPException(
                     status_code=400,
-                    detail=f"Insufficient stock for {item.get('product_name')}. Available: {current_qty}, Requested: {quantity}",
+                    detail=f"Quantity must be greater than zero for {item.get('product_name')}",
                 )
+            ordered[product_id] = ordered.get(product_id, Decimal("0")) + quantity
+            StockLevelService.add(
+                level_deltas,
+                StockLevelService.key(product_id, warehouse_id, item.get("batch_number")),
+                -quantity,
+            )
 
-        customer_ref = db.collection("customers").document(data.get("customer_id"))
-        customer_doc = customer_ref.get()
-        if not customer_doc.exists:
-            raise HTTPException(status_code=400, detail="Customer not found")
-
-        customer_data = customer_doc.to_dict()
-        current_balance = Decimal(str(customer_data.get("balance", 0)))
+        product_ids = list(ordered)
         total_amount = Decimal(str(data.get("total_amount", 0)))
         amount_paid = Decimal(str(data.get("amount_paid", 0)))
+        issue_date = data.get("issue_date") or datetime.now().isoformat()
 
-        available_credit = abs(current_balance) if current_balance < 0 else Decimal("0")
-        credit_applied = (
-            available_credit if available_credit <= total_amount else total_amount
-        )
-        effective_paid = amount_paid + credit_applied
-
-        payment_status = "unpaid"
-        if effective_paid >= total_amount:
-            payment_status = "paid"
-        elif effective_paid > 0:
-            payment_status = "partial"
-
-        # Auto-generate invoice number if not provided
+        customer_ref = db.collection("customers").document(data.get("customer_id"))
+        numbering = get_numbering_service(company_id)
         invoice_number = data.get("invoice_number")
-        if not invoice_number:
-            counter_ref = db.collection("counters").document(f"invoice_{company_id}")
-            try:
-                # Use a transaction to safely increment the counter
-                @firestore.transactional
-                def get_next_invoice_number(transaction, counter_ref):
-                    snapshot = transaction.get(counter_ref)
-                    if not snapshot.exists:
-                        new_count = 1
-                        transaction.set(counter_ref, {"count": new_count})
-                    else:
-                        new_count = snapshot.get("count") + 1
-                        transaction.update(counter_ref, {"count": new_count})
-                    return new_count
-
-                transaction = db.transaction()
-                next_count = get_next_invoice_number(transaction, counter_ref)
-                invoice_number = f"INV-{next_count:05d}"
-            except Exception as e:
-                print(f"Error generating invoice number: {e}")
-                # Fallback to timestamp if transaction fails
-                invoice_number = f"INV-{int(datetime.now().timestamp())}"
-
-        # Store creator info
-        creator_role = user.get("role", "staff").capitalize()
-        created_by_display = "Admin" if user.get("role") == "admin" else creator_role
-
-        # Create invoice
-        invoice_data = {
-            "company_id": company_id,
-            "invoice_number": invoice_number,
-            "customer_id": data.get("customer_id"),
-            "customer_name": data.get("customer_name"),
-            "customer_phone": data.get("customer_phone", ""),
-            "items": data.get("items", []),
-            "subtotal": str(data.get("subtotal", 0)),
-            "discount": str(data.get("discount", 0)),
-            "tax": str(data.get("tax", 0)),
-            "total_amount": str(total_amount),
-            "amount_paid": str(amount_paid),
-            "credit_applied": str(credit_applied),
-            "effective_paid": str(effective_paid),
-            "payment_status": payment_status,
-            "payment_method": data.get("payment_method", "cash"),
-            "notes": data.get("notes", ""),
-            "status": "closed"
-            if payment_status == "paid"
-            else data.get("status", "issued"),
-            "issue_date": data.get("issue_date") or datetime.now().isoformat(),
-            "due_date": data.get("due_date"),
-            "created_by": created_by_display,
-            "created_by_uid": user.get("uid"),
-            "created_at": firestore.SERVER_TIMESTAMP,
-        }
-
+        claim_number = not invoice_number and numbering.is_gapless("sales_invoice")
+        if not invoice_number and not claim_number:
+            invoice_number = numbering.get_next_number("sales_invoice")
+        item_refs = {pid: db.collection("items").document(pid) for pid in product_ids}
         doc_ref = db.collection("invoices").document()
-        doc_ref.set(invoice_data)
-
-        # Deduct stock for each item
-        for item in data.get("items", []):
-            product_id = item.get("product_id")
-            quantity = Decimal(str(item.get("quantity", 0)))
-
-            product_ref = db.collection("items").document(product_id)
-            product_doc = product_ref.get()
-            product_data = product_doc.to_dict()
+        aging = get_ar_aging_service(company_id)
+        levels = get_stock_level_service(company_id)
+
+        @firestore.transactional
+        def _execute(transaction):
+            # PHASE 1: reads (items, customer and counter in one get_all; layers
+            # and, for an explicit warehouse, its stock levels via batched "in"
+            # queries)
+            refs = list(item_refs.values()) + [customer_ref]
+            if claim_number:
+                refs.extend(numbering.transaction_refs("sales_invoice"))
+            snapshots = {
+                snap.reference.path: snap
+                for snap in db.get_all(refs, transaction=transaction)
+            }
 
-            current_qty = Decimal(str(product_data.get("current_qty", 0)))
-            current_wac = Decimal(str(product_data.get("current_wac", 0)))
-            new_qty = current_qty - quantity
+            layers_by_product: Dict[str, List[Any]] = {pid: [] for pid in product_ids}
+            for start in range(0, len(product_ids), 30):
+                layer_query = (
+                    db.collection("stock_cost_layers")
+                    .where("company_id", "==", company_id)
+                    .where("product_id", "in", product_ids[start : start + 30])
+                )
+                for layer_doc in layer_query.get(transaction=transaction):
+                    layers_by_product[layer_doc.get("product_id")].append(layer_doc)
 
-            product_ref.update(
-                {
-                    "current_qty": str(new_qty),
-                    "total_value": str(new_qty * current_wac),
-                    "updated_at": firestore.SERVER_TIMESTAMP,
-                }
+            in_warehouse = (
+                levels.available_in(transaction, warehouse_id, product_ids)
+                if warehouse_id
+                else None
             )
 
-            # Backfill layer quantities for legacy stock (pre-layer records)
-            layer_docs = list(
-                db.collection("stock_cost_layers")
-                .where("company_id", "==", company_id)
-                .where("product_id", "==", product_id)
-                .stream()
+            # PHASE 2: validate and compute in memory
+            item_updates = {}
+            layer_writes = []
+            cost_consumption = []
+            rates: Dict[str, tuple] = {}
+            for item in data.get("items", []):
+                snap = snapshots.get(item_refs[item.get("product_id")].path)
+                if snap is None or not snap.exists:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Product {item.get('product_name')} not found",
+                    )
+                product_data = snap.to_dict()
+                if product_data.get("company_id") != company_id:
+                    raise HTTPException(
+                        status_code=403, detail="Unauthorized product access"
+                    )
+
+                unit_price = _safe_decimal(item.get("price", 0))
+                cost_price = _safe_decimal(product_data.get("cost_price", 0))
+                if unit_price < cost_price:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=(
+                            f"Selling price cannot be less than cost for {item.get('product_name')}. "
+                            f"Cost: {cost_price}, Price: {unit_price}"
+                        ),
+                    )
+
+            for product_id in product_ids:
+                product_data = snapshots[item_refs[product_id].path].to_dict()
+                quantity = ordered[product_id]
+                current_qty = _safe_decimal(product_data.get("current_qty", 0))
+                current_wac = _safe_decimal(product_data.get("current_wac", 0))
+                if quantity > current_qty:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Insufficient stock for {product_data.get('name', product_id)}. Available: {current_qty}, Requested: {quantity}",
+                    )
+                if in_warehouse is not None and quantity > in_warehouse[product_id]:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=(
+                            f"Insufficient stock for {product_data.get('name', product_id)} "
+                            f"in warehouse {warehouse_id}. Available: {in_warehouse[product_id]}, "
+                            f"Requested: {quantity}"
+                        ),
+                    )
+
+                new_qty = current_qty - quantity
+                rates[product_id] = (current_wac, current_wac)
+                item_updates[product_id] = with_units(
+                    {
+                        "current_qty": str(new_qty),
+                        "total_value": str(new_qty * current_wac),
+                        "updated_at": firestore.SERVER_TIMESTAMP,
+                    },
+                    ITEM_AMOUNTS,
+                )
+                writes, taken = _plan_sale_layers(
+                    product_id, layers_by_product[product_id], current_qty, current_wac, quantity
+                )
+                layer_writes.extend(writes)
+                cost_consumption.extend({"product_id": product_id, **t} for t in taken)
+
+            customer_snap = snapshots.get(customer_ref.path)
+            if customer_snap is None or not customer_snap.exists:
+                raise HTTPException(status_code=400, detail="Customer not found")
+            customer_data = customer_snap.to_dict()
+            if customer_data.get("company_id") != company_id:
+                raise HTTPException(status_code=403, detail="Unauthorized customer access")
+
+            current_balance = _safe_decimal(customer_data.get("balance", 0))
+            settlement = _invoice_settlement(current_balance, total_amount, amount_paid)
+            due_amount = settlement["due_amount"]
+
+            # Create invoice
+            invoice_data = _invoice_document(
+                data, user, company_id, invoice_number, issue_date, settlement, aging
             )
-            layer_on_hand = Decimal("0")
-            for ld in layer_docs:
-                layer_on_hand += _safe_decimal(ld.to_dict().get("qty_on_hand", 0))
+            invoice_data["cost_consumption"] = cost_consumption
 
-            if layer_on_hand < current_qty:
-                missing = current_qty - layer_on_hand
-                if missing > 0:
-                    _upsert_cost_layer(db, company_id, product_id, current_wac, missing)
+            # Update customer running balance (supports credit carry-over)
+            total_purchases = _safe_decimal(customer_data.get("total_purchases", 0))
+            new_balance = current_balance + total_amount - amount_paid
 
-            _consume_cost_layers_fifo(db, company_id, product_id, quantity)
-
-        # Update customer running balance (supports credit carry-over)
-        total_purchases = Decimal(str(customer_data.get("total_purchases", 0)))
-        new_balance = current_balance + total_amount - amount_paid
+            # invoice + items + layers + levels and their ledger rows + customer
+            # + sequence + two aging documents
+            write_count = (
+                1 + len(item_updates) + len(layer_writes) + 2 * len(level_deltas) + 1 + 1 + 2
+            )
+            if write_count > FIRESTORE_WRITE_LIMIT:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Invoice touches too many products/cost layers for one transaction",
+                )
 
-        customer_ref.update(
-            {
-                "balance": str(new_balance),
-                "total_purchases": str(total_purchases + total_amount),
-                "updated_at": firestore.SERVER_TIMESTAMP,
-            }
+            # PHASE 3: writes
+            if claim_number:
+                # Gapless mode: the number commits or rolls back with the invoice
+                invoice_data["invoice_number"] = numbering.claim(
+                    transaction, "sales_invoice", snapshots
+                )
+            transaction.set(doc_ref, invoice_data)
+            for product_id, update in item_updates.items():
+                transaction.update(item_refs[product_id], update)
+            _write_cost_layers(transaction, db, company_id, layer_writes)
+            levels.apply(transaction, level_deltas)
+            levels.record_ledger(
+                transaction, level_deltas, rates, doc_ref.id, "INV", data.get("customer_id")
+            )
+            transaction.update(
+                customer_ref,
+                {
+                    "balance": str(new_balance),
+                    "total_purchases": str(total_purchases + total_amount),
+                    **_customer_summary_update(
+                        customer_data, invoiced=total_amount, paid_on_invoices=amount_paid
+                    ),
+                    "updated_at": firestore.SERVER_TIMESTAMP,
+                },
+            )
+            aging.apply(
+                transaction,
+                data.get("customer_id"),
+                {invoice_data["aging_bucket"]: due_amount},
+            )
+            return invoice_data
+
+        started = time.perf_counter()
+        invoice_data = _execute(db.transaction(max_attempts=INVOICE_TX_MAX_ATTEMPTS))
+        logger.info(
+            "invoice %s created: %d lines in %.1f ms",
+            doc_ref.id,
+            len(data.get("items", [])),
+            (time.perf_counter() - started) * 1000,
         )
 
         # Remove non-serializable timestamp sentinels before returning
@@ -1913,6 +3349,409 @@ def create_invoice(data: dict, user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Offline POS terminals replay their queue in one call; each chunk of
+# invoices is applied in a single transaction.
+BULK_INVOICE_LIMIT = 1000
+BULK_INVOICE_CHUNK = 50
+
+
+class _ChunkTooLarge(Exception):
+    """A bulk invoice chunk would exceed the per-transaction write limit."""
+
+
+def _bulk_invoice_lines(entry: dict) -> Dict[str, Decimal]:
+    """Validate an offline invoice payload; returns quantity per product."""
+    key = entry.get("idempotency_key")
+    if not key or not isinstance(key, str) or "/" in key or len(key) > 200:
+        raise ValueError("A client idempotency_key (max 200 chars, no '/') is required")
+    if not entry.get("customer_id"):
+        raise ValueError("Customer is required")
+    if not entry.get("items"):
+        raise ValueError("At least one item is required")
+
+    ordered: Dict[str, Decimal] = {}
+    for item in entry["items"]:
+        product_id = item.get("product_id")
+        if not product_id:
+            raise ValueError("Each item needs a product_id")
+        quantity = _safe_decimal(item.get("quantity", 0))
+        if quantity <= 0:
+            raise ValueError(
+                f"Quantity must be greater than zero for {item.get('product_name')}"
+            )
+        ordered[product_id] = ordered.get(product_id, Decimal("0")) + quantity
+    return ordered
+
+
+def _ingest_invoice_chunk(
+    db,
+    user: dict,
+    company_id: str,
+    chunk: List[tuple],
+    integrity,
+    numbering,
+    aging,
+    drawn_numbers: Dict[int, str],
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Apply a chunk of ``(index, entry, ordered)`` offline invoices in one transaction.
+
+    Every product, customer and idempotency key in the chunk is read once
+    with ``get_all`` and written once; invoices are applied in order against
+    that in-memory state, so stock and balances chain correctly within the
+    chunk. An invoice that fails validation is rejected on its own without
+    affecting the rest. Raises _ChunkTooLarge if the chunk needs more than
+    one transaction's worth of writes.
+    """
+    product_ids = sorted({pid for _, _, ordered in chunk for pid in ordered})
+    customer_ids = sorted({entry["customer_id"] for _, entry, _ in chunk})
+    item_refs = {pid: db.collection("items").document(pid) for pid in product_ids}
+    customer_refs = {
+        cid: db.collection("customers").document(cid) for cid in customer_ids
+    }
+    key_refs = integrity.idempotency_refs([entry["idempotency_key"] for _, entry, _ in chunk])
+    gapless = numbering.is_gapless("sales_invoice")
+    levels = get_stock_level_service(company_id)
+
+    @firestore.transactional
+    def _execute(transaction):
+        # PHASE 1: reads
+        refs = list(item_refs.values()) + list(customer_refs.values()) + list(key_refs.values())
+        if gapless:
+            refs.extend(numbering.transaction_refs("sales_invoice"))
+        snapshots = {
+            snap.reference.path: snap
+            for snap in db.get_all(refs, transaction=transaction)
+        }
+        processed = integrity.processed_keys(key_refs, snapshots)
+
+        products: Dict[str, Dict[str, Any]] = {}
+        for pid, ref in item_refs.items():
+            snap = snapshots.get(ref.path)
+            if snap is not None and snap.exists and snap.get("company_id") == company_id:
+                product_data = snap.to_dict()
+                products[pid] = {
+                    "data": product_data,
+                    "qty": _safe_decimal(product_data.get("current_qty", 0)),
+                    "wac": _safe_decimal(product_data.get("current_wac", 0)),
+                    "cost": _safe_decimal(product_data.get("cost_price", 0)),
+                    "layers": [],
+                    "touched": False,
+                }
+
+        layer_product_ids = list(products)
+        layer_docs: Dict[str, List[Any]] = {pid: [] for pid in layer_product_ids}
+        for start in range(0, len(layer_product_ids), 30):
+            layer_query = (
+                db.collection("stock_cost_layers")
+                .where("company_id", "==", company_id)
+                .where("product_id", "in", layer_product_ids[start : start + 30])
+            )
+            for layer_doc in layer_query.get(transaction=transaction):
+                layer_docs[layer_doc.get("product_id")].append(layer_doc)
+        for pid, docs in layer_docs.items():
+            products[pid]["layers"] = _load_cost_layers(docs)
+
+        customers: Dict[str, Dict[str, Any]] = {}
+        for cid, ref in customer_refs.items():
+            snap = snapshots.get(ref.path)
+            if snap is not None and snap.exists and snap.get("company_id") == company_id:
+                customer_data = snap.to_dict()
+                customers[cid] = {
+                    "data": customer_data,
+                    "balance": _safe_decimal(customer_data.get("balance", 0)),
+                    "total_purchases": _safe_decimal(customer_data.get("total_purchases", 0)),
+                    "invoiced": Decimal("0"),
+                    "paid": Decimal("0"),
+                    "count": 0,
+                }
+
+        # PHASE 2: apply invoices in order, in memory
+        outcomes: Dict[int, Dict[str, Any]] = {}
+        accepted = []
+        aging_deltas: Dict[str, Dict[str, Decimal]] = {}
+        level_deltas: Dict[tuple, Decimal] = {}
+        movements: Dict[int, tuple] = {}  # index -> (its level deltas, rates)
+        for index, entry, ordered in chunk:
+            key = entry["idempotency_key"]
+            if key in processed:
+                outcomes[index] = {
+                    "status": "duplicate",
+                    "id": processed[key].get("invoice_id"),
+                    "invoice_number": processed[key].get("invoice_number"),
+                }
+                continue
+
+            customer = customers.get(entry["customer_id"])
+            error = None if customer else "Customer not found"
+            for item in entry["items"]:
+                if error:
+                    break
+                product = products.get(item["product_id"])
+                if product is None:
+                    error = f"Product {item.get('product_name') or item['product_id']} not found"
+                elif _safe_decimal(item.get("price", 0)) < product["cost"]:
+                    error = f"Selling price cannot be less than cost for {item.get('product_name')}"
+            for pid, quantity in ordered.items():
+                if error:
+                    break
+                if quantity > products[pid]["qty"]:
+                    error = (
+                        f"Insufficient stock for {products[pid]['data'].get('name', pid)}. "
+                        f"Available: {products[pid]['qty']}, Requested: {quantity}"
+                    )
+            if error:
+                outcomes[index] = {"status": "rejected", "error": error}
+                continue
+
+            cost_consumption = []
+            for pid, quantity in ordered.items():
+                product = products[pid]
+                taken = _consume_cost_layers(
+                    product["layers"], product["qty"], product["wac"], quantity
+                )
+                cost_consumption.extend({"product_id": pid, **t} for t in taken)
+                product["qty"] -= quantity
+                product["touched"] = True
+            # Offline sales already happened, so levels are not checked, only moved
+            invoice_deltas: Dict[tuple, Decimal] = {}
+            for item in entry["items"]:
+                StockLevelService.add(
+                    invoice_deltas,
+                    StockLevelService.key(
+                        item["product_id"], entry.get("warehouse_id"), item.get("batch_number")
+                    ),
+                    -_safe_decimal(item.get("quantity", 0)),
+                )
+            for level_key, quantity in invoice_deltas.items():
+                StockLevelService.add(level_deltas, level_key, quantity)
+            movements[index] = (
+                invoice_deltas,
+                {pid: (products[pid]["wac"], products[pid]["wac"]) for pid in ordered},
+            )
+
+            total_amount = Decimal(str(entry.get("total_amount", 0)))
+            amount_paid = Decimal(str(entry.get("amount_paid", 0)))
+            settlement = _invoice_settlement(customer["balance"], total_amount, amount_paid)
+            customer["balance"] += total_amount - amount_paid
+            customer["total_purchases"] += total_amount
+            customer["invoiced"] += total_amount
+            customer["paid"] += amount_paid
+            customer["count"] += 1
+
+            issue_date = entry.get("issue_date") or datetime.now().isoformat()
+            invoice_data = _invoice_document(
+                entry,
+                user,
+                company_id,
+                entry.get("invoice_number") or drawn_numbers.get(index),
+                issue_date,
+                settlement,
+                aging,
+            )
+            invoice_data["idempotency_key"] = key
+            invoice_data["cost_consumption"] = cost_consumption
+            bucket = invoice_data["aging_bucket"]
+            if bucket:
+                deltas = aging_deltas.setdefault(entry["customer_id"], {})
+                deltas[bucket] = deltas.get(bucket, Decimal("0")) + settlement["due_amount"]
+            accepted.append((index, invoice_data))
+
+        layer_writes = [
+            write
+            for pid, product in products.items()
+            if product["touched"]
+            for write in _cost_layer_writes(product["layers"], pid)
+        ]
+        touched_products = [pid for pid, p in products.items() if p["touched"]]
+        touched_customers = [cid for cid, c in customers.items() if c["count"]]
+        # invoices + keys + items + layers + levels + ledger rows + customers
+        # + sequence + aging documents
+        write_count = (
+            2 * len(accepted)
+            + len(touched_products)
+            + len(layer_writes)
+            + len(level_deltas)
+            + sum(len(movements[index][0]) for index, _ in accepted)
+            + len(touched_customers)
+            + 1
+            + len(aging_deltas)
+            + 1
+        )
+        if write_count > FIRESTORE_WRITE_LIMIT:
+            raise _ChunkTooLarge()
+
+        # PHASE 3: writes
+        unnumbered = [inv for _, inv in accepted if not inv["invoice_number"]]
+        if gapless and unnumbered:
+            # The numbers commit or roll back with the invoices
+            for invoice_data, number in zip(
+                unnumbered,
+                numbering.claim_many(transaction, "sales_invoice", snapshots, len(unnumbered)),
+            ):
+                invoice_data["invoice_number"] = number
+
+        for index, invoice_data in accepted:
+            doc_ref = db.collection("invoices").document()
+            transaction.set(doc_ref, invoice_data)
+            integrity.set_idempotency(
+                transaction,
+                invoice_data["idempotency_key"],
+                {"invoice_id": doc_ref.id, "invoice_number": invoice_data["invoice_number"]},
+            )
+            invoice_deltas, rates = movements[index]
+            levels.record_ledger(
+                transaction, invoice_deltas, rates, doc_ref.id, "INV", invoice_data.get("customer_id")
+            )
+            outcomes[index] = {
+                "status": "created",
+                "id": doc_ref.id,
+                "invoice_number": invoice_data["invoice_number"],
+            }
+
+        for pid in touched_products:
+            product = products[pid]
+            transaction.update(
+                item_refs[pid],
+                with_units(
+                    {
+                        "current_qty": str(product["qty"]),
+                        "total_value": str(product["qty"] * product["wac"]),
+                        "updated_at": firestore.SERVER_TIMESTAMP,
+                    },
+                    ITEM_AMOUNTS,
+                ),
+            )
+        _write_cost_layers(transaction, db, company_id, layer_writes)
+        levels.apply(transaction, level_deltas)
+
+        for cid in touched_customers:
+            customer = customers[cid]
+            transaction.update(
+                customer_refs[cid],
+                {
+                    "balance": str(customer["balance"]),
+                    "total_purchases": str(customer["total_purchases"]),
+                    **_customer_summary_update(
+                        customer["data"],
+                        invoiced=customer["invoiced"],
+                        paid_on_invoices=customer["paid"],
+                        invoice_count=customer["count"],
+                    ),
+                    "updated_at": firestore.SERVER_TIMESTAMP,
+                },
+            )
+        aging.apply_many(transaction, aging_deltas)
+        return outcomes
+
+    if not gapless:
+        # Block-allocated numbers are drawn once per invoice and reused if
+        # the transaction retries.
+        for index, entry, _ in chunk:
+            if not entry.get("invoice_number") and index not in drawn_numbers:
+                drawn_numbers[index] = numbering.get_next_number("sales_invoice")
+
+    return _execute(db.transaction(max_attempts=INVOICE_TX_MAX_ATTEMPTS))
+
+
+@router.post("/sales/invoices/bulk")
+@router.post("/invoices/bulk")
+def create_invoices_bulk(data: dict, user: dict = Depends(get_current_user)):
+    """
+    Ingest invoices queued offline by POS terminals.
+
+    Body: ``{"invoices": [{...invoice..., "idempotency_key": "..."}, ...]}``.
+    Each invoice carries a client-generated idempotency key; replaying a key
+    returns the invoice created the first time instead of creating another.
+    Invoices are applied in the order sent, in chunked transactions. Returns
+    one result per invoice, in order, with status created, duplicate,
+    rejected (will never succeed as sent) or failed (safe to retry).
+    """
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    entries = data.get("invoices") or []
+    if not entries:
+        raise HTTPException(status_code=400, detail="No invoices provided")
+    if len(entries) > BULK_INVOICE_LIMIT:
+        raise HTTPException(
+            status_code=400, detail=f"At most {BULK_INVOICE_LIMIT} invoices per request"
+        )
+
+    db = get_db()
+    integrity = get_integrity_service(company_id)
+    numbering = get_numbering_service(company_id)
+    aging = get_ar_aging_service(company_id)
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(entries)
+    pending: List[tuple] = []
+    first_by_key: Dict[str, int] = {}
+    repeats: List[tuple] = []
+    for index, entry in enumerate(entries):
+        try:
+            ordered = _bulk_invoice_lines(entry)
+        except ValueError as e:
+            results[index] = {"status": "rejected", "error": str(e)}
+            continue
+        key = entry["idempotency_key"]
+        if key in first_by_key:
+            repeats.append((index, first_by_key[key]))
+            continue
+        first_by_key[key] = index
+        pending.append((index, entry, ordered))
+
+    drawn_numbers: Dict[int, str] = {}
+
+    def _ingest(chunk: List[tuple]):
+        try:
+            outcomes = _ingest_invoice_chunk(
+                db, user, company_id, chunk, integrity, numbering, aging, drawn_numbers
+            )
+        except _ChunkTooLarge:
+            if len(chunk) == 1:
+                results[chunk[0][0]] = {
+                    "status": "rejected",
+                    "error": "Invoice touches too many products/cost layers for one transaction",
+                }
+                return
+            middle = len(chunk) // 2
+            _ingest(chunk[:middle])
+            _ingest(chunk[middle:])
+            return
+        except Exception as e:
+            logger.exception("bulk invoice chunk of %d failed", len(chunk))
+            outcomes = {index: {"status": "failed", "error": str(e)} for index, _, _ in chunk}
+        for index, outcome in outcomes.items():
+            results[index] = outcome
+
+    started = time.perf_counter()
+    for start in range(0, len(pending), BULK_INVOICE_CHUNK):
+        _ingest(pending[start : start + BULK_INVOICE_CHUNK])
+
+    for index, first in repeats:
+        first_result = results[first] or {}
+        if first_result.get("status") in ("created", "duplicate"):
+            results[index] = {**first_result, "status": "duplicate"}
+        else:
+            results[index] = dict(first_result)
+
+    for index, result in enumerate(results):
+        result["index"] = index
+        result["idempotency_key"] = entries[index].get("idempotency_key")
+
+    counts: Dict[str, int] = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    logger.info(
+        "bulk invoices: %d received, %s in %.1f ms",
+        len(entries),
+        counts,
+        (time.perf_counter() - started) * 1000,
+    )
+    return {"results": results, "counts": counts}
+
+
 @router.get("/sales/invoices/{invoice_id}")
 @router.get("/invoices/{invoice_id}")
 def get_invoice(invoice_id: str, user: dict = Depends(get_current_user)):
@@ -1969,12 +3808,38 @@ def add_payment(
             payment_status = "partial"
 
         # Update invoice
-        invoice_ref.update({
+        credit_applied = _safe_decimal(invoice_data.get("credit_applied", 0))
+        previous_due = _invoice_due_amount(invoice_data)
+        new_due = max(total_amount - new_paid - credit_applied, Decimal("0"))
+        customer_id = invoice_data.get("customer_id")
+        customer_ref = (
+            db.collection("customers").document(customer_id) if customer_id else None
+        )
+        customer_doc = customer_ref.get() if customer_ref is not None else None
+        batch = db.batch()
+        aging_fields = get_ar_aging_service(company_id).reduce(
+            batch,
+            invoice_data.get("customer_id"),
+            invoice_data,
+            min(new_paid - current_paid, previous_due),
+        )
+        batch.update(invoice_ref, {
             "amount_paid": str(new_paid),
+            "effective_paid": str(new_paid + credit_applied),
+            "due_amount": str(new_due),
             "payment_status": payment_status,
             "status": "closed" if payment_status == "paid" else invoice_data.get("status", "issued"),
+            **aging_fields,
             "updated_at": firestore.SERVER_TIMESTAMP
         })
+        if customer_doc is not None and customer_doc.exists:
+            # Increments only, so the unlocked read above cannot lose updates
+            summary_update = _customer_summary_update(
+                customer_doc.to_dict(), paid_on_invoices=new_paid - current_paid
+            )
+            if summary_update:
+                batch.update(customer_ref, summary_update)
+        batch.commit()
 
         # Record payment for audit trail
         db.collection("payments").document().set({
@@ -1994,183 +3859,95 @@ def add_payment(
 
 
 @router.get("/sales/invoices/{invoice_id}/pdf")
-def get_invoice_pdf(invoice_id: str):
-    """Return a print-friendly HTML view of the invoice."""
-    db = get_db()
-    doc = db.collection("invoices").document(invoice_id).get()
-
-    if not doc.exists:
-        raise HTTPException(status_code=404, detail="Invoice not found")
-
-    inv = doc.to_dict()
-    items_html = ""
-    for item in inv.get("items", []):
-        items_html += f"""
-        <tr>
-            <td style="padding: 12px; border-bottom: 1px solid #eee;">{item.get('product_name')}</td>
-            <td style="padding: 12px; border-bottom: 1px solid #eee; text-align: right;">{item.get('quantity')}</td>
-            <td style="padding: 12px; border-bottom: 1px solid #eee; text-align: right;">{int(float(item.get('price', 0))):,} IQD</td>
-            <td style="padding: 12px; border-bottom: 1px solid #eee; text-align: right; font-weight: bold;">{int(float(item.get('total', 0))):,} IQD</td>
-        </tr>
-        """
-
-    total = float(inv.get("total_amount", 0))
-    paid = float(inv.get("amount_paid", 0))
-    remaining = total - paid
-    
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Invoice {inv.get('invoice_number')}</title>
-        <style>
-            body {{ font-family: 'Inter', system-ui, sans-serif; color: #1e293b; line-height: 1.5; padding: 40px; max-width: 800px; margin: auto; }}
-            .header {{ display: flex; justify-content: space-between; align-items: flex-start; margin-bottom: 40px; }}
-            .logo {{ font-size: 24px; font-weight: 900; color: #0f172a; letter-spacing: -0.025em; }}
-            .invoice-info {{ text-align: right; }}
-            .invoice-info h1 {{ margin: 0; font-size: 32px; font-weight: 900; }}
-            .details {{ display: grid; grid-template-cols: 1fr 1fr; gap: 40px; margin-bottom: 40px; }}
-            .section-title {{ font-size: 12px; font-weight: 900; text-transform: uppercase; color: #64748b; letter-spacing: 0.05em; margin-bottom: 8px; }}
-            table {{ width: 100%; border-collapse: collapse; margin-bottom: 40px; }}
-            th {{ text-align: left; font-size: 12px; font-weight: 900; text-transform: uppercase; color: #64748b; padding: 12px; border-bottom: 2px solid #e2e8f0; }}
-            .totals {{ margin-left: auto; width: 300px; }}
-            .total-row {{ display: flex; justify-content: space-between; padding: 8px 0; }}
-            .total-row.grand-total {{ font-size: 20px; font-weight: 900; border-top: 2px solid #e2e8f0; margin-top: 12px; padding-top: 12px; }}
-            @media print {{ .no-print {{ display: none; }} body {{ padding: 0; }} }}
-        </style>
-    </head>
-    <body onload="window.print()">
-        <div class="header">
-            <div class="logo">OPENGATE ERP</div>
-            <div class="invoice-info">
-                <h1>INVOICE</h1>
-                <p style="font-weight: bold; color: #64748b;">#{inv.get('invoice_number')}</p>
-            </div>
-        </div>
-
-        <div class="details">
-            <div>
-                <div class="section-title">Bill To</div>
-                <p style="font-weight: bold; font-size: 18px; margin: 0;">{inv.get('customer_name')}</p>
-                <p style="margin: 4px 0; color: #64748b;">{inv.get('customer_phone', '')}</p>
-            </div>
-            <div style="text-align: right;">
-                <div class="section-title">Invoice Details</div>
-                <p style="margin: 4px 0;"><strong>Date:</strong> {inv.get('issue_date')}</p>
-                <p style="margin: 4px 0;"><strong>Status:</strong> {inv.get('status').upper()}</p>
-            </div>
-        </div>
-
-        <table>
-            <thead>
-                <tr>
-                    <th>Item Description</th>
-                    <th style="text-align: right;">Qty</th>
-                    <th style="text-align: right;">Price</th>
-                    <th style="text-align: right;">Total</th>
-                </tr>
-            </thead>
-            <tbody>
-                {items_html}
-            </tbody>
-        </table>
-
-        <div class="totals">
-            <div class="total-row">
-                <span>Subtotal</span>
-                <span style="font-weight: bold;">{int(float(inv.get('subtotal', 0))):,} IQD</span>
-            </div>
-            <div class="total-row">
-                <span>Discount</span>
-                <span style="font-weight: bold; color: #10b981;">-{int(float(inv.get('discount', 0))):,} IQD</span>
-            </div>
-            <div class="total-row grand-total">
-                <span>Total</span>
-                <span>{int(total):,} IQD</span>
-            </div>
-            <div class="total-row" style="color: #10b981; font-weight: bold;">
-                <span>Amount Paid</span>
-                <span>{int(paid):,} IQD</span>
-            </div>
-            <div class="total-row" style="color: #f59e0b; font-weight: bold;">
-                <span>Balance Due</span>
-                <span>{int(remaining):,} IQD</span>
-            </div>
-        </div>
-
-        <div style="margin-top: 80px; text-align: center; color: #94a3b8; font-size: 12px;">
-            Thank you for your business!
-        </div>
-    </body>
-    </html>
+def get_invoice_pdf(
+    invoice_id: str,
+    request: Request,
+    format: str = Query("html"),
+    user: dict = Depends(get_current_user),
+):
     """
-    from fastapi.responses import HTMLResponse
-    return HTMLResponse(content=html_content)
+    Return a print-friendly view of the invoice (``format=html`` or ``pdf``).
 
+    Renders are cached per invoice revision and company branding; clients
+    sending the ETag back in If-None-Match get 304 while nothing changed.
+    Invoices of another company are reported as not found, as in print-batch.
+    """
+    if format not in RENDER_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be html or pdf")
 
-@router.post("/sales/invoices/{invoice_id}/return")
-@router.post("/invoices/{invoice_id}/return")
-def process_return(invoice_id: str, data: dict, user: dict = Depends(get_current_user)):
-    """Process a return for an invoice."""
     db = get_db()
-    company_id = user.get("company_id")
-
-    invoice_ref = db.collection("invoices").document(invoice_id)
-    invoice_doc = invoice_ref.get()
+    doc = db.collection("invoices").document(invoice_id).get()
 
-    if not invoice_doc.exists:
+    if not doc.exists or doc.get("company_id") != user.get("company_id"):
         raise HTTPException(status_code=404, detail="Invoice not found")
 
-    invoice_data = invoice_doc.to_dict()
+    renderer = get_invoice_renderer()
+    etag = renderer.etag(doc, format)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
 
-    # Process each returned item
-    for return_item in data.get("items", []):
-        product_id = return_item.get("product_id")
-        quantity = Decimal(str(return_item.get("quantity", 0)))
-        refund_amount = Decimal(str(return_item.get("refund_amount", 0)))
+    content, media_type = renderer.render(doc, format)
+    return Response(content=content, media_type=media_type, headers=headers)
 
-        # Add stock back
-        product_ref = db.collection("items").document(product_id)
-        product_doc = product_ref.get()
 
-        if product_doc.exists:
-            product_data = product_doc.to_dict()
-            current_qty = Decimal(str(product_data.get("current_qty", 0)))
-            current_wac = Decimal(str(product_data.get("current_wac", 0)))
-            new_qty = current_qty + quantity
-
-            product_ref.update(
-                {
-                    "current_qty": str(new_qty),
-                    "total_value": str(new_qty * current_wac),
-                    "updated_at": firestore.SERVER_TIMESTAMP,
-                }
-            )
+@router.post("/documents/print-batch")
+def print_documents_batch(data: dict, user: dict = Depends(get_current_user)):
+    """
+    Render many invoices, bills and vouchers in one call.
 
-    # Create return record
-    return_ref = db.collection("returns").document()
-    return_ref.set(
-        {
-            "company_id": company_id,
-            "invoice_id": invoice_id,
-            "items": data.get("items", []),
-            "total_refund": str(data.get("total_refund", 0)),
-            "reason": data.get("reason", ""),
-            "created_by": user.get("uid"),
-            "created_at": firestore.SERVER_TIMESTAMP,
-        }
+    Body: ``{"documents": [{"type": "invoice", "id": "..."}, ...], "output": "pdf" | "zip"}``.
+    Types are invoice, bill, payment_voucher and receipt_voucher. Documents
+    are read with a single get_all and rendered across a process pool; the
+    response streams one merged PDF or a ZIP of per-document PDFs.
+    """
+    output = data.get("output", "pdf")
+    if output not in BATCH_OUTPUTS:
+        raise HTTPException(status_code=400, detail="output must be pdf or zip")
+
+    documents = [
+        (entry.get("type", "invoice"), entry.get("id"))
+        for entry in data.get("documents", [])
+        if isinstance(entry, dict) and entry.get("id")
+    ]
+    renderer = get_batch_renderer(user.get("company_id"))
+    try:
+        loaded = renderer.fetch(documents)
+    except ValueError as e:
+        status = 404 if str(e).startswith("Not found") else 400
+        raise HTTPException(status_code=status, detail=str(e))
+
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    if output == "zip":
+        body, media_type, filename = renderer.stream_zip(loaded), "application/zip", f"documents-{stamp}.zip"
+    else:
+        body, media_type, filename = renderer.stream_pdf(loaded), "application/pdf", f"documents-{stamp}.pdf"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
-    # Update invoice status
-    invoice_ref.update(
-        {
-            "status": "returned",
-            "return_id": return_ref.id,
-            "updated_at": firestore.SERVER_TIMESTAMP,
-        }
-    )
 
-    return {"id": return_ref.id, "status": "processed"}
+@router.post("/sales/invoices/{invoice_id}/return")
+@router.post("/invoices/{invoice_id}/return")
+def process_return(invoice_id: str, data: dict, user: dict = Depends(get_current_user)):
+    """
+    Process a full or partial return for an invoice.
+
+    Body: ``{"items": [{"product_id", "quantity", "refund_amount", "line_index"?}],
+    "total_refund", "reason"}``. Stock, cost layers, the invoice's returned
+    quantities, aging and the customer balance change in one transaction.
+    """
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    try:
+        return get_return_service(company_id).process_return(invoice_id, data, user)
+    except ValueError as e:
+        status = 404 if str(e) == "Invoice not found" else 400
+        raise HTTPException(status_code=status, detail=str(e))
 
 
 # ===================== TRANSFERS =====================
@@ -2192,7 +3969,8 @@ def list_transfers(
             "created_at", direction=firestore.Query.DESCENDING
         ).stream()
         docs = list(docs)
-    except Exception:
+    except FailedPrecondition as e:
+        record_index_fallback("GET /transfers", e)
         docs = list(query.stream())
         docs.sort(
             key=lambda d: d.to_dict().get("created_at") or "",
@@ -2237,13 +4015,19 @@ def create_transfer(data: dict, user: dict = Depends(get_current_user)):
 def update_transfer_status(
     transfer_id: str, status: str, user: dict = Depends(get_current_user)
 ):
-    """Update transfer status (pending → in_transit → received)."""
+    """Update transfer status (pending → in_transit → received).
+
+    Receiving moves every line's stock from the source to the destination
+    warehouse (see TransferService.receive); a transfer left in "receiving"
+    by an interrupted receipt can be received again to finish it.
+    """
     db = get_db()
+    company_id = user.get("company_id")
 
     transfer_ref = db.collection("transfers").document(transfer_id)
     transfer_doc = transfer_ref.get()
 
-    if not transfer_doc.exists:
+    if not transfer_doc.exists or transfer_doc.get("company_id") != company_id:
         raise HTTPException(status_code=404, detail="Transfer not found")
 
     transfer_data = transfer_doc.to_dict()
@@ -2252,6 +4036,7 @@ def update_transfer_status(
     valid_transitions = {
         "pending": ["in_transit", "cancelled"],
         "in_transit": ["received"],
+        "receiving": ["received"],
         "received": [],
         "cancelled": [],
     }
@@ -2263,16 +4048,19 @@ def update_transfer_status(
             detail=f"Invalid status transition from {current_status} to {status}",
         )
 
+    if status == "received":
+        try:
+            return get_transfer_service(company_id).receive(transfer_id, user)
+        except ValueError as e:
+            status_code = 404 if str(e) == "Transfer not found" else 400
+            raise HTTPException(status_code=status_code, detail=str(e))
+
     update_data = {
         "status": status,
         "updated_at": firestore.SERVER_TIMESTAMP,
         "updated_by": user.get("uid"),
     }
 
-    if status == "received":
-        update_data["received_by"] = user.get("uid")
-        update_data["received_at"] = firestore.SERVER_TIMESTAMP
-
     transfer_ref.update(update_data)
 
     return {"id": transfer_id, "status": status}
@@ -2370,6 +4158,46 @@ def create_warehouse(data: dict, user: dict = Depends(get_current_user)):
     return {"id": ref.id, **safe_payload}
 
 
+@router.get("/warehouse/warehouses/{warehouse_id}/stock")
+def get_warehouse_stock(
+    warehouse_id: str,
+    limit: int = Query(500, ge=1, le=2000),
+    user: dict = Depends(get_current_user),
+):
+    """On-hand quantity per product and batch in one warehouse."""
+    company_id = user.get("company_id")
+    return get_stock_level_service(company_id).stock_in_warehouse(warehouse_id, limit=limit)
+
+
+@router.post("/inventory/stock-levels/rebuild")
+def rebuild_stock_levels(user: dict = Depends(get_current_user)):
+    """Recompute per-warehouse stock levels from the stock ledger.
+
+    Admin maintenance job; run after a backfill or if levels are suspected
+    to have drifted from the ledger.
+    """
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    company_id = user.get("company_id")
+    return get_stock_level_service(company_id).rebuild()
+
+
+@router.post("/maintenance/native-amounts")
+def backfill_native_amounts(user: dict = Depends(get_current_user)):
+    """Backfill integer amounts on items and GL accounts written before dual-writes.
+
+    Safe to rerun; documents already carrying current integers are skipped.
+    """
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    company_id = user.get("company_id")
+    if not company_id:
+        raise HTTPException(status_code=400, detail="Company ID not found")
+
+    return get_amount_migration_service(company_id).backfill()
+
+
 # ===================== COMPANY PROFILE =====================
 @router.get("/company/profile")
 def get_company_profile(user: dict = Depends(get_current_user)):
@@ -2426,6 +4254,7 @@ def update_company_profile(data: dict, user: dict = Depends(get_current_user)):
     if not ref.get().exists:
         payload["created_at"] = firestore.SERVER_TIMESTAMP
     ref.set(payload, merge=True)
+    invalidate_company_branding(company_id)
 
     safe_payload = payload.copy()
     safe_payload["updated_at"] = datetime.now().isoformat()
@@ -2637,7 +4466,7 @@ def import_products(file: dict, user: dict = Depends(get_current_user)):
                 )
                 continue
 
-            product_record = {
+            product_record = with_units({
                 "company_id": company_id,
                 "name": product_data.get("name"),
                 "sku": product_data.get("sku"),
@@ -2651,7 +4480,7 @@ def import_products(file: dict, user: dict = Depends(get_current_user)):
                 "unit": product_data.get("unit", "piece"),
                 "created_at": firestore.SERVER_TIMESTAMP,
                 "created_by": user.get("uid"),
-            }
+            }, ITEM_AMOUNTS)
 
             doc_ref = db.collection("items").document()
             doc_ref.set(product_record)
@@ -2666,3 +4495,40 @@ def import_products(file: dict, user: dict = Depends(get_current_user)):
         "errors": len(errors),
         "details": {"created": created, "errors": errors},
     }
+
+
+# ===================== DIAGNOSTICS =====================
+@router.get("/admin/index-fallbacks")
+def get_index_fallbacks(user: dict = Depends(get_current_user)):
+    """Full-scan fallbacks taken by this process since start, by route."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    return {"fallbacks": index_fallback_counts()}
+
+
+@router.get("/admin/gl-outbox")
+def get_gl_outbox_stats(user: dict = Depends(get_current_user)):
+    """GL outbox poster lag (age of the oldest pending entry) and counters."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    return get_gl_outbox_service().stats()
+
+
+@router.get("/admin/report-cache")
+def get_report_cache_stats(user: dict = Depends(get_current_user)):
+    """Report cache hit / miss / eviction counters and tier sizes."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    return get_report_cache().stats()
+
+
+@router.post("/admin/gl-outbox/drain")
+def drain_gl_outbox(limit: int = 200, user: dict = Depends(get_current_user)):
+    """Apply pending GL outbox entries now instead of waiting for the poster."""
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+    return get_gl_outbox_service().drain_once(limit=min(max(limit, 1), 1000))
@@ -13,4 +13,52 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     ENVIRONMENT: str = "development"
 
+    # Document numbering: numbers reserved per process at a time, and the
+    # document types (comma separated) that must be numbered without gaps.
+    # Gapless types are claimed inside the creating transaction; removing
+    # sales_invoice trades sequential fiscal invoice numbers (with several
+    # workers, gaps and out-of-order numbers) for invoice throughput.
+    SEQUENCE_BLOCK_SIZE: int = 50
+    GAPLESS_SEQUENCES: str = "sales_invoice,journal_entry,credit_note"
+
+    # GL balance sharding: shards given to a hot account, and the posting
+    # rate (postings per window) that promotes an account. 0 shards turns
+    # automatic promotion off.
+    GL_BALANCE_SHARDS: int = 10
+    GL_SHARD_PROMOTE_POSTINGS: int = 60
+    GL_SHARD_PROMOTE_WINDOW_SECONDS: float = 60.0
+
+    # GL posting: "direct" updates account balances in the document's own
+    # transaction; "outbox" queues them for the background poster, which
+    # applies up to GL_OUTBOX_BATCH_SIZE entries per drain.
+    GL_POSTING_MODE: str = "direct"
+    GL_OUTBOX_BATCH_SIZE: int = 200
+    GL_OUTBOX_POLL_SECONDS: float = 1.0
+
+    # Receivables aging: shard documents holding each company's aging total
+    # (never lower it; increments on dropped shards would be lost).
+    AR_AGING_SHARDS: int = 10
+
+    # Chart of accounts cache: seconds a company's code -> id map is served
+    # from memory before it is reloaded.
+    CHART_OF_ACCOUNTS_TTL_SECONDS: float = 300.0
+
+    # Financial statements: account code prefixes (comma separated) of cash
+    # and bank accounts, and of the balance-sheet accounts the cash-flow
+    # statement reports under investing and financing (equity is financing;
+    # everything else is operating).
+    CASH_ACCOUNT_CODES: str = "18"
+    INVESTING_ACCOUNT_CODES: str = "11,12,16"
+    FINANCING_ACCOUNT_CODES: str = ""
+
+    # Report cache: results keyed by the ledger watermark (spread over
+    # LEDGER_WATERMARK_SHARDS documents per company; never lower it), kept
+    # LRU in memory and, when REPORT_CACHE_DIR is set to an absolute path
+    # writable only by this service (e.g. /var/cache/warehouse-reports),
+    # on disk shared by the host's workers. Empty keeps the disk tier off.
+    LEDGER_WATERMARK_SHARDS: int = 10
+    REPORT_CACHE_MEMORY_ENTRIES: int = 256
+    REPORT_CACHE_DIR: str = ""
+    REPORT_CACHE_DISK_ENTRIES: int = 2048
+
 settings = Settings()
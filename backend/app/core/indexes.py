@@ -0,0 +1,208 @@
+"""
+Firestore Index Manifest
+Every query shape the backend runs that needs a composite index, checked
+against firestore.indexes.json at startup and in CI, plus a per-route
+counter of the in-memory fallbacks taken when an index is missing.
+"""
+import json
+import logging
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = Path(__file__).parent.parent.parent / "firestore.indexes.json"
+
+_ORDERS = {"ASC": "ASCENDING", "DESC": "DESCENDING"}
+
+# (label, collection, equality fields, ordered/range/array fields)
+# Ordered fields are (field, "ASC" | "DESC" | "CONTAINS").
+QUERY_SHAPES: List[Tuple[str, str, Tuple[str, ...], Tuple[Tuple[str, str], ...]]] = [
+    # Dashboard
+    ("GET /dashboard/stats", "invoices", ("company_id",), (("created_at", "ASC"),)),
+    ("GET /dashboard/recent-sales", "invoices", ("company_id",), (("issue_date", "DESC"),)),
+    ("GET /dashboard/expiring-products", "batches", ("company_id",), (("expiry_date", "ASC"),)),
+    # Invoices
+    ("GET /invoices", "invoices", ("company_id",), (("issue_date", "DESC"),)),
+    ("GET /invoices?status", "invoices", ("company_id", "status"), (("issue_date", "DESC"),)),
+    ("GET /invoices?customer_id", "invoices", ("company_id", "customer_id"), (("issue_date", "DESC"),)),
+    (
+        "GET /invoices?status&customer_id",
+        "invoices",
+        ("company_id", "status", "customer_id"),
+        (("issue_date", "DESC"),),
+    ),
+    (
+        "POST /customers/{id}/payment",
+        "invoices",
+        ("company_id", "customer_id", "payment_status"),
+        (("issue_date", "ASC"),),
+    ),
+    ("POST /reports/ar-aging/age", "invoices", ("company_id", "aging_bucket"), (("aging_due_date", "ASC"),)),
+    ("GET /reports/ar-aging", "ar_aging", ("company_id",), (("total_units", "DESC"),)),
+    # Customers
+    ("GET /customers?search", "customers", ("company_id",), (("search_keys", "CONTAINS"),)),
+    (
+        "GET /customers/{id} payments",
+        "customer_payments",
+        ("company_id", "customer_id"),
+        (("created_at", "DESC"),),
+    ),
+    # Stock
+    ("GET /products/adjustments", "stock_adjustments", ("company_id",), (("created_at", "DESC"),)),
+    (
+        "GET /products/adjustments?product_id",
+        "stock_adjustments",
+        ("company_id", "product_id"),
+        (("created_at", "DESC"),),
+    ),
+    (
+        "GET /products/{id}/ledger",
+        "stock_adjustments",
+        ("company_id", "product_id"),
+        (("created_at", "ASC"),),
+    ),
+    ("stock snapshots", "stock_adjustments", ("company_id",), (("created_at", "ASC"),)),
+    ("stock snapshots", "stock_ledger", ("company_id",), (("timestamp", "ASC"),)),
+    ("stock snapshots", "stock_ledger", ("company_id", "item_id"), (("timestamp", "ASC"),)),
+    ("stock snapshots", "stock_snapshot_periods", ("company_id",), (("period_end", "DESC"),)),
+    ("GET /products/inbound", "stock_inbound", ("company_id",), (("created_at", "DESC"),)),
+    (
+        "_consume_cost_layers_fifo",
+        "stock_cost_layers",
+        ("company_id", "product_id"),
+        (("created_at", "ASC"),),
+    ),
+    ("GET /receiving", "goods_receipts", ("company_id",), (("created_at", "DESC"),)),
+    (
+        "GET /warehouse/warehouses/{id}/stock",
+        "stock_levels",
+        ("company_id", "warehouse_id"),
+        (("item_id", "ASC"),),
+    ),
+    (
+        "GET /products/{id}/locations",
+        "stock_levels",
+        ("company_id", "item_id"),
+        (("warehouse_id", "ASC"),),
+    ),
+    ("GET /transfers", "transfers", ("company_id",), (("created_at", "DESC"),)),
+    ("GET /transfers?status", "transfers", ("company_id", "status"), (("created_at", "DESC"),)),
+    # Team
+    ("GET /shifts", "shifts", ("company_id",), (("date", "DESC"),)),
+    ("GET /shifts?employee_id", "shifts", ("company_id", "employee_id"), (("date", "DESC"),)),
+    # Accounting / sales services
+    ("AccountingService.get_accounts", "accounts", ("company_id",), (("code", "ASC"),)),
+    ("AccountingService.get_accounts?type", "accounts", ("company_id", "type"), (("code", "ASC"),)),
+    ("GLOutboxService.drain_once", "gl_outbox", ("status",), (("created_at", "ASC"),)),
+    ("AccountLedgerService.rows", "account_ledger", ("company_id", "account_id"), (("date", "ASC"),)),
+    ("GLSnapshotService.daily_rows", "account_daily_balances", ("company_id",), (("day", "ASC"),)),
+    (
+        "GLSnapshotService.account_balance_as_of",
+        "account_daily_balances",
+        ("company_id", "account_id"),
+        (("day", "ASC"),),
+    ),
+    ("GLCubeService.movements", "account_period_balances", ("company_id",), (("period", "ASC"),)),
+    (
+        "GLSnapshotService._latest_period",
+        "account_snapshot_periods",
+        ("company_id",),
+        (("last_day", "DESC"),),
+    ),
+    (
+        "GLSnapshotService.discard_from",
+        "account_snapshot_periods",
+        ("company_id",),
+        (("last_day", "ASC"),),
+    ),
+    ("SalesService.list_quotations", "quotations", ("status",), (("created_at", "DESC"),)),
+    ("SalesService.list_sales_orders", "sales_orders", ("status",), (("created_at", "DESC"),)),
+    ("SalesService.list_purchase_orders", "purchase_orders", ("status",), (("created_at", "DESC"),)),
+]
+
+
+def load_manifest(path: Optional[Path] = None) -> Dict[str, Any]:
+    with open(path or MANIFEST_PATH, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _field_spec(field: Dict[str, Any]) -> Tuple[str, str]:
+    return field["fieldPath"], field.get("order") or field.get("arrayConfig")
+
+
+def shape_index_fields(shape) -> List[Dict[str, str]]:
+    """The composite index a shape needs, in firestore.indexes.json field form."""
+    _, _, equality, ordered = shape
+    fields = [{"fieldPath": name, "order": "ASCENDING"} for name in equality]
+    for name, order in ordered:
+        if order == "CONTAINS":
+            fields.append({"fieldPath": name, "arrayConfig": "CONTAINS"})
+        else:
+            fields.append({"fieldPath": name, "order": _ORDERS[order]})
+    return fields
+
+
+def is_covered(shape, indexes: List[Dict[str, Any]]) -> bool:
+    """Equality fields may appear in any order; ordered fields must follow exactly."""
+    _, collection, equality, _ = shape
+    needed = [_field_spec(f) for f in shape_index_fields(shape)]
+    prefix = len(equality)
+    for index in indexes:
+        if index.get("collectionGroup") != collection:
+            continue
+        fields = [_field_spec(f) for f in index.get("fields", [])]
+        if len(fields) != len(needed):
+            continue
+        if sorted(fields[:prefix]) == sorted(needed[:prefix]) and fields[prefix:] == needed[prefix:]:
+            return True
+    return False
+
+
+def missing_indexes(manifest: Optional[Dict[str, Any]] = None) -> List[Tuple[str, str, List[Dict[str, str]]]]:
+    """Query shapes with no matching composite index in the manifest."""
+    indexes = (manifest or load_manifest()).get("indexes", [])
+    return [
+        (shape[0], shape[1], shape_index_fields(shape))
+        for shape in QUERY_SHAPES
+        if not is_covered(shape, indexes)
+    ]
+
+
+def check_index_manifest() -> List[str]:
+    """Startup check: log (and return) every query shape the manifest does not cover."""
+    try:
+        missing = missing_indexes()
+    except (OSError, ValueError) as e:
+        logger.warning("Could not read %s: %s", MANIFEST_PATH.name, e)
+        return []
+
+    problems = [
+        f"{label}: {collection} "
+        + ", ".join(f"{f['fieldPath']} {f.get('order') or f.get('arrayConfig')}" for f in fields)
+        for label, collection, fields in missing
+    ]
+    for problem in problems:
+        logger.warning("Missing composite index for %s", problem)
+    return problems
+
+
+# ----------------------------------------------------------------------
+# Runtime fallbacks
+# ----------------------------------------------------------------------
+_fallbacks: Counter = Counter()
+_fallbacks_lock = threading.Lock()
+
+
+def record_index_fallback(route: str, error: Exception):
+    """Count and log a query that fell back to an in-memory scan."""
+    with _fallbacks_lock:
+        _fallbacks[route] += 1
+    logger.warning("Index fallback on %s (full scan): %s", route, error)
+
+
+def index_fallback_counts() -> Dict[str, int]:
+    with _fallbacks_lock:
+        return dict(_fallbacks)
@@ -0,0 +1,199 @@
+"""
+Fixed-point Amounts
+Integer-backed money, quantity and rate values with one rounding policy.
+
+    Money     ten-thousandths (amounts carry four decimals; 1 fils = 10 units)
+    Quantity  thousandths (milli-units)
+    Rate      millionths (unit costs / WAC)
+
+Arithmetic stays in integers; the only rounding happens when a result must
+drop digits (quantity x rate, value / quantity, parsing), always ROUND_HALF_UP.
+
+Stored amounts are moving from decimal strings to native integers. Writers
+store both (``with_units``: ``current_qty`` plus ``current_qty_units``), so
+Firestore can index, range-query and Increment the integer. Readers prefer
+the integer and fall back to the string for documents not yet migrated
+(``read``).
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Any, Dict, Type
+
+ROUNDING = ROUND_HALF_UP
+UNITS_SUFFIX = "_units"
+
+
+def _div_round(numerator: int, denominator: int) -> int:
+    """Integer division rounded half away from zero (ROUND_HALF_UP)."""
+    if denominator < 0:
+        numerator, denominator = -numerator, -denominator
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if remainder * 2 >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+class Fixed:
+    """A fixed-point number stored as an integer count of 1/SCALE."""
+
+    SCALE = 1
+    __slots__ = ("units",)
+
+    def __init__(self, units: int = 0):
+        self.units = int(units)
+
+    # ------------------------------------------------------------------
+    # Construction
+    # ------------------------------------------------------------------
+    @classmethod
+    def parse(cls, value: Any) -> "Fixed":
+        """From a stored string, number or Decimal; blanks and junk are zero."""
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, Fixed):
+            return cls(_div_round(value.units * cls.SCALE, value.SCALE))
+        if isinstance(value, int) and not isinstance(value, bool):
+            return cls(value * cls.SCALE)
+        if value is None or value == "":
+            return cls()
+        try:
+            scaled = Decimal(str(value)) * cls.SCALE
+        except InvalidOperation:
+            return cls()
+        return cls(int(scaled.quantize(Decimal("1"), ROUNDING)))
+
+    @classmethod
+    def read(cls, data: Dict[str, Any], field: str) -> "Fixed":
+        """Dual-read: the native ``<field>_units`` if present, else the string field."""
+        units = data.get(field + UNITS_SUFFIX)
+        if isinstance(units, int) and not isinstance(units, bool):
+            return cls(units)
+        return cls.parse(data.get(field))
+
+    # ------------------------------------------------------------------
+    # Output
+    # ------------------------------------------------------------------
+    def to_decimal(self) -> Decimal:
+        return Decimal(self.units) / self.SCALE
+
+    def __str__(self) -> str:
+        if not self.units:
+            return "0"
+        return format(self.to_decimal().normalize(), "f")
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({str(self)})"
+
+    def __float__(self) -> float:
+        return self.units / self.SCALE
+
+    def fields(self, field: str) -> Dict[str, Any]:
+        """Dual-write: the legacy string field and its native integer."""
+        return {field: str(self), field + UNITS_SUFFIX: self.units}
+
+    # ------------------------------------------------------------------
+    # Arithmetic (same type only; cross-type helpers below)
+    # ------------------------------------------------------------------
+    def _same(self, other: "Fixed") -> int:
+        if type(other) is not type(self):
+            raise TypeError(f"cannot combine {type(self).__name__} with {type(other).__name__}")
+        return other.units
+
+    def __add__(self, other: "Fixed") -> "Fixed":
+        return type(self)(self.units + self._same(other))
+
+    def __sub__(self, other: "Fixed") -> "Fixed":
+        return type(self)(self.units - self._same(other))
+
+    def __neg__(self) -> "Fixed":
+        return type(self)(-self.units)
+
+    def __abs__(self) -> "Fixed":
+        return type(self)(abs(self.units))
+
+    def __mul__(self, factor: int) -> "Fixed":
+        if not isinstance(factor, int):
+            return NotImplemented
+        return type(self)(self.units * factor)
+
+    __rmul__ = __mul__
+
+    def __bool__(self) -> bool:
+        return self.units != 0
+
+    def __eq__(self, other: Any) -> bool:
+        return type(other) is type(self) and other.units == self.units
+
+    def __hash__(self) -> int:
+        return hash((type(self).__name__, self.units))
+
+    def __lt__(self, other: "Fixed") -> bool:
+        return self.units < self._same(other)
+
+    def __le__(self, other: "Fixed") -> bool:
+        return self.units <= self._same(other)
+
+    def __gt__(self, other: "Fixed") -> bool:
+        return self.units > self._same(other)
+
+    def __ge__(self, other: "Fixed") -> bool:
+        return self.units >= self._same(other)
+
+
+class Money(Fixed):
+    SCALE = 10_000
+    __slots__ = ()
+
+
+class Quantity(Fixed):
+    SCALE = 1_000
+    __slots__ = ()
+
+
+class Rate(Fixed):
+    SCALE = 1_000_000
+    __slots__ = ()
+
+
+def value_of(quantity: Quantity, rate: Rate) -> Money:
+    """quantity x unit rate, rounded once to money."""
+    return Money(
+        _div_round(quantity.units * rate.units * Money.SCALE, Quantity.SCALE * Rate.SCALE)
+    )
+
+
+def rate_of(value: Money, quantity: Quantity) -> Rate:
+    """value / quantity, rounded once to a rate (zero for zero quantity)."""
+    if not quantity.units:
+        return Rate()
+    return Rate(
+        _div_round(value.units * Rate.SCALE * Quantity.SCALE, quantity.units * Money.SCALE)
+    )
+
+
+# Stored amounts per collection, with their fixed-point type
+ITEM_AMOUNTS: Dict[str, Type[Fixed]] = {
+    "current_qty": Quantity,
+    "current_wac": Rate,
+    "total_value": Money,
+}
+ACCOUNT_AMOUNTS: Dict[str, Type[Fixed]] = {
+    "total_debit": Money,
+    "total_credit": Money,
+    "balance": Money,
+}
+
+
+def with_units(data: Dict[str, Any], amounts: Dict[str, Type[Fixed]]) -> Dict[str, Any]:
+    """
+    ``data`` plus the native integer of every amount field it sets, so a
+    write never leaves a stale ``_units`` beside an updated string.
+    Client-supplied ``_units`` values are dropped in favour of the string.
+    """
+    native = {field + UNITS_SUFFIX for field in amounts}
+    result = {key: value for key, value in data.items() if key not in native}
+    for field, kind in amounts.items():
+        if field in result:
+            value = kind.parse(result[field])
+            result[field] = str(value) if isinstance(result[field], Fixed) else result[field]
+            result[field + UNITS_SUFFIX] = value.units
+    return result
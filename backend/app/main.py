@@ -3,6 +3,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from app.api import router as api_router
 from app.core.firebase import init_firebase
+from app.core.indexes import check_index_manifest
+from app.services.gl_outbox import start_gl_outbox_poster, stop_gl_outbox_poster
+from app.services.rendering import shutdown_render_pool
 
 app = FastAPI(
     title="Warehouse Management API (Firebase)", version="1.0.0", redirect_slashes=False
@@ -27,6 +30,18 @@ async def startup_event():
     except Exception as e:
         print(f"Failed to initialize Firebase on startup: {e}")
 
+    missing = check_index_manifest()
+    if missing:
+        print(f"⚠️ firestore.indexes.json is missing {len(missing)} composite index(es); see logs")
+
+    start_gl_outbox_poster()
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    shutdown_render_pool()
+    stop_gl_outbox_poster()
+
 
 @app.get("/")
 async def root():
@@ -0,0 +1,187 @@
+"""
+Account Ledger
+Journal lines exploded per account, so GL and statement queries for one
+account over a date range are a single indexed range query instead of a
+scan of every journal entry.
+
+PostingEngine writes one row per (journal entry, account) in the posting
+transaction, with the entry's debit/credit for that account summed over its
+lines. ``balance`` is the account balance right after the posting when the
+posting knows it (direct mode, unsharded account) and null otherwise; it is
+in posting order, so date-ordered reports derive their own running balance.
+
+Voiding posts a reversal entry through PostingEngine like any other posting,
+so a voided entry's rows are netted out by the reversal's rows.
+"""
+from datetime import date, datetime, time, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from google.cloud import firestore
+from app.core.firebase import get_db
+from app.core.money import Money
+from app.services.gl_outbox import account_totals
+from app.services.gl_snapshots import day_key, get_gl_snapshot_service, shift_day
+
+
+def _memos(lines_data: List[Dict[str, Any]]) -> Dict[str, str]:
+    """Distinct line memos (or descriptions) per account, in line order."""
+    memos: Dict[str, List[str]] = {}
+    for line in lines_data or []:
+        memo = line.get("memo") or line.get("description")
+        account_memos = memos.setdefault(line.get("account_id"), [])
+        if memo and memo not in account_memos:
+            account_memos.append(memo)
+    return {account_id: "; ".join(values) for account_id, values in memos.items()}
+
+
+def _utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+class AccountLedgerService:
+    """Writes and queries per-account journal lines."""
+
+    COLLECTION = "account_ledger"
+    JOURNAL_COLLECTION = "journal_entries"
+    WRITE_BATCH_SIZE = 450
+
+    def __init__(self, company_id: Optional[str] = "default"):
+        self.db = get_db()
+        self.company_id = company_id
+
+    @staticmethod
+    def row_id(je_id: str, account_id: str) -> str:
+        return f"{je_id}_{account_id}".replace("/", "-")
+
+    @staticmethod
+    def _row(
+        je_id: str,
+        account_id: str,
+        entry: Dict[str, Any],
+        debit: Money,
+        credit: Money,
+        memo: str,
+        balance: Optional[Money] = None,
+    ) -> Dict[str, Any]:
+        row = {
+            "company_id": entry.get("company_id"),
+            "account_id": account_id,
+            "je_id": je_id,
+            "date": entry.get("date") or firestore.SERVER_TIMESTAMP,
+            "number": entry.get("number", ""),
+            "description": entry.get("description", ""),
+            "memo": memo,
+            **debit.fields("debit"),
+            **credit.fields("credit"),
+            "balance": None,
+            "balance_units": None,
+        }
+        if entry.get("original_je_id"):
+            row["reverses_je_id"] = entry["original_je_id"]
+        if balance is not None:
+            row.update(balance.fields("balance"))
+        return row
+
+    # ------------------------------------------------------------------
+    # Posting
+    # ------------------------------------------------------------------
+    def record(
+        self,
+        writer,
+        je_id: str,
+        entry: Dict[str, Any],
+        lines_data: List[Dict[str, Any]],
+        balances: Optional[Dict[str, Money]] = None,
+        account_ids: Optional[Iterable[str]] = None,
+    ) -> int:
+        """
+        Write the entry's rows inside ``writer`` (transaction or batch), one
+        per account, limited to ``account_ids`` when given. ``balances`` maps
+        account id -> balance after this posting where known. Returns the
+        number of writes.
+        """
+        totals = account_totals(lines_data)
+        if account_ids is not None:
+            allowed = set(account_ids)
+            totals = {aid: amounts for aid, amounts in totals.items() if aid in allowed}
+        memos = _memos(lines_data)
+        balances = balances or {}
+        for account_id, (debit, credit) in totals.items():
+            writer.set(
+                self.db.collection(self.COLLECTION).document(self.row_id(je_id, account_id)),
+                self._row(je_id, account_id, entry, debit, credit, memos.get(account_id, ""), balances.get(account_id)),
+            )
+        return len(totals)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def iter_rows(
+        self, account_id: str, from_date: datetime, to_date: Optional[datetime] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Rows of one account dated from ``from_date`` (to ``to_date`` if given), by date, as read."""
+        query = (
+            self.db.collection(self.COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .where("account_id", "==", account_id)
+            .where("date", ">=", _utc(from_date))
+        )
+        if to_date is not None:
+            query = query.where("date", "<=", _utc(to_date))
+        for doc in query.order_by("date").stream():
+            yield {"id": doc.id, **doc.to_dict()}
+
+    def period(self, account_id: str, from_date: datetime, to_date: datetime) -> Dict[str, Any]:
+        """
+        Opening balance and the rows within [from_date, to_date].
+
+        The opening balance is the account's balance at the end of the day
+        before ``from_date`` (GLSnapshotService), not the live balance worked
+        back, so entries still queued in outbox mode cannot skew it. Rows are
+        one range query bounded on both sides, from the start of
+        ``from_date``'s (UTC) day, where that balance ends.
+        """
+        first_day = day_key(_utc(from_date))
+        opening = get_gl_snapshot_service(self.company_id).account_balance_as_of(
+            account_id, shift_day(first_day, -1)
+        )
+        start = datetime.combine(date.fromisoformat(first_day), time.min, tzinfo=timezone.utc)
+        rows = [
+            {**row, "net": Money.read(row, "debit") - Money.read(row, "credit")}
+            for row in self.iter_rows(account_id, start, to_date)
+        ]
+        return {"opening_balance": opening, "rows": rows}
+
+    # ------------------------------------------------------------------
+    # Rebuild
+    # ------------------------------------------------------------------
+    def rebuild(self) -> Dict[str, int]:
+        """
+        Write rows for every POSTED or VOIDED journal entry of the company
+        (backfill for entries posted before the ledger existed). Row ids are
+        deterministic, so reruns overwrite instead of duplicating.
+        """
+        entries = (
+            self.db.collection(self.JOURNAL_COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .where("status", "in", ["POSTED", "VOIDED"])
+            .stream()
+        )
+        batch, pending, written, scanned = self.db.batch(), 0, 0, 0
+        for doc in entries:
+            data = doc.to_dict() or {}
+            scanned += 1
+            lines = data.get("lines") or []
+            if pending + len(lines) > self.WRITE_BATCH_SIZE:
+                batch.commit()
+                batch, pending = self.db.batch(), 0
+            writes = self.record(batch, doc.id, data, lines)
+            pending += writes
+            written += writes
+        if pending:
+            batch.commit()
+        return {"entries_scanned": scanned, "rows_written": written}
+
+
+def get_account_ledger_service(company_id: Optional[str] = "default") -> AccountLedgerService:
+    """Factory function to get an account ledger service instance."""
+    return AccountLedgerService(company_id=company_id)
@@ -1,23 +1,40 @@
 from typing import List, Dict, Any, Optional
 from app.core.firebase import get_db
 from app.models.core import DocumentStatus
-from app.schemas.accounting import JournalEntryCreate, AccountCreate
+from app.schemas.accounting import JournalEntryCreate, AccountCreate, AccountType
+from app.core.money import ACCOUNT_AMOUNTS, Money
 from .posting import PostingEngine
+from .gl_balances import get_gl_balance_service
+from .chart_of_accounts import invalidate_chart_of_accounts, resolve_account_id
+from google.api_core.exceptions import FailedPrecondition
 from google.cloud import firestore
+from app.core.indexes import record_index_fallback
 from decimal import Decimal
 
+# Account metadata callers may set; balances are maintained by postings only.
+ACCOUNT_FIELDS = (
+    "code",
+    "name_ar",
+    "name_en",
+    "type",
+    "parent_id",
+    "is_group",
+    "is_reconcilable",
+    "currency",
+    "active",
+    "subledger_type",
+)
+
+
 class AccountingService:
     def __init__(self):
         self.db = get_db()
         self.posting_engine = PostingEngine()
+        self.gl_balances = get_gl_balance_service()
 
     def get_account_id_by_code(self, company_id: str, code: str) -> Optional[str]:
-        """Resolve a document ID from an account code."""
-        docs = list(self.db.collection("accounts")
-                    .where("company_id", "==", company_id)
-                    .where("code", "==", code)
-                    .limit(1).stream())
-        return docs[0].id if docs else None
+        """Resolve a document ID from an account code (cached chart of accounts)."""
+        return resolve_account_id(company_id, code)
 
     def get_accounts(self, company_id: str, type_filter: Optional[str] = None) -> List[Dict[str, Any]]:
         """Fetch all accounts for a company with optional type filtering."""
@@ -32,10 +49,11 @@ class AccountingService:
             # Try with ordering first
             try:
                 docs = query.order_by("code").stream()
-                return [{"id": doc.id, **doc.to_dict()} for doc in docs]
-            except Exception as e:
-                print(f"⚠️ Index missing or query failed with order_by: {e}")
-                print("Falling back to client-side sorting...")
+                return self.gl_balances.with_balances([{"id": doc.id, **doc.to_dict()} for doc in docs])
+            except FailedPrecondition as e:
+                record_index_fallback(
+                    "AccountingService.get_accounts" + ("?type" if type_filter else ""), e
+                )
                 
                 # Fallback: fetch without Sort, then sort in Python
                 # Re-build query without order_by
@@ -44,7 +62,7 @@ class AccountingService:
                     query = query.where("type", "==", type_filter)
                     
                 docs = query.stream()
-                results = [{"id": doc.id, **doc.to_dict()} for doc in docs]
+                results = self.gl_balances.with_balances([{"id": doc.id, **doc.to_dict()} for doc in docs])
                 return sorted(results, key=lambda x: x.get("code", ""))
                 
         except Exception as e:
@@ -68,6 +86,79 @@ class AccountingService:
                 
         return tree
 
+    # ------------------------------------------------------------------
+    # Chart maintenance (every change drops the cached chart of accounts)
+    # ------------------------------------------------------------------
+    def _company_account(self, company_id: str, account_id: str):
+        snap = self.db.collection("accounts").document(account_id).get()
+        if not snap.exists or snap.get("company_id") != company_id:
+            raise ValueError("Account not found")
+        return snap
+
+    def _clean_account_fields(
+        self, company_id: str, data: Dict[str, Any], account_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        fields = {field: data[field] for field in ACCOUNT_FIELDS if field in data}
+        if "type" in fields:
+            fields["type"] = AccountType(fields["type"]).value
+        if "code" in fields:
+            fields["code"] = str(fields["code"] or "").strip()
+            if not fields["code"]:
+                raise ValueError("Account code is required")
+            duplicates = (
+                self.db.collection("accounts")
+                .where("company_id", "==", company_id)
+                .where("code", "==", fields["code"])
+                .limit(2)
+                .stream()
+            )
+            if any(doc.id != account_id for doc in duplicates):
+                raise ValueError(f"Account code {fields['code']} already exists")
+        if fields.get("parent_id"):
+            if fields["parent_id"] == account_id:
+                raise ValueError("An account cannot be its own parent")
+            self._company_account(company_id, fields["parent_id"])
+        return fields
+
+    def create_account(self, company_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Add an account to the chart with zero balances."""
+        fields = self._clean_account_fields(company_id, data)
+        if not fields.get("code") or not fields.get("type"):
+            raise ValueError("Account code and type are required")
+
+        account = {
+            "name_ar": "",
+            "name_en": "",
+            "parent_id": None,
+            "is_group": False,
+            "is_reconcilable": False,
+            "currency": "IQD",
+            "active": True,
+            "subledger_type": None,
+            **fields,
+            "company_id": company_id,
+        }
+        for field in ACCOUNT_AMOUNTS:
+            account.update(Money().fields(field))
+
+        ref = self.db.collection("accounts").document()
+        ref.set(account)
+        invalidate_chart_of_accounts(company_id)
+        return {"id": ref.id, **account}
+
+    def update_account(self, company_id: str, account_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Change an account's metadata (code, names, type, parent, flags)."""
+        self._company_account(company_id, account_id)
+        fields = self._clean_account_fields(company_id, data, account_id)
+        if fields:
+            self.db.collection("accounts").document(account_id).update(fields)
+            invalidate_chart_of_accounts(company_id)
+        return {"id": account_id, **fields}
+
+    def deactivate_account(self, company_id: str, account_id: str) -> Dict[str, Any]:
+        """Hide an account from new postings; its history and balance are kept."""
+        return self.update_account(company_id, account_id, {"active": False})
+
     def create_journal_entry(self, data: JournalEntryCreate):
         """Creates and posts a journal entry synchronously within a transaction."""
         transaction = self.db.transaction()
@@ -89,7 +180,7 @@ class AccountingService:
             account_ids = list(set(line["account_id"] for line in lines_data))
             accounts_data = posting_engine.get_accounts_for_transaction(transaction, account_ids)
 
-            transaction.set(je_ref, {
+            je_data = {
                 "number": data.number,
                 "date": data.date,
                 "description": data.description,
@@ -98,10 +189,11 @@ class AccountingService:
                 "flat_account_ids": account_ids,
                 "company_id": data.company_id,
                 "attachments": data.attachments
-            })
+            }
+            transaction.set(je_ref, je_data)
 
             # Pass pre-fetched data to posting engine
-            posting_engine.post_journal_entry(transaction, je_ref.id, lines_data, accounts_data)
+            posting_engine.post_journal_entry(transaction, je_ref.id, lines_data, accounts_data, entry=je_data)
             return je_ref.id
 
         return _execute(transaction, self.db, self.posting_engine, data)
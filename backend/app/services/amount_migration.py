@@ -0,0 +1,75 @@
+"""
+Amount Migration
+Backfills the native integer amounts (``<field>_units``) on documents written
+before amounts were dual-written.
+
+Documents that already carry every integer are skipped, so the backfill can be
+rerun until it reports nothing left to update. Until it has run for a company,
+readers fall back to the decimal strings (see app.core.money).
+"""
+from typing import Any, Dict, Type
+from google.cloud import firestore
+from app.core.firebase import get_db
+from app.core.money import ACCOUNT_AMOUNTS, ITEM_AMOUNTS, UNITS_SUFFIX, Fixed
+
+
+class AmountMigrationService:
+    """Adds native integer amounts next to the legacy decimal strings."""
+
+    ITEMS_COLLECTION = "items"
+    ACCOUNTS_COLLECTION = "accounts"
+    WRITE_BATCH_SIZE = 450
+
+    def __init__(self, company_id: str = "default"):
+        self.db = get_db()
+        self.company_id = company_id
+
+    @staticmethod
+    def missing_units(data: Dict[str, Any], amounts: Dict[str, Type[Fixed]]) -> Dict[str, int]:
+        """The integer fields ``data`` lacks or holds out of step with its strings."""
+        updates = {}
+        for field, kind in amounts.items():
+            if field not in data:
+                continue
+            units = kind.parse(data.get(field)).units
+            if data.get(field + UNITS_SUFFIX) != units:
+                updates[field + UNITS_SUFFIX] = units
+        return updates
+
+    def _backfill(self, collection: str, amounts: Dict[str, Type[Fixed]]) -> Dict[str, int]:
+        fields = [f for field in amounts for f in (field, field + UNITS_SUFFIX)]
+        docs = (
+            self.db.collection(collection)
+            .where("company_id", "==", self.company_id)
+            .select(fields)
+            .stream()
+        )
+        scanned, updated = 0, 0
+        batch, pending = self.db.batch(), 0
+        for doc in docs:
+            scanned += 1
+            updates = self.missing_units(doc.to_dict() or {}, amounts)
+            if not updates:
+                continue
+            updates["amounts_migrated_at"] = firestore.SERVER_TIMESTAMP
+            batch.update(doc.reference, updates)
+            pending += 1
+            updated += 1
+            if pending >= self.WRITE_BATCH_SIZE:
+                batch.commit()
+                batch, pending = self.db.batch(), 0
+        if pending:
+            batch.commit()
+        return {"scanned": scanned, "updated": updated}
+
+    def backfill(self) -> Dict[str, Any]:
+        """Backfill items and GL accounts of the company; returns counts per collection."""
+        return {
+            "items": self._backfill(self.ITEMS_COLLECTION, ITEM_AMOUNTS),
+            "accounts": self._backfill(self.ACCOUNTS_COLLECTION, ACCOUNT_AMOUNTS),
+        }
+
+
+def get_amount_migration_service(company_id: str = "default") -> AmountMigrationService:
+    """Factory function to get an amount migration service instance."""
+    return AmountMigrationService(company_id=company_id)
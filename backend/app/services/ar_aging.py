@@ -0,0 +1,380 @@
+"""
+Receivables Aging
+Current / 1-30 / 31-60 / 61-90 / 90+ buckets per customer and per company.
+Buckets are adjusted as invoices are created, paid and returned, and aged
+forward by a nightly sweep over each open invoice's due date, so the aging
+report is a read of a few small documents.
+
+Bucket amounts are integer Money units (``buckets_units``, ``total_units``)
+so every change is an Increment; the decimal strings are derived on read.
+
+The company total is spread over ``{company_id}_{n}`` shard documents in
+``ar_aging_totals``: each change Increments one random shard, so invoices,
+payments and returns of a company are not serialized on one document.
+Reads sum the shards; never lower AR_AGING_SHARDS (increments on dropped
+shards would be lost).
+"""
+import random
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+from google.cloud import firestore
+from app.core.config import settings
+from app.core.firebase import get_db
+from app.core.money import Money
+
+BUCKETS = ("current", "1_30", "31_60", "61_90", "90_plus")
+# Upper bound (days overdue) of every bucket except the last.
+BUCKET_LIMITS = (("current", 0), ("1_30", 30), ("31_60", 60), ("61_90", 90))
+OPEN_PAYMENT_STATUSES = ["unpaid", "partial"]
+
+
+def today_utc() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def aging_due_date(due_date: Any, issue_date: Any = None) -> str:
+    """Normalize an invoice's due date (falling back to its issue date) to YYYY-MM-DD."""
+    for value in (due_date, issue_date):
+        if not value:
+            continue
+        if hasattr(value, "date"):
+            return value.date().isoformat()
+        try:
+            return date.fromisoformat(str(value)[:10]).isoformat()
+        except ValueError:
+            continue
+    return today_utc().isoformat()
+
+
+def bucket_for(due_date: str, today: Optional[date] = None) -> str:
+    days_overdue = ((today or today_utc()) - date.fromisoformat(due_date)).days
+    for bucket, limit in BUCKET_LIMITS:
+        if days_overdue <= limit:
+            return bucket
+    return "90_plus"
+
+
+class ARAgingService:
+    """Maintains and reads receivables aging buckets."""
+
+    CUSTOMERS_COLLECTION = "ar_aging"
+    COMPANY_COLLECTION = "ar_aging_totals"
+    SWEEP_CHUNK = 200
+    BATCH_LIMIT = 500
+
+    def __init__(self, company_id: str = "default", shards: Optional[int] = None):
+        self.db = get_db()
+        self.company_id = company_id
+        self.shards = max(1, shards or settings.AR_AGING_SHARDS)
+
+    def _customer_ref(self, customer_id: str):
+        return self.db.collection(self.CUSTOMERS_COLLECTION).document(
+            f"{self.company_id}_{customer_id}"
+        )
+
+    def _company_ref(self, shard: int):
+        return self.db.collection(self.COMPANY_COLLECTION).document(f"{self.company_id}_{shard}")
+
+    def _company_refs(self) -> List[Any]:
+        # The unsharded document of earlier versions is summed until a rebuild removes it.
+        legacy = self.db.collection(self.COMPANY_COLLECTION).document(self.company_id)
+        return [legacy] + [self._company_ref(shard) for shard in range(self.shards)]
+
+    # ------------------------------------------------------------------
+    # Incremental updates
+    # ------------------------------------------------------------------
+    @staticmethod
+    def invoice_fields(
+        due_amount: Decimal, due_date: Any, issue_date: Any = None
+    ) -> Dict[str, Any]:
+        """Aging fields to store on an invoice with the given outstanding amount."""
+        normalized = aging_due_date(due_date, issue_date)
+        return {
+            "aging_due_date": normalized,
+            "aging_bucket": bucket_for(normalized) if due_amount > 0 else None,
+        }
+
+    def _increment_payload(self, deltas: Dict[str, int]) -> Dict[str, Any]:
+        return {
+            "company_id": self.company_id,
+            "buckets_units": {bucket: firestore.Increment(v) for bucket, v in deltas.items()},
+            "total_units": firestore.Increment(sum(deltas.values())),
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        }
+
+    def apply(self, writer, customer_id: str, deltas: Dict[str, Decimal]):
+        """
+        Add signed amounts to a customer's buckets and the company total.
+
+        ``writer`` is a transaction or write batch, so the change commits
+        together with the invoice or payment that caused it.
+        """
+        self.apply_many(writer, {customer_id: deltas})
+
+    def apply_many(self, writer, deltas_by_customer: Dict[str, Dict[str, Decimal]]):
+        """``apply`` for several customers, with a single write to one company shard."""
+        company: Dict[str, int] = {}
+        for customer_id, deltas in deltas_by_customer.items():
+            units = {bucket: Money.parse(v).units for bucket, v in deltas.items() if bucket}
+            units = {bucket: v for bucket, v in units.items() if v}
+            if not units:
+                continue
+            writer.set(
+                self._customer_ref(customer_id),
+                {**self._increment_payload(units), "customer_id": customer_id},
+                merge=True,
+            )
+            for bucket, value in units.items():
+                company[bucket] = company.get(bucket, 0) + value
+
+        company = {bucket: v for bucket, v in company.items() if v}
+        if company:
+            writer.set(
+                self._company_ref(random.randrange(self.shards)),
+                self._increment_payload(company),
+                merge=True,
+            )
+
+    def reduce(
+        self, writer, customer_id: str, invoice: Dict[str, Any], reduction: Decimal
+    ) -> Dict[str, Any]:
+        """
+        Take a payment or return off an invoice's bucket.
+
+        Returns the aging fields to merge into the invoice update. Invoices
+        created before aging existed carry no bucket and are left to
+        ``rebuild``.
+        """
+        deltas: Dict[str, Dict[str, Decimal]] = {}
+        fields = self.plan_reduction(deltas, customer_id, invoice, reduction)
+        self.apply_many(writer, deltas)
+        return fields
+
+    @staticmethod
+    def plan_reduction(
+        deltas_by_customer: Dict[str, Dict[str, Decimal]],
+        customer_id: str,
+        invoice: Dict[str, Any],
+        reduction: Decimal,
+    ) -> Dict[str, Any]:
+        """
+        ``reduce`` without the writes: accumulates the bucket change into
+        ``deltas_by_customer`` so a caller settling many invoices writes the
+        aging documents once, with ``apply_many``.
+        """
+        bucket = invoice.get("aging_bucket")
+        if not bucket or reduction <= 0:
+            return {}
+
+        deltas = deltas_by_customer.setdefault(customer_id, {})
+        deltas[bucket] = deltas.get(bucket, Decimal("0")) - reduction
+        remaining = Decimal(str(invoice.get("due_amount", 0))) - reduction
+        return {} if remaining > 0 else {"aging_bucket": None}
+
+    # ------------------------------------------------------------------
+    # Nightly sweep
+    # ------------------------------------------------------------------
+    def age(self, today: Optional[date] = None) -> Dict[str, Any]:
+        """
+        Move open invoices whose due date crossed a bucket boundary.
+
+        Each source bucket is swept with an indexed ``aging_due_date`` range
+        query, oldest bucket first, in transactional chunks so a payment
+        landing mid-sweep cannot be double counted.
+        """
+        today = today or today_utc()
+        moved = 0
+
+        for bucket, limit in reversed(BUCKET_LIMITS):
+            cutoff = (today - timedelta(days=limit)).isoformat()
+            query = (
+                self.db.collection("invoices")
+                .where("company_id", "==", self.company_id)
+                .where("aging_bucket", "==", bucket)
+                .where("aging_due_date", "<", cutoff)
+                .limit(self.SWEEP_CHUNK)
+            )
+            while True:
+                count = self._age_chunk(self.db.transaction(), query, today)
+                moved += count
+                if count < self.SWEEP_CHUNK:
+                    break
+
+        return {
+            "company_id": self.company_id,
+            "as_of": today.isoformat(),
+            "invoices_moved": moved,
+        }
+
+    def _age_chunk(self, transaction, query, today: date) -> int:
+        @firestore.transactional
+        def _execute(transaction):
+            docs = query.get(transaction=transaction)
+            per_customer: Dict[str, Dict[str, Decimal]] = {}
+            for doc in docs:
+                data = doc.to_dict()
+                old_bucket = data.get("aging_bucket")
+                new_bucket = bucket_for(data.get("aging_due_date"), today)
+                due = Decimal(str(data.get("due_amount", 0)))
+                deltas = per_customer.setdefault(data.get("customer_id"), {})
+                deltas[old_bucket] = deltas.get(old_bucket, Decimal("0")) - due
+                deltas[new_bucket] = deltas.get(new_bucket, Decimal("0")) + due
+                transaction.update(doc.reference, {"aging_bucket": new_bucket})
+
+            for customer_id, deltas in per_customer.items():
+                self.apply(transaction, customer_id, deltas)
+            return len(docs)
+
+        return _execute(transaction)
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _format(data: Dict[str, Any]) -> Dict[str, Any]:
+        buckets = data.get("buckets_units") or {}
+        return {
+            "buckets": {bucket: str(Money(buckets.get(bucket) or 0)) for bucket in BUCKETS},
+            "total": str(Money.read(data, "total")),
+        }
+
+    def get_customer_aging(self, customer_id: str) -> Dict[str, Any]:
+        doc = self._customer_ref(customer_id).get()
+        return {"customer_id": customer_id, **self._format(doc.to_dict() if doc.exists else {})}
+
+    def _company_totals(self) -> Dict[str, Any]:
+        """Company buckets summed over the shard documents (one get_all)."""
+        buckets = {bucket: 0 for bucket in BUCKETS}
+        for snap in self.db.get_all(self._company_refs()):
+            data = snap.to_dict() if snap.exists else None
+            for bucket, units in ((data or {}).get("buckets_units") or {}).items():
+                buckets[bucket] = buckets.get(bucket, 0) + int(units or 0)
+        return {"buckets_units": buckets, "total_units": sum(buckets.values())}
+
+    def get_report(self, limit: int = 100) -> Dict[str, Any]:
+        """Company totals plus the customers with the largest receivables."""
+        customer_docs = (
+            self.db.collection(self.CUSTOMERS_COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .where("total_units", ">", 0)
+            .order_by("total_units", direction=firestore.Query.DESCENDING)
+            .limit(limit)
+            .stream()
+        )
+        return {
+            **self._format(self._company_totals()),
+            "customers": [
+                {"customer_id": doc.get("customer_id"), **self._format(doc.to_dict())}
+                for doc in customer_docs
+            ],
+        }
+
+    # ------------------------------------------------------------------
+    # Backfill
+    # ------------------------------------------------------------------
+    def rebuild(self) -> Dict[str, Any]:
+        """
+        Recompute every bucket from the open invoices.
+
+        Used once to seed aging for existing data and to repair drift. Tags
+        each open invoice with its bucket and rewrites the aggregate documents:
+        the company total goes to shard 0, the other shards are zeroed and the
+        unsharded document of earlier versions is deleted.
+        """
+        today = today_utc()
+        per_customer: Dict[str, Dict[str, int]] = {}
+        company: Dict[str, int] = {bucket: 0 for bucket in BUCKETS}
+
+        batch = self.db.batch()
+        pending = 0
+
+        def _queue(method, *args, **kwargs):
+            nonlocal batch, pending
+            getattr(batch, method)(*args, **kwargs)
+            pending += 1
+            if pending >= self.BATCH_LIMIT:
+                batch.commit()
+                batch = self.db.batch()
+                pending = 0
+
+        invoice_docs = (
+            self.db.collection("invoices")
+            .where("company_id", "==", self.company_id)
+            .where("payment_status", "in", OPEN_PAYMENT_STATUSES)
+            .stream()
+        )
+        invoice_count = 0
+        for doc in invoice_docs:
+            data = doc.to_dict()
+            if data.get("due_amount") is not None:
+                due = Decimal(str(data.get("due_amount")))
+            else:
+                due = (
+                    Decimal(str(data.get("total_amount", 0)))
+                    - Decimal(str(data.get("amount_paid", 0)))
+                    - Decimal(str(data.get("credit_applied", 0)))
+                )
+            fields = self.invoice_fields(due, data.get("due_date"), data.get("issue_date"))
+            _queue("update", doc.reference, {**fields, "due_amount": str(max(due, Decimal("0")))})
+
+            if fields["aging_bucket"]:
+                invoice_count += 1
+                bucket = fields["aging_bucket"]
+                buckets = per_customer.setdefault(
+                    data.get("customer_id"), {b: 0 for b in BUCKETS}
+                )
+                buckets[bucket] += Money.parse(due).units
+                company[bucket] += Money.parse(due).units
+
+        existing = (
+            self.db.collection(self.CUSTOMERS_COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .stream()
+        )
+        for doc in existing:
+            customer_id = doc.get("customer_id")
+            if customer_id not in per_customer:
+                per_customer[customer_id] = {b: 0 for b in BUCKETS}
+
+        for customer_id, buckets in per_customer.items():
+            _queue(
+                "set",
+                self._customer_ref(customer_id),
+                {
+                    "company_id": self.company_id,
+                    "customer_id": customer_id,
+                    "buckets_units": buckets,
+                    "total_units": sum(buckets.values()),
+                    "updated_at": firestore.SERVER_TIMESTAMP,
+                },
+            )
+        legacy, *shard_refs = self._company_refs()
+        _queue("delete", legacy)
+        for shard, ref in enumerate(shard_refs):
+            buckets = company if shard == 0 else {bucket: 0 for bucket in BUCKETS}
+            _queue(
+                "set",
+                ref,
+                {
+                    "company_id": self.company_id,
+                    "buckets_units": buckets,
+                    "total_units": sum(buckets.values()),
+                    "updated_at": firestore.SERVER_TIMESTAMP,
+                },
+            )
+        if pending:
+            batch.commit()
+
+        return {
+            "company_id": self.company_id,
+            "as_of": today.isoformat(),
+            "open_invoices": invoice_count,
+            "customers": len(per_customer),
+            **self._format({"buckets_units": company, "total_units": sum(company.values())}),
+        }
+
+
+def get_ar_aging_service(company_id: str = "default") -> ARAgingService:
+    """Factory function to get an AR aging service instance."""
+    return ARAgingService(company_id=company_id)
@@ -5,6 +5,7 @@ from google.cloud import firestore
 from app.core.firebase import get_db
 from app.schemas.bills import BillCreate, BillStatus
 from app.schemas.accounting import JournalEntryCreate, JournalLineBase
+from .chart_of_accounts import resolve_account_id
 from .posting import PostingEngine
 
 
@@ -14,6 +15,10 @@ class BillService:
         self.collection = self.db.collection("bills")
         self.posting_engine = PostingEngine()
 
+        # Default AP / expense accounts, resolved from the cached chart
+        default_ap_id = resolve_account_id(company_id, "21", "21")
+        expense_account_id = resolve_account_id(company_id, "52", "52")
+
         # 4. Accounting Transaction (Inside Firestore Transaction for safety)
         transaction = self.db.transaction()
         
@@ -25,18 +30,7 @@ class BillService:
                 raise ValueError("Supplier not found")
             supplier_data = supplier_snap.to_dict()
             
-            ap_account_id = supplier_data.get("ap_account_id")
-            if not ap_account_id:
-                # Resolve code "21"
-                ap_query = self.db.collection("accounts").where("company_id", "==", company_id).where("code", "==", "21").limit(1)
-                ap_snaps = ap_query.get(transaction=transaction)
-                ap_account_id = ap_snaps[0].id if ap_snaps else "21"
-
-            expense_account_id = "52" # Fallback
-            exp_query = self.db.collection("accounts").where("company_id", "==", company_id).where("code", "==", "52").limit(1)
-            exp_snaps = exp_query.get(transaction=transaction)
-            if exp_snaps:
-                expense_account_id = exp_snaps[0].id
+            ap_account_id = supplier_data.get("ap_account_id") or default_ap_id
 
             # 2. PERFORM WRITES (Write Phase)
             lines = []
@@ -59,7 +53,7 @@ class BillService:
             je_ref = self.db.collection("journal_entries").document()
             je_lines_dict = [line.model_dump() for line in lines]
             
-            transaction.set(je_ref, {
+            je_data = {
                 "number": f"JE-BILL-{bill_data['bill_number']}",
                 "date": firestore.SERVER_TIMESTAMP,
                 "description": f"Bill from {supplier_data.get('name')}",
@@ -68,13 +62,14 @@ class BillService:
                 "company_id": company_id,
                 "source_doc_id": doc_ref.id,
                 "source_doc_type": "BILL"
-            })
+            }
+            transaction.set(je_ref, je_data)
             
             # Pre-fetch accounts for posting
             account_ids = list(set(line["account_id"] for line in je_lines_dict))
             accounts_data = self.posting_engine.get_accounts_for_transaction(transaction, account_ids)
             
-            self.posting_engine.post_journal_entry(transaction, je_ref.id, je_lines_dict, accounts_data)
+            self.posting_engine.post_journal_entry(transaction, je_ref.id, je_lines_dict, accounts_data, entry=je_data)
             
             bill_data["journal_id"] = je_ref.id
             bill_data["supplier_name"] = supplier_data.get("name")
@@ -0,0 +1,129 @@
+"""
+Chart of Accounts
+Per-company cache of account metadata for code -> id resolution.
+
+Documents post to well-known codes ("122" receivables, "41" sales, "21"
+payables, "52" expenses) whose document ids differ per company. The chart is
+loaded with one query the first time a company needs it and then served from
+memory, so resolving accounts costs no reads and can happen before a
+transaction starts instead of as a query inside it.
+
+Balances are not cached here; postings still read the account documents
+they update (PostingEngine.get_accounts_for_transaction).
+
+AccountingService's create/update/deactivate methods (the /accounting/accounts
+endpoints) call ``invalidate_chart_of_accounts`` after every change. Other
+workers and accounts edited outside this API rely on the cached chart
+expiring after CHART_OF_ACCOUNTS_TTL_SECONDS, and a code missing from it
+triggers a reload (at most once per MISS_RELOAD_SECONDS).
+"""
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.firebase import get_db
+
+# Account fields kept in the cache (never balances)
+METADATA_FIELDS = [
+    "code",
+    "name_en",
+    "name_ar",
+    "type",
+    "parent_id",
+    "is_group",
+    "active",
+    "subledger_type",
+]
+MISS_RELOAD_SECONDS = 5.0
+
+
+class ChartOfAccounts:
+    """One company's accounts: id -> metadata, code -> id and ids per type."""
+
+    def __init__(self, company_id: str, accounts: Dict[str, Dict[str, Any]]):
+        self.company_id = company_id
+        self.accounts = accounts
+        self.by_code: Dict[str, str] = {}
+        self.by_type: Dict[str, List[str]] = {}
+        # Ordered by code so "first account of a type" is stable
+        for account_id, meta in sorted(accounts.items(), key=lambda kv: (str(kv[1].get("code") or ""), kv[0])):
+            code = meta.get("code")
+            if code:
+                self.by_code.setdefault(str(code), account_id)
+            if meta.get("type"):
+                self.by_type.setdefault(meta["type"], []).append(account_id)
+
+    def id_for(self, code: str, default: Optional[str] = None) -> Optional[str]:
+        return self.by_code.get(str(code), default)
+
+    def account(self, account_id: str) -> Optional[Dict[str, Any]]:
+        return self.accounts.get(account_id)
+
+    def ids_of_type(self, account_type: str) -> List[str]:
+        return list(self.by_type.get(account_type, []))
+
+    def __contains__(self, account_id: str) -> bool:
+        return account_id in self.accounts
+
+
+# company_id -> (expires at, chart, last miss reload)
+_charts: Dict[str, Tuple[float, ChartOfAccounts, float]] = {}
+_charts_lock = threading.Lock()
+
+
+def _load(company_id: str) -> ChartOfAccounts:
+    docs = (
+        get_db()
+        .collection("accounts")
+        .where("company_id", "==", company_id)
+        .select(METADATA_FIELDS)
+        .stream()
+    )
+    return ChartOfAccounts(company_id, {doc.id: doc.to_dict() or {} for doc in docs})
+
+
+def get_chart_of_accounts(company_id: str) -> ChartOfAccounts:
+    """The company's chart, from memory while fresh."""
+    now = time.monotonic()
+    with _charts_lock:
+        cached = _charts.get(company_id)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    chart = _load(company_id)
+    with _charts_lock:
+        _charts[company_id] = (now + settings.CHART_OF_ACCOUNTS_TTL_SECONDS, chart, now)
+    return chart
+
+
+def invalidate_chart_of_accounts(company_id: Optional[str] = None):
+    """Drop one company's cached chart (or all of them)."""
+    with _charts_lock:
+        if company_id is None:
+            _charts.clear()
+        else:
+            _charts.pop(company_id, None)
+
+
+def resolve_account_id(company_id: str, code: str, default: Optional[str] = None) -> Optional[str]:
+    """
+    Account id for ``code``. A code missing from a cached chart reloads it
+    once (accounts added since it was loaded), rate-limited per company.
+    """
+    chart = get_chart_of_accounts(company_id)
+    account_id = chart.id_for(code)
+    if account_id:
+        return account_id
+
+    now = time.monotonic()
+    with _charts_lock:
+        cached = _charts.get(company_id)
+        stale = cached is not None and cached[1] is chart and cached[2] + MISS_RELOAD_SECONDS <= now
+        if stale:
+            # Claim the reload so concurrent misses don't all query
+            _charts[company_id] = (cached[0], chart, now)
+    if stale:
+        chart = _load(company_id)
+        with _charts_lock:
+            _charts[company_id] = (now + settings.CHART_OF_ACCOUNTS_TTL_SECONDS, chart, now)
+    return chart.id_for(code, default)
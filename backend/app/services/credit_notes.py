@@ -4,7 +4,8 @@ from google.cloud import firestore
 from app.core.firebase import get_db
 from app.schemas.credit_notes import CreditNoteCreate, CreditNoteStatus
 from app.services.posting import PostingEngine
-from app.services.accounting import AccountingService
+from app.services.numbering import get_numbering_service
+from app.services.chart_of_accounts import get_chart_of_accounts, resolve_account_id
 from decimal import Decimal
 
 class CreditNoteService:
@@ -13,22 +14,6 @@ class CreditNoteService:
         self.collection = self.db.collection("credit_notes")
         self.posting_engine = PostingEngine()
 
-    def _next_number(self, company_id: str) -> str:
-        year = datetime.now().strftime("%Y")
-        counter_ref = self.db.collection("counters").document(f"credit_notes_{company_id}_{year}")
-        
-        transaction = self.db.transaction()
-        @firestore.transactional
-        def increment(transaction):
-            snapshot = counter_ref.get(transaction=transaction)
-            current = snapshot.to_dict().get("value", 0) if snapshot.exists else 0
-            new_val = current + 1
-            transaction.set(counter_ref, {"value": new_val})
-            return new_val
-        
-        seq = increment(transaction)
-        return f"CN-{year}-{seq:06d}"
-
     def create_credit_note(self, data: CreditNoteCreate, user: dict) -> str:
         """Create and Post a Credit Note."""
         company_id = user.get("company_id")
@@ -44,10 +29,13 @@ class CreditNoteService:
             raise ValueError("Customer has no linked AR Account")
 
         # 2. Prepare Data
-        cn_number = self._next_number(company_id)
+        # CN-YYYY-NNNNNN from the shared sequence service; gapless sequences
+        # are claimed inside the posting transaction below
+        numbering = get_numbering_service(company_id)
+        gapless = numbering.is_gapless("credit_note")
+        drawn_number = None if gapless else numbering.get_next_number("credit_note")
         cn_data = data.model_dump()
         cn_data.update({
-            "number": cn_number,
             "status": CreditNoteStatus.ISSUED, # Immediate posting for MVP
             "company_id": company_id,
             "created_at": firestore.SERVER_TIMESTAMP,
@@ -55,11 +43,40 @@ class CreditNoteService:
             "date": datetime.fromisoformat(data.date) if isinstance(data.date, str) else data.date
         })
 
+        # Resolve Default Sales/Returns Account from the cached chart:
+        # '41' (Sales) if present, else the first revenue account
+        sales_returns_id = resolve_account_id(company_id, "41")
+        if not sales_returns_id:
+            revenue_ids = get_chart_of_accounts(company_id).ids_of_type("REVENUE")
+            sales_returns_id = revenue_ids[0] if revenue_ids else None
+        if not sales_returns_id:
+            raise ValueError("No Revenue/Sales account found for company")
+        account_ids = list(
+            {line.account_id or sales_returns_id for line in data.lines} | {ar_account_id}
+        )
+
         # 3. Transaction for GL Posting
         transaction = self.db.transaction()
         
         @firestore.transactional
         def _execute(transaction):
+            # Reads first: the sequence (gapless mode) and the accounts
+            snapshots = {}
+            if gapless:
+                snapshots = {
+                    snap.reference.path: snap
+                    for snap in self.db.get_all(
+                        numbering.transaction_refs("credit_note"), transaction=transaction
+                    )
+                }
+            accounts_data = self.posting_engine.get_accounts_for_transaction(transaction, account_ids)
+
+            # Gapless mode: the number commits or rolls back with the credit note
+            cn_number = (
+                numbering.claim(transaction, "credit_note", snapshots) if gapless else drawn_number
+            )
+            cn_data["number"] = cn_number
+
             # Create CN Doc
             doc_ref = self.collection.document()
             
@@ -69,21 +86,6 @@ class CreditNoteService:
             
             # For simplicity, we assume a default "Sales Returns" account if not specified per line
             # In a real app, this might come from settings. 
-            # Resolve Default Sales/Returns Account
-            acc_service = AccountingService()
-            
-            # Use '41' (Sales) as default code for returns if not specified
-            sales_returns_id = acc_service.get_account_id_by_code(company_id, "41")
-            
-            # If still not found, try to find ANY revenue account
-            if not sales_returns_id:
-                rev_accounts = acc_service.get_accounts(company_id, type_filter="REVENUE")
-                if rev_accounts:
-                    sales_returns_id = rev_accounts[0]["id"]
-            
-            if not sales_returns_id:
-                raise ValueError("No Revenue/Sales account found for company")
-            
             lines = []
             total = Decimal("0")
             
@@ -123,14 +125,10 @@ class CreditNoteService:
                 "source_doc_type": "CREDIT_NOTE"
             }
 
-            # Post to GL
-            account_ids = list(set(l["account_id"] for l in lines))
-            accounts_data = self.posting_engine.get_accounts_for_transaction(transaction, account_ids)
-            
             # NOW perform all writes
             je_ref = self.db.collection("journal_entries").document()
             transaction.set(je_ref, je_data)
-            self.posting_engine.post_journal_entry(transaction, je_ref.id, lines, accounts_data)
+            self.posting_engine.post_journal_entry(transaction, je_ref.id, lines, accounts_data, entry=je_data)
 
             # Save CN
             cn_data["journal_entry_id"] = je_ref.id
@@ -0,0 +1,307 @@
+"""
+Customer Search Index
+Normalized phone (E.164) and name search keys stored on each customer, so
+counter lookups and duplicate-phone checks are indexed queries with a limit
+instead of a scan of every customer in the company.
+"""
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+from google.cloud import firestore
+
+IRAQ_COUNTRY_CODE = "964"
+MIN_PHONE_PREFIX = 4
+MIN_NAME_PREFIX = 2
+MAX_NAME_PREFIX = 15
+DEFAULT_SEARCH_LIMIT = 25
+# Most candidates read to fill one page when matches are filtered after the query.
+SEARCH_SCAN_LIMIT = 500
+
+# Arabic letter variants folded to one form so "أحمد", "احمد" and "إحمد" match.
+_ARABIC_FOLD = str.maketrans(
+    {
+        "أ": "ا",
+        "إ": "ا",
+        "آ": "ا",
+        "ٱ": "ا",
+        "ى": "ي",
+        "ئ": "ي",
+        "ؤ": "و",
+        "ة": "ه",
+        "ـ": None,  # tatweel
+    }
+)
+_ARABIC_DIACRITICS = re.compile("[ً-ْٰ]")
+_EASTERN_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹", "01234567890123456789")
+_TOKEN_SPLIT = re.compile(r"[^\w]+", re.UNICODE)
+
+
+def normalize_text(value: Optional[str]) -> str:
+    """Lowercase, strip Arabic diacritics/tatweel and fold letter variants."""
+    if not value:
+        return ""
+    text = str(value).translate(_EASTERN_DIGITS)
+    text = _ARABIC_DIACRITICS.sub("", text)
+    return text.translate(_ARABIC_FOLD).lower().strip()
+
+
+def name_tokens(*values: Optional[str]) -> List[str]:
+    tokens = []
+    for value in values:
+        for token in _TOKEN_SPLIT.split(normalize_text(value)):
+            if token and token not in tokens:
+                tokens.append(token)
+    return tokens
+
+
+def _phone_digits(value: Optional[str]) -> str:
+    if not value:
+        return ""
+    text = str(value).translate(_EASTERN_DIGITS).strip()
+    digits = re.sub(r"\D", "", text)
+    if text.startswith("+"):
+        return "+" + digits
+    return digits
+
+
+def normalize_phone(value: Optional[str]) -> Optional[str]:
+    """
+    Normalize a phone number to E.164, treating local numbers as Iraqi.
+
+    Accepts "0770 123 4567", "770-123-4567", "+964 770 123 4567",
+    "00964770...", "964770..." and Arabic-Indic digits.
+    """
+    digits = _phone_digits(value)
+    if not digits:
+        return None
+
+    if digits.startswith("+"):
+        international = digits[1:]
+    elif digits.startswith("00"):
+        international = digits[2:]
+    elif digits.startswith(IRAQ_COUNTRY_CODE) and len(digits) > 10:
+        international = digits
+    elif digits.startswith("0"):
+        international = IRAQ_COUNTRY_CODE + digits[1:]
+    else:
+        international = IRAQ_COUNTRY_CODE + digits
+
+    if international.startswith(IRAQ_COUNTRY_CODE + "0"):
+        # "+964 0770..." is a common mistake; the trunk zero is not dialled.
+        international = IRAQ_COUNTRY_CODE + international[len(IRAQ_COUNTRY_CODE) + 1 :]
+
+    if len(international) < 8:
+        return None
+    return "+" + international
+
+
+def local_phone(e164: str) -> str:
+    """Iraqi local format ("07701234567"); other countries keep international digits."""
+    digits = e164.lstrip("+")
+    if digits.startswith(IRAQ_COUNTRY_CODE):
+        return "0" + digits[len(IRAQ_COUNTRY_CODE) :]
+    return digits
+
+
+def phone_search_keys(value: Optional[str]) -> List[str]:
+    """
+    Phone search keys a complete or partial number can match.
+
+    Keys hold prefixes of ``local_phone``, so "+964 770", "00964 770" and
+    "0770" all give "p:0770". Bare digits starting with the country code
+    ("964770") may be either reading and give both keys. Prefixes shorter
+    than MIN_PHONE_PREFIX give none.
+    """
+    digits = _phone_digits(value)
+    bare = digits.lstrip("+")
+    if digits.startswith("+"):
+        international = [bare]
+    elif bare.startswith("00"):
+        international = [bare[2:]]
+    else:
+        international = [bare] if bare.startswith(IRAQ_COUNTRY_CODE) else []
+
+    locals_ = []
+    if not digits.startswith("+") and not bare.startswith("00"):
+        locals_.append(bare if bare.startswith("0") else "0" + bare)
+    for number in international:
+        if number.startswith(IRAQ_COUNTRY_CODE):
+            national = number[len(IRAQ_COUNTRY_CODE) :]
+            # "+964 0770..." is a common mistake; the trunk zero is not dialled.
+            locals_.append("0" + (national[1:] if national.startswith("0") else national))
+        else:
+            locals_.append(number)
+
+    keys = []
+    for local in locals_:
+        key = f"p:{local}"
+        if len(local) >= MIN_PHONE_PREFIX and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def build_search_fields(customer: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Search fields to store on a customer document.
+
+    ``phone_e164`` backs duplicate detection; ``search_keys`` holds
+    namespaced prefixes ("p:0770...", "n:ahm...") queried with array_contains.
+    """
+    keys: List[str] = []
+
+    e164 = normalize_phone(customer.get("phone"))
+    if e164:
+        local = local_phone(e164)
+        for length in range(MIN_PHONE_PREFIX, len(local) + 1):
+            keys.append(f"p:{local[:length]}")
+
+    tokens = name_tokens(
+        customer.get("first_name"),
+        customer.get("last_name"),
+        customer.get("company_name"),
+        customer.get("name"),
+    )
+    for token in tokens:
+        for length in range(MIN_NAME_PREFIX, min(len(token), MAX_NAME_PREFIX) + 1):
+            key = f"n:{token[:length]}"
+            if key not in keys:
+                keys.append(key)
+
+    email = normalize_text(customer.get("email"))
+    if email:
+        keys.append(f"e:{email}")
+
+    return {
+        "phone_e164": e164,
+        "search_keys": keys,
+    }
+
+
+def search_keys_for_query(query: str) -> List[str]:
+    """
+    The most selective search keys for a free-text counter query: one key,
+    or several readings of an ambiguous phone number (any may match).
+    """
+    text = normalize_text(query)
+    if not text:
+        return []
+
+    if "@" in text:
+        return [f"e:{text}"]
+
+    digits = _phone_digits(query)
+    if digits and len(digits.lstrip("+")) >= MIN_PHONE_PREFIX and not re.search(
+        r"[^\d\s+\-()]", text
+    ):
+        return phone_search_keys(digits)
+
+    tokens = [token for token in name_tokens(text) if not token.isdigit()]
+    if not tokens:
+        return []
+    longest = max(tokens, key=len)
+    if len(longest) < MIN_NAME_PREFIX:
+        return []
+    return [f"n:{longest[:MAX_NAME_PREFIX]}"]
+
+
+def matches_query(customer: Dict[str, Any], query: str) -> bool:
+    """Check every query token against a customer's keys (post-filter for multi-word queries)."""
+    keys = set(customer.get("search_keys") or [])
+    for token in name_tokens(query):
+        if token.isdigit():
+            if len(token) < MIN_PHONE_PREFIX:
+                continue
+            candidates = phone_search_keys(token)
+        else:
+            candidates = [f"n:{token[:MAX_NAME_PREFIX]}"]
+        if not keys.intersection(candidates):
+            return False
+    return True
+
+
+def search_customers(
+    db,
+    company_id: str,
+    query: str,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    keep: Optional[Callable[[Dict[str, Any]], bool]] = None,
+) -> List[Any]:
+    """
+    Indexed customer lookup by phone, name prefix or email.
+
+    Name queries may carry more words (or a phone fragment) than the key
+    queried, and ``keep`` narrows results further; both are checked on each
+    candidate, reading further pages until ``limit`` customers match or
+    SEARCH_SCAN_LIMIT candidates were read.
+    """
+    keys = search_keys_for_query(query)
+    if not keys:
+        return []
+
+    candidates = db.collection("customers").where("company_id", "==", company_id)
+    if len(keys) == 1:
+        candidates = candidates.where("search_keys", "array_contains", keys[0])
+    else:
+        candidates = candidates.where("search_keys", "array_contains_any", keys)
+
+    by_words = keys[0].startswith("n:")
+    if not by_words and keep is None:
+        return list(candidates.limit(limit).stream())
+
+    page_size = min(max(limit * 2, 50), SEARCH_SCAN_LIMIT)
+    matches, scanned, cursor = [], 0, None
+    while scanned < SEARCH_SCAN_LIMIT:
+        page = candidates.limit(page_size)
+        if cursor is not None:
+            page = page.start_after(cursor)
+        docs = list(page.stream())
+        for doc in docs:
+            data = doc.to_dict() or {}
+            if (not by_words or matches_query(data, query)) and (keep is None or keep(data)):
+                matches.append(doc)
+                if len(matches) >= limit:
+                    return matches
+        scanned += len(docs)
+        if len(docs) < page_size:
+            break
+        cursor = docs[-1]
+    return matches
+
+
+def find_customers_by_phone(db, company_id: str, phone: Optional[str]) -> List[Any]:
+    """Customers already using this phone number in any format (at most two)."""
+    e164 = normalize_phone(phone)
+    if not e164:
+        return []
+
+    return list(
+        db.collection("customers")
+        .where("company_id", "==", company_id)
+        .where("phone_e164", "==", e164)
+        .limit(2)
+        .stream()
+    )
+
+
+def reindex_customers(db, company_id: str, batch_size: int = 400) -> int:
+    """
+    Backfill search fields on every customer of a company, dropping the unused
+    ``phone_variants`` of older documents. Returns the count updated.
+    """
+    updated = 0
+    batch = db.batch()
+    pending = 0
+    for doc in db.collection("customers").where("company_id", "==", company_id).stream():
+        batch.update(
+            doc.reference,
+            {**build_search_fields(doc.to_dict() or {}), "phone_variants": firestore.DELETE_FIELD},
+        )
+        pending += 1
+        updated += 1
+        if pending >= batch_size:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    return updated
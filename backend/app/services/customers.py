@@ -2,6 +2,27 @@ from typing import List, Optional
 from google.cloud import firestore
 from app.core.firebase import get_db
 from fastapi import HTTPException
+from app.services.customer_search import (
+    build_search_fields,
+    find_customers_by_phone,
+    search_customers,
+)
+
+# Summary counters kept on each customer document by the invoice and payment
+# writers, so the customer header renders from a single read. Totals are
+# integer Money units changed only by Increment, in the same transaction or
+# batch as the invoice or payment; their strings are derived on read.
+CUSTOMER_SUMMARY_TOTALS = ("total_invoiced", "total_paid_on_invoices", "total_manual_payments")
+EMPTY_CUSTOMER_SUMMARY = {
+    "invoice_count": 0,
+    "payment_count": 0,
+    "total_invoiced_units": 0,
+    "total_paid_on_invoices_units": 0,
+    "total_manual_payments_units": 0,
+    "last_invoice_at": None,
+    "last_payment_at": None,
+    "last_activity_at": None,
+}
 
 
 class CustomersService:
@@ -20,33 +41,30 @@ class CustomersService:
         page_size: int = 50
     ) -> dict:
         """List customers with optional search and filters."""
-        # Use simpler where syntax to avoid FieldFilter import issues
-        query = self.collection.where("company_id", "==", self.company_id)
+        if search:
+            # Indexed lookup on normalized search_keys, capped at the pages up to this one
+            keep = (lambda data: data.get("status") == status) if status else None
+            docs = search_customers(self.db, self.company_id, search, page * page_size, keep)
+        else:
+            # Use simpler where syntax to avoid FieldFilter import issues
+            query = self.collection.where("company_id", "==", self.company_id)
 
-        if status:
-            query = query.where("status", "==", status)
+            if status:
+                query = query.where("status", "==", status)
 
-        # Fetch all for the company (client-side search & sort)
-        docs = query.stream()
+            # Fetch all for the company (client-side sort)
+            docs = query.stream()
 
         results = []
         for d in docs:
             item = {"id": d.id, **d.to_dict()}
+            item.pop("search_keys", None)
             # Convert timestamp to ISO string if it exists for JSON safety
             if "created_at" in item and item["created_at"]:
                 try:
                     item["created_at"] = item["created_at"].isoformat()
                 except: pass
-            
-            if search:
-                search_lower = search.lower()
-                name = f"{item.get('first_name', '')} {item.get('last_name', '')}".lower()
-                company = (item.get("company_name") or "").lower()
-                phone = (item.get("phone") or "").lower()
-                email = (item.get("email") or "").lower()
-                if not any(search_lower in field for field in [name, company, phone, email]):
-                    continue
-            
+
             # Ensure name property exists for frontend
             if not item.get("name"):
                 if item.get("company_name"):
@@ -84,23 +102,20 @@ class CustomersService:
         if self.role not in ["admin", "accountant"]:
             raise HTTPException(status_code=403, detail="Only admin/accountant can create customers")
 
-        # Check duplicate phone within company
+        # Check duplicate phone within company (any spelling of the same number)
         phone = data.get("phone")
-        if phone:
-            existing = self.collection \
-                .where("company_id", "==", self.company_id) \
-                .where("phone", "==", phone) \
-                .limit(1).get()
-            if len(existing) > 0:
-                raise HTTPException(status_code=409, detail=f"Customer with phone {phone} already exists")
+        if phone and find_customers_by_phone(self.db, self.company_id, phone):
+            raise HTTPException(status_code=409, detail=f"Customer with phone {phone} already exists")
 
         doc_ref = self.collection.document()
         customer_data = {
             **data,
+            **EMPTY_CUSTOMER_SUMMARY,
             "company_id": self.company_id,
             "created_at": firestore.SERVER_TIMESTAMP,
             "created_by": self.current_user.get("email"),
         }
+        customer_data.update(build_search_fields(customer_data))
         doc_ref.set(customer_data)
         return doc_ref.id
 
@@ -116,15 +131,15 @@ class CustomersService:
 
         # If phone is being changed, check for duplicates
         if "phone" in data and data["phone"]:
-            existing = self.collection \
-                .where("company_id", "==", self.company_id) \
-                .where("phone", "==", data["phone"]) \
-                .limit(1).get()
-            for e in existing:
+            for e in find_customers_by_phone(self.db, self.company_id, data["phone"]):
                 if e.id != customer_id:
                     raise HTTPException(status_code=409, detail=f"Phone {data['phone']} already in use")
 
-        update_data = {k: v for k, v in data.items() if v is not None}
+        update_data = {
+            k: v for k, v in data.items()
+            if v is not None and k not in EMPTY_CUSTOMER_SUMMARY and k not in CUSTOMER_SUMMARY_TOTALS
+        }
+        update_data.update(build_search_fields({**doc.to_dict(), **update_data}))
         update_data["updated_at"] = firestore.SERVER_TIMESTAMP
         doc_ref.update(update_data)
         return {"id": customer_id, **doc.to_dict(), **update_data}
@@ -4,6 +4,7 @@ from google.cloud import firestore
 from app.core.firebase import get_db
 from app.schemas.expenses import ExpenseCreate, ExpenseStatus
 from app.services.posting import PostingEngine
+from app.services.numbering import get_numbering_service
 from decimal import Decimal
 
 class ExpenseService:
@@ -13,20 +14,8 @@ class ExpenseService:
         self.posting_engine = PostingEngine()
 
     def _next_number(self, company_id: str) -> str:
-        year = datetime.now().strftime("%Y")
-        counter_ref = self.db.collection("counters").document(f"expenses_{company_id}_{year}")
-        
-        transaction = self.db.transaction()
-        @firestore.transactional
-        def increment(transaction):
-            snapshot = counter_ref.get(transaction=transaction)
-            current = snapshot.to_dict().get("value", 0) if snapshot.exists else 0
-            new_val = current + 1
-            transaction.set(counter_ref, {"value": new_val})
-            return new_val
-        
-        seq = increment(transaction)
-        return f"EXP-{year}-{seq:06d}"
+        """EXP-YYYY-NNNNNN from the shared sequence service."""
+        return get_numbering_service(company_id).get_next_number("expense")
 
     def create_expense(self, data: ExpenseCreate, user: dict) -> str:
         """Create and Post an Expense."""
@@ -96,7 +85,7 @@ class ExpenseService:
             # NOW perform all writes
             je_ref = self.db.collection("journal_entries").document()
             transaction.set(je_ref, je_data)
-            self.posting_engine.post_journal_entry(transaction, je_ref.id, lines, accounts_data)
+            self.posting_engine.post_journal_entry(transaction, je_ref.id, lines, accounts_data, entry=je_data)
             
             # Save Expense
             exp_data["journal_entry_id"] = je_ref.id
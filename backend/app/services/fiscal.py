@@ -9,6 +9,7 @@ from google.cloud import firestore
 from app.core.firebase import get_db
 from app.core.audit import get_audit_logger
 from app.models.core import DocumentStatus
+from app.services.gl_snapshots import get_gl_snapshot_service
 
 class FiscalService:
     """Manages fiscal periods and opening balances."""
@@ -25,6 +26,8 @@ class FiscalService:
         """
         Close a fiscal period (month).
         Once closed, no transactions can be posted to this period.
+        Writes the period's per-account balance snapshot first, so a period
+        is only marked closed once its snapshot exists.
         
         Args:
             year: Fiscal year
@@ -41,13 +44,17 @@ class FiscalService:
         if existing.exists and existing.to_dict().get("status") == "CLOSED":
             raise ValueError(f"Period {year}-{month:02d} is already closed")
         
+        snapshot = get_gl_snapshot_service(self.company_id).take_snapshot(year, month)
+        
         period_data = {
             "company_id": self.company_id,
             "year": year,
             "month": month,
             "status": "CLOSED",
             "closed_at": firestore.SERVER_TIMESTAMP,
-            "closed_by": self.user_id
+            "closed_by": self.user_id,
+            "snapshot_period": snapshot["period"],
+            "snapshot_accounts": snapshot["account_count"]
         }
         
         period_ref.set(period_data)
@@ -76,7 +83,10 @@ class FiscalService:
         return period_doc.to_dict().get("status") != "CLOSED"
     
     def reopen_period(self, year: int, month: int) -> str:
-        """Reopen a closed period (admin only)."""
+        """Reopen a closed period (admin only).
+        Balance snapshots from this period on are discarded: postings to the
+        reopened period would make them stale.
+        """
         period_key = f"{self.company_id}_{year}_{month:02d}"
         period_ref = self.db.collection(self.PERIODS_COLLECTION).document(period_key)
         
@@ -89,6 +99,7 @@ class FiscalService:
             "reopened_at": firestore.SERVER_TIMESTAMP,
             "reopened_by": self.user_id
         })
+        get_gl_snapshot_service(self.company_id).discard_from(year, month)
         
         self.audit.log_action(
             action="REOPEN_PERIOD",
@@ -114,7 +125,9 @@ class FiscalService:
         from app.services.numbering import get_numbering_service
         
         numbering = get_numbering_service(self.company_id)
-        je_number = numbering.get_next_number("journal_entry", effective_date.year)
+        year = effective_date.year
+        gapless = numbering.is_gapless("journal_entry")
+        je_number = None if gapless else numbering.get_next_number("journal_entry", year)
         
         lines = []
         for balance in balances:
@@ -136,7 +149,22 @@ class FiscalService:
             "lines": lines
         }
         
-        je_ref.set(je_data)
+
+        @firestore.transactional
+        def _create(transaction):
+            if gapless:
+                # The number commits or rolls back with the entry
+                snapshots = {
+                    snap.reference.path: snap
+                    for snap in self.db.get_all(
+                        numbering.transaction_refs("journal_entry", year), transaction=transaction
+                    )
+                }
+                je_data["number"] = numbering.claim(transaction, "journal_entry", snapshots, year)
+            transaction.set(je_ref, je_data)
+
+        _create(self.db.transaction())
+        je_number = je_data["number"]
         
         self.audit.log_create(
             collection="journal_entries",
@@ -0,0 +1,185 @@
+"""
+GL Balance Shards
+Spreads the running balance of hot GL accounts over shard documents.
+
+An unsharded account keeps total_debit / total_credit / balance on its own
+document, read-modify-written by every posting. Once an account has
+``balance_shards`` set, postings instead Increment one shard picked at
+random per transaction and the account document keeps its balance as of
+promotion, so the balance is that base plus the sum of the shards.
+
+Cash, AR, revenue and COGS take a line from almost every document; one
+document sustains about one write per second, so accounts this process sees
+posted to faster than that are promoted automatically.
+"""
+import random
+import threading
+import time
+from collections import deque
+from decimal import Decimal
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set
+from google.cloud import firestore
+from app.core.config import settings
+from app.core.firebase import get_db
+from app.core.money import Money
+
+
+class ContentionTracker:
+    """
+    Sliding window of postings per account in this process. Transaction
+    retries call the posting again, so contended accounts fill up faster.
+    """
+
+    def __init__(self, threshold: int, window_seconds: float):
+        self.threshold = threshold
+        self.window_seconds = window_seconds
+        self._events: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, account_ids: Iterable[str]) -> Set[str]:
+        """Record one posting per account; returns those over the threshold."""
+        now = time.monotonic()
+        cutoff = now - self.window_seconds
+        hot = set()
+        with self._lock:
+            for account_id in account_ids:
+                events = self._events.setdefault(account_id, deque())
+                events.append(now)
+                while events and events[0] < cutoff:
+                    events.popleft()
+                if len(events) >= self.threshold:
+                    hot.add(account_id)
+        return hot
+
+    def forget(self, account_id: str):
+        with self._lock:
+            self._events.pop(account_id, None)
+
+
+class GLBalanceService:
+    """Writes and reads sharded GL account balances."""
+
+    COLLECTION = "account_balance_shards"
+    ACCOUNTS = "accounts"
+
+    # Shared by every service instance in this process
+    _tracker = ContentionTracker(
+        settings.GL_SHARD_PROMOTE_POSTINGS, settings.GL_SHARD_PROMOTE_WINDOW_SECONDS
+    )
+
+    def __init__(self, shard_count: Optional[int] = None):
+        self.db = get_db()
+        self.shard_count = settings.GL_BALANCE_SHARDS if shard_count is None else shard_count
+
+    # ------------------------------------------------------------------
+    # Shards
+    # ------------------------------------------------------------------
+    @staticmethod
+    def shard_count_of(account: Dict[str, Any]) -> int:
+        return int(account.get("balance_shards") or 0)
+
+    def _shard_ref(self, account_id: str, shard: int):
+        return self.db.collection(self.COLLECTION).document(f"{account_id}_{shard}")
+
+    def shard_refs(self, account_id: str, account: Dict[str, Any]) -> List[Any]:
+        return [self._shard_ref(account_id, i) for i in range(self.shard_count_of(account))]
+
+    # ------------------------------------------------------------------
+    # Posting
+    # ------------------------------------------------------------------
+    def observe(self, accounts: Dict[str, Dict[str, Any]]) -> Set[str]:
+        """
+        Note a posting to ``accounts`` (id -> pre-fetched data); returns the
+        unsharded ones that should be promoted in this posting.
+        """
+        if self.shard_count <= 0:
+            return set()
+        unsharded = [aid for aid, acc in accounts.items() if not self.shard_count_of(acc)]
+        return self._tracker.observe(unsharded)
+
+    def promotion_fields(self, account_id: str) -> Dict[str, Any]:
+        """
+        Fields that promote an account, written with its last direct balance
+        update so promotion costs no extra write on the hot document.
+        """
+        self._tracker.forget(account_id)
+        return {"balance_shards": self.shard_count, "sharded_at": firestore.SERVER_TIMESTAMP}
+
+    def add(self, transaction, account_id: str, account: Dict[str, Any], debit: Money, credit: Money):
+        """Add a line to one randomly picked shard (no read needed; amounts in Money units)."""
+        shard = random.randrange(self.shard_count_of(account))
+        transaction.set(
+            self._shard_ref(account_id, shard),
+            {
+                "company_id": account.get("company_id"),
+                "account_id": account_id,
+                "shard": shard,
+                "debit_units": firestore.Increment(Money.parse(debit).units),
+                "credit_units": firestore.Increment(Money.parse(credit).units),
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            },
+            merge=True,
+        )
+
+    def promote(self, account_id: str, shards: Optional[int] = None) -> int:
+        """Shard an account explicitly (e.g. before a known peak); returns its shard count."""
+        ref = self.db.collection(self.ACCOUNTS).document(account_id)
+        snap = ref.get()
+        if not snap.exists:
+            raise ValueError("Account not found")
+        current = self.shard_count_of(snap.to_dict())
+        if current:
+            return current
+        count = shards or self.shard_count or settings.GL_BALANCE_SHARDS
+        ref.update({"balance_shards": count, "sharded_at": firestore.SERVER_TIMESTAMP})
+        return count
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+    def balances(self, accounts: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Money]]:
+        """
+        total_debit / total_credit / balance per account (id -> account data),
+        summing the shards of sharded accounts with one get_all.
+        """
+        totals = {
+            aid: {
+                "total_debit": Money.read(acc, "total_debit"),
+                "total_credit": Money.read(acc, "total_credit"),
+            }
+            for aid, acc in accounts.items()
+        }
+        refs = [ref for aid, acc in accounts.items() for ref in self.shard_refs(aid, acc)]
+        if refs:
+            for snap in self.db.get_all(refs):
+                if not snap.exists:
+                    continue
+                shard = snap.to_dict()
+                account_totals = totals[shard["account_id"]]
+                account_totals["total_debit"] += Money(shard.get("debit_units") or 0)
+                account_totals["total_credit"] += Money(shard.get("credit_units") or 0)
+        for account_totals in totals.values():
+            account_totals["balance"] = account_totals["total_debit"] - account_totals["total_credit"]
+        return totals
+
+    def with_balances(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Account rows (with ``id``) with their balance fields summed over shards."""
+        sharded = {row["id"]: row for row in rows if self.shard_count_of(row)}
+        if not sharded:
+            return rows
+        totals = self.balances(sharded)
+        for row in rows:
+            if row["id"] in totals:
+                row.update({field: str(value) for field, value in totals[row["id"]].items()})
+        return rows
+
+    def account_balance(self, account_id: str, account: Dict[str, Any]) -> Decimal:
+        """Current balance (debit - credit) of one account."""
+        if not self.shard_count_of(account):
+            return Money.read(account, "balance").to_decimal()
+        return self.balances({account_id: account})[account_id]["balance"].to_decimal()
+
+
+def get_gl_balance_service(shard_count: Optional[int] = None) -> GLBalanceService:
+    """Factory function to get a GL balance service instance."""
+    return GLBalanceService(shard_count=shard_count)
@@ -0,0 +1,258 @@
+"""
+GL Period Cube
+Per-account debit/credit by calendar month, the aggregate that date-range
+financial statements read instead of journal entries.
+
+Every posting Increments its account's cell for the posting month in
+``account_period_balances`` next to the daily bucket (GLSnapshotService), in
+the posting transaction or in the outbox poster. A report over any list of
+date ranges reads whole months from the cube and only the partial months at
+the edges of a range from the daily buckets, so a 24-month comparative
+statement reads at most 24 x accounts cells.
+
+Cells load into one column vector per account (integer Money units) and are
+summed column-wise; ``roll_up`` adds each account's vector into its
+``parent_id`` ancestors for hierarchical statements.
+"""
+import random
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from google.cloud import firestore
+from app.core.firebase import get_db
+from app.core.money import Money
+from app.services.chart_of_accounts import ChartOfAccounts
+from app.services.gl_snapshots import get_gl_snapshot_service, month_bounds
+
+# Columns a comparative statement may ask for
+MAX_COLUMNS = 24
+
+# Upper bound of "every day" (post-dated entries included)
+LAST_DAY = "9999-12-31"
+
+DayRange = Tuple[str, str]  # (first day, last day), inclusive, YYYY-MM-DD
+
+
+def period_key(day: str) -> str:
+    """Cube period (YYYY-MM) of a posting day."""
+    return day[:7]
+
+
+def _next_period(period: str) -> str:
+    year, month = int(period[:4]), int(period[5:7])
+    return f"{year + month // 12}-{month % 12 + 1:02d}"
+
+
+def _split(first_day: str, last_day: str) -> Tuple[List[str], List[DayRange]]:
+    """Whole months and leftover day ranges covering [first_day, last_day]."""
+    months, edges = [], []
+    period = period_key(first_day)
+    while period <= period_key(last_day):
+        month_first, month_last = month_bounds(int(period[:4]), int(period[5:7]))
+        start, end = max(first_day, month_first), min(last_day, month_last)
+        if (start, end) == (month_first, month_last):
+            months.append(period)
+        else:
+            edges.append((start, end))
+        period = _next_period(period)
+    return months, edges
+
+
+def _runs(periods: Iterable[str]) -> List[Tuple[str, str]]:
+    """Sorted periods grouped into contiguous (first, last) runs."""
+    runs: List[Tuple[str, str]] = []
+    for period in sorted(set(periods)):
+        if runs and _next_period(runs[-1][1]) == period:
+            runs[-1] = (runs[-1][0], period)
+        else:
+            runs.append((period, period))
+    return runs
+
+
+def month_ranges(first_period: str, last_period: str) -> List[DayRange]:
+    """One (first, last) day range per month from first_period to last_period."""
+    ranges = []
+    period = first_period
+    while period <= last_period:
+        ranges.append(month_bounds(int(period[:4]), int(period[5:7])))
+        period = _next_period(period)
+    return ranges
+
+
+class Movements:
+    """Debit and credit per account and column, as Money units."""
+
+    def __init__(self, columns: List[DayRange]):
+        self.columns = columns
+        self.debit: Dict[str, List[int]] = {}
+        self.credit: Dict[str, List[int]] = {}
+        self.cells_read = 0
+
+    def add(self, account_id: str, column: int, debit_units: int, credit_units: int):
+        if not account_id:
+            return
+        if account_id not in self.debit:
+            self.debit[account_id] = [0] * len(self.columns)
+            self.credit[account_id] = [0] * len(self.columns)
+        self.debit[account_id][column] += debit_units
+        self.credit[account_id][column] += credit_units
+
+    def net(self) -> Dict[str, List[int]]:
+        """Debit minus credit per account and column."""
+        return {
+            account_id: [d - c for d, c in zip(debits, self.credit[account_id])]
+            for account_id, debits in self.debit.items()
+        }
+
+
+def roll_up(chart: ChartOfAccounts, values: Dict[str, List[int]]) -> Dict[str, List[int]]:
+    """Each account's own vector plus the vectors of all its descendants."""
+    rolled = {account_id: list(vector) for account_id, vector in values.items()}
+    for account_id, vector in values.items():
+        seen = {account_id}
+        parent = (chart.account(account_id) or {}).get("parent_id")
+        while parent and parent not in seen:
+            seen.add(parent)
+            target = rolled.setdefault(parent, [0] * len(vector))
+            for column, units in enumerate(vector):
+                target[column] += units
+            parent = (chart.account(parent) or {}).get("parent_id")
+    return rolled
+
+
+class GLCubeService:
+    """Maintains and reads the (account, month) aggregate cube."""
+
+    COLLECTION = "account_period_balances"
+    WRITE_BATCH_SIZE = 450
+
+    def __init__(self, company_id: Optional[str] = "default"):
+        self.db = get_db()
+        self.company_id = company_id
+
+    # ------------------------------------------------------------------
+    # Posting
+    # ------------------------------------------------------------------
+    def add(
+        self,
+        writer,
+        company_id: Optional[str],
+        account_id: str,
+        account: Dict[str, Any],
+        period: str,
+        debit: Money,
+        credit: Money,
+    ):
+        """Increment one account's cell for ``period`` (no read; one write)."""
+        doc_id = f"{account_id}_{period}"
+        shards = int(account.get("balance_shards") or 0)
+        if shards:
+            doc_id = f"{doc_id}_{random.randrange(shards)}"
+        writer.set(
+            self.db.collection(self.COLLECTION).document(doc_id),
+            {
+                "company_id": company_id or account.get("company_id"),
+                "account_id": account_id,
+                "period": period,
+                "debit_units": firestore.Increment(debit.units),
+                "credit_units": firestore.Increment(credit.units),
+            },
+            merge=True,
+        )
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+    def movements(self, ranges: List[DayRange]) -> Movements:
+        """
+        Debit/credit per account for each (first day, last day) column: whole
+        months from the cube, partial months from the daily buckets.
+        """
+        result = Movements(ranges)
+
+        month_columns: Dict[str, List[int]] = {}
+        edges: List[Tuple[int, DayRange]] = []
+        for column, (first_day, last_day) in enumerate(ranges):
+            if first_day > last_day:
+                raise ValueError(f"Empty date range {first_day}..{last_day}")
+            months, column_edges = _split(first_day, last_day)
+            for period in months:
+                month_columns.setdefault(period, []).append(column)
+            edges.extend((column, edge) for edge in column_edges)
+
+        for first_period, last_period in _runs(month_columns):
+            cells = (
+                self.db.collection(self.COLLECTION)
+                .where("company_id", "==", self.company_id)
+                .where("period", ">=", first_period)
+                .where("period", "<=", last_period)
+                .select(["account_id", "period", "debit_units", "credit_units"])
+                .stream()
+            )
+            for doc in cells:
+                data = doc.to_dict() or {}
+                result.cells_read += 1
+                for column in month_columns.get(data.get("period"), []):
+                    result.add(
+                        data.get("account_id"), column, data.get("debit_units") or 0, data.get("credit_units") or 0
+                    )
+
+        snapshots = get_gl_snapshot_service(self.company_id)
+        for column, (first_day, last_day) in edges:
+            for account_id, _, _, data in snapshots.daily_rows(first_day, last_day):
+                result.cells_read += 1
+                result.add(account_id, column, data.get("debit_units") or 0, data.get("credit_units") or 0)
+        return result
+
+    # ------------------------------------------------------------------
+    # Rebuild
+    # ------------------------------------------------------------------
+    def rebuild(self) -> Dict[str, int]:
+        """
+        Recompute the cube from the daily buckets (backfill; run after
+        GLSnapshotService.rebuild, while posting is quiet: cells are replaced).
+        """
+        totals: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        for account_id, day, _, data in get_gl_snapshot_service(self.company_id).daily_rows(None, LAST_DAY):
+            key = (account_id, period_key(day))
+            debit, credit = totals.get(key, (0, 0))
+            totals[key] = (debit + (data.get("debit_units") or 0), credit + (data.get("credit_units") or 0))
+
+        existing = (
+            self.db.collection(self.COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .select([])
+            .stream()
+        )
+        batch, pending, removed = self.db.batch(), 0, 0
+        for doc in existing:
+            batch.delete(doc.reference)
+            pending += 1
+            removed += 1
+            if pending >= self.WRITE_BATCH_SIZE:
+                batch.commit()
+                batch, pending = self.db.batch(), 0
+        if pending:
+            batch.commit()
+            batch, pending = self.db.batch(), 0
+        for (account_id, period), (debit, credit) in totals.items():
+            batch.set(
+                self.db.collection(self.COLLECTION).document(f"{account_id}_{period}"),
+                {
+                    "company_id": self.company_id,
+                    "account_id": account_id,
+                    "period": period,
+                    "debit_units": debit,
+                    "credit_units": credit,
+                },
+            )
+            pending += 1
+            if pending >= self.WRITE_BATCH_SIZE:
+                batch.commit()
+                batch, pending = self.db.batch(), 0
+        if pending:
+            batch.commit()
+        return {"cells_written": len(totals), "cells_removed": removed}
+
+
+def get_gl_cube_service(company_id: Optional[str] = "default") -> GLCubeService:
+    """Factory function to get a GL cube service instance."""
+    return GLCubeService(company_id=company_id)
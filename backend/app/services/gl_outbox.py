@@ -0,0 +1,317 @@
+"""
+GL Posting Outbox
+Applies journal entry balance updates asynchronously (GL_POSTING_MODE=outbox).
+
+In outbox mode a posting writes the journal entry and one ``gl_outbox``
+document (the entry's debit/credit per account, as Money units) in the
+business document's own commit, and never reads or writes account documents.
+A background poster drains the outbox oldest first, sums many entries per
+account and applies each group in one transaction: one balance update per
+account (or one shard Increment for sharded accounts), one daily bucket
+Increment per account and posting day and one cube Increment per account and
+posting month, then deletes the applied outbox documents and bumps the
+ledger watermark of each company touched (cached reports read balances). Re-reading the outbox documents inside that transaction makes
+concurrent posters safe; an entry is applied exactly once.
+
+Account balances lag the journal by the poster lag (``stats``). Entries that
+reference a missing account are left in the outbox as "failed" with the
+offending ids instead of blocking the rest.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from google.cloud import firestore
+from app.core.config import settings
+from app.core.firebase import get_db
+from app.core.money import Money
+from app.services.gl_balances import get_gl_balance_service
+from app.services.gl_cube import get_gl_cube_service, period_key
+from app.services.gl_snapshots import day_key, get_gl_snapshot_service
+from app.services.ledger_watermark import get_ledger_watermark_service
+
+logger = logging.getLogger(__name__)
+
+# Firestore's per-transaction write cap
+WRITE_LIMIT = 500
+
+AccountTotals = Dict[str, Tuple[Money, Money]]  # account_id -> (debit, credit)
+
+
+def account_totals(lines_data: List[Dict[str, Any]]) -> AccountTotals:
+    """(debit, credit) per account, with repeated lines for one account summed."""
+    totals: AccountTotals = {}
+    for line in lines_data or []:
+        account_id = line.get("account_id")
+        if not account_id:
+            continue
+        debit, credit = totals.get(account_id, (Money(), Money()))
+        totals[account_id] = (
+            debit + Money.parse(line.get("debit", "0")),
+            credit + Money.parse(line.get("credit", "0")),
+        )
+    return totals
+
+
+class GLOutboxService:
+    """Queues journal entry balance updates and applies them in batches."""
+
+    COLLECTION = "gl_outbox"
+    ACCOUNTS = "accounts"
+
+    # Poster metrics, shared by every instance in this process
+    _stats: Dict[str, Any] = {
+        "drains": 0,
+        "entries_applied": 0,
+        "entries_failed": 0,
+        "account_updates": 0,
+        "last_drain_at": None,
+        "last_error": None,
+    }
+    _stats_lock = threading.Lock()
+
+    def __init__(self):
+        self.db = get_db()
+        self.gl_balances = get_gl_balance_service()
+        self.snapshots = get_gl_snapshot_service(None)
+        self.cube = get_gl_cube_service(None)
+        self.watermark = get_ledger_watermark_service(None)
+
+    # ------------------------------------------------------------------
+    # Enqueue (inside the business transaction)
+    # ------------------------------------------------------------------
+    def enqueue(
+        self, transaction, entry_id: str, totals: AccountTotals, day: str, company_id: Optional[str] = None
+    ):
+        """Write the entry's per-account totals to the outbox (one write)."""
+        transaction.set(
+            self.db.collection(self.COLLECTION).document(entry_id),
+            {
+                "entry_id": entry_id,
+                "company_id": company_id,
+                "status": "pending",
+                "day": day,
+                "accounts": {
+                    account_id: {"debit_units": debit.units, "credit_units": credit.units}
+                    for account_id, (debit, credit) in totals.items()
+                },
+                "created_at": firestore.SERVER_TIMESTAMP,
+            },
+        )
+
+    # ------------------------------------------------------------------
+    # Draining
+    # ------------------------------------------------------------------
+    def _pending(self, limit: int):
+        return (
+            self.db.collection(self.COLLECTION)
+            .where("status", "==", "pending")
+            .order_by("created_at")
+            .limit(limit)
+            .stream()
+        )
+
+    @staticmethod
+    def group_entries(entries: List[Tuple[str, Dict[str, Any]]]) -> List[List[str]]:
+        """
+        Split pending entries (id, data) into groups whose writes (one per
+        distinct account, one per account and day, one per account and month,
+        one watermark bump per company, one delete per entry) fit in one
+        transaction.
+        """
+        groups: List[List[str]] = []
+        current: List[str] = []
+        accounts: set = set()
+        companies: set = set()
+        for entry_id, data in entries:
+            entry_accounts = {(aid, data.get("day")) for aid in (data.get("accounts") or {})}
+            merged = accounts | entry_accounts
+            merged_companies = companies | {data.get("company_id")}
+            writes = (
+                len({aid for aid, _ in merged})
+                + len(merged)
+                + len({(aid, period_key(day or "")) for aid, day in merged})
+                + len(merged_companies)
+                + len(current)
+                + 1
+            )
+            if current and writes > WRITE_LIMIT:
+                groups.append(current)
+                current, merged, merged_companies = [], set(entry_accounts), {data.get("company_id")}
+            current.append(entry_id)
+            accounts, companies = merged, merged_companies
+        if current:
+            groups.append(current)
+        return groups
+
+    def _apply_group(self, entry_ids: List[str]) -> Dict[str, int]:
+        outbox = self.db.collection(self.COLLECTION)
+        entry_refs = [outbox.document(entry_id) for entry_id in entry_ids]
+
+        @firestore.transactional
+        def _apply(transaction):
+            # PHASE 1: reads (outbox entries, then every account they touch)
+            entries = {}
+            for snap in self.db.get_all(entry_refs, transaction=transaction):
+                data = snap.to_dict() if snap.exists else None
+                if data and data.get("status") == "pending":
+                    entries[snap.id] = data
+            account_ids = sorted({aid for data in entries.values() for aid in data.get("accounts", {})})
+            account_refs = [self.db.collection(self.ACCOUNTS).document(aid) for aid in account_ids]
+            accounts = {
+                snap.id: snap.to_dict()
+                for snap in (self.db.get_all(account_refs, transaction=transaction) if account_refs else [])
+                if snap.exists
+            }
+
+            # Sum applicable entries per account, and per account and day
+            totals: AccountTotals = {}
+            daily: Dict[Tuple[str, str], Tuple[Money, Money]] = {}
+            applied, failed = [], []
+            for entry_id, data in entries.items():
+                missing = [aid for aid in data.get("accounts", {}) if aid not in accounts]
+                if missing:
+                    failed.append((entry_id, missing))
+                    continue
+                applied.append(entry_id)
+                for aid, amounts in data["accounts"].items():
+                    line_debit = Money(amounts.get("debit_units") or 0)
+                    line_credit = Money(amounts.get("credit_units") or 0)
+                    debit, credit = totals.get(aid, (Money(), Money()))
+                    totals[aid] = (debit + line_debit, credit + line_credit)
+                    key = (aid, data.get("day") or day_key(data.get("created_at")))
+                    debit, credit = daily.get(key, (Money(), Money()))
+                    daily[key] = (debit + line_debit, credit + line_credit)
+
+            # PHASE 2: writes, one per account
+            for aid, (debit, credit) in totals.items():
+                account = accounts[aid]
+                if self.gl_balances.shard_count_of(account):
+                    self.gl_balances.add(transaction, aid, account, debit, credit)
+                    continue
+                new_debit = Money.read(account, "total_debit") + debit
+                new_credit = Money.read(account, "total_credit") + credit
+                transaction.update(
+                    self.db.collection(self.ACCOUNTS).document(aid),
+                    {
+                        **new_debit.fields("total_debit"),
+                        **new_credit.fields("total_credit"),
+                        **(new_debit - new_credit).fields("balance"),
+                    },
+                )
+            monthly: Dict[Tuple[str, str], Tuple[Money, Money]] = {}
+            for (aid, day), (debit, credit) in daily.items():
+                self.snapshots.add(transaction, None, aid, accounts[aid], day, debit, credit)
+                month_debit, month_credit = monthly.get((aid, period_key(day)), (Money(), Money()))
+                monthly[(aid, period_key(day))] = (month_debit + debit, month_credit + credit)
+            for (aid, period), (debit, credit) in monthly.items():
+                self.cube.add(transaction, None, aid, accounts[aid], period, debit, credit)
+            touched: Dict[str, set] = {}
+            for aid in totals:
+                company_id = accounts[aid].get("company_id")
+                if company_id:
+                    touched.setdefault(company_id, set()).add(aid)
+            for company_id, account_ids in touched.items():
+                self.watermark.bump(transaction, company_id, account_ids)
+            for entry_id in applied:
+                transaction.delete(outbox.document(entry_id))
+            for entry_id, missing in failed:
+                transaction.update(
+                    outbox.document(entry_id),
+                    {"status": "failed", "missing_accounts": missing, "failed_at": firestore.SERVER_TIMESTAMP},
+                )
+            return {"applied": len(applied), "failed": len(failed), "accounts": len(totals)}
+
+        return _apply(self.db.transaction())
+
+    def drain_once(self, limit: Optional[int] = None) -> Dict[str, int]:
+        """Apply up to ``limit`` of the oldest pending entries; returns counts."""
+        limit = limit or settings.GL_OUTBOX_BATCH_SIZE
+        entries = [(doc.id, doc.to_dict() or {}) for doc in self._pending(limit)]
+        result = {"applied": 0, "failed": 0, "accounts": 0, "transactions": 0}
+        for group in self.group_entries(entries):
+            counts = self._apply_group(group)
+            for key, value in counts.items():
+                result[key] += value
+            result["transactions"] += 1
+
+        with self._stats_lock:
+            self._stats["drains"] += 1
+            self._stats["entries_applied"] += result["applied"]
+            self._stats["entries_failed"] += result["failed"]
+            self._stats["account_updates"] += result["accounts"]
+            self._stats["last_drain_at"] = time.time()
+        return result
+
+    # ------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------
+    def lag_seconds(self) -> float:
+        """Age of the oldest pending entry (0 when the outbox is empty)."""
+        oldest = next(iter(self._pending(1)), None)
+        created_at = oldest.get("created_at") if oldest else None
+        if not created_at:
+            return 0.0
+        return max(0.0, (datetime.now(timezone.utc) - created_at).total_seconds())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["mode"] = settings.GL_POSTING_MODE
+        stats["poster_running"] = _poster is not None and _poster.is_alive()
+        stats["lag_seconds"] = round(self.lag_seconds(), 3)
+        return stats
+
+    @classmethod
+    def record_error(cls, error: Exception):
+        with cls._stats_lock:
+            cls._stats["last_error"] = f"{type(error).__name__}: {error}"
+
+
+def get_gl_outbox_service() -> GLOutboxService:
+    """Factory function to get a GL outbox service instance."""
+    return GLOutboxService()
+
+
+# ----------------------------------------------------------------------
+# Background poster
+# ----------------------------------------------------------------------
+_poster: Optional[threading.Thread] = None
+_poster_stop = threading.Event()
+_poster_lock = threading.Lock()
+
+
+def _run_poster():
+    service = get_gl_outbox_service()
+    while not _poster_stop.is_set():
+        try:
+            result = service.drain_once()
+        except Exception as e:
+            logger.exception("GL outbox drain failed")
+            service.record_error(e)
+            result = None
+        # Keep draining while there is a backlog; otherwise wait for more
+        if not result or result["applied"] + result["failed"] < settings.GL_OUTBOX_BATCH_SIZE:
+            _poster_stop.wait(settings.GL_OUTBOX_POLL_SECONDS)
+
+
+def start_gl_outbox_poster():
+    """Start the poster thread once per process (outbox mode only)."""
+    global _poster
+    if settings.GL_POSTING_MODE != "outbox":
+        return
+    with _poster_lock:
+        if _poster is None or not _poster.is_alive():
+            _poster_stop.clear()
+            _poster = threading.Thread(target=_run_poster, name="gl-outbox-poster", daemon=True)
+            _poster.start()
+
+
+def stop_gl_outbox_poster():
+    global _poster
+    with _poster_lock:
+        _poster_stop.set()
+        if _poster is not None:
+            _poster.join(timeout=5)
+            _poster = None
@@ -0,0 +1,373 @@
+"""
+GL Period Snapshots
+Per-account balances by day and month-end snapshots, so a trial balance as
+of any date reads O(accounts) documents instead of replaying the journal.
+
+Every posting Increments its account's bucket for the posting day (UTC) in
+``account_daily_balances`` in the posting transaction (the outbox poster
+does it in outbox mode); sharded accounts spread their buckets over the same
+number of shards. Closing a fiscal period writes one snapshot row per account
+(opening, debit, credit, closing) rolled forward from the previous snapshot.
+
+A trial balance as of day D is the latest snapshot covering days <= D plus
+the daily buckets after it, up to D.
+"""
+import calendar
+import random
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, Optional, Tuple
+from google.cloud import firestore
+from app.core.firebase import get_db
+from app.core.money import Money
+from app.services.chart_of_accounts import get_chart_of_accounts
+
+
+def day_key(value: Any = None) -> str:
+    """Posting day (UTC, YYYY-MM-DD) of a journal date; today for server timestamps."""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def shift_day(day: str, days: int) -> str:
+    return (date.fromisoformat(day) + timedelta(days=days)).isoformat()
+
+
+def month_bounds(year: int, month: int) -> Tuple[str, str]:
+    last = calendar.monthrange(year, month)[1]
+    return date(year, month, 1).isoformat(), date(year, month, last).isoformat()
+
+
+class GLSnapshotService:
+    """Maintains daily GL buckets and month-end balance snapshots."""
+
+    DAILY_COLLECTION = "account_daily_balances"
+    SNAPSHOTS_COLLECTION = "account_balance_snapshots"
+    PERIODS_COLLECTION = "account_snapshot_periods"
+    LEDGER_COLLECTION = "account_ledger"
+    WRITE_BATCH_SIZE = 450
+
+    def __init__(self, company_id: Optional[str] = "default"):
+        self.db = get_db()
+        self.company_id = company_id
+
+    # ------------------------------------------------------------------
+    # Posting
+    # ------------------------------------------------------------------
+    def add(
+        self,
+        writer,
+        company_id: Optional[str],
+        account_id: str,
+        account: Dict[str, Any],
+        day: str,
+        debit: Money,
+        credit: Money,
+    ):
+        """Increment one account's bucket for ``day`` (no read; one write)."""
+        doc_id = f"{account_id}_{day}"
+        shards = int(account.get("balance_shards") or 0)
+        if shards:
+            doc_id = f"{doc_id}_{random.randrange(shards)}"
+        writer.set(
+            self.db.collection(self.DAILY_COLLECTION).document(doc_id),
+            {
+                "company_id": company_id or account.get("company_id"),
+                "account_id": account_id,
+                "day": day,
+                "debit_units": firestore.Increment(debit.units),
+                "credit_units": firestore.Increment(credit.units),
+            },
+            merge=True,
+        )
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+    def daily_rows(
+        self, start_day: Optional[str], end_day: str
+    ) -> Iterator[Tuple[str, str, Money, Dict[str, Any]]]:
+        """(account_id, day, net, bucket) for buckets in [start_day, end_day]."""
+        query = self.db.collection(self.DAILY_COLLECTION).where("company_id", "==", self.company_id)
+        if start_day:
+            query = query.where("day", ">=", start_day)
+        query = query.where("day", "<=", end_day)
+        for doc in query.select(["account_id", "day", "debit_units", "credit_units"]).stream():
+            data = doc.to_dict() or {}
+            net = Money(data.get("debit_units") or 0) - Money(data.get("credit_units") or 0)
+            yield data.get("account_id"), data.get("day"), net, data
+
+    def _latest_period(self, on_or_before_day: str) -> Optional[Dict[str, Any]]:
+        """Most recent snapshot whose last covered day is <= the given day."""
+        docs = list(
+            self.db.collection(self.PERIODS_COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .where("last_day", "<=", on_or_before_day)
+            .order_by("last_day", direction=firestore.Query.DESCENDING)
+            .limit(1)
+            .stream()
+        )
+        return docs[0].to_dict() if docs else None
+
+    def _load_snapshot(self, period: str) -> Dict[str, Money]:
+        docs = (
+            self.db.collection(self.SNAPSHOTS_COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .where("period", "==", period)
+            .select(["account_id", "closing", "closing_units"])
+            .stream()
+        )
+        return {
+            data["account_id"]: Money.read(data, "closing")
+            for data in (doc.to_dict() or {} for doc in docs)
+            if data.get("account_id")
+        }
+
+    def _base(self, on_or_before_day: str) -> Tuple[Optional[Dict[str, Any]], Dict[str, Money], Optional[str]]:
+        """Latest snapshot, its closing balances, and the first day after it."""
+        snapshot = self._latest_period(on_or_before_day)
+        if not snapshot:
+            return None, {}, None
+        return snapshot, self._load_snapshot(snapshot["period"]), shift_day(snapshot["last_day"], 1)
+
+    # ------------------------------------------------------------------
+    # Snapshots
+    # ------------------------------------------------------------------
+    def take_snapshot(self, year: int, month: int) -> Dict[str, Any]:
+        """
+        Write opening / debit / credit / closing per account for a month,
+        rolled forward from the previous snapshot (the first one reads every
+        bucket before the month).
+        """
+        period = f"{year}-{month:02d}"
+        first_day, last_day = month_bounds(year, month)
+        previous, closing, start_day = self._base(shift_day(first_day, -1))
+
+        opening = dict(closing)
+        movement: Dict[str, Tuple[Money, Money]] = {}
+        days_read = 0
+        for account_id, day, net, data in self.daily_rows(start_day, last_day):
+            days_read += 1
+            if day < first_day:
+                opening[account_id] = opening.get(account_id, Money()) + net
+                continue
+            debit, credit = movement.get(account_id, (Money(), Money()))
+            movement[account_id] = (
+                debit + Money(data.get("debit_units") or 0),
+                credit + Money(data.get("credit_units") or 0),
+            )
+
+        batch, pending = self.db.batch(), 0
+        total_debit, total_credit = Money(), Money()
+        accounts = set(opening) | set(movement)
+        for account_id in accounts:
+            debit, credit = movement.get(account_id, (Money(), Money()))
+            start = opening.get(account_id, Money())
+            total_debit += debit
+            total_credit += credit
+            batch.set(
+                self.db.collection(self.SNAPSHOTS_COLLECTION).document(
+                    f"{self.company_id}_{period}_{account_id}"
+                ),
+                {
+                    "company_id": self.company_id,
+                    "period": period,
+                    "last_day": last_day,
+                    "account_id": account_id,
+                    **start.fields("opening"),
+                    **debit.fields("debit"),
+                    **credit.fields("credit"),
+                    **(start + debit - credit).fields("closing"),
+                    "created_at": firestore.SERVER_TIMESTAMP,
+                },
+            )
+            pending += 1
+            if pending >= self.WRITE_BATCH_SIZE:
+                batch.commit()
+                batch, pending = self.db.batch(), 0
+
+        summary = {
+            "company_id": self.company_id,
+            "period": period,
+            "last_day": last_day,
+            "previous_period": previous["period"] if previous else None,
+            "account_count": len(accounts),
+            "days_read": days_read,
+            "total_debit": str(total_debit),
+            "total_credit": str(total_credit),
+            "status": "COMPLETE",
+            "created_at": firestore.SERVER_TIMESTAMP,
+        }
+        batch.set(
+            self.db.collection(self.PERIODS_COLLECTION).document(f"{self.company_id}_{period}"),
+            summary,
+        )
+        batch.commit()
+        return {**summary, "created_at": datetime.now().isoformat()}
+
+    def discard_from(self, year: int, month: int) -> int:
+        """
+        Drop snapshots of this month and later (a reopened period makes them
+        stale); as-of reads then fall back to the previous snapshot.
+        """
+        first_day, _ = month_bounds(year, month)
+        docs = (
+            self.db.collection(self.PERIODS_COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .where("last_day", ">=", first_day)
+            .stream()
+        )
+        removed = 0
+        for doc in docs:
+            doc.reference.delete()
+            removed += 1
+        return removed
+
+    # ------------------------------------------------------------------
+    # As-of trial balance
+    # ------------------------------------------------------------------
+    def balances_as_of(self, as_of: date) -> Tuple[Optional[Dict[str, Any]], Dict[str, Money], int]:
+        """(snapshot used, balance per account, buckets read) at the end of ``as_of``."""
+        snapshot, balances, start_day = self._base(day_key(as_of))
+
+        days_read = 0
+        for account_id, _, net, _ in self.daily_rows(start_day, day_key(as_of)):
+            days_read += 1
+            balances[account_id] = balances.get(account_id, Money()) + net
+        return snapshot, balances, days_read
+
+    def account_balance_as_of(self, account_id: str, as_of_day: str) -> Money:
+        """
+        One account's balance at the end of ``as_of_day``: its row in the
+        latest snapshot plus its own daily buckets since (in outbox mode,
+        entries still queued are not included).
+        """
+        snapshot = self._latest_period(as_of_day)
+        balance, start_day = Money(), None
+        if snapshot:
+            row = (
+                self.db.collection(self.SNAPSHOTS_COLLECTION)
+                .document(f"{self.company_id}_{snapshot['period']}_{account_id}")
+                .get()
+            )
+            if row.exists:
+                balance = Money.read(row.to_dict(), "closing")
+            start_day = shift_day(snapshot["last_day"], 1)
+
+        query = (
+            self.db.collection(self.DAILY_COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .where("account_id", "==", account_id)
+        )
+        if start_day:
+            query = query.where("day", ">=", start_day)
+        query = query.where("day", "<=", as_of_day)
+        for doc in query.select(["debit_units", "credit_units"]).stream():
+            data = doc.to_dict() or {}
+            balance += Money(data.get("debit_units") or 0) - Money(data.get("credit_units") or 0)
+        return balance
+
+    def trial_balance_as_of(self, as_of: date) -> Dict[str, Any]:
+        """Trial balance at the end of ``as_of`` (UTC day)."""
+        as_of_day = day_key(as_of)
+        snapshot, balances, days_read = self.balances_as_of(as_of)
+
+        chart = get_chart_of_accounts(self.company_id)
+        rows = []
+        total_debit, total_credit = Money(), Money()
+        for account_id in set(chart.accounts) | set(balances):
+            meta = chart.account(account_id) or {}
+            bal = balances.get(account_id, Money())
+            row = {
+                "account_id": account_id,
+                "code": meta.get("code") or "",
+                "name": meta.get("name_en"),
+                "type": meta.get("type"),
+                "debit": "0.00",
+                "credit": "0.00",
+                "net_balance": str(bal),
+            }
+            if bal.units > 0:
+                row["debit"] = str(bal)
+                total_debit += bal
+            elif bal.units < 0:
+                row["credit"] = str(abs(bal))
+                total_credit += abs(bal)
+            rows.append(row)
+        rows.sort(key=lambda x: x["code"])
+
+        return {
+            "as_of": as_of_day,
+            "snapshot_period": snapshot["period"] if snapshot else None,
+            "days_read": days_read,
+            "rows": rows,
+            "total_debit": str(total_debit),
+            "total_credit": str(total_credit),
+        }
+
+    # ------------------------------------------------------------------
+    # Rebuild
+    # ------------------------------------------------------------------
+    def rebuild(self) -> Dict[str, int]:
+        """
+        Recompute the daily buckets from ``account_ledger`` (backfill for
+        postings made before buckets existed). Run while posting is quiet:
+        buckets are replaced, not merged.
+        """
+        totals: Dict[Tuple[str, str], Tuple[Money, Money]] = {}
+        rows = (
+            self.db.collection(self.LEDGER_COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .select(["account_id", "date", "debit", "debit_units", "credit", "credit_units"])
+            .stream()
+        )
+        for doc in rows:
+            data = doc.to_dict() or {}
+            key = (data.get("account_id"), day_key(data.get("date")))
+            debit, credit = totals.get(key, (Money(), Money()))
+            totals[key] = (debit + Money.read(data, "debit"), credit + Money.read(data, "credit"))
+
+        existing = (
+            self.db.collection(self.DAILY_COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .select([])
+            .stream()
+        )
+        batch, pending, removed = self.db.batch(), 0, 0
+        for doc in existing:
+            batch.delete(doc.reference)
+            pending += 1
+            removed += 1
+            if pending >= self.WRITE_BATCH_SIZE:
+                batch.commit()
+                batch, pending = self.db.batch(), 0
+        if pending:
+            batch.commit()
+            batch, pending = self.db.batch(), 0
+        for (account_id, day), (debit, credit) in totals.items():
+            batch.set(
+                self.db.collection(self.DAILY_COLLECTION).document(f"{account_id}_{day}"),
+                {
+                    "company_id": self.company_id,
+                    "account_id": account_id,
+                    "day": day,
+                    "debit_units": debit.units,
+                    "credit_units": credit.units,
+                },
+            )
+            pending += 1
+            if pending >= self.WRITE_BATCH_SIZE:
+                batch.commit()
+                batch, pending = self.db.batch(), 0
+        if pending:
+            batch.commit()
+        return {"buckets_written": len(totals), "buckets_removed": removed}
+
+
+def get_gl_snapshot_service(company_id: Optional[str] = "default") -> GLSnapshotService:
+    """Factory function to get a GL snapshot service instance."""
+    return GLSnapshotService(company_id=company_id)
@@ -6,6 +6,7 @@ from google.cloud import firestore
 from app.core.firebase import get_db
 from app.models.core import DocumentStatus
 from app.services.posting import PostingEngine
+from app.services.transfers import get_transfer_service
 
 class ReturnCreate(BaseModel):
     number: str
@@ -87,20 +88,22 @@ class IntegrationService:
             "description": f"Reduce Receivable for Return {data.number}"
         })
 
-        transaction.set(je_ref, {
+        je_data = {
             "number": f"JE-RET-{data.number}",
             "date": firestore.SERVER_TIMESTAMP,
             "description": f"Sales Return: {data.reason}",
             "status": DocumentStatus.DRAFT,
             "source_document_type": "RETURN",
-            "lines": lines_data
-        })
+            "lines": lines_data,
+            "company_id": item_data.get("company_id"),
+        }
+        transaction.set(je_ref, je_data)
         
         # Pre-fetch accounts
         account_ids = list(set(line["account_id"] for line in lines_data))
         accounts_data = self.posting_engine.get_accounts_for_transaction(transaction, account_ids)
         
-        self.posting_engine.post_journal_entry(transaction, je_id, lines_data, accounts_data)
+        self.posting_engine.post_journal_entry(transaction, je_id, lines_data, accounts_data, entry=je_data)
         return je_id
 
     async def create_purchase_return(self, data: ReturnCreate):
@@ -147,52 +150,29 @@ class IntegrationService:
             "description": f"Reduce Payable for Return {data.number}"
         })
 
-        transaction.set(je_ref, {
+        je_data = {
             "number": f"JE-PRET-{data.number}",
             "date": firestore.SERVER_TIMESTAMP,
             "description": f"Purchase Return: {data.reason}",
             "status": DocumentStatus.DRAFT,
             "source_document_type": "PURCHASE_RETURN",
-            "lines": lines_data
-        })
+            "lines": lines_data,
+            "company_id": item_data.get("company_id"),
+        }
+        transaction.set(je_ref, je_data)
         
         # Pre-fetch accounts
         account_ids = list(set(line["account_id"] for line in lines_data))
         accounts_data = self.posting_engine.get_accounts_for_transaction(transaction, account_ids)
 
-        self.posting_engine.post_journal_entry(transaction, je_id, lines_data, accounts_data)
+        self.posting_engine.post_journal_entry(transaction, je_id, lines_data, accounts_data, entry=je_data)
         return je_id
 
     async def create_stock_transfer(self, data: TransferCreate):
-        """Transfers stock between warehouses. No financial impact."""
-        for line in data.lines:
-            item_id = line["item_id"]
-            quantity = Decimal(str(line["quantity"]))
-            
-            item_snap = self.db.collection("items").document(item_id).get()
-            item_data = item_snap.to_dict()
-            wac = Decimal(item_data.get("current_wac", "0"))
-            
-            # OUT from source warehouse
-            self.db.collection("stock_ledger").add({
-                "timestamp": firestore.SERVER_TIMESTAMP,
-                "item_id": item_id,
-                "warehouse_id": data.from_warehouse_id,
-                "quantity": str(-quantity),
-                "unit_cost": str(wac),
-                "valuation_rate": str(wac),
-                "source_document_type": "TRANSFER_OUT"
-            })
-            
-            # IN to destination warehouse
-            self.db.collection("stock_ledger").add({
-                "timestamp": firestore.SERVER_TIMESTAMP,
-                "item_id": item_id,
-                "warehouse_id": data.to_warehouse_id,
-                "quantity": str(quantity),
-                "unit_cost": str(wac),
-                "valuation_rate": str(wac),
-                "source_document_type": "TRANSFER_IN"
-            })
+        """Transfers stock between warehouses. No financial impact.
+        Lines post through PostingEngine in as few transactions as the write limit allows."""
+        get_transfer_service(None).post_transfer(
+            data.number, data.from_warehouse_id, data.to_warehouse_id, data.lines
+        )
         
         return {"message": f"Transfer {data.number} completed"}
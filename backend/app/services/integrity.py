@@ -3,7 +3,7 @@ Data Integrity & Idempotency Service
 Prevents duplicate postings and ensures atomic transactions.
 """
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from google.cloud import firestore
 from app.core.firebase import get_db
 
@@ -17,6 +17,9 @@ class IntegrityService:
         self.db = get_db()
         self.company_id = company_id
     
+    def _key_ref(self, key: str):
+        return self.db.collection(self.IDEMPOTENCY_COLLECTION).document(f"{self.company_id}_{key}")
+    
     def check_and_set_idempotency(self, key: str) -> bool:
         """
         Check if an operation has already been performed.
@@ -28,8 +31,7 @@ class IntegrityService:
         Returns:
             True if this is a new operation, False if duplicate
         """
-        full_key = f"{self.company_id}_{key}"
-        key_ref = self.db.collection(self.IDEMPOTENCY_COLLECTION).document(full_key)
+        key_ref = self._key_ref(key)
         
         transaction = self.db.transaction()
         
@@ -46,16 +48,44 @@ class IntegrityService:
                 return False
             
             # New key, set it
-            transaction.set(ref, {
-                "key": key,
-                "company_id": self.company_id,
-                "created_at": firestore.SERVER_TIMESTAMP,
-                "processed": True
-            })
+            self.set_idempotency(transaction, key)
             return True
         
         return _check_and_set(transaction, key_ref)
     
+    # ------------------------------------------------------------------
+    # Batched checks inside a caller's transaction
+    # ------------------------------------------------------------------
+    def idempotency_refs(self, keys: List[str]) -> Dict[str, Any]:
+        """Key documents to include in the caller's transactional ``get_all``."""
+        return {key: self._key_ref(key) for key in keys}
+    
+    def processed_keys(self, refs: Dict[str, Any], snapshots: Dict[str, Any]) -> Dict[str, dict]:
+        """
+        Keys already processed, with whatever result was stored for them.
+        
+        ``snapshots`` maps document path to the snapshots read for ``refs``.
+        """
+        processed = {}
+        for key, ref in refs.items():
+            snap = snapshots.get(ref.path)
+            if snap is not None and snap.exists:
+                processed[key] = snap.to_dict()
+        return processed
+    
+    def set_idempotency(self, writer, key: str, result: Optional[Dict[str, Any]] = None):
+        """
+        Mark a key processed in a transaction or batch, storing ``result``
+        (e.g. the id of the document created) for replays to return.
+        """
+        writer.set(self._key_ref(key), {
+            "key": key,
+            "company_id": self.company_id,
+            "created_at": firestore.SERVER_TIMESTAMP,
+            "processed": True,
+            **(result or {}),
+        })
+    
     def generate_idempotency_key(self, doc_type: str, doc_number: str) -> str:
         """Generate a standardized idempotency key."""
         return f"{doc_type}_{doc_number}"
@@ -1,9 +1,11 @@
 from decimal import Decimal
 from google.cloud import firestore
 from app.core.firebase import get_db
+from app.core.money import ITEM_AMOUNTS, Money, Quantity, Rate, rate_of, value_of, with_units
 from app.models.core import DocumentStatus
 from app.schemas.erp import GRNCreate, DeliveryNoteCreate
 from .posting import PostingEngine
+from .stock_levels import get_stock_level_service
 
 class InventoryService:
     def __init__(self):
@@ -50,8 +52,9 @@ class InventoryService:
             # ==============================================================================
             je_ref = db.collection("journal_entries").document()
             je_id = je_ref.id
+            levels = get_stock_level_service(items_data_map[unique_item_ids[0]].get("company_id"))
             
-            total_value = Decimal("0")
+            total_value = Money()
             lines_data = []
             
             # We need to track updated item state in memory to handle multiple lines for same item
@@ -60,22 +63,25 @@ class InventoryService:
             stock_moves_to_write = [] # List of tuples: (item_id, item_ref, new_stats, ledger_entry)
 
             for line in data.lines:
-                qty = Decimal(str(line.quantity))
-                cost = Decimal(str(line.unit_cost))
+                qty = Quantity.parse(line.quantity)
+                cost = Rate.parse(line.unit_cost)
                 item_id = line.item_id
                 
                 # Update temp state
-                current_qty = Decimal(temp_items_state[item_id].get("current_qty", "0"))
-                current_val = Decimal(temp_items_state[item_id].get("total_value", "0"))
+                current_qty = Quantity.read(temp_items_state[item_id], "current_qty")
+                current_val = Money.read(temp_items_state[item_id], "total_value")
                 
+                line_val = value_of(qty, cost)
                 new_qty = current_qty + qty
-                new_val = current_val + (qty * cost)
-                new_wac = new_val / new_qty if new_qty != 0 else cost
+                new_val = current_val + line_val
+                new_wac = rate_of(new_val, new_qty) if new_qty else cost
                 
                 # Update temp map for next iteration
-                temp_items_state[item_id]["current_qty"] = str(new_qty)
-                temp_items_state[item_id]["total_value"] = str(new_val)
-                temp_items_state[item_id]["current_wac"] = str(new_wac)
+                temp_items_state[item_id].update({
+                    **new_qty.fields("current_qty"),
+                    **new_val.fields("total_value"),
+                    **new_wac.fields("current_wac"),
+                })
 
                 # Prepare Stock Ledger Entry
                 ledger_entry = {
@@ -88,6 +94,7 @@ class InventoryService:
                     "source_document_id": je_id,
                     "source_document_type": "GRN",
                     "description": f"GRN In: {line.quantity} @ {line.unit_cost}",
+                    "batch_number": line.batch_number,
                     "company_id": items_data_map[item_id].get("company_id")
                 }
                 
@@ -99,7 +106,6 @@ class InventoryService:
 
                 # Accounting Lines
                 inv_acc_id = items_data_map[item_id]["inventory_account_id"]
-                line_val = qty * cost
                 total_value += line_val
                 
                 lines_data.append({
@@ -124,29 +130,39 @@ class InventoryService:
             # 1. Update Items
             for item_id, stats in temp_items_state.items():
                 ref = db.collection("items").document(item_id)
-                transaction.update(ref, {
+                transaction.update(ref, with_units({
                     "current_qty": stats["current_qty"],
                     "total_value": stats["total_value"],
                     "current_wac": stats["current_wac"]
-                })
+                }, ITEM_AMOUNTS))
             
-            # 2. Add Stock Ledger Entries
+            # 2. Add Stock Ledger Entries (and per-warehouse levels)
+            level_deltas = {}
             for move in stock_moves_to_write:
                 led_ref = db.collection("stock_ledger").document()
                 transaction.set(led_ref, move["ledger"])
+                ledger = move["ledger"]
+                levels.add(
+                    level_deltas,
+                    levels.key(ledger["item_id"], ledger["warehouse_id"], ledger.get("batch_number")),
+                    Decimal(ledger["quantity"]),
+                )
+            levels.apply(transaction, level_deltas)
             
             # 3. Save Journal
-            transaction.set(je_ref, {
+            je_data = {
                 "number": f"JE-GRN-{data.number}",
                 "date": firestore.SERVER_TIMESTAMP,
                 "description": f"Automated Journal for GRN {data.number}",
                 "status": "DRAFT",
                 "source_document_type": "GRN",
-                "lines": lines_data
-            })
+                "lines": lines_data,
+                "company_id": items_data_map[unique_item_ids[0]].get("company_id"),
+            }
+            transaction.set(je_ref, je_data)
 
             # 4. Post Journal (passing pre-fetched accounts)
-            posting_engine.post_journal_entry(transaction, je_id, lines_data, accounts_data)
+            posting_engine.post_journal_entry(transaction, je_id, lines_data, accounts_data, entry=je_data)
             
             # --- AP SUBLEDGER LINK ---
             if supplier_id:
@@ -209,22 +225,23 @@ class InventoryService:
             # ==============================================================================
             je_ref = db.collection("journal_entries").document()
             je_id = je_ref.id
+            levels = get_stock_level_service(items_data_map[unique_item_ids[0]].get("company_id"))
             
-            total_revenue = Decimal("0")
-            total_cogs = Decimal("0")
+            total_revenue = Money()
+            total_cogs = Money()
             lines_data = []
             
             temp_items_state = {k: v.copy() for k, v in items_data_map.items()}
             stock_moves_to_write = []
 
             for line in data.lines:
-                qty = Decimal(str(line.quantity)) # Positive for logic, negative for update
+                qty = Quantity.parse(line.quantity) # Positive for logic, negative for update
                 item_id = line.item_id
                 
-                current_qty = Decimal(temp_items_state[item_id].get("current_qty", "0"))
-                current_val = Decimal(temp_items_state[item_id].get("total_value", "0"))
+                current_qty = Quantity.read(temp_items_state[item_id], "current_qty")
+                current_val = Money.read(temp_items_state[item_id], "total_value")
                 # Use current WAC for COGS
-                wac = Decimal(temp_items_state[item_id].get("current_wac", "0"))
+                wac = Rate.read(temp_items_state[item_id], "current_wac")
                 
                 # Check negative stock? (Optional, skipping for now to allow overdrafts if needed, or fail)
                 if current_qty < qty:
@@ -233,11 +250,14 @@ class InventoryService:
 
                 new_qty = current_qty - qty
                 # OUT means value decreases by (qty * WAC)
-                new_val = current_val - (qty * wac)
+                line_cogs = value_of(qty, wac)
+                new_val = current_val - line_cogs
                 
                 # WAC does NOT change on OUT, filters only updates keys
-                temp_items_state[item_id]["current_qty"] = str(new_qty)
-                temp_items_state[item_id]["total_value"] = str(new_val)
+                temp_items_state[item_id].update({
+                    **new_qty.fields("current_qty"),
+                    **new_val.fields("total_value"),
+                })
                 
                 # Ledger
                 ledger_entry = {
@@ -250,12 +270,12 @@ class InventoryService:
                     "source_document_id": je_id,
                     "source_document_type": "DO",
                     "description": f"Sale Out: {line.quantity}",
+                    "batch_number": line.batch_number,
                     "company_id": items_data_map[item_id].get("company_id")
                 }
                 stock_moves_to_write.append({"ledger": ledger_entry})
                 
                 # Accounting
-                line_cogs = qty * wac
                 total_cogs += line_cogs
                 
                 # Simplified Revenue: Cost + 30% margin override
@@ -264,7 +284,7 @@ class InventoryService:
                 # For now using logic: Input doesn't have price? check schema.
                 # Schema DeliveryNoteLine only has quantity. 
                 # We'll use WAC * 1.5 as default price if not provided.
-                line_revenue = line_cogs * Decimal("1.5") 
+                line_revenue = Money.parse(line_cogs.to_decimal() * Decimal("1.5"))
                 total_revenue += line_revenue
                 
                 # COGS / Inventory Lines
@@ -308,28 +328,38 @@ class InventoryService:
             for item_id, stats in temp_items_state.items():
                 ref = db.collection("items").document(item_id)
                 # Ensure we only update what changed
-                transaction.update(ref, {
+                transaction.update(ref, with_units({
                     "current_qty": stats["current_qty"],
                     "total_value": stats["total_value"]
-                })
+                }, ITEM_AMOUNTS))
             
-            # 2. Ledger
+            # 2. Ledger (and per-warehouse levels)
+            level_deltas = {}
             for move in stock_moves_to_write:
                 led_ref = db.collection("stock_ledger").document()
                 transaction.set(led_ref, move["ledger"])
+                ledger = move["ledger"]
+                levels.add(
+                    level_deltas,
+                    levels.key(ledger["item_id"], ledger["warehouse_id"], ledger.get("batch_number")),
+                    Decimal(ledger["quantity"]),
+                )
+            levels.apply(transaction, level_deltas)
                 
             # 3. Journal
-            transaction.set(je_ref, {
+            je_data = {
                 "number": f"JE-DO-{data.number}",
                 "date": firestore.SERVER_TIMESTAMP,
                 "description": f"Automated Journal for DO {data.number}",
                 "status": "DRAFT",
                 "source_document_type": "DO",
-                "lines": lines_data
-            })
+                "lines": lines_data,
+                "company_id": items_data_map[unique_item_ids[0]].get("company_id"),
+            }
+            transaction.set(je_ref, je_data)
 
             # 4. Post
-            posting_engine.post_journal_entry(transaction, je_id, lines_data, accounts_data)
+            posting_engine.post_journal_entry(transaction, je_id, lines_data, accounts_data, entry=je_data)
             
             return je_id
 
@@ -359,7 +389,7 @@ class InventoryService:
                 )
                 # 2. IN to target
                 posting_engine.record_stock_movement(
-                    transaction, item_id, data.to_warehouse_id, qty, Decimal(item_data["current_wac"]), 
+                    transaction, item_id, data.to_warehouse_id, qty, Rate.read(item_data, "current_wac").to_decimal(), 
                     doc_id, "TRF", item_data, 
                     batch_number=line.batch_number, 
                     customer_id=data.customer_id
@@ -385,7 +415,7 @@ class InventoryService:
                 
                 # Record movement
                 posting_engine.record_stock_movement(
-                    transaction, item_id, data.warehouse_id, qty, Decimal(item_data["current_wac"]),
+                    transaction, item_id, data.warehouse_id, qty, Rate.read(item_data, "current_wac").to_decimal(),
                     doc_id, "ADJ", item_data, 
                     batch_number=line.batch_number, 
                     customer_id=data.customer_id
@@ -5,7 +5,9 @@ from app.core.firebase import get_db
 from app.schemas.invoices import InvoiceCreate, InvoiceUpdate, InvoiceStatus, Invoice
 from app.schemas.accounting import JournalEntryCreate, JournalLineBase
 from app.services.accounting import AccountingService
+from app.services.chart_of_accounts import resolve_account_id
 from app.services.posting import PostingEngine
+from app.services.numbering import get_numbering_service
 from decimal import Decimal
 
 
@@ -16,25 +18,8 @@ class InvoiceService:
         self.posting_engine = PostingEngine()
 
     def _next_invoice_number(self, company_id: str) -> str:
-        """Generate INV-YYYY-NNNNNN using a Firestore counter."""
-        year = datetime.now().strftime("%Y")
-        counter_ref = self.db.collection("counters").document(f"invoices_{company_id}_{year}")
-        
-        transaction = self.db.transaction()
-        
-        @firestore.transactional
-        def increment(transaction):
-            snapshot = counter_ref.get(transaction=transaction)
-            if snapshot.exists:
-                current = snapshot.to_dict().get("value", 0)
-            else:
-                current = 0
-            new_val = current + 1
-            transaction.set(counter_ref, {"value": new_val})
-            return new_val
-        
-        seq = increment(transaction)
-        return f"INV-{year}-{seq:06d}"
+        """Generate INV-YYYY-NNNNNN from the shared sequence service."""
+        return get_numbering_service(company_id).get_next_number("invoice")
 
     def create_invoice(self, data: InvoiceCreate, user: dict) -> str:
         """Create a new invoice in DRAFT status."""
@@ -144,7 +129,12 @@ class InvoiceService:
     def mark_issued(self, invoice_id: str, user: dict) -> dict:
         """Transition DRAFT -> ISSUED. Lock editing and Post to Ledger."""
         doc_ref = self.collection.document(invoice_id)
-        
+        company_id = user.get("company_id")
+
+        # Default AR / revenue accounts, resolved from the cached chart
+        default_ar_id = resolve_account_id(company_id, "122", "122")
+        default_revenue_id = resolve_account_id(company_id, "41", "41")
+
         transaction = self.db.transaction()
 
         @firestore.transactional
@@ -154,11 +144,12 @@ class InvoiceService:
                 raise ValueError("Invoice not found")
             
             data = doc.to_dict()
+            if data.get("company_id") != company_id:
+                raise ValueError("Invoice not found")
             if data["status"] != InvoiceStatus.DRAFT:
                 raise ValueError("Only DRAFT invoices can be issued")
 
-            company_id = data["company_id"]
-            
+
             # 1. Look up Customer AR Account
             customer_ref = self.db.collection("customers").document(data["customer_id"])
             customer_snap = customer_ref.get(transaction=transaction)
@@ -168,18 +159,7 @@ class InvoiceService:
             customer_data = customer_snap.to_dict()
             
             # Dynamic Resolve Account IDs
-            ar_account_id = customer_data.get("ar_account_id")
-            if not ar_account_id:
-                # Resolve code "122" within transaction
-                ar_query = self.db.collection("accounts")\
-                    .where("company_id", "==", company_id)\
-                    .where("code", "==", "122")\
-                    .limit(1)
-                ar_snaps = ar_query.get(transaction=transaction)
-                if ar_snaps:
-                    ar_account_id = ar_snaps[0].id
-                else:
-                    ar_account_id = "122" # Final fallback
+            ar_account_id = customer_data.get("ar_account_id") or default_ar_id
 
             # 2. Prepare Journal Lines
             # Dr Receivable (AR)
@@ -195,18 +175,7 @@ class InvoiceService:
             
             # Collect revenue lines per item or grouped
             # For now, we'll use a single Revenue line for simplicity or one per item
-            revenue_account_id = data.get("revenue_account_id")
-            if not revenue_account_id:
-                # Resolve code "41" within transaction
-                rev_query = self.db.collection("accounts")\
-                    .where("company_id", "==", company_id)\
-                    .where("code", "==", "41")\
-                    .limit(1)
-                rev_snaps = rev_query.get(transaction=transaction)
-                if rev_snaps:
-                    revenue_account_id = rev_snaps[0].id
-                else:
-                    revenue_account_id = "41"
+            revenue_account_id = data.get("revenue_account_id") or default_revenue_id
             
             # If items have specific revenue accounts, we should use them
             # Checking if lines have product info
@@ -223,7 +192,7 @@ class InvoiceService:
             je_ref = self.db.collection("journal_entries").document()
             je_lines_dict = [line.model_dump() for line in lines]
             
-            transaction.set(je_ref, {
+            je_data = {
                 "number": f"JE-INV-{data['invoice_number']}",
                 "date": firestore.SERVER_TIMESTAMP,
                 "description": f"Invoice {data['invoice_number']} to {data['customer_name']}",
@@ -232,7 +201,8 @@ class InvoiceService:
                 "company_id": company_id,
                 "source_doc_id": invoice_id,
                 "source_doc_type": "INV"
-            })
+            }
+            transaction.set(je_ref, je_data)
 
             # 4. Post using Engine
             # Pre-fetch accounts for atomic balance updates
@@ -240,7 +210,7 @@ class InvoiceService:
             account_ids = list(set(line["account_id"] for line in je_lines_dict))
             accounts_data = self.posting_engine.get_accounts_for_transaction(transaction, account_ids)
             
-            self.posting_engine.post_journal_entry(transaction, je_ref.id, je_lines_dict, accounts_data)
+            self.posting_engine.post_journal_entry(transaction, je_ref.id, je_lines_dict, accounts_data, entry=je_data)
 
             # 5. Lock Invoice
             update_data = {
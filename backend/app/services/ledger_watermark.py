@@ -0,0 +1,89 @@
+"""
+Ledger Watermark
+Per-company version of the posted ledger, used to key cached reports.
+
+Every posting Increments ``version`` and its accounts' entries in
+``accounts`` on one random shard document of its company (one write, no
+read, so the watermark is never a hot document). Rebuilds of the derived
+collections Increment ``epoch``. Reading the watermark sums the shards:
+the totals only ever grow, so a report cached under one token is served
+only while nothing it depends on has been posted since.
+
+Shards are ``{company_id}_{n}`` documents in ``ledger_watermarks``; never
+lower LEDGER_WATERMARK_SHARDS (increments on dropped shards would be lost).
+"""
+import random
+from typing import Any, Dict, Iterable, Optional
+from google.cloud import firestore
+from app.core.config import settings
+from app.core.firebase import get_db
+
+
+class LedgerWatermarkService:
+    """Bumps and reads the sharded ledger watermark of one company."""
+
+    COLLECTION = "ledger_watermarks"
+
+    def __init__(self, company_id: Optional[str] = "default", shards: Optional[int] = None):
+        self.db = get_db()
+        self.company_id = company_id
+        self.shards = max(1, shards or settings.LEDGER_WATERMARK_SHARDS)
+
+    def _ref(self, company_id: str, shard: int):
+        return self.db.collection(self.COLLECTION).document(f"{company_id}_{shard}")
+
+    def bump(self, writer, company_id: Optional[str], account_ids: Iterable[str]):
+        """Record a posting to ``account_ids`` inside ``writer`` (one write)."""
+        company_id = company_id or self.company_id
+        if not company_id:
+            return
+        writer.set(
+            self._ref(company_id, random.randrange(self.shards)),
+            {
+                "company_id": company_id,
+                "version": firestore.Increment(1),
+                "accounts": {account_id: firestore.Increment(1) for account_id in account_ids},
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            },
+            merge=True,
+        )
+
+    def bump_epoch(self):
+        """Invalidate every cached report of the company (after a rebuild)."""
+        self._ref(self.company_id, 0).set(
+            {
+                "company_id": self.company_id,
+                "epoch": firestore.Increment(1),
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            },
+            merge=True,
+        )
+
+    def read(self) -> Dict[str, Any]:
+        """Summed watermark: {"epoch", "version", "accounts": {account_id: version}}."""
+        refs = [self._ref(self.company_id, shard) for shard in range(self.shards)]
+        watermark: Dict[str, Any] = {"epoch": 0, "version": 0, "accounts": {}}
+        for snap in self.db.get_all(refs):
+            data = snap.to_dict() if snap.exists else None
+            if not data:
+                continue
+            watermark["epoch"] += int(data.get("epoch") or 0)
+            watermark["version"] += int(data.get("version") or 0)
+            for account_id, version in (data.get("accounts") or {}).items():
+                watermark["accounts"][account_id] = watermark["accounts"].get(account_id, 0) + int(version or 0)
+        return watermark
+
+    def token(self, account_id: Optional[str] = None) -> str:
+        """
+        Cache token: the company's version, or only ``account_id``'s version
+        for reports that read a single account.
+        """
+        watermark = self.read()
+        if account_id:
+            return f"{watermark['epoch']}:{account_id}:{watermark['accounts'].get(account_id, 0)}"
+        return f"{watermark['epoch']}:{watermark['version']}"
+
+
+def get_ledger_watermark_service(company_id: Optional[str] = "default") -> LedgerWatermarkService:
+    """Factory function to get a ledger watermark service instance."""
+    return LedgerWatermarkService(company_id=company_id)
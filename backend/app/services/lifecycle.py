@@ -9,6 +9,7 @@ from google.cloud import firestore
 from app.core.firebase import get_db
 from app.core.audit import get_audit_logger
 from app.models.core import DocumentStatus
+from app.services.posting import PostingEngine
 
 class LifecycleService:
     """Manages document lifecycle and reversal logic."""
@@ -18,10 +19,13 @@ class LifecycleService:
         self.audit = get_audit_logger(user_id, company_id)
         self.user_id = user_id
         self.company_id = company_id
+        self.posting_engine = PostingEngine()
     
     def void_journal_entry(self, je_id: str, reason: str = "") -> str:
         """
         Void a posted journal entry by creating a reversal entry.
+        The reversal is posted like any entry: account balances and the
+        account_ledger take the swapped lines.
         
         Args:
             je_id: Journal Entry ID to void
@@ -57,6 +61,10 @@ class LifecycleService:
                     "description": f"Reversal: {line.get('description', '')}"
                 })
             
+            # Pre-fetch accounts before any write
+            account_ids = list({line["account_id"] for line in reversal_lines if line.get("account_id")})
+            accounts_data = self.posting_engine.get_accounts_for_transaction(transaction, account_ids)
+
             reversal_ref = db.collection("journal_entries").document()
             reversal_data = {
                 "number": f"REV-{je_data.get('number', je_id)}",
@@ -69,8 +77,11 @@ class LifecycleService:
                 "company_id": self.company_id
             }
             
-            # 4. Write reversal
+            # 4. Write and post reversal
             transaction.set(reversal_ref, reversal_data)
+            self.posting_engine.post_journal_entry(
+                transaction, reversal_ref.id, reversal_lines, accounts_data, entry=reversal_data
+            )
             
             # 5. Mark original as VOIDED (not deleted)
             transaction.update(je_ref, {
@@ -1,85 +1,240 @@
 """
 Document Numbering Service
 Generates sequential document numbers: JE-2026-000001
+
+Numbers are handed out from blocks reserved per process on the sequence
+document, so concurrent creators do not serialize on one counter. Sequences
+configured as gapless (fiscal documents) are claimed one number at a time,
+ideally inside the transaction that creates the document.
 """
+import threading
 from datetime import datetime
+from typing import Any, Dict, List, Optional
 from google.cloud import firestore
+from app.core.config import settings
 from app.core.firebase import get_db
 
+
 class NumberingService:
     """Generates unique, sequential document numbers."""
-    
+
     COLLECTION = "sequences"
-    
+
     # Document type prefixes
     PREFIXES = {
         "journal_entry": "JE",
         "grn": "GRN",
         "delivery_note": "DO",
         "invoice": "INV",
+        "sales_invoice": "INV",
         "payment": "PAY",
-        "receipt": "RCV"
+        "receipt": "RCV",
+        "expense": "EXP",
+        "credit_note": "CN",
+    }
+
+    # Sequences that run across years keep their historical number format.
+    YEARLESS = {"sales_invoice"}
+    FORMATS = {
+        "sales_invoice": "{prefix}-{number:05d}",
     }
-    
-    def __init__(self, company_id: str = "default"):
+    DEFAULT_FORMAT = "{prefix}-{year}-{number:06d}"
+
+    # Counters used before this service existed: (document id template, field).
+    # A sequence starting fresh continues from its legacy counter.
+    LEGACY_COUNTERS = {
+        "sales_invoice": ("invoice_{company_id}", "count"),
+        "invoice": ("invoices_{company_id}_{year}", "value"),
+        "expense": ("expenses_{company_id}_{year}", "value"),
+        "credit_note": ("credit_notes_{company_id}_{year}", "value"),
+    }
+    LEGACY_COLLECTION = "counters"
+
+    # Reserved blocks shared by every service instance in this process:
+    # sequence key -> [next number, last number in block]
+    _blocks: Dict[str, List[int]] = {}
+    _locks: Dict[str, threading.Lock] = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, company_id: str = "default", block_size: Optional[int] = None):
         self.db = get_db()
         self.company_id = company_id
-    
+        self.block_size = block_size or settings.SEQUENCE_BLOCK_SIZE
+        self.gapless_types = {
+            doc_type.strip()
+            for doc_type in settings.GAPLESS_SEQUENCES.split(",")
+            if doc_type.strip()
+        }
+
+    # ------------------------------------------------------------------
+    # Keys and formatting
+    # ------------------------------------------------------------------
+    def _resolve_year(self, doc_type: str, year: Optional[int]) -> Optional[int]:
+        if doc_type in self.YEARLESS:
+            return None
+        return year if year is not None else datetime.now().year
+
+    def _sequence_key(self, doc_type: str, year: Optional[int]) -> str:
+        if year is None:
+            return f"{self.company_id}_{doc_type}"
+        return f"{self.company_id}_{doc_type}_{year}"
+
+    def _sequence_ref(self, doc_type: str, year: Optional[int]):
+        return self.db.collection(self.COLLECTION).document(self._sequence_key(doc_type, year))
+
+    def _legacy_ref(self, doc_type: str, year: Optional[int]):
+        legacy = self.LEGACY_COUNTERS.get(doc_type)
+        if not legacy:
+            return None
+        doc_id = legacy[0].format(company_id=self.company_id, year=year)
+        return self.db.collection(self.LEGACY_COLLECTION).document(doc_id)
+
+    def format_number(self, doc_type: str, number: int, year: Optional[int] = None) -> str:
+        prefix = self.PREFIXES.get(doc_type, doc_type.upper()[:3])
+        template = self.FORMATS.get(doc_type, self.DEFAULT_FORMAT)
+        return template.format(prefix=prefix, year=year, number=number)
+
+    def is_gapless(self, doc_type: str) -> bool:
+        return doc_type in self.gapless_types
+
+    def _current_from(self, doc_type: str, seq_snap, legacy_snap) -> int:
+        if seq_snap is not None and seq_snap.exists:
+            return seq_snap.to_dict().get("current", 0)
+        if legacy_snap is not None and legacy_snap.exists:
+            return legacy_snap.to_dict().get(self.LEGACY_COUNTERS[doc_type][1], 0)
+        return 0
+
+    def _sequence_fields(self, doc_type: str, year: Optional[int], current: int) -> Dict[str, Any]:
+        return {
+            "current": current,
+            "doc_type": doc_type,
+            "year": year,
+            "company_id": self.company_id,
+            "last_updated": firestore.SERVER_TIMESTAMP,
+        }
+
+    # ------------------------------------------------------------------
+    # Allocation
+    # ------------------------------------------------------------------
+    def _reserve(self, doc_type: str, year: Optional[int], count: int) -> int:
+        """Advance the sequence document by ``count``; returns the first number reserved."""
+        seq_ref = self._sequence_ref(doc_type, year)
+        legacy_ref = self._legacy_ref(doc_type, year)
+
+        @firestore.transactional
+        def _get_next(transaction):
+            refs = [seq_ref] + ([legacy_ref] if legacy_ref is not None else [])
+            snaps = {snap.reference.path: snap for snap in self.db.get_all(refs, transaction=transaction)}
+            current = self._current_from(
+                doc_type,
+                snaps.get(seq_ref.path),
+                snaps.get(legacy_ref.path) if legacy_ref is not None else None,
+            )
+            transaction.set(seq_ref, self._sequence_fields(doc_type, year, current + count))
+            return current + 1
+
+        return _get_next(self.db.transaction())
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        with self._locks_guard:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def next_value(self, doc_type: str, year: Optional[int] = None) -> int:
+        """Next sequence value (integer) for a document type."""
+        year = self._resolve_year(doc_type, year)
+        if self.is_gapless(doc_type):
+            return self._reserve(doc_type, year, 1)
+
+        key = self._sequence_key(doc_type, year)
+        with self._lock_for(key):
+            block = self._blocks.get(key)
+            if block is None or block[0] > block[1]:
+                first = self._reserve(doc_type, year, self.block_size)
+                block = [first, first + self.block_size - 1]
+                self._blocks[key] = block
+            value = block[0]
+            block[0] += 1
+            return value
+
     def get_next_number(self, doc_type: str, year: int = None) -> str:
         """
         Get the next sequential number for a document type.
-        
+
+        Block-allocated sequences are unique and increasing within a process,
+        but numbers left in a block when a process exits are skipped. A
+        gapless sequence drawn here is claimed in a transaction of its own,
+        so a document that then fails to commit leaves a hole; creators of
+        gapless documents use ``transaction_refs`` and ``claim`` instead.
+
         Args:
             doc_type: Type of document (e.g., 'journal_entry', 'grn')
             year: Fiscal year (defaults to current year)
-        
+
         Returns:
             Formatted document number (e.g., 'JE-2026-000001')
         """
-        if year is None:
-            year = datetime.now().year
-        
-        prefix = self.PREFIXES.get(doc_type, doc_type.upper()[:3])
-        sequence_key = f"{self.company_id}_{doc_type}_{year}"
-        
-        # Use Firestore transaction for atomic increment
-        transaction = self.db.transaction()
-        
-        @firestore.transactional
-        def _get_next(transaction, db):
-            seq_ref = db.collection(self.COLLECTION).document(sequence_key)
-            seq_doc = seq_ref.get(transaction=transaction)
-            
-            if seq_doc.exists:
-                current = seq_doc.to_dict().get("current", 0)
-            else:
-                current = 0
-            
-            next_num = current + 1
-            
-            transaction.set(seq_ref, {
-                "current": next_num,
-                "doc_type": doc_type,
-                "year": year,
-                "company_id": self.company_id,
-                "last_updated": firestore.SERVER_TIMESTAMP
-            })
-            
-            return next_num
-        
-        next_num = _get_next(transaction, self.db)
-        
-        # Format: PREFIX-YEAR-NNNNNN
-        return f"{prefix}-{year}-{next_num:06d}"
-    
+        year = self._resolve_year(doc_type, year)
+        return self.format_number(doc_type, self.next_value(doc_type, year), year)
+
+    # ------------------------------------------------------------------
+    # Gapless numbering inside a caller's transaction
+    # ------------------------------------------------------------------
+    def transaction_refs(self, doc_type: str, year: Optional[int] = None) -> List[Any]:
+        """Documents to include in the caller's transactional reads before ``claim``."""
+        year = self._resolve_year(doc_type, year)
+        legacy_ref = self._legacy_ref(doc_type, year)
+        return [self._sequence_ref(doc_type, year)] + ([legacy_ref] if legacy_ref is not None else [])
+
+    def claim(
+        self,
+        transaction,
+        doc_type: str,
+        snapshots: Dict[str, Any],
+        year: Optional[int] = None,
+    ) -> str:
+        """
+        Take the next number within the caller's transaction.
+
+        ``snapshots`` maps document path to the snapshots read for
+        ``transaction_refs``. The number commits or rolls back with the
+        document it is assigned to, so no gaps are left.
+        """
+        return self.claim_many(transaction, doc_type, snapshots, 1, year)[0]
+
+    def claim_many(
+        self,
+        transaction,
+        doc_type: str,
+        snapshots: Dict[str, Any],
+        count: int,
+        year: Optional[int] = None,
+    ) -> List[str]:
+        """``claim`` for ``count`` documents created in the same transaction."""
+        year = self._resolve_year(doc_type, year)
+        if count <= 0:
+            return []
+        seq_ref = self._sequence_ref(doc_type, year)
+        legacy_ref = self._legacy_ref(doc_type, year)
+        current = self._current_from(
+            doc_type,
+            snapshots.get(seq_ref.path),
+            snapshots.get(legacy_ref.path) if legacy_ref is not None else None,
+        )
+        transaction.set(seq_ref, self._sequence_fields(doc_type, year, current + count))
+        return [self.format_number(doc_type, current + n, year) for n in range(1, count + 1)]
+
     def get_current_number(self, doc_type: str, year: int = None) -> int:
-        """Get the current sequence number without incrementing."""
-        if year is None:
-            year = datetime.now().year
-        
-        sequence_key = f"{self.company_id}_{doc_type}_{year}"
-        seq_doc = self.db.collection(self.COLLECTION).document(sequence_key).get()
-        
+        """
+        Get the current sequence number without incrementing.
+
+        For block-allocated sequences this is the end of the highest block
+        reserved by any process, not the last number assigned.
+        """
+        year = self._resolve_year(doc_type, year)
+        seq_doc = self._sequence_ref(doc_type, year).get()
+
         if seq_doc.exists:
             return seq_doc.to_dict().get("current", 0)
         return 0
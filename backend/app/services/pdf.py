@@ -5,69 +5,111 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from io import BytesIO
 from datetime import datetime
+from typing import Optional
+from xml.sax.saxutils import escape
+
+# Styles are built once per process; ReportLab only reads them while rendering.
+_STYLES = getSampleStyleSheet()
+
+_TITLE_STYLE = ParagraphStyle(
+    'Title',
+    parent=_STYLES['Heading1'],
+    fontSize=24,
+    textColor=colors.HexColor("#2563eb"),
+    spaceAfter=12
+)
+
+_HEADER_STYLE = ParagraphStyle(
+    'Header',
+    parent=_STYLES['Normal'],
+    fontSize=10,
+    textColor=colors.gray
+)
+
+_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#f1f5f9")),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor("#1e293b")),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('ALIGN', (0, 0), (0, -1), 'LEFT'), # Align items left
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 12),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor("#f8fafc")), # Footer background
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('GRID', (0, 0), (-1, -2), 1, colors.HexColor("#e2e8f0")),
+    ('LINEBELOW', (0, -1), (-1, -1), 2, colors.HexColor("#2563eb")),
+])
+
+_COL_WIDTHS = [3 * inch, 1 * inch, 1.5 * inch, 1.5 * inch]
+
 
 class PDFService:
-    def generate_invoice(self, data: dict, type: str = "INVOICE") -> bytes:
+    def generate_invoice(self, data: dict, type: str = "INVOICE", branding: Optional[dict] = None) -> bytes:
+        # Branding is free text from the company profile; Paragraph parses markup.
+        branding = {k: escape(str(v)) for k, v in (branding or {}).items() if v}
         buffer = BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=A4)
         elements = []
-        styles = getSampleStyleSheet()
-
-        # Define custom styles
-        title_style = ParagraphStyle(
-            'Title',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor("#2563eb"),
-            spaceAfter=12
-        )
-        
-        header_style = ParagraphStyle(
-            'Header',
-            parent=styles['Normal'],
-            fontSize=10,
-            textColor=colors.gray
-        )
 
         # --- Header Section ---
-        elements.append(Paragraph(f"OpenGate ERP - {type}", title_style))
-        elements.append(Paragraph(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", header_style))
-        elements.append(Paragraph(f"Reference: {data.get('id', 'N/A')}", header_style))
-        
+        company_name = branding.get("company_name") or "OpenGate ERP"
+        elements.append(Paragraph(f"{company_name} - {type}", _TITLE_STYLE))
+        for key in ("location", "phone", "email"):
+            if branding.get(key):
+                elements.append(Paragraph(branding[key], _HEADER_STYLE))
+        # The document's own date keeps output stable, so rendered PDFs can be cached.
+        issued = data.get("issue_date") or data.get("date")
+        if hasattr(issued, "strftime"):
+            issued = issued.strftime('%Y-%m-%d')
+        elif issued:
+            issued = str(issued)[:10]
+        elements.append(Paragraph(f"Date: {issued or datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", _HEADER_STYLE))
+        reference = (
+            data.get('invoice_number') or data.get('bill_number') or data.get('voucher_number')
+            or data.get('receipt_number') or data.get('number') or data.get('id', 'N/A')
+        )
+        elements.append(Paragraph(f"Reference: {reference}", _HEADER_STYLE))
+
         # Support both 'customer' and 'customer_name'
         customer = data.get("customer") or data.get("customer_name")
         if customer:
-            elements.append(Paragraph(f"Customer: {customer}", header_style))
-            
+            elements.append(Paragraph(f"Customer: {customer}", _HEADER_STYLE))
+
         # Support both 'vendor' and 'supplier_name'
-        vendor = data.get("vendor") or data.get("supplier_name")
+        vendor = data.get("vendor") or data.get("supplier_name") or data.get("payee")
         if vendor:
-             elements.append(Paragraph(f"Vendor: {vendor}", header_style))
-        
+             elements.append(Paragraph(f"Vendor: {vendor}", _HEADER_STYLE))
+
         elements.append(Spacer(1, 0.5 * inch))
 
         # --- Items Table ---
         # Table Header
         table_data = [['Item', 'Qty', 'Price', 'Total']]
-        
+
         # Table Rows
         total_amount = 0
         # Support both 'items' and 'lines'
         items = data.get('items') or data.get('lines', [])
-        
+        # Vouchers carry a single amount rather than lines
+        if not items and data.get('amount') is not None:
+            items = [{'name': data.get('description') or type.title(), 'quantity': 1, 'price': data['amount']}]
+
         for item in items:
             # Handle different field names for qty and price
             try:
                 raw_qty = item.get('quantity') or item.get('qty', 0)
-                raw_price = item.get('unit_price') or item.get('price', 0)
+                raw_price = item.get('unit_price') or item.get('price') or item.get('unit_cost', 0)
                 qty = float(raw_qty)
                 price = float(raw_price)
                 total = qty * price
                 total_amount += total
-                
+
                 # Handle different field names for item name
-                name = item.get('item_name') or item.get('name', 'Unknown Item')
-                
+                name = (
+                    item.get('item_name') or item.get('product_name') or item.get('description')
+                    or item.get('name', 'Unknown Item')
+                )
+
                 table_data.append([
                     name,
                     f"{qty:,.2f}",
@@ -76,39 +118,35 @@ class PDFService:
                 ])
             except (ValueError, TypeError):
                 continue
-            
+
         # Total Row
         table_data.append(['', '', 'Grand Total:', f"${total_amount:,.2f}"])
 
         # Create Table
-        table = Table(table_data, colWidths=[3 * inch, 1 * inch, 1.5 * inch, 1.5 * inch])
-        
-        # Style Table
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#f1f5f9")),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor("#1e293b")),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('ALIGN', (0, 0), (0, -1), 'LEFT'), # Align items left
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor("#f8fafc")), # Footer background
-            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-            ('GRID', (0, 0), (-1, -2), 1, colors.HexColor("#e2e8f0")),
-            ('LINEBELOW', (0, -1), (-1, -1), 2, colors.HexColor("#2563eb")),
-        ]))
+        table = Table(table_data, colWidths=_COL_WIDTHS)
+        table.setStyle(_TABLE_STYLE)
 
         elements.append(table)
         elements.append(Spacer(1, 0.5 * inch))
 
         # --- Footer / Signature Section ---
-        elements.append(Paragraph("Authorized Signature:", styles['Heading4']))
+        elements.append(Paragraph("Authorized Signature:", _STYLES['Heading4']))
         elements.append(Spacer(1, 0.3 * inch))
-        elements.append(Paragraph("___________________________", styles['Normal']))
-        elements.append(Paragraph(f"Generated by: {data.get('created_by_email', 'Admin')}", styles['Normal']))
-        elements.append(Paragraph("OpenGate ERP System", styles['Italic']))
+        elements.append(Paragraph("___________________________", _STYLES['Normal']))
+        elements.append(Paragraph(f"Generated by: {data.get('created_by_email', 'Admin')}", _STYLES['Normal']))
+        if branding.get("invoice_note"):
+            elements.append(Paragraph(branding["invoice_note"], _STYLES['Normal']))
+        if branding.get("payment_details"):
+            elements.append(Paragraph(branding["payment_details"], _STYLES['Normal']))
+        elements.append(Paragraph(f"{company_name}", _STYLES['Italic']))
 
         # Build PDF
         doc.build(elements)
         buffer.seek(0)
         return buffer.getvalue()
+
+
+def render_document(job: tuple) -> bytes:
+    """Process-pool entry point: ``job`` is (data, type, branding)."""
+    data, doc_type, branding = job
+    return PDFService().generate_invoice(data, type=doc_type, branding=branding)
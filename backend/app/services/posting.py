@@ -1,53 +1,100 @@
 from decimal import Decimal
 from typing import Optional, Dict, Any
 from google.cloud import firestore
+from app.core.config import settings
 from app.core.firebase import get_db
+from app.core.money import Money, Quantity, Rate, rate_of, value_of
 from app.models.core import JournalEntry, DocumentStatus
+from app.services.account_ledger import get_account_ledger_service
+from app.services.gl_balances import get_gl_balance_service
+from app.services.gl_cube import get_gl_cube_service, period_key
+from app.services.gl_outbox import account_totals, get_gl_outbox_service
+from app.services.gl_snapshots import day_key, get_gl_snapshot_service
+from app.services.ledger_watermark import get_ledger_watermark_service
+from app.services.stock_levels import get_stock_level_service
 
 class PostingEngine:
     def __init__(self):
         self.db = get_db()
+        self.gl_balances = get_gl_balance_service()
+        self.ledger = get_account_ledger_service(None)
+        self.snapshots = get_gl_snapshot_service(None)
+        self.cube = get_gl_cube_service(None)
+        self.watermark = get_ledger_watermark_service(None)
+        # Outbox mode: balances are applied later by the GL outbox poster
+        self.outbox_mode = settings.GL_POSTING_MODE == "outbox"
+        self.outbox = get_gl_outbox_service() if self.outbox_mode else None
 
     def get_accounts_for_transaction(self, transaction, account_ids: list[str]) -> Dict[str, Dict[str, Any]]:
-        """Pre-fetches accounts for a transaction to avoid Read-after-Write violations."""
+        """Pre-fetches accounts for a transaction to avoid Read-after-Write violations.
+        In outbox mode nothing is read: postings don't touch account documents.
+        """
         if not account_ids:
             return {}
         unique_ids = list(set(account_ids))
+        if self.outbox_mode:
+            return {aid: {} for aid in unique_ids}
         refs = [self.db.collection("accounts").document(aid) for aid in unique_ids]
         snapshots = self.db.get_all(refs, transaction=transaction)
         return {snap.id: snap.to_dict() or {} for snap in snapshots}
 
-    def post_journal_entry(self, transaction, entry_id: str, lines_data: list = None, accounts_data: Dict[str, Any] = None):
-        """Finalizes a journal entry using Firestore Transaction."""
+    def post_journal_entry(
+        self,
+        transaction,
+        entry_id: str,
+        lines_data: list = None,
+        accounts_data: Dict[str, Any] = None,
+        entry: Optional[Dict[str, Any]] = None,
+    ):
+        """Finalizes a journal entry using Firestore Transaction.
+        ``entry`` is the journal entry header as written (date, number,
+        description, company_id) for the account_ledger rows.
+        """
         entry_ref = self.db.collection("journal_entries").document(entry_id)
         
-        # Validate balance
+        # Validate balance (to the last stored digit)
         if lines_data:
-            total_debit = Decimal("0")
-            total_credit = Decimal("0")
+            total_debit = Money()
+            total_credit = Money()
             for line in lines_data:
-                total_debit += Decimal(str(line.get("debit", "0")))
-                total_credit += Decimal(str(line.get("credit", "0")))
-            if abs(total_debit - total_credit) > Decimal("0.0001"):
+                total_debit += Money.parse(line.get("debit", "0"))
+                total_credit += Money.parse(line.get("credit", "0"))
+            if abs(total_debit - total_credit) > Money(1):
                 raise ValueError(f"Journal does not balance: D:{total_debit} C:{total_credit}")
 
         # Update status
         transaction.update(entry_ref, {"status": "POSTED"})
 
-        # Update Account Balances (Read-Modify-Write for String Fields)
+        # Update Account Balances, one write per account however many lines
+        # hit it (Read-Modify-Write for String Fields, Increment on one shard
+        # for sharded hot accounts, or one outbox entry in outbox mode)
         if lines_data and accounts_data:
-            for line in lines_data:
-                acc_id = line.get("account_id")
-                if not acc_id or acc_id not in accounts_data: continue
-                
-                debit = Decimal(str(line.get("debit", "0")))
-                credit = Decimal(str(line.get("credit", "0")))
-                
-                # Get current values from pre-fetched data
+            totals = {
+                aid: amounts for aid, amounts in account_totals(lines_data).items() if aid in accounts_data
+            }
+            header = dict(entry or {})
+            if not header.get("company_id"):
+                header["company_id"] = next(
+                    (acc.get("company_id") for acc in accounts_data.values() if acc.get("company_id")), None
+                )
+            day = day_key(header.get("date"))
+            # Cached reports of these accounts are stale from this commit on
+            self.watermark.bump(transaction, header["company_id"], totals)
+            if self.outbox_mode:
+                self.outbox.enqueue(transaction, entry_id, totals, day, header["company_id"])
+                self.ledger.record(transaction, entry_id, header, lines_data, account_ids=totals)
+                return True
+
+            balances = {}
+            promote = self.gl_balances.observe({aid: accounts_data[aid] for aid in totals})
+            for acc_id, (debit, credit) in totals.items():
+                # Get current values from pre-fetched data (native integers when present)
                 current_acc = accounts_data[acc_id]
-                current_debit = Decimal(str(current_acc.get("total_debit", "0")))
-                current_credit = Decimal(str(current_acc.get("total_credit", "0")))
-                current_balance = Decimal(str(current_acc.get("balance", "0")))
+                if self.gl_balances.shard_count_of(current_acc):
+                    self.gl_balances.add(transaction, acc_id, current_acc, debit, credit)
+                    continue
+                current_debit = Money.read(current_acc, "total_debit")
+                current_credit = Money.read(current_acc, "total_credit")
                 
                 # Calculate new values
                 new_debit = current_debit + debit
@@ -56,18 +103,35 @@ class PostingEngine:
                 # BUT traditionally balance = Debit - Credit for simple storage
                 new_balance = new_debit - new_credit
                 
-                # Update in transaction
+                # Update in transaction, string and native integer side by side
+                # (promotion rides on this write; later postings use shards)
+                balance_fields = {
+                    **new_debit.fields("total_debit"),
+                    **new_credit.fields("total_credit"),
+                    **new_balance.fields("balance"),
+                }
+                acc_update = dict(balance_fields)
+                if acc_id in promote:
+                    promote.discard(acc_id)
+                    acc_update.update(self.gl_balances.promotion_fields(acc_id))
+                    current_acc["balance_shards"] = acc_update["balance_shards"]
                 acc_ref = self.db.collection("accounts").document(acc_id)
-                transaction.update(acc_ref, {
-                    "total_debit": str(new_debit),
-                    "total_credit": str(new_credit),
-                    "balance": str(new_balance)
-                })
+                transaction.update(acc_ref, acc_update)
                 
-                # Update local cache in case multiple lines touch same account
-                accounts_data[acc_id]["total_debit"] = str(new_debit)
-                accounts_data[acc_id]["total_credit"] = str(new_credit)
-                accounts_data[acc_id]["balance"] = str(new_balance)
+                # Update local cache in case later entries in this transaction touch it
+                current_acc.update(balance_fields)
+                balances[acc_id] = new_balance
+
+            # Daily bucket (as-of trial balances) and month cell (statements) per account
+            for acc_id, (debit, credit) in totals.items():
+                self.snapshots.add(
+                    transaction, header["company_id"], acc_id, accounts_data[acc_id], day, debit, credit
+                )
+                self.cube.add(
+                    transaction, header["company_id"], acc_id, accounts_data[acc_id], period_key(day), debit, credit
+                )
+
+            self.ledger.record(transaction, entry_id, header, lines_data, balances, account_ids=totals)
         
         return True
 
@@ -112,24 +176,28 @@ class PostingEngine:
             snapshot = item_ref.get(transaction=transaction)
             item_data = snapshot.to_dict() or {}
         
-        current_qty = Decimal(item_data.get("current_qty", "0"))
-        current_value = Decimal(item_data.get("total_value", "0"))
+        current_qty = Quantity.read(item_data, "current_qty")
+        current_value = Money.read(item_data, "total_value")
+        moved = Quantity.parse(quantity)
+        cost = Rate.parse(unit_cost)
         
-        new_qty = current_qty + quantity
+        new_qty = current_qty + moved
         
-        if quantity > 0: # IN
-            new_value = current_value + (quantity * unit_cost)
-            new_valuation_rate = new_value / new_qty if new_qty != 0 else unit_cost
+        if moved.units > 0: # IN
+            new_value = current_value + value_of(moved, cost)
+            new_valuation_rate = rate_of(new_value, new_qty) if new_qty else cost
         else: # OUT
-            new_valuation_rate = Decimal(item_data.get("current_wac", str(unit_cost)))
-            new_value = current_value + (quantity * new_valuation_rate) # quantity is negative
+            has_wac = "current_wac" in item_data or "current_wac_units" in item_data
+            new_valuation_rate = Rate.read(item_data, "current_wac") if has_wac else cost
+            new_value = current_value + value_of(moved, new_valuation_rate) # moved is negative
 
-        # Update Item metadata in the transaction
-        transaction.update(item_ref, {
-            "current_qty": str(new_qty),
-            "total_value": str(new_value),
-            "current_wac": str(new_valuation_rate)
-        })
+        # Update Item metadata in the transaction (string and native integer side by side)
+        item_fields = {
+            **new_qty.fields("current_qty"),
+            **new_value.fields("total_value"),
+            **new_valuation_rate.fields("current_wac"),
+        }
+        transaction.update(item_ref, item_fields)
 
         # Add Ledger Entry
         movement_ref = self.db.collection("stock_ledger").document()
@@ -147,10 +215,58 @@ class PostingEngine:
             "company_id": item_data.get("company_id")
         })
         
+        # Per-warehouse balance moves in the same transaction as the ledger entry
+        get_stock_level_service(item_data.get("company_id")).record(
+            transaction, item_id, warehouse_id, quantity, batch_number
+        )
+        
         # Update the provided item_data dictionary so subsequent calls in the same transaction
         # see the updated values without re-reading from Firestore.
-        item_data["current_qty"] = str(new_qty)
-        item_data["total_value"] = str(new_value)
-        item_data["current_wac"] = str(new_valuation_rate)
+        item_data.update(item_fields)
         
-        return new_valuation_rate
+        return new_valuation_rate.to_decimal()
+
+    def record_stock_transfer(
+        self,
+        transaction,
+        item_id: str,
+        from_warehouse_id: str,
+        to_warehouse_id: str,
+        quantity: Decimal,
+        doc_id: Optional[str] = None,
+        item_data: Optional[Dict[str, Any]] = None,
+        batch_number: Optional[str] = None,
+        doc_type: str = "TRF"
+    ):
+        """Records an inter-warehouse move (OUT + IN at current WAC) in a Firestore transaction.
+        Same ledger and level entries as two record_stock_movement calls, but the item document
+        is not rewritten: its quantity, value and WAC are unchanged by a transfer.
+        Pass item_data (pre-fetched via get_items_for_transaction); returns the number of writes.
+        """
+        if item_data is None:
+            snapshot = self.db.collection("items").document(item_id).get(transaction=transaction)
+            item_data = snapshot.to_dict() or {}
+        
+        company_id = item_data.get("company_id")
+        wac = Rate.read(item_data, "current_wac")
+        
+        for warehouse_id, signed_qty in ((from_warehouse_id, -quantity), (to_warehouse_id, quantity)):
+            movement_ref = self.db.collection("stock_ledger").document()
+            transaction.set(movement_ref, {
+                "timestamp": firestore.SERVER_TIMESTAMP,
+                "item_id": item_id,
+                "warehouse_id": warehouse_id,
+                "quantity": str(signed_qty),
+                "unit_cost": str(wac),
+                "valuation_rate": str(wac),
+                "source_document_id": doc_id,
+                "source_document_type": doc_type,
+                "batch_number": batch_number,
+                "company_id": company_id
+            })
+        
+        levels = get_stock_level_service(company_id)
+        return 2 + levels.apply(transaction, {
+            levels.key(item_id, from_warehouse_id, batch_number): -quantity,
+            levels.key(item_id, to_warehouse_id, batch_number): quantity,
+        })
@@ -0,0 +1,479 @@
+"""
+Invoice Rendering
+Print views (HTML and PDF) built from templates compiled once per process and
+branded from the cached company profile. Rendered output is cached by the
+invoice's update_time, so reprints and previews of an unchanged invoice are
+served from memory and can be answered with 304 Not Modified via the ETag.
+
+Batches of invoices, bills and vouchers are rendered to PDF in a process
+pool and streamed back as one merged PDF or a ZIP.
+"""
+import hashlib
+import html
+import io
+import multiprocessing
+import os
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from string import Template
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pypdf import PdfReader, PdfWriter
+
+from app.core.firebase import get_db
+from app.services.pdf import PDFService, render_document
+
+FORMATS = {
+    "html": "text/html; charset=utf-8",
+    "pdf": "application/pdf",
+}
+
+BRANDING_TTL_SECONDS = 300
+ARTIFACT_CACHE_SIZE = 256
+
+DEFAULT_BRANDING = {
+    "company_name": "OpenGate ERP",
+    "location": "",
+    "phone": "",
+    "email": "",
+    "website": "",
+    "invoice_note": "",
+    "payment_details": "",
+}
+
+# ----------------------------------------------------------------------
+# Templates
+# ----------------------------------------------------------------------
+_HTML_PAGE = Template("""<!DOCTYPE html>
+<html>
+<head>
+    <title>Invoice $invoice_number</title>
+    <style>
+        body { font-family: 'Inter', system-ui, sans-serif; color: #1e293b; line-height: 1.5; padding: 40px; max-width: 800px; margin: auto; }
+        .header { display: flex; justify-content: space-between; align-items: flex-start; margin-bottom: 40px; }
+        .logo { font-size: 24px; font-weight: 900; color: #0f172a; letter-spacing: -0.025em; text-transform: uppercase; }
+        .company-contact { margin: 4px 0 0; font-size: 12px; color: #64748b; }
+        .invoice-info { text-align: right; }
+        .invoice-info h1 { margin: 0; font-size: 32px; font-weight: 900; }
+        .details { display: grid; grid-template-cols: 1fr 1fr; gap: 40px; margin-bottom: 40px; }
+        .section-title { font-size: 12px; font-weight: 900; text-transform: uppercase; color: #64748b; letter-spacing: 0.05em; margin-bottom: 8px; }
+        table { width: 100%; border-collapse: collapse; margin-bottom: 40px; }
+        th { text-align: left; font-size: 12px; font-weight: 900; text-transform: uppercase; color: #64748b; padding: 12px; border-bottom: 2px solid #e2e8f0; }
+        td { padding: 12px; border-bottom: 1px solid #eee; }
+        .num { text-align: right; }
+        .totals { margin-left: auto; width: 300px; }
+        .total-row { display: flex; justify-content: space-between; padding: 8px 0; }
+        .total-row.grand-total { font-size: 20px; font-weight: 900; border-top: 2px solid #e2e8f0; margin-top: 12px; padding-top: 12px; }
+        .notes { margin-top: 40px; font-size: 13px; color: #475569; white-space: pre-line; }
+        @media print { .no-print { display: none; } body { padding: 0; } }
+    </style>
+</head>
+<body onload="window.print()">
+    <div class="header">
+        <div>
+            <div class="logo">$company_name</div>
+            $company_contact
+        </div>
+        <div class="invoice-info">
+            <h1>INVOICE</h1>
+            <p style="font-weight: bold; color: #64748b;">#$invoice_number</p>
+        </div>
+    </div>
+
+    <div class="details">
+        <div>
+            <div class="section-title">Bill To</div>
+            <p style="font-weight: bold; font-size: 18px; margin: 0;">$customer_name</p>
+            <p style="margin: 4px 0; color: #64748b;">$customer_phone</p>
+        </div>
+        <div style="text-align: right;">
+            <div class="section-title">Invoice Details</div>
+            <p style="margin: 4px 0;"><strong>Date:</strong> $issue_date</p>
+            <p style="margin: 4px 0;"><strong>Status:</strong> $status</p>
+        </div>
+    </div>
+
+    <table>
+        <thead>
+            <tr>
+                <th>Item Description</th>
+                <th class="num">Qty</th>
+                <th class="num">Price</th>
+                <th class="num">Total</th>
+            </tr>
+        </thead>
+        <tbody>
+$rows
+        </tbody>
+    </table>
+
+    <div class="totals">
+        <div class="total-row">
+            <span>Subtotal</span>
+            <span style="font-weight: bold;">$subtotal</span>
+        </div>
+        <div class="total-row">
+            <span>Discount</span>
+            <span style="font-weight: bold; color: #10b981;">-$discount</span>
+        </div>
+        <div class="total-row grand-total">
+            <span>Total</span>
+            <span>$total</span>
+        </div>
+        <div class="total-row" style="color: #10b981; font-weight: bold;">
+            <span>Amount Paid</span>
+            <span>$paid</span>
+        </div>
+        <div class="total-row" style="color: #f59e0b; font-weight: bold;">
+            <span>Balance Due</span>
+            <span>$remaining</span>
+        </div>
+    </div>
+
+    $notes
+
+    <div style="margin-top: 80px; text-align: center; color: #94a3b8; font-size: 12px;">
+        Thank you for your business!
+    </div>
+</body>
+</html>
+""")
+
+_HTML_ROW = Template("""            <tr>
+                <td>$name</td>
+                <td class="num">$quantity</td>
+                <td class="num">$price</td>
+                <td class="num" style="font-weight: bold;">$total</td>
+            </tr>""")
+
+_HTML_NOTE = Template('<div class="notes">$text</div>')
+_HTML_CONTACT = Template('<p class="company-contact">$text</p>')
+
+
+def _text(value: Any) -> str:
+    return html.escape(str(value)) if value is not None else ""
+
+
+def _iqd(value: Any) -> str:
+    try:
+        amount = int(float(value or 0))
+    except (TypeError, ValueError):
+        amount = 0
+    return f"{amount:,} IQD"
+
+
+def _date_text(value: Any) -> str:
+    if hasattr(value, "isoformat"):
+        return value.isoformat()[:10]
+    return _text(value)
+
+
+def render_invoice_html(inv: Dict[str, Any], branding: Dict[str, Any]) -> str:
+    rows = "\n".join(
+        _HTML_ROW.substitute(
+            name=_text(item.get("product_name") or item.get("name")),
+            quantity=_text(item.get("quantity")),
+            price=_iqd(item.get("price")),
+            total=_iqd(item.get("total")),
+        )
+        for item in inv.get("items", [])
+    )
+
+    total = float(inv.get("total_amount", 0) or 0)
+    paid = float(inv.get("amount_paid", 0) or 0)
+
+    contact = " &middot; ".join(
+        _text(branding[key]) for key in ("location", "phone", "email", "website") if branding.get(key)
+    )
+    notes = "\n".join(
+        _HTML_NOTE.substitute(text=_text(branding[key]))
+        for key in ("invoice_note", "payment_details")
+        if branding.get(key)
+    )
+
+    return _HTML_PAGE.substitute(
+        company_name=_text(branding.get("company_name") or DEFAULT_BRANDING["company_name"]),
+        company_contact=_HTML_CONTACT.substitute(text=contact) if contact else "",
+        invoice_number=_text(inv.get("invoice_number")),
+        customer_name=_text(inv.get("customer_name")),
+        customer_phone=_text(inv.get("customer_phone", "")),
+        issue_date=_date_text(inv.get("issue_date")),
+        status=_text((inv.get("status") or "").upper()),
+        rows=rows,
+        subtotal=_iqd(inv.get("subtotal")),
+        discount=_iqd(inv.get("discount")),
+        total=_iqd(total),
+        paid=_iqd(paid),
+        remaining=_iqd(total - paid),
+        notes=notes,
+    )
+
+
+# ----------------------------------------------------------------------
+# Company branding
+# ----------------------------------------------------------------------
+# company_id -> (expires at, branding, version)
+_branding_cache: Dict[str, Tuple[float, Dict[str, Any], str]] = {}
+_branding_lock = threading.Lock()
+
+
+def get_company_branding(company_id: Optional[str]) -> Tuple[Dict[str, Any], str]:
+    """
+    Branding fields from the company profile and a version string for cache keys.
+
+    Profiles are cached for BRANDING_TTL_SECONDS; updates made through this
+    process are picked up immediately via ``invalidate_company_branding``.
+    """
+    if not company_id:
+        return dict(DEFAULT_BRANDING), "default"
+
+    now = time.monotonic()
+    with _branding_lock:
+        cached = _branding_cache.get(company_id)
+    if cached and cached[0] > now:
+        return cached[1], cached[2]
+
+    doc = get_db().collection("company_settings").document(company_id).get()
+    if doc.exists:
+        data = doc.to_dict()
+        branding = {key: data.get(key) or default for key, default in DEFAULT_BRANDING.items()}
+        version = doc.update_time.isoformat() if doc.update_time else "profile"
+    else:
+        branding, version = dict(DEFAULT_BRANDING), "default"
+
+    with _branding_lock:
+        _branding_cache[company_id] = (now + BRANDING_TTL_SECONDS, branding, version)
+    return branding, version
+
+
+def invalidate_company_branding(company_id: Optional[str]):
+    with _branding_lock:
+        _branding_cache.pop(company_id, None)
+
+
+# ----------------------------------------------------------------------
+# Rendered artifacts
+# ----------------------------------------------------------------------
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True when an If-None-Match header names ``etag`` (weak comparison)."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class InvoiceRenderer:
+    """Renders invoice print views, caching output per invoice revision."""
+
+    _cache: "OrderedDict[Tuple[str, ...], bytes]" = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    def __init__(self):
+        self.pdf = PDFService()
+
+    def _cache_key(self, snapshot, fmt: str) -> Tuple[str, ...]:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format: {fmt}")
+        company_id = (snapshot.to_dict() or {}).get("company_id")
+        _, branding_version = get_company_branding(company_id)
+        revision = snapshot.update_time.isoformat() if snapshot.update_time else ""
+        return (snapshot.id, revision, fmt, branding_version)
+
+    def etag(self, snapshot, fmt: str = "html") -> str:
+        """Strong ETag for an invoice revision in a given format and branding."""
+        digest = hashlib.sha256("|".join(self._cache_key(snapshot, fmt)).encode("utf-8"))
+        return f'"{digest.hexdigest()[:32]}"'
+
+    def render(self, snapshot, fmt: str = "html") -> Tuple[bytes, str]:
+        """Rendered content and media type, from cache when the invoice is unchanged."""
+        key = self._cache_key(snapshot, fmt)
+        with self._cache_lock:
+            content = self._cache.get(key)
+            if content is not None:
+                self._cache.move_to_end(key)
+                return content, FORMATS[fmt]
+
+        inv = snapshot.to_dict()
+        branding, _ = get_company_branding(inv.get("company_id"))
+        if fmt == "pdf":
+            content = self.pdf.generate_invoice({"id": snapshot.id, **inv}, branding=branding)
+        else:
+            content = render_invoice_html(inv, branding).encode("utf-8")
+
+        with self._cache_lock:
+            self._cache[key] = content
+            self._cache.move_to_end(key)
+            while len(self._cache) > ARTIFACT_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return content, FORMATS[fmt]
+
+
+# ----------------------------------------------------------------------
+# Batch rendering
+# ----------------------------------------------------------------------
+# document type -> (collection, title printed on the document)
+DOCUMENT_TYPES = {
+    "invoice": ("invoices", "INVOICE"),
+    "bill": ("bills", "BILL"),
+    "payment_voucher": ("payment_vouchers", "PAYMENT VOUCHER"),
+    "receipt_voucher": ("receipt_vouchers", "RECEIPT VOUCHER"),
+}
+NUMBER_FIELDS = ("invoice_number", "bill_number", "voucher_number", "receipt_number")
+BATCH_OUTPUTS = ("pdf", "zip")
+BATCH_RENDER_LIMIT = 500
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """
+    Process pool shared by batch renders, one worker per core.
+
+    Workers are spawned rather than forked: forking a process that already
+    holds gRPC channels to Firestore is unsafe, and the workers only need
+    ReportLab.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def shutdown_render_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _portable(value: Any) -> Any:
+    """Plain, picklable copy of Firestore data for the worker processes."""
+    if isinstance(value, dict):
+        return {k: _portable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_portable(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+class BatchRenderer:
+    """Fetches a batch of documents in one round trip and renders them to PDF."""
+
+    def __init__(self, company_id: str):
+        self.db = get_db()
+        self.company_id = company_id
+
+    def fetch(self, documents: List[Tuple[str, str]]) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """
+        Load ``(doc_type, id)`` pairs with a single ``get_all``, keeping request order.
+
+        Raises ValueError for unknown types and for documents that are missing
+        or not stamped with this company (unstamped documents included).
+        """
+        if not documents:
+            raise ValueError("No documents requested")
+        if len(documents) > BATCH_RENDER_LIMIT:
+            raise ValueError(f"At most {BATCH_RENDER_LIMIT} documents per batch")
+        unknown = sorted({doc_type for doc_type, _ in documents if doc_type not in DOCUMENT_TYPES})
+        if unknown:
+            raise ValueError(f"Unknown document type(s): {', '.join(unknown)}")
+
+        refs = [
+            self.db.collection(DOCUMENT_TYPES[doc_type][0]).document(doc_id)
+            for doc_type, doc_id in documents
+        ]
+        snaps = {snap.reference.path: snap for snap in self.db.get_all(refs)}
+
+        loaded, missing = [], []
+        for (doc_type, doc_id), ref in zip(documents, refs):
+            snap = snaps.get(ref.path)
+            data = snap.to_dict() if snap is not None and snap.exists else None
+            if data is None or not self.company_id or data.get("company_id") != self.company_id:
+                missing.append(f"{doc_type}/{doc_id}")
+                continue
+            loaded.append((doc_type, doc_id, {"id": doc_id, **_portable(data)}))
+        if missing:
+            raise ValueError(f"Not found: {', '.join(missing)}")
+        return loaded
+
+    def render(self, loaded: List[Tuple[str, str, Dict[str, Any]]]) -> Iterator[Tuple[str, bytes]]:
+        """Yield ``(file name, pdf bytes)`` in request order as workers finish them."""
+        branding, _ = get_company_branding(self.company_id)
+        jobs = [(data, DOCUMENT_TYPES[doc_type][1], branding) for doc_type, _, data in loaded]
+        chunksize = max(1, len(jobs) // ((os.cpu_count() or 1) * 4))
+        results = get_render_pool().map(render_document, jobs, chunksize=chunksize)
+        for (doc_type, doc_id, data), content in zip(loaded, results):
+            number = next((data[f] for f in NUMBER_FIELDS if data.get(f)), doc_id)
+            yield f"{doc_type}-{number}.pdf".replace("/", "-"), content
+
+    def stream_pdf(self, loaded) -> Iterator[bytes]:
+        """One merged PDF, streamed once all documents are rendered."""
+        writer = PdfWriter()
+        for _, content in self.render(loaded):
+            writer.append(PdfReader(io.BytesIO(content)))
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        buffer.seek(0)
+        while True:
+            chunk = buffer.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    def stream_zip(self, loaded) -> Iterator[bytes]:
+        """A ZIP with one PDF per document, streamed as each one is rendered."""
+        sink = _ChunkSink()
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, content in self.render(loaded):
+                archive.writestr(name, content)
+                yield sink.drain()
+        yield sink.drain()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable buffer that ZipFile can stream into."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def get_batch_renderer(company_id: str) -> BatchRenderer:
+    """Factory function to get a batch renderer instance."""
+    return BatchRenderer(company_id=company_id)
+
+
+def get_invoice_renderer() -> InvoiceRenderer:
+    """Factory function to get an invoice renderer instance."""
+    return InvoiceRenderer()
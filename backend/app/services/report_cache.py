@@ -0,0 +1,232 @@
+"""
+Report Cache
+Computed report results keyed by (company, report, params, ledger watermark).
+
+A result is only served while the watermark it was computed under is still
+current (LedgerWatermarkService), so a posting makes exactly the reports that
+read its company, or its account, miss on the next request. Storing a newer
+result for the same (company, report, params) drops the one it replaces.
+
+Two LRU tiers: an in-process dict of REPORT_CACHE_MEMORY_ENTRIES results,
+and pickled files under REPORT_CACHE_DIR (shared by the workers of one host,
+evicted by access time) of REPORT_CACHE_DISK_ENTRIES results. The disk tier
+is off unless REPORT_CACHE_DIR is an absolute path. The directory must only
+be writable by this service: files are unpickled.
+
+The latest key per (company, report, params) is tracked in an LRU as large as
+the bigger tier; a scope dropped from it only loses the early removal of its
+superseded result, which the tiers' own LRU then evicts.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Returned by ``get`` on a miss (None is a valid cached result)
+MISS = object()
+
+
+def _digest(*parts: Any) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ReportCache:
+    """Two-tier LRU cache of report results."""
+
+    def __init__(self, memory_entries: int, directory: Optional[str], disk_entries: int):
+        self.memory_entries = max(0, memory_entries)
+        self.disk_entries = max(0, disk_entries)
+        self.directory = Path(directory) if directory and self.disk_entries else None
+        self._memory: "OrderedDict[str, Tuple[str, Any]]" = OrderedDict()  # key -> (company, value)
+        # (company, report, params) -> (company, key), least recently stored first
+        self._latest: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: Counter = Counter()
+        self._disk_count = 0
+        if self.directory and not self.directory.is_absolute():
+            logger.warning("REPORT_CACHE_DIR %s is not absolute; disk tier off", directory)
+            self.directory = None
+        if self.directory:
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self._disk_count = sum(1 for _ in self.directory.glob("*.pkl"))
+            except OSError:
+                logger.exception("Report cache directory unusable; disk tier off")
+                self.directory = None
+        self.scope_entries = max(self.memory_entries, self.disk_entries if self.directory else 0)
+
+    # ------------------------------------------------------------------
+    # Keys
+    # ------------------------------------------------------------------
+    @staticmethod
+    def scope(company_id: str, report: str, params: Dict[str, Any]) -> str:
+        return _digest(company_id, report, params)
+
+    @staticmethod
+    def key(scope: str, watermark: str) -> str:
+        return _digest(scope, watermark)
+
+    def _path(self, company_id: str, key: str) -> Path:
+        # Company prefix so one company's files can be dropped without reading them
+        return self.directory / f"{_digest(company_id)[:16]}-{key}.pkl"
+
+    # ------------------------------------------------------------------
+    # Lookup / store
+    # ------------------------------------------------------------------
+    def get(self, company_id: str, report: str, params: Dict[str, Any], watermark: str) -> Any:
+        """The cached result, or MISS."""
+        key = self.key(self.scope(company_id, report, params), watermark)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return self._memory[key][1]
+
+        if self.directory:
+            path = self._path(company_id, key)
+            try:
+                with open(path, "rb") as fh:
+                    value = pickle.load(fh)
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+            except (OSError, pickle.UnpicklingError, EOFError):
+                logger.warning("Unreadable report cache file %s", path)
+            else:
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                    self._remember(company_id, key, value)
+                return value
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return MISS
+
+    def put(self, company_id: str, report: str, params: Dict[str, Any], watermark: str, value: Any):
+        """Store a result, dropping the one it replaces for the same report and params."""
+        scope = self.scope(company_id, report, params)
+        key = self.key(scope, watermark)
+        with self._lock:
+            previous = self._latest.pop(scope, (None, None))[1]
+            if self.scope_entries:
+                self._latest[scope] = (company_id, key)
+                while len(self._latest) > self.scope_entries:
+                    self._latest.popitem(last=False)
+            if previous and previous != key:
+                self._memory.pop(previous, None)
+                self._stats["replaced"] += 1
+            self._remember(company_id, key, value)
+        if previous and previous != key:
+            self._unlink(self._path(company_id, previous) if self.directory else None)
+        if self.directory:
+            self._write(company_id, key, value)
+
+    def _remember(self, company_id: str, key: str, value: Any):
+        # Caller holds the lock
+        if not self.memory_entries:
+            return
+        self._memory[key] = (company_id, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["memory_evictions"] += 1
+
+    # ------------------------------------------------------------------
+    # Disk tier
+    # ------------------------------------------------------------------
+    def _write(self, company_id: str, key: str, value: Any):
+        path = self._path(company_id, key)
+        try:
+            existed = path.exists()
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump(value, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except (OSError, pickle.PicklingError, TypeError):
+            logger.exception("Could not write report cache file %s", path)
+            return
+        with self._lock:
+            if not existed:
+                self._disk_count += 1
+            over = self._disk_count > self.disk_entries
+        if over:
+            self._prune()
+
+    def _prune(self):
+        """Drop the least recently used files down to 90% of the disk limit."""
+        try:
+            files = sorted(self.directory.glob("*.pkl"), key=lambda p: p.stat().st_mtime)
+        except OSError:
+            return
+        excess = len(files) - int(self.disk_entries * 0.9)
+        for path in files[:max(excess, 0)]:
+            self._unlink(path)
+            self._stats["disk_evictions"] += 1
+        with self._lock:
+            self._disk_count = len(files) - max(excess, 0)
+
+    @staticmethod
+    def _unlink(path: Optional[Path]):
+        if path is None:
+            return
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+    def invalidate(self, company_id: Optional[str] = None) -> int:
+        """Drop one company's results (or all of them) from both tiers."""
+        with self._lock:
+            keys = [key for key, (owner, _) in self._memory.items() if company_id is None or owner == company_id]
+            for key in keys:
+                del self._memory[key]
+            scopes = [scope for scope, (owner, _) in self._latest.items() if company_id is None or owner == company_id]
+            for scope in scopes:
+                del self._latest[scope]
+        removed = len(keys)
+        if self.directory:
+            pattern = f"{_digest(company_id)[:16]}-*.pkl" if company_id else "*.pkl"
+            for path in self.directory.glob(pattern):
+                self._unlink(path)
+                removed += 1
+            with self._lock:
+                self._disk_count = sum(1 for _ in self.directory.glob("*.pkl"))
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["tracked_scopes"] = len(self._latest)
+            stats["disk_entries"] = self._disk_count if self.directory else 0
+        stats["disk_dir"] = str(self.directory) if self.directory else None
+        return stats
+
+
+_cache: Optional[ReportCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_report_cache() -> ReportCache:
+    """The process-wide report cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ReportCache(
+                settings.REPORT_CACHE_MEMORY_ENTRIES,
+                settings.REPORT_CACHE_DIR,
+                settings.REPORT_CACHE_DISK_ENTRIES,
+            )
+        return _cache
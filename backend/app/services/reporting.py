@@ -1,34 +1,167 @@
-from datetime import datetime, time
+import csv
+import io
+import json
+from datetime import date, datetime, time, timezone
 from decimal import Decimal
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from google.cloud import firestore
+from app.core.config import settings
 from app.core.firebase import get_db
+from app.core.money import Money
+from app.services.account_ledger import get_account_ledger_service
+from app.services.chart_of_accounts import ChartOfAccounts, get_chart_of_accounts
+from app.services.gl_balances import get_gl_balance_service
+from app.services.gl_cube import MAX_COLUMNS, get_gl_cube_service, month_ranges, roll_up
+from app.services.gl_snapshots import day_key, get_gl_snapshot_service, shift_day
+
+
+def _code_prefixes(value: str) -> Tuple[str, ...]:
+    return tuple(prefix.strip() for prefix in value.split(",") if prefix.strip())
+
+
+def _is_cogs(meta: Dict[str, Any]) -> bool:
+    return str(meta.get("code") or "").startswith("51") # Convention for COGS
+
+
+def _income_section(meta: Dict[str, Any]) -> Optional[Tuple[str, int]]:
+    """(section, sign) of an account in the P&L; revenue is credit-normal."""
+    if meta.get("type") == "REVENUE":
+        return "revenue", -1
+    if meta.get("type") == "EXPENSE":
+        return ("cogs" if _is_cogs(meta) else "expenses"), 1
+    return None
+
+
+def _balance_section(meta: Dict[str, Any]) -> Optional[Tuple[str, int]]:
+    """(section, sign) of an account in the balance sheet."""
+    return {
+        "ASSET": ("assets", 1),
+        "LIABILITY": ("liabilities", -1),
+        "EQUITY": ("equity", -1),
+    }.get(meta.get("type"))
+
+
+def _depth(chart: ChartOfAccounts, account_id: str) -> int:
+    depth, seen = 0, {account_id}
+    parent = (chart.account(account_id) or {}).get("parent_id")
+    while parent and parent not in seen:
+        seen.add(parent)
+        depth += 1
+        parent = (chart.account(parent) or {}).get("parent_id")
+    return depth
+
+
+def _sections(chart: ChartOfAccounts, rolled: Dict[str, List[int]], section_of) -> Dict[str, List[Dict[str, Any]]]:
+    """Statement rows per section, group accounts included with rolled-up amounts."""
+    sections: Dict[str, List[Dict[str, Any]]] = {}
+    for account_id, vector in rolled.items():
+        meta = chart.account(account_id) or {}
+        placement = section_of(meta)
+        if not placement or not any(vector):
+            continue
+        name, sign = placement
+        sections.setdefault(name, []).append({
+            "account_id": account_id,
+            "code": meta.get("code") or "",
+            "name": meta.get("name_en"),
+            "parent_id": meta.get("parent_id"),
+            "is_group": bool(meta.get("is_group")),
+            "level": _depth(chart, account_id),
+            "amounts": [str(Money(sign * units)) for units in vector],
+        })
+    for rows in sections.values():
+        rows.sort(key=lambda x: x["code"])
+    return sections
+
+
+def _single_column(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Rows of a one-column statement, with "amount" instead of "amounts"."""
+    return [
+        {**{key: value for key, value in row.items() if key != "amounts"}, "amount": row["amounts"][0]}
+        for row in rows
+    ]
+
+
+# Columns of streamed CSV ledgers; the opening and totals events are rows too
+STREAM_CSV_COLUMNS = ["type", "date", "number", "description", "memo", "debit", "credit", "balance"]
+
+
+def ndjson_lines(events: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    """One JSON document per event and line."""
+    for event in events:
+        yield json.dumps(event, default=str, ensure_ascii=False) + "\n"
+
+
+def csv_lines(events: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    """A CSV header, then one row per opening / line / totals event."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def row(values):
+        writer.writerow(values)
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return text
+
+    yield row(STREAM_CSV_COLUMNS)
+    for event in events:
+        kind = event.get("type")
+        if kind == "opening":
+            yield row(["opening", event["date"], "", "Opening balance", "", "", "", event["balance"]])
+        elif kind == "line":
+            yield row([event.get(column, "") for column in STREAM_CSV_COLUMNS])
+        elif kind == "totals":
+            yield row(["totals", "", "", "", "", event["total_debit"], event["total_credit"], event["closing_balance"]])
+
+
+def _section_totals(
+    chart: ChartOfAccounts, values: Dict[str, List[int]], section_of, width: int
+) -> Dict[str, List[int]]:
+    """Signed units per section and column, from each account's own amounts."""
+    totals: Dict[str, List[int]] = {}
+    for account_id, vector in values.items():
+        placement = section_of(chart.account(account_id) or {})
+        if not placement:
+            continue
+        name, sign = placement
+        target = totals.setdefault(name, [0] * width)
+        for column, units in enumerate(vector):
+            target[column] += sign * units
+    return totals
+
 
 class ReportingService:
     def __init__(self):
         self.db = get_db()
+        self.gl_balances = get_gl_balance_service()
+
+    def _account_balances(self, company_id: str):
+        """Company accounts as (id, data, Money balance), summing sharded balances."""
+        docs = list(self.db.collection("accounts").where("company_id", "==", company_id).stream())
+        accounts = {doc.id: doc.to_dict() for doc in docs}
+        totals = self.gl_balances.balances(
+            {aid: acc for aid, acc in accounts.items() if self.gl_balances.shard_count_of(acc)}
+        )
+        for aid, data in accounts.items():
+            bal = totals[aid]["balance"] if aid in totals else Money.read(data, "balance")
+            yield aid, data, bal
     
     async def get_trial_balance(self, company_id: str, as_of_date: Optional[datetime] = None) -> List[Dict[str, Any]]:
         """
         Returns a list of all accounts with their balances.
-        If as_of_date is provided, we might need to calculate backwards (complex),
-        OR just return current balances if date is today/none.
-        For MVP, we return CURRENT balances from the accounts collection.
-        Real date-based TB requires computing history from JEs.
+        Without as_of_date: CURRENT balances from the accounts collection.
+        With as_of_date: balances at the end of that day, from the nearest
+        period snapshot plus the daily buckets since (GLSnapshotService).
         """
-        # MVP: Current Balances only. 
-        # TODO: Implement historical TB by reversing JEs from current balance.
-        
-        accounts_ref = self.db.collection("accounts").where("company_id", "==", company_id)
-        docs = accounts_ref.stream()
+        if as_of_date is not None:
+            return get_gl_snapshot_service(company_id).trial_balance_as_of(as_of_date)
         
         tb_data = []
-        total_debit = Decimal("0")
-        total_credit = Decimal("0")
+        total_debit = Money()
+        total_credit = Money()
         
-        for doc in docs:
-            data = doc.to_dict()
-            bal = Decimal(data.get("balance", "0"))
+        for account_id, data, bal in self._account_balances(company_id):
             
             # Determine Debit/Credit columns based on Account Type
             # Asset/Expense: Positive balance is Debit.
@@ -40,7 +173,7 @@ class ReportingService:
             # So Positive = Debit, Negative = Credit.
             
             row = {
-                "account_id": doc.id,
+                "account_id": account_id,
                 "code": data.get("code"),
                 "name": data.get("name_en"), # Should support locale
                 "type": data.get("type"),
@@ -49,10 +182,10 @@ class ReportingService:
                 "net_balance": str(bal)
             }
             
-            if bal > 0:
+            if bal.units > 0:
                 row["debit"] = str(bal)
                 total_debit += bal
-            elif bal < 0:
+            elif bal.units < 0:
                 row["credit"] = str(abs(bal))
                 total_credit += abs(bal)
                 
@@ -98,74 +231,30 @@ class ReportingService:
         if end_date.tzinfo is None:
             end_date = end_date.replace(tzinfo=timezone.utc)
 
-        # 3. Get Current Balance for accurate back-calculation
+        # 3. Check the linked account
         acc_ref = self.db.collection("accounts").document(ar_account_id)
         acc_snap = acc_ref.get()
         if not acc_snap.exists:
              raise ValueError("Linked AR Account not found")
-        
-        current_balance = Decimal(acc_snap.to_dict().get("balance", "0"))
 
-        # 4. Strategy: Fetch ALL POSTED Journal Entries for the company 
-        # and filter in-memory to avoid index requirements for now.
-        je_query = self.db.collection("journal_entries")\
-            .where("company_id", "==", company_id)\
-            .where("status", "==", "POSTED")
-            
-        jes = list(je_query.stream())
-        
-        report_lines = []
-        period_net_change = Decimal("0")
-        future_net_change = Decimal("0")
-        pre_period_net_change = Decimal("0") # (opening balance should be based on this if we used a different strategy)
-        
-        for je in jes:
-            data = je.to_dict()
-            je_date = data.get("date") # DatetimeWithNanoseconds
-            
-            # Normalize je_date if needed (Firestore usually returns aware)
-            if je_date.tzinfo is None:
-                je_date = je_date.replace(tzinfo=timezone.utc)
-                
-            # Find lines for this account
-            relevant_lines = [l for l in data.get("lines", []) if l.get("account_id") == ar_account_id]
-            
-            for line in relevant_lines:
-                debit = Decimal(str(line.get("debit", "0")))
-                credit = Decimal(str(line.get("credit", "0")))
-                net = debit - credit
-                
-                # Check date bucket
-                if je_date < start_date:
-                    pre_period_net_change += net
-                elif je_date <= end_date:
-                    report_lines.append({
-                        "date": je_date,
-                        "number": data.get("number"),
-                        "description": data.get("description"),
-                        "debit": str(debit),
-                        "credit": str(credit),
-                        "balance_impact": str(net),
-                        "memo": line.get("memo")
-                    })
-                    period_net_change += net
-                else: # Future transaction (je_date > end_date)
-                    future_net_change += net
-
-        # Sort report lines by date
-        report_lines.sort(key=lambda x: x["date"])
-
-        # Review Math:
-        # Current Balance = Opening_Historic + PrePeriod + Period + Future
-        # Opening_at_Start = Current - Period - Future? 
-        # NO. If we fetch ALL history, then Opening = PrePeriod.
-        # But if we don't know when company started, using Current is safer.
-        # Opening_at_Start = Current - Period - Future
-        
-        opening_balance = current_balance - period_net_change - future_net_change
-        closing_balance = opening_balance + period_net_change
-        
+        # 4. Opening balance from the daily buckets, then one range query on
+        # the account's ledger rows within [start_date, end_date]
+        period = get_account_ledger_service(company_id).period(ar_account_id, start_date, end_date)
+        report_lines = [
+            {
+                "date": row["date"],
+                "number": row.get("number"),
+                "description": row.get("description"),
+                "debit": str(Money.read(row, "debit")),
+                "credit": str(Money.read(row, "credit")),
+                "balance_impact": str(row["net"]),
+                "memo": row.get("memo"),
+            }
+            for row in period["rows"]
+        ]
 
+        opening_balance = period["opening_balance"]
+        closing_balance = opening_balance + sum((row["net"] for row in period["rows"]), Money())
         
         return {
             "customer_name": cust_data.get("name"),
@@ -182,9 +271,9 @@ class ReportingService:
     async def get_general_ledger(self, company_id: str, account_id: str, from_date: datetime, to_date: datetime) -> Dict[str, Any]:
         """
         Calculates the general ledger for a specific account.
-        1. Fetch opening balance by summing all JEs before from_date.
-        2. Fetch all JEs in range.
-        3. Build running balance.
+        1. Opening balance = balance at the end of the day before from_date.
+        2. Fetch the account's ledger rows within [from_date, to_date] (one range query).
+        3. Build running balance over the rows.
         """
         # 1. Get Account Details
         acc_ref = self.db.collection("accounts").document(account_id)
@@ -200,75 +289,25 @@ class ReportingService:
         if to_date.tzinfo is None:
             to_date = to_date.replace(tzinfo=timezone.utc)
 
-        # 2. Get Current Balance for back-calculation or just sum from start
-        # To be safe and avoid issues with missing historical data, we use the account's current balance
-        # as the ground truth at 'now' and work backwards, similar to customer statement.
-        current_balance = Decimal(acc_data.get("balance", "0"))
-
-        # 3. Fetch JEs for this account
-        # Optimization: Use flat_account_ids if it exists to query efficiently
-        je_query = self.db.collection("journal_entries")\
-            .where("company_id", "==", company_id)\
-            .where("status", "==", "POSTED")
-        
-        # We might want to filter by account if possible, but Firestore doesn't support 'in' with arrays nicely for many IDs.
-        # However, we can use array_contains if we store all account IDs in a flat array on the JE.
-        # For now, let's filter in-memory to be safe unless we are sure about the field name.
-        # Actually, looking at AccountingService.create_journal_entry, I see:
-        # "flat_account_ids": account_ids
-        je_query = je_query.where("flat_account_ids", "array_contains", account_id)
-        
-        jes = list(je_query.stream())
-        
-        report_lines = []
-        period_net_change = Decimal("0")
-        future_net_change = Decimal("0")
-        
-        for je in jes:
-            data = je.to_dict()
-            je_date = data.get("date")
-            if je_date.tzinfo is None:
-                je_date = je_date.replace(tzinfo=timezone.utc)
-            
-            # Find relevant lines in this JE
-            lines = [l for l in data.get("lines", []) if l.get("account_id") == account_id]
-            for l in lines:
-                debit = Decimal(str(l.get("debit", "0")))
-                credit = Decimal(str(l.get("credit", "0")))
-                net = debit - credit
-                
-                if je_date < from_date:
-                    pass # We will calculate opening balance by subtracting period and future from current
-                elif je_date <= to_date:
-                    report_lines.append({
-                        "id": je.id,
-                        "date": je_date.isoformat(),
-                        "number": data.get("number", ""),
-                        "description": data.get("description", ""),
-                        "memo": l.get("memo", ""),
-                        "debit": str(debit),
-                        "credit": str(credit),
-                        "net": net
-                    })
-                    period_net_change += net
-                else:
-                    future_net_change += net
+        # 2. Opening balance and one indexed range query on the account's
+        # ledger rows (see AccountLedgerService.period)
+        period = get_account_ledger_service(company_id).period(account_id, from_date, to_date)
+        opening_balance = period["opening_balance"]
 
-        # To calculate Opening Balance correctly:
-        # Current = sum(ALL)
-        # Opening_at_from_date = Current - sum(from_date to NOW)
-        # where sum(from_date to NOW) = period_net_change + future_net_change
-        opening_balance = current_balance - period_net_change - future_net_change
-        
-        # Sort and build running balance
-        report_lines.sort(key=lambda x: x["date"])
-        
+        # Build running balance in date order
         running = opening_balance
         final_lines = []
-        for line in report_lines:
-            running += line["net"]
+        for row in period["rows"]:
+            running += row["net"]
             final_lines.append({
-                **line,
+                "id": row["je_id"],
+                "date": row["date"].isoformat(),
+                "number": row.get("number", ""),
+                "description": row.get("description", ""),
+                "memo": row.get("memo", ""),
+                "debit": str(Money.read(row, "debit")),
+                "credit": str(Money.read(row, "credit")),
+                "net": row["net"].to_decimal(),
                 "balance": str(running)
             })
             
@@ -286,19 +325,163 @@ class ReportingService:
             "closing_balance": str(running)
         }
 
-    async def get_income_statement(self, company_id: str) -> Dict[str, Any]:
+    def _income_columns(self, company_id: str, ranges: List[Tuple[str, str]]) -> Dict[str, Any]:
+        """P&L per (first day, last day) column, from the period cube."""
+        movements = get_gl_cube_service(company_id).movements(ranges)
+        chart = get_chart_of_accounts(company_id)
+        net = movements.net()
+        width = len(ranges)
+
+        totals = _section_totals(chart, net, _income_section, width)
+        revenue, cogs, expenses = (totals.get(name, [0] * width) for name in ("revenue", "cogs", "expenses"))
+        gross_profit = [r - c for r, c in zip(revenue, cogs)]
+        net_profit = [g - e for g, e in zip(gross_profit, expenses)]
+        details = _sections(chart, roll_up(chart, net), _income_section)
+
+        def column_strings(vector):
+            return [str(Money(units)) for units in vector]
+
+        return {
+            "columns": [{"from": first, "to": last} for first, last in ranges],
+            "revenue": column_strings(revenue),
+            "cogs": column_strings(cogs),
+            "gross_profit": column_strings(gross_profit),
+            "expenses": column_strings(expenses),
+            "net_profit": column_strings(net_profit),
+            "details": {name: details.get(name, []) for name in ("revenue", "cogs", "expenses")},
+            "cells_read": movements.cells_read,
+        }
+
+    def _stream_account(
+        self,
+        company_id: str,
+        account_id: str,
+        header: Dict[str, Any],
+        from_date: datetime,
+        to_date: datetime,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Header, opening balance, then the account's ledger rows in date order
+        with a running balance as the query yields them, then totals. The
+        opening balance is the end of the day before from_date (snapshots and
+        daily buckets), so nothing is read ahead and memory stays constant.
+        """
+        yield header
+        opening = get_gl_snapshot_service(company_id).account_balance_as_of(
+            account_id, shift_day(day_key(from_date), -1)
+        )
+        yield {"type": "opening", "date": day_key(from_date), "balance": str(opening)}
+
+        running, total_debit, total_credit = opening, Money(), Money()
+        for row in get_account_ledger_service(company_id).iter_rows(account_id, from_date, to_date):
+            debit, credit = Money.read(row, "debit"), Money.read(row, "credit")
+            running += debit - credit
+            total_debit += debit
+            total_credit += credit
+            yield {
+                "type": "line",
+                "id": row["je_id"],
+                "date": row["date"].isoformat(),
+                "number": row.get("number", ""),
+                "description": row.get("description", ""),
+                "memo": row.get("memo", ""),
+                "debit": str(debit),
+                "credit": str(credit),
+                "balance": str(running),
+            }
+        yield {
+            "type": "totals",
+            "total_debit": str(total_debit),
+            "total_credit": str(total_credit),
+            "closing_balance": str(running),
+        }
+
+    @staticmethod
+    def _stream_range(from_date: datetime, to_date: datetime) -> Tuple[datetime, datetime]:
+        # Streams open at the start of from_date's (UTC) day, where the daily
+        # buckets behind the opening balance end
+        from_day = date.fromisoformat(day_key(from_date))
+        if to_date.tzinfo is None:
+            to_date = to_date.replace(tzinfo=timezone.utc)
+        return datetime.combine(from_day, time.min, tzinfo=timezone.utc), to_date
+
+    def stream_general_ledger(
+        self, company_id: str, account_id: str, from_date: datetime, to_date: datetime
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        get_general_ledger as a stream of events (account, opening, line...,
+        totals). The account is checked before anything is streamed.
+        """
+        acc_snap = self.db.collection("accounts").document(account_id).get()
+        if not acc_snap.exists:
+            raise ValueError("Account not found")
+        acc_data = acc_snap.to_dict()
+        header = {
+            "type": "account",
+            "account_id": account_id,
+            "code": acc_data.get("code"),
+            "name_ar": acc_data.get("name_ar"),
+            "name_en": acc_data.get("name_en"),
+            "account_type": acc_data.get("type"),
+        }
+        return self._stream_account(company_id, account_id, header, *self._stream_range(from_date, to_date))
+
+    def stream_customer_statement(
+        self, company_id: str, customer_id: str, from_date: datetime, to_date: datetime
+    ) -> Iterator[Dict[str, Any]]:
+        """get_customer_statement as a stream of events (customer, opening, line..., totals)."""
+        cust_snap = self.db.collection("customers").document(customer_id).get()
+        if not cust_snap.exists:
+            raise ValueError("Customer not found")
+        cust_data = cust_snap.to_dict()
+        ar_account_id = cust_data.get("ar_account_id")
+        if not ar_account_id:
+            raise ValueError("Customer does NOT have a linked AR Account configured.")
+        acc_snap = self.db.collection("accounts").document(ar_account_id).get()
+        if not acc_snap.exists:
+            raise ValueError("Linked AR Account not found")
+        acc_data = acc_snap.to_dict()
+        header = {
+            "type": "customer",
+            "customer_id": customer_id,
+            "customer_name": cust_data.get("name"),
+            "account_name": acc_data.get("name_en"),
+            "currency": acc_data.get("currency", "IQD"),
+        }
+        return self._stream_account(company_id, ar_account_id, header, *self._stream_range(from_date, to_date))
+
+    async def get_income_statement(
+        self, company_id: str, from_date: Optional[datetime] = None, to_date: Optional[datetime] = None
+    ) -> Dict[str, Any]:
         """
         Generates a simple P&L for the company.
+        Without dates: lifetime account balances. With dates: movements in
+        [from_date, to_date] from the period cube (from_date defaults to the
+        start of to_date's year, to_date to today), with group accounts
+        rolled up over parent_id.
         """
+        if from_date is not None or to_date is not None:
+            last_day = day_key(to_date)
+            first_day = day_key(from_date) if from_date is not None else f"{last_day[:4]}-01-01"
+            report = self._income_columns(company_id, [(first_day, last_day)])
+            return {
+                "from": first_day,
+                "to": last_day,
+                **{key: report[key][0] for key in ("revenue", "cogs", "gross_profit", "expenses", "net_profit")},
+                "details": {
+                    name: _single_column(rows)
+                    for name, rows in report["details"].items()
+                },
+                "cells_read": report["cells_read"],
+            }
+
         # 1. Fetch all Revenue and Expense accounts
-        accounts_ref = self.db.collection("accounts").where("company_id", "==", company_id)
         # We can filter by type in code or query. Firestore allows 'in' for up to 10.
         # But types are REVENUE, EXPENSE.
-        docs = accounts_ref.stream()
         
-        revenue_total = Decimal("0")
-        cogs_total = Decimal("0")
-        expense_total = Decimal("0")
+        revenue_total = Money()
+        cogs_total = Money()
+        expense_total = Money()
         
         details = {
             "revenue": [],
@@ -306,8 +489,7 @@ class ReportingService:
             "expenses": []
         }
         
-        for doc in docs:
-            data = doc.to_dict()
+        for _, data, bal in self._account_balances(company_id):
             acct_type = data.get("type", "")
             
             # Balance logic:
@@ -319,8 +501,6 @@ class ReportingService:
             # So Revenue (Credit normal) will have NEGATIVE balance.
             # Expense (Debit normal) will have POSITIVE balance.
             
-            bal = Decimal(data.get("balance", "0"))
-            
             if acct_type == "REVENUE":
                 # Invert because Revenue is Credit-normal
                 val = -bal
@@ -328,8 +508,7 @@ class ReportingService:
                 details["revenue"].append({"name": data.get("name_en"), "amount": str(val)})
                 
             elif acct_type == "EXPENSE":
-                code = data.get("code", "")
-                if code.startswith("51"): # Convention for COGS
+                if _is_cogs(data):
                      cogs_total += bal
                      details["cogs"].append({"name": data.get("name_en"), "amount": str(bal)})
                 else:
@@ -348,6 +527,138 @@ class ReportingService:
             "details": details
         }
 
+    async def get_comparative_income_statement(
+        self, company_id: str, from_period: str, to_period: str
+    ) -> Dict[str, Any]:
+        """P&L with one column per month from from_period to to_period (YYYY-MM)."""
+        try:
+            first = date.fromisoformat(f"{from_period}-01")
+            last = date.fromisoformat(f"{to_period}-01")
+        except ValueError:
+            raise ValueError("Periods must be YYYY-MM")
+        months = (last.year - first.year) * 12 + last.month - first.month + 1
+        if months < 1:
+            raise ValueError("from_period is after to_period")
+        if months > MAX_COLUMNS:
+            raise ValueError(f"At most {MAX_COLUMNS} periods per comparative statement")
+
+        ranges = month_ranges(from_period, to_period)
+        report = self._income_columns(company_id, ranges)
+        for column, (first_day, _) in zip(report["columns"], ranges):
+            column["period"] = first_day[:7]
+        return report
+
+    async def get_balance_sheet(self, company_id: str, as_of_date: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Assets, liabilities and equity at the end of as_of_date (default
+        today), from the balance snapshots. Revenue and expense balances not
+        yet closed to equity are shown as current earnings.
+        """
+        snapshot, balances, _ = get_gl_snapshot_service(company_id).balances_as_of(as_of_date)
+        chart = get_chart_of_accounts(company_id)
+        values = {account_id: [balance.units] for account_id, balance in balances.items()}
+
+        totals = _section_totals(chart, values, _balance_section, 1)
+        earnings = _section_totals(chart, values, _income_section, 1)
+        assets, liabilities, equity = (totals.get(name, [0])[0] for name in ("assets", "liabilities", "equity"))
+        current_earnings = (
+            earnings.get("revenue", [0])[0] - earnings.get("cogs", [0])[0] - earnings.get("expenses", [0])[0]
+        )
+        sections = _sections(chart, roll_up(chart, values), _balance_section)
+
+        return {
+            "as_of": day_key(as_of_date),
+            "snapshot_period": snapshot["period"] if snapshot else None,
+            **{
+                name: _single_column(sections.get(name, []))
+                for name in ("assets", "liabilities", "equity")
+            },
+            "total_assets": str(Money(assets)),
+            "total_liabilities": str(Money(liabilities)),
+            "current_earnings": str(Money(current_earnings)),
+            "total_equity": str(Money(equity + current_earnings)),
+            "total_liabilities_and_equity": str(Money(liabilities + equity + current_earnings)),
+            "balanced": assets == liabilities + equity + current_earnings,
+        }
+
+    async def get_cash_flow(self, company_id: str, from_date: datetime, to_date: datetime) -> Dict[str, Any]:
+        """
+        Cash-flow statement for [from_date, to_date] (indirect method): net
+        profit plus the change of every non-cash balance-sheet account, split
+        into operating / investing / financing by account code (settings),
+        reconciled against the movement of the cash accounts.
+        """
+        first_day, last_day = day_key(from_date), day_key(to_date)
+        movements = get_gl_cube_service(company_id).movements([(first_day, last_day)])
+        chart = get_chart_of_accounts(company_id)
+        cash_codes = _code_prefixes(settings.CASH_ACCOUNT_CODES)
+        investing_codes = _code_prefixes(settings.INVESTING_ACCOUNT_CODES)
+        financing_codes = _code_prefixes(settings.FINANCING_ACCOUNT_CODES)
+
+        def flow_section(meta: Dict[str, Any]) -> Optional[str]:
+            code = str(meta.get("code") or "")
+            account_type = meta.get("type")
+            if account_type not in ("ASSET", "LIABILITY", "EQUITY"):
+                return None
+            if account_type == "ASSET" and code.startswith(cash_codes):
+                return "cash"
+            if code.startswith(investing_codes):
+                return "investing"
+            if account_type == "EQUITY" or code.startswith(financing_codes):
+                return "financing"
+            return "operating"
+
+        net_profit = -sum(
+            vector[0] for account_id, vector in movements.net().items()
+            if _income_section(chart.account(account_id) or {})
+        )
+        sections = {name: {"lines": [], "total": 0} for name in ("operating", "investing", "financing")}
+        sections["operating"]["total"] = net_profit
+        cash_lines, receipts, payments = [], 0, 0
+        for account_id, debits in movements.debit.items():
+            meta = chart.account(account_id) or {}
+            name = flow_section(meta)
+            debit, credit = debits[0], movements.credit[account_id][0]
+            if not name or (name != "cash" and debit == credit):
+                continue
+            line = {"account_id": account_id, "code": meta.get("code") or "", "name": meta.get("name_en")}
+            if name == "cash":
+                receipts += debit
+                payments += credit
+                cash_lines.append({
+                    **line,
+                    "receipts": str(Money(debit)),
+                    "payments": str(Money(credit)),
+                    "net": str(Money(debit - credit)),
+                })
+                continue
+            # An asset increase uses cash; a liability or equity increase provides it
+            sections[name]["lines"].append({**line, "amount": str(Money(credit - debit))})
+            sections[name]["total"] += credit - debit
+
+        cash_ids = [account_id for account_id in chart.accounts if flow_section(chart.account(account_id)) == "cash"]
+        _, opening_balances, _ = get_gl_snapshot_service(company_id).balances_as_of(
+            date.fromisoformat(shift_day(first_day, -1))
+        )
+        opening_cash = sum(opening_balances.get(account_id, Money()).units for account_id in cash_ids)
+        net_change = sum(section["total"] for section in sections.values())
+
+        for section in sections.values():
+            section["lines"].sort(key=lambda x: x["code"])
+            section["total"] = str(Money(section["total"]))
+        cash_lines.sort(key=lambda x: x["code"])
+        return {
+            "from": first_day,
+            "to": last_day,
+            "net_profit": str(Money(net_profit)),
+            **sections,
+            "net_change": str(Money(net_change)),
+            "opening_cash": str(Money(opening_cash)),
+            "closing_cash": str(Money(opening_cash + receipts - payments)),
+            "cash_accounts": cash_lines,
+            "reconciled": net_change == receipts - payments,
+        }
+
     async def get_dashboard_stats(self):
         """
         Get KPIs for the dashboard.
@@ -0,0 +1,387 @@
+"""
+Sales Returns
+Partial and full returns against a sales invoice, applied in one transaction.
+
+Returned quantities are tracked on each invoice line, so validating a later
+return needs only the invoice itself. Stock goes back into the cost layers it
+was sold from, at the cost it was sold at (recorded on the invoice as
+``cost_consumption``); invoices created before that was recorded are restored
+at the product's current WAC. Stock whose layer no longer exists joins the
+product's layer at the same cost, or one new layer per cost.
+"""
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List
+from google.cloud import firestore
+from app.core.firebase import get_db
+from app.core.money import ITEM_AMOUNTS, with_units
+from app.services.ar_aging import get_ar_aging_service
+from app.services.stock_levels import StockLevelService, get_stock_level_service
+
+
+def _dec(value: Any) -> Decimal:
+    if value is None or value == "":
+        return Decimal("0")
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"Invalid number: {value!r}") from None
+
+
+def _str(value: Decimal) -> str:
+    return format(value.normalize(), "f") if value else "0"
+
+
+class ReturnService:
+    """Validates and applies sales returns."""
+
+    INVOICES = "invoices"
+    RETURNS = "returns"
+    ITEMS = "items"
+    LAYERS = "stock_cost_layers"
+    CUSTOMERS = "customers"
+
+    def __init__(self, company_id: str = "default"):
+        self.db = get_db()
+        self.company_id = company_id
+        self.aging = get_ar_aging_service(company_id)
+        self.levels = get_stock_level_service(company_id)
+
+    # ------------------------------------------------------------------
+    # Planning (pure)
+    # ------------------------------------------------------------------
+    @staticmethod
+    def allocate_lines(lines: List[Dict[str, Any]], requested: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Match requested return lines to invoice lines.
+
+        A request may name ``line_index``; otherwise its quantity is spread
+        over the invoice lines for that product in order. Raises ValueError
+        when more is returned than is left on the invoice.
+        """
+        if not requested:
+            raise ValueError("At least one item is required")
+
+        remaining = [_dec(line.get("quantity")) - _dec(line.get("returned_qty")) for line in lines]
+        allocations = []
+        for request in requested:
+            product_id = request.get("product_id")
+            quantity = _dec(request.get("quantity"))
+            if quantity <= 0:
+                raise ValueError("Return quantity must be greater than zero")
+
+            if request.get("line_index") is not None:
+                index = int(request["line_index"])
+                if not 0 <= index < len(lines) or (
+                    product_id and lines[index].get("product_id") != product_id
+                ):
+                    raise ValueError(f"Invoice line {index} does not match product {product_id}")
+                candidates = [index]
+            else:
+                candidates = [i for i, line in enumerate(lines) if line.get("product_id") == product_id]
+                if not candidates:
+                    raise ValueError(f"Product {product_id} is not on this invoice")
+
+            left = quantity
+            for index in candidates:
+                take = min(remaining[index], left)
+                if take <= 0:
+                    continue
+                remaining[index] -= take
+                left -= take
+                allocations.append(
+                    {
+                        "line_index": index,
+                        "product_id": lines[index].get("product_id"),
+                        "product_name": lines[index].get("product_name"),
+                        "quantity": take,
+                    }
+                )
+                if left <= 0:
+                    break
+            if left > 0:
+                name = lines[candidates[0]].get("product_name") or product_id
+                raise ValueError(
+                    f"Cannot return {quantity} of {name}: only {quantity - left} left to return"
+                )
+        return allocations
+
+    @staticmethod
+    def plan_restoration(
+        consumption: List[Dict[str, Any]],
+        product_id: str,
+        returned_before: Decimal,
+        quantity: Decimal,
+    ) -> List[Dict[str, Any]]:
+        """
+        Layers to put ``quantity`` back into, newest consumption first.
+
+        Quantity already returned is skipped from the newest end, so repeated
+        partial returns walk back through the layers the sale drew from.
+        Anything not covered by recorded consumption gets ``unit_cost`` None
+        (restored at current WAC).
+        """
+        pieces = []
+        skip, left = returned_before, quantity
+        for taken in reversed([c for c in consumption if c.get("product_id") == product_id]):
+            if left <= 0:
+                break
+            available = _dec(taken.get("qty"))
+            if skip >= available:
+                skip -= available
+                continue
+            available -= skip
+            skip = Decimal("0")
+            take = min(available, left)
+            pieces.append(
+                {"layer_id": taken.get("layer_id"), "unit_cost": _dec(taken.get("unit_cost")), "qty": take}
+            )
+            left -= take
+        if left > 0:
+            pieces.append({"layer_id": None, "unit_cost": None, "qty": left})
+        return pieces
+
+    @staticmethod
+    def due_amount(invoice: Dict[str, Any]) -> Decimal:
+        """Outstanding amount of an invoice (stored due_amount, derived for older rows)."""
+        if invoice.get("due_amount") is not None:
+            return _dec(invoice.get("due_amount"))
+        return (
+            _dec(invoice.get("total_amount"))
+            - _dec(invoice.get("amount_paid"))
+            - _dec(invoice.get("credit_applied"))
+        )
+
+    # ------------------------------------------------------------------
+    # Transaction
+    # ------------------------------------------------------------------
+    def process_return(self, invoice_id: str, data: Dict[str, Any], user: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Apply a return in one transaction: stock, cost layers, the level in
+        the invoice's warehouse and its stock ledger rows, the invoice's
+        per-line returned quantities, receivables aging and the customer
+        balance, plus the return record.
+        """
+        invoice_ref = self.db.collection(self.INVOICES).document(invoice_id)
+        return_ref = self.db.collection(self.RETURNS).document()
+
+        @firestore.transactional
+        def _execute(transaction):
+            # PHASE 1: reads (the invoice, then everything it names in one get_all)
+            invoice_snap = invoice_ref.get(transaction=transaction)
+            if not invoice_snap.exists:
+                raise ValueError("Invoice not found")
+            invoice = invoice_snap.to_dict()
+            if invoice.get("company_id") != self.company_id:
+                raise ValueError("Invoice not found")
+            if invoice.get("status") == "returned":
+                raise ValueError("Invoice has already been fully returned")
+
+            lines = [dict(line) for line in invoice.get("items", [])]
+            allocations = self.allocate_lines(lines, data.get("items", []))
+
+            returning: Dict[str, Decimal] = {}
+            for allocation in allocations:
+                pid = allocation["product_id"]
+                returning[pid] = returning.get(pid, Decimal("0")) + allocation["quantity"]
+
+            consumption = invoice.get("cost_consumption") or []
+            restorations = {}
+            for pid, quantity in returning.items():
+                returned_before = sum(
+                    (_dec(line.get("returned_qty")) for line in lines if line.get("product_id") == pid),
+                    Decimal("0"),
+                )
+                restorations[pid] = self.plan_restoration(consumption, pid, returned_before, quantity)
+
+            product_refs = {pid: self.db.collection(self.ITEMS).document(pid) for pid in returning}
+            layer_ids = {
+                piece["layer_id"]
+                for pieces in restorations.values()
+                for piece in pieces
+                if piece["layer_id"]
+            }
+            layer_refs = {lid: self.db.collection(self.LAYERS).document(lid) for lid in layer_ids}
+            customer_id = invoice.get("customer_id")
+            customer_ref = self.db.collection(self.CUSTOMERS).document(customer_id) if customer_id else None
+
+            refs = list(product_refs.values()) + list(layer_refs.values())
+            if customer_ref is not None:
+                refs.append(customer_ref)
+            snapshots = {
+                snap.reference.path: snap
+                for snap in self.db.get_all(refs, transaction=transaction)
+            }
+
+            def _known_layer(piece):
+                snap = snapshots.get(layer_refs[piece["layer_id"]].path) if piece["layer_id"] else None
+                return snap if snap is not None and snap.exists else None
+
+            # Products with pieces whose layer is unknown or gone: their layers
+            # by cost, so those pieces join an existing layer at the same cost
+            by_cost_ids = [
+                pid
+                for pid, pieces in restorations.items()
+                if any(_known_layer(piece) is None for piece in pieces)
+            ]
+            layers_by_cost: Dict[tuple, Any] = {}
+            for start in range(0, len(by_cost_ids), 30):
+                query = (
+                    self.db.collection(self.LAYERS)
+                    .where("company_id", "==", self.company_id)
+                    .where("product_id", "in", by_cost_ids[start : start + 30])
+                )
+                for layer_doc in query.get(transaction=transaction):
+                    key = (layer_doc.get("product_id"), _str(_dec(layer_doc.get("unit_cost"))))
+                    layers_by_cost.setdefault(key, layer_doc)
+
+            # PHASE 2: compute
+            product_updates = {}
+            layer_updates: Dict[str, Decimal] = {}
+            new_layers: Dict[tuple, Decimal] = {}
+            rates: Dict[str, tuple] = {}
+            restored_cost = Decimal("0")
+            for pid, quantity in returning.items():
+                snap = snapshots.get(product_refs[pid].path)
+                if snap is None or not snap.exists:
+                    raise ValueError(f"Product {pid} not found")
+                product = snap.to_dict()
+                current_qty = _dec(product.get("current_qty"))
+                current_wac = _dec(product.get("current_wac"))
+                total_value = _dec(product.get("total_value"))
+                value_before = total_value
+
+                # Pieces grouped per layer (known id, else cost) before any write
+                for piece in restorations[pid]:
+                    unit_cost = piece["unit_cost"] if piece["unit_cost"] is not None else current_wac
+                    total_value += piece["qty"] * unit_cost
+                    restored_cost += piece["qty"] * unit_cost
+                    layer_snap = _known_layer(piece)
+                    if layer_snap is None:
+                        layer_snap = layers_by_cost.get((pid, _str(unit_cost)))
+                    if layer_snap is not None:
+                        layer_refs.setdefault(layer_snap.id, layer_snap.reference)
+                        layer_updates[layer_snap.id] = (
+                            layer_updates.get(layer_snap.id, _dec(layer_snap.get("qty_on_hand")))
+                            + piece["qty"]
+                        )
+                    else:
+                        key = (pid, _str(unit_cost))
+                        new_layers[key] = new_layers.get(key, Decimal("0")) + piece["qty"]
+
+                new_qty = current_qty + quantity
+                new_wac = total_value / new_qty if new_qty > 0 else current_wac
+                rates[pid] = ((total_value - value_before) / quantity, new_wac)
+                product_updates[pid] = with_units({
+                    "current_qty": _str(new_qty),
+                    "total_value": _str(total_value),
+                    "current_wac": _str(new_wac) if new_qty > 0 else product.get("current_wac", "0"),
+                    "updated_at": firestore.SERVER_TIMESTAMP,
+                }, ITEM_AMOUNTS)
+
+            level_deltas: Dict[tuple, Decimal] = {}
+            for allocation in allocations:
+                line = lines[allocation["line_index"]]
+                line["returned_qty"] = _str(_dec(line.get("returned_qty")) + allocation["quantity"])
+                StockLevelService.add(
+                    level_deltas,
+                    StockLevelService.key(
+                        allocation["product_id"], invoice.get("warehouse_id"), line.get("batch_number")
+                    ),
+                    allocation["quantity"],
+                )
+            fully_returned = all(
+                _dec(line.get("returned_qty")) >= _dec(line.get("quantity")) for line in lines
+            )
+
+            if data.get("total_refund") is not None:
+                refund = _dec(data.get("total_refund"))
+            else:
+                refund = sum(
+                    (_dec(item.get("refund_amount")) for item in data.get("items", [])), Decimal("0")
+                )
+            previous_due = self.due_amount(invoice)
+            reduction = min(refund, previous_due) if previous_due > 0 else Decimal("0")
+            settled = reduction > 0 and previous_due - reduction <= 0
+
+            # PHASE 3: writes
+            for pid, update in product_updates.items():
+                transaction.update(product_refs[pid], update)
+            for lid, qty_on_hand in layer_updates.items():
+                transaction.update(
+                    layer_refs[lid],
+                    {"qty_on_hand": _str(qty_on_hand), "updated_at": firestore.SERVER_TIMESTAMP},
+                )
+            for (pid, unit_cost), qty in new_layers.items():
+                transaction.set(
+                    self.db.collection(self.LAYERS).document(),
+                    {
+                        "company_id": self.company_id,
+                        "product_id": pid,
+                        "unit_cost": unit_cost,
+                        "qty_on_hand": _str(qty),
+                        "qty_received_total": _str(qty),
+                        "source": "return",
+                        "created_at": firestore.SERVER_TIMESTAMP,
+                        "updated_at": firestore.SERVER_TIMESTAMP,
+                    },
+                )
+            self.levels.apply(transaction, level_deltas)
+            self.levels.record_ledger(transaction, level_deltas, rates, return_ref.id, "RETURN", customer_id)
+
+            aging_fields = self.aging.reduce(transaction, customer_id, invoice, reduction)
+            invoice_update = {
+                "items": lines,
+                "status": "returned" if fully_returned else "partially_returned",
+                "return_id": return_ref.id,
+                "return_ids": firestore.ArrayUnion([return_ref.id]),
+                "returned_amount": _str(_dec(invoice.get("returned_amount")) + refund),
+                **aging_fields,
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            }
+            if reduction > 0:
+                invoice_update["due_amount"] = _str(previous_due - reduction)
+            if settled:
+                # Nothing left to collect: off the open-invoice queries and aging
+                invoice_update["payment_status"] = "paid"
+                invoice_update["aging_bucket"] = None
+            transaction.update(invoice_ref, invoice_update)
+
+            customer_snap = snapshots.get(customer_ref.path) if customer_ref is not None else None
+            if reduction > 0 and customer_snap is not None and customer_snap.exists:
+                # The refund comes off what the customer owes on this invoice
+                balance = _dec(customer_snap.get("balance"))
+                transaction.update(
+                    customer_ref,
+                    {"balance": _str(balance - reduction), "updated_at": firestore.SERVER_TIMESTAMP},
+                )
+
+            return_items = [
+                {**allocation, "quantity": _str(allocation["quantity"])} for allocation in allocations
+            ]
+            transaction.set(
+                return_ref,
+                {
+                    "company_id": self.company_id,
+                    "invoice_id": invoice_id,
+                    "items": return_items,
+                    "total_refund": _str(refund),
+                    "restored_cost": _str(restored_cost),
+                    "reason": data.get("reason", ""),
+                    "created_by": user.get("uid"),
+                    "created_at": firestore.SERVER_TIMESTAMP,
+                },
+            )
+            return {
+                "id": return_ref.id,
+                "status": "processed",
+                "invoice_status": invoice_update["status"],
+                "items": return_items,
+                "total_refund": _str(refund),
+            }
+
+        return _execute(self.db.transaction())
+
+
+def get_return_service(company_id: str = "default") -> ReturnService:
+    """Factory function to get a return service instance."""
+    return ReturnService(company_id=company_id)
@@ -0,0 +1,314 @@
+"""
+Stock Levels
+On-hand quantity per (item, warehouse, batch), kept next to the company-wide
+``current_qty`` on items. Every stock movement adds its signed quantity in the
+same transaction or batch that records the movement, so "stock in warehouse X"
+and "where is item Y" are indexed reads instead of ledger replays.
+
+Quantities are stored as integer thousandths so movements can use Increment
+without reading the level first.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from google.cloud import firestore
+from app.core.firebase import get_db
+
+# Movements recorded without a warehouse (most API-side stock writes) land here.
+DEFAULT_WAREHOUSE = "main"
+NO_BATCH = "-"
+MILLI = Decimal("1000")
+
+LevelKey = Tuple[str, str, Optional[str]]  # (item_id, warehouse_id, batch_number)
+
+
+def to_milli(quantity: Any) -> int:
+    return int((Decimal(str(quantity)) * MILLI).quantize(Decimal("1"), ROUND_HALF_UP))
+
+
+def from_milli(value: Any) -> Decimal:
+    return Decimal(int(value or 0)) / MILLI
+
+
+def _format(quantity: Decimal) -> str:
+    return format(quantity.normalize(), "f") if quantity else "0"
+
+
+class StockLevelService:
+    """Maintains and queries per-warehouse stock levels."""
+
+    COLLECTION = "stock_levels"
+    LEDGER_COLLECTION = "stock_ledger"
+    ADJUSTMENTS_COLLECTION = "stock_adjustments"
+    ITEMS_COLLECTION = "items"
+    WRITE_BATCH_SIZE = 450
+
+    def __init__(self, company_id: str = "default"):
+        self.db = get_db()
+        self.company_id = company_id
+
+    # ------------------------------------------------------------------
+    # Keys
+    # ------------------------------------------------------------------
+    @staticmethod
+    def key(item_id: str, warehouse_id: Optional[str] = None, batch_number: Optional[str] = None) -> LevelKey:
+        return (item_id, warehouse_id or DEFAULT_WAREHOUSE, batch_number or None)
+
+    def _level_ref(self, key: LevelKey):
+        item_id, warehouse_id, batch_number = key
+        doc_id = "_".join([self.company_id, item_id, warehouse_id, batch_number or NO_BATCH]).replace("/", "-")
+        return self.db.collection(self.COLLECTION).document(doc_id)
+
+    # ------------------------------------------------------------------
+    # Movements
+    # ------------------------------------------------------------------
+    def apply(self, writer, deltas: Dict[LevelKey, Decimal]):
+        """
+        Add signed quantities to levels inside ``writer`` (a transaction or
+        write batch), one write per level. Returns the number of writes.
+        """
+        writes = 0
+        for key, quantity in deltas.items():
+            milli = to_milli(quantity)
+            if not milli:
+                continue
+            item_id, warehouse_id, batch_number = key
+            writer.set(
+                self._level_ref(key),
+                {
+                    "company_id": self.company_id,
+                    "item_id": item_id,
+                    "warehouse_id": warehouse_id,
+                    "batch_number": batch_number,
+                    "quantity_milli": firestore.Increment(milli),
+                    "updated_at": firestore.SERVER_TIMESTAMP,
+                },
+                merge=True,
+            )
+            writes += 1
+        return writes
+
+    def record(
+        self,
+        writer,
+        item_id: str,
+        warehouse_id: Optional[str],
+        quantity: Decimal,
+        batch_number: Optional[str] = None,
+    ):
+        """Single-movement form of ``apply``."""
+        return self.apply(writer, {self.key(item_id, warehouse_id, batch_number): quantity})
+
+    def record_ledger(
+        self,
+        writer,
+        deltas: Dict[LevelKey, Decimal],
+        rates: Dict[str, Tuple[Decimal, Decimal]],
+        source_id: Optional[str] = None,
+        source_type: Optional[str] = None,
+        customer_id: Optional[str] = None,
+    ) -> int:
+        """
+        Write one ``stock_ledger`` row per movement in ``deltas``, for paths
+        that update items themselves instead of through
+        PostingEngine.record_stock_movement (sales, receipts, returns), so
+        stock snapshots and level rebuilds replay them. ``rates`` maps item id
+        -> (unit cost of the movement, valuation rate after it). Returns the
+        number of writes.
+        """
+        writes = 0
+        for (item_id, warehouse_id, batch_number), quantity in deltas.items():
+            if not to_milli(quantity):
+                continue
+            unit_cost, valuation_rate = rates.get(item_id, (Decimal("0"), Decimal("0")))
+            writer.set(
+                self.db.collection(self.LEDGER_COLLECTION).document(),
+                {
+                    "timestamp": firestore.SERVER_TIMESTAMP,
+                    "item_id": item_id,
+                    "warehouse_id": warehouse_id,
+                    "quantity": _format(quantity),
+                    "unit_cost": str(unit_cost),
+                    "valuation_rate": str(valuation_rate),
+                    "source_document_id": source_id,
+                    "source_document_type": source_type,
+                    "batch_number": batch_number,
+                    "customer_id": customer_id,
+                    "company_id": self.company_id,
+                },
+            )
+            writes += 1
+        return writes
+
+    @staticmethod
+    def add(deltas: Dict[LevelKey, Decimal], key: LevelKey, quantity: Decimal):
+        """Accumulate a movement into a deltas map before ``apply``."""
+        deltas[key] = deltas.get(key, Decimal("0")) + quantity
+
+    def available_in(self, transaction, warehouse_id: str, item_ids: Iterable[str]) -> Dict[str, Decimal]:
+        """On-hand quantity per item in one warehouse (all batches), read in ``transaction``."""
+        available = {item_id: Decimal("0") for item_id in item_ids}
+        for (item_id, _), quantity in self.batches_in(transaction, warehouse_id, available).items():
+            available[item_id] += quantity
+        return available
+
+    def batches_in(
+        self, transaction, warehouse_id: str, item_ids: Iterable[str]
+    ) -> Dict[Tuple[str, Optional[str]], Decimal]:
+        """On-hand quantity per (item, batch) in one warehouse, read in ``transaction``."""
+        item_ids = list(item_ids)
+        levels: Dict[Tuple[str, Optional[str]], Decimal] = {}
+        for start in range(0, len(item_ids), 30):
+            query = (
+                self.db.collection(self.COLLECTION)
+                .where("company_id", "==", self.company_id)
+                .where("warehouse_id", "==", warehouse_id)
+                .where("item_id", "in", item_ids[start : start + 30])
+            )
+            for doc in query.get(transaction=transaction):
+                key = (doc.get("item_id"), doc.get("batch_number") or None)
+                levels[key] = levels.get(key, Decimal("0")) + from_milli(doc.get("quantity_milli"))
+        return levels
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _row(doc) -> Dict[str, Any]:
+        data = doc.to_dict() or {}
+        return {
+            "item_id": data.get("item_id"),
+            "warehouse_id": data.get("warehouse_id"),
+            "batch_number": data.get("batch_number"),
+            "quantity": _format(from_milli(data.get("quantity_milli"))),
+        }
+
+    def stock_in_warehouse(self, warehouse_id: str, limit: int = 500) -> List[Dict[str, Any]]:
+        """Non-zero levels in one warehouse, by item."""
+        docs = (
+            self.db.collection(self.COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .where("warehouse_id", "==", warehouse_id)
+            .order_by("item_id")
+            .limit(limit)
+            .stream()
+        )
+        return [row for row in map(self._row, docs) if row["quantity"] != "0"]
+
+    def item_locations(self, item_id: str) -> List[Dict[str, Any]]:
+        """Non-zero levels of one item, by warehouse."""
+        docs = (
+            self.db.collection(self.COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .where("item_id", "==", item_id)
+            .order_by("warehouse_id")
+            .stream()
+        )
+        return [row for row in map(self._row, docs) if row["quantity"] != "0"]
+
+    # ------------------------------------------------------------------
+    # Rebuild
+    # ------------------------------------------------------------------
+    def rebuild(self) -> Dict[str, Any]:
+        """
+        Recompute every level from ``stock_ledger`` and ``stock_adjustments``.
+
+        The two collections hold disjoint movements (the API's manual
+        adjustments and inbound entries write only ``stock_adjustments``), so
+        each movement is replayed once, into the warehouse and batch it
+        names. Movements recorded in neither (receipts, sales and returns from
+        before those wrote ledger rows) are reconciled against each item's
+        ``current_qty``: the difference is booked to the default warehouse, so
+        levels always add up to the company-wide quantity.
+        """
+        totals: Dict[LevelKey, Decimal] = {}
+        sources = (
+            (self.LEDGER_COLLECTION, "item_id", "quantity"),
+            (self.ADJUSTMENTS_COLLECTION, "product_id", "quantity_change"),
+        )
+        replayed = {}
+        for collection, item_field, quantity_field in sources:
+            rows = (
+                self.db.collection(collection)
+                .where("company_id", "==", self.company_id)
+                .select([item_field, "warehouse_id", "batch_number", quantity_field])
+                .stream()
+            )
+            replayed[collection] = 0
+            for doc in rows:
+                data = doc.to_dict() or {}
+                if not data.get(item_field):
+                    continue
+                replayed[collection] += 1
+                self.add(
+                    totals,
+                    self.key(data[item_field], data.get("warehouse_id"), data.get("batch_number")),
+                    Decimal(str(data.get(quantity_field) or 0)),
+                )
+
+        per_item: Dict[str, Decimal] = {}
+        for (item_id, _, _), quantity in totals.items():
+            per_item[item_id] = per_item.get(item_id, Decimal("0")) + quantity
+
+        reconciled = 0
+        items = (
+            self.db.collection(self.ITEMS_COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .select(["current_qty"])
+            .stream()
+        )
+        for doc in items:
+            current_qty = Decimal(str((doc.to_dict() or {}).get("current_qty") or 0))
+            difference = current_qty - per_item.get(doc.id, Decimal("0"))
+            if difference:
+                self.add(totals, self.key(doc.id), difference)
+                reconciled += 1
+
+        existing = (
+            self.db.collection(self.COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .select([])
+            .stream()
+        )
+        current_paths = {self._level_ref(key).path for key in totals}
+        stale = [doc.reference for doc in existing if doc.reference.path not in current_paths]
+
+        batch, pending, written = self.db.batch(), 0, 0
+        for ref in stale:
+            batch.delete(ref)
+            pending += 1
+            if pending >= self.WRITE_BATCH_SIZE:
+                batch.commit()
+                batch, pending = self.db.batch(), 0
+        for key, quantity in totals.items():
+            item_id, warehouse_id, batch_number = key
+            batch.set(
+                self._level_ref(key),
+                {
+                    "company_id": self.company_id,
+                    "item_id": item_id,
+                    "warehouse_id": warehouse_id,
+                    "batch_number": batch_number,
+                    "quantity_milli": to_milli(quantity),
+                    "updated_at": firestore.SERVER_TIMESTAMP,
+                },
+            )
+            pending += 1
+            written += 1
+            if pending >= self.WRITE_BATCH_SIZE:
+                batch.commit()
+                batch, pending = self.db.batch(), 0
+        if pending:
+            batch.commit()
+
+        return {
+            "ledger_rows": replayed[self.LEDGER_COLLECTION],
+            "adjustment_rows": replayed[self.ADJUSTMENTS_COLLECTION],
+            "levels_written": written,
+            "levels_removed": len(stale),
+            "items_reconciled": reconciled,
+        }
+
+
+def get_stock_level_service(company_id: str = "default") -> StockLevelService:
+    """Factory function to get a stock level service instance."""
+    return StockLevelService(company_id=company_id)
@@ -0,0 +1,308 @@
+"""
+Inventory Period Snapshots
+Month-end closing quantity, value and WAC per product, used to answer
+"what was on hand on date X" without replaying the whole stock history.
+"""
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from google.cloud import firestore
+from app.core.firebase import get_db
+
+
+def _to_decimal(value: Any) -> Decimal:
+    try:
+        return Decimal(str(value))
+    except Exception:
+        return Decimal("0")
+
+
+def _month_start(year: int, month: int) -> datetime:
+    return datetime(year, month, 1, tzinfo=timezone.utc)
+
+
+def _next_month_start(year: int, month: int) -> datetime:
+    if month == 12:
+        return _month_start(year + 1, 1)
+    return _month_start(year, month + 1)
+
+
+class StockSnapshotService:
+    """Writes and reads per-product month-end stock snapshots."""
+
+    SNAPSHOTS_COLLECTION = "stock_snapshots"
+    PERIODS_COLLECTION = "stock_snapshot_periods"
+    BATCH_LIMIT = 500
+
+    def __init__(self, company_id: str = "default"):
+        self.db = get_db()
+        self.company_id = company_id
+
+    # ------------------------------------------------------------------
+    # Movements
+    # ------------------------------------------------------------------
+    def _stream_movements(
+        self,
+        start: Optional[datetime],
+        end: datetime,
+        product_id: Optional[str] = None,
+        end_inclusive: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Load stock_ledger and stock_adjustments movements in [start, end), oldest first."""
+        end_op = "<=" if end_inclusive else "<"
+        sources = (
+            ("stock_ledger", "timestamp", "item_id"),
+            ("stock_adjustments", "created_at", "product_id"),
+        )
+
+        movements = []
+        for collection, time_field, product_field in sources:
+            query = self.db.collection(collection).where("company_id", "==", self.company_id)
+            if product_id:
+                query = query.where(product_field, "==", product_id)
+            if start is not None:
+                query = query.where(time_field, ">=", start)
+            query = query.where(time_field, end_op, end).order_by(time_field)
+
+            for doc in query.stream():
+                data = doc.to_dict() or {}
+                if collection == "stock_ledger":
+                    qty = _to_decimal(data.get("quantity", 0))
+                    unit_cost = _to_decimal(data.get("unit_cost", 0))
+                    rate = _to_decimal(data.get("valuation_rate", 0))
+                else:
+                    qty = _to_decimal(data.get("quantity_change", 0))
+                    unit_cost = _to_decimal(data.get("unit_cost", 0))
+                    rate = Decimal("0")
+                movements.append(
+                    {
+                        "product_id": data.get(product_field),
+                        "at": data.get(time_field),
+                        "quantity": qty,
+                        "unit_cost": unit_cost,
+                        "valuation_rate": rate,
+                    }
+                )
+
+        movements.sort(key=lambda m: m["at"] or datetime.min.replace(tzinfo=timezone.utc))
+        return movements
+
+    @staticmethod
+    def _apply_movement(state: Dict[str, Decimal], movement: Dict[str, Any]):
+        """Roll one movement into a {qty, value} state using WAC costing."""
+        qty = movement["quantity"]
+        current_qty = state["qty"]
+        current_value = state["value"]
+
+        if qty > 0:
+            cost = movement["unit_cost"]
+            if cost <= 0:
+                cost = movement["valuation_rate"]
+            if cost <= 0 and current_qty > 0:
+                cost = current_value / current_qty
+            current_value += qty * cost
+        elif qty < 0:
+            wac = current_value / current_qty if current_qty > 0 else movement["valuation_rate"]
+            current_value += qty * wac
+
+        current_qty += qty
+        if current_qty == 0:
+            current_value = Decimal("0")
+
+        state["qty"] = current_qty
+        state["value"] = current_value
+
+    @classmethod
+    def _roll_forward(
+        cls, base: Dict[str, Dict[str, Decimal]], movements: Iterable[Dict[str, Any]]
+    ) -> Dict[str, Dict[str, Decimal]]:
+        states = {pid: dict(state) for pid, state in base.items()}
+        for movement in movements:
+            pid = movement["product_id"]
+            if not pid:
+                continue
+            state = states.setdefault(pid, {"qty": Decimal("0"), "value": Decimal("0")})
+            cls._apply_movement(state, movement)
+        return states
+
+    @staticmethod
+    def _state_row(product_id: str, state: Dict[str, Decimal]) -> Dict[str, str]:
+        qty = state["qty"]
+        value = state["value"]
+        wac = value / qty if qty > 0 else Decimal("0")
+        return {
+            "product_id": product_id,
+            "qty": str(qty),
+            "value": str(value),
+            "wac": str(wac),
+        }
+
+    # ------------------------------------------------------------------
+    # Snapshots
+    # ------------------------------------------------------------------
+    def _latest_period(self, on_or_before: datetime) -> Optional[Dict[str, Any]]:
+        """Most recent completed snapshot whose period_end is <= the given instant."""
+        docs = list(
+            self.db.collection(self.PERIODS_COLLECTION)
+            .where("company_id", "==", self.company_id)
+            .where("period_end", "<=", on_or_before)
+            .order_by("period_end", direction=firestore.Query.DESCENDING)
+            .limit(1)
+            .stream()
+        )
+        return docs[0].to_dict() if docs else None
+
+    def _load_snapshot(
+        self, period: str, product_id: Optional[str] = None
+    ) -> Dict[str, Dict[str, Decimal]]:
+        if product_id:
+            doc = (
+                self.db.collection(self.SNAPSHOTS_COLLECTION)
+                .document(f"{self.company_id}_{period}_{product_id}")
+                .get()
+            )
+            docs = [doc] if doc.exists else []
+        else:
+            docs = (
+                self.db.collection(self.SNAPSHOTS_COLLECTION)
+                .where("company_id", "==", self.company_id)
+                .where("period", "==", period)
+                .stream()
+            )
+
+        base = {}
+        for doc in docs:
+            data = doc.to_dict() or {}
+            base[data.get("product_id")] = {
+                "qty": _to_decimal(data.get("qty", 0)),
+                "value": _to_decimal(data.get("value", 0)),
+            }
+        return base
+
+    def take_snapshot(self, year: int, month: int) -> Dict[str, Any]:
+        """
+        Write closing quantity/value/WAC for every product at the end of a month.
+
+        Rolls forward from the previous completed snapshot, so a run reads one
+        month of movements. The first run for a company seeds from full history.
+
+        Args:
+            year: Calendar year of the period
+            month: Month number (1-12)
+
+        Returns:
+            Summary of the written snapshot period
+        """
+        period = f"{year}-{month:02d}"
+        period_end = _next_month_start(year, month)
+
+        previous = self._latest_period(_month_start(year, month))
+        if previous:
+            base = self._load_snapshot(previous["period"])
+            window_start = previous["period_end"]
+        else:
+            base = {}
+            window_start = None
+
+        movements = self._stream_movements(window_start, period_end)
+        states = self._roll_forward(base, movements)
+
+        total_value = Decimal("0")
+        batch = self.db.batch()
+        pending = 0
+        for product_id, state in states.items():
+            row = self._state_row(product_id, state)
+            total_value += state["value"]
+            ref = self.db.collection(self.SNAPSHOTS_COLLECTION).document(
+                f"{self.company_id}_{period}_{product_id}"
+            )
+            batch.set(
+                ref,
+                {
+                    **row,
+                    "company_id": self.company_id,
+                    "period": period,
+                    "period_end": period_end,
+                    "created_at": firestore.SERVER_TIMESTAMP,
+                },
+            )
+            pending += 1
+            if pending >= self.BATCH_LIMIT:
+                batch.commit()
+                batch = self.db.batch()
+                pending = 0
+
+        summary = {
+            "company_id": self.company_id,
+            "period": period,
+            "period_end": period_end,
+            "previous_period": previous["period"] if previous else None,
+            "product_count": len(states),
+            "movements_read": len(movements),
+            "total_value": str(total_value),
+            "status": "COMPLETE",
+            "created_at": firestore.SERVER_TIMESTAMP,
+        }
+        batch.set(
+            self.db.collection(self.PERIODS_COLLECTION).document(f"{self.company_id}_{period}"),
+            summary,
+        )
+        batch.commit()
+
+        return {
+            **summary,
+            "period_end": period_end.isoformat(),
+            "created_at": datetime.now().isoformat(),
+        }
+
+    def get_valuation_as_of(
+        self, as_of: datetime, product_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Stock quantity and value per product as of an instant.
+
+        Reads the nearest snapshot at or before ``as_of`` and applies only the
+        movements recorded since that snapshot's period end.
+        """
+        if as_of.tzinfo is None:
+            as_of = as_of.replace(tzinfo=timezone.utc)
+
+        snapshot = self._latest_period(as_of)
+        if snapshot:
+            base = self._load_snapshot(snapshot["period"], product_id)
+            window_start = snapshot["period_end"]
+        else:
+            base = {}
+            window_start = None
+
+        movements = self._stream_movements(
+            window_start, as_of, product_id=product_id, end_inclusive=True
+        )
+        states = self._roll_forward(base, movements)
+
+        rows = [self._state_row(pid, state) for pid, state in states.items()]
+        rows.sort(key=lambda r: r["product_id"])
+        total_qty, total_value = self._totals(states.values())
+
+        return {
+            "as_of": as_of.isoformat(),
+            "snapshot_period": snapshot["period"] if snapshot else None,
+            "movements_read": len(movements),
+            "total_qty": str(total_qty),
+            "total_value": str(total_value),
+            "items": rows,
+        }
+
+    @staticmethod
+    def _totals(states: Iterable[Dict[str, Decimal]]) -> Tuple[Decimal, Decimal]:
+        total_qty = Decimal("0")
+        total_value = Decimal("0")
+        for state in states:
+            total_qty += state["qty"]
+            total_value += state["value"]
+        return total_qty, total_value
+
+
+def get_stock_snapshot_service(company_id: str = "default") -> StockSnapshotService:
+    """Factory function to get a stock snapshot service instance."""
+    return StockSnapshotService(company_id=company_id)
@@ -0,0 +1,231 @@
+"""
+Stock Transfers
+Moves stock between warehouses when a transfer is received.
+
+Every line posts an OUT and an IN movement through PostingEngine (ledger rows
+and per-warehouse levels). Items are prefetched with one get_all per
+transaction and checked against the source warehouse's stock levels.
+Transfers too large for one transaction are applied in chunks, with the
+transfer left in "receiving" until the last chunk commits.
+"""
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+from google.cloud import firestore
+from app.core.firebase import get_db
+from app.services.posting import PostingEngine
+from app.services.stock_levels import get_stock_level_service
+
+# Firestore's per-transaction write cap
+WRITE_LIMIT = 500
+# Two ledger rows plus two stock levels per line
+WRITES_PER_LINE = 4
+
+TransferLine = Tuple[str, Optional[str], Decimal]  # (item_id, batch_number, quantity)
+
+
+def _dec(value: Any) -> Decimal:
+    if value is None or value == "":
+        return Decimal("0")
+    return Decimal(str(value))
+
+
+class TransferService:
+    """Posts inter-warehouse transfers."""
+
+    TRANSFERS = "transfers"
+
+    def __init__(self, company_id: Optional[str] = "default"):
+        self.db = get_db()
+        self.company_id = company_id
+        self.posting_engine = PostingEngine()
+        self.levels = get_stock_level_service(company_id)
+
+    # ------------------------------------------------------------------
+    # Planning (pure)
+    # ------------------------------------------------------------------
+    @staticmethod
+    def aggregate_lines(lines: List[Dict[str, Any]]) -> List[TransferLine]:
+        """
+        Merge lines for the same item and batch, keeping first-seen order.
+        Accepts ``product_id`` (API transfers) or ``item_id`` (ERP transfers).
+        """
+        totals: Dict[Tuple[str, Optional[str]], Decimal] = {}
+        for line in lines:
+            item_id = line.get("product_id") or line.get("item_id")
+            if not item_id:
+                raise ValueError("Each transfer line needs a product_id")
+            quantity = _dec(line.get("quantity"))
+            if quantity <= 0:
+                raise ValueError(
+                    f"Quantity must be greater than zero for {line.get('product_name') or item_id}"
+                )
+            key = (item_id, line.get("batch_number") or None)
+            totals[key] = totals.get(key, Decimal("0")) + quantity
+        return [(item_id, batch, quantity) for (item_id, batch), quantity in totals.items()]
+
+    @staticmethod
+    def chunk_lines(lines: List[TransferLine], reserved: int = 1) -> List[List[TransferLine]]:
+        """Split lines so each chunk's writes (plus ``reserved``) fit in one transaction."""
+        per_chunk = max(1, (WRITE_LIMIT - reserved) // WRITES_PER_LINE)
+        return [lines[start : start + per_chunk] for start in range(0, len(lines), per_chunk)]
+
+    # ------------------------------------------------------------------
+    # Transaction helpers
+    # ------------------------------------------------------------------
+    def _prefetch_items(
+        self, transaction, from_warehouse_id: str, chunk: List[TransferLine]
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Read and validate every item in ``chunk`` (one get_all) against its
+        stock in the source warehouse: the line's batch when it names one,
+        otherwise the item's total there.
+        """
+        needed: Dict[str, Decimal] = {}
+        for item_id, _, quantity in chunk:
+            needed[item_id] = needed.get(item_id, Decimal("0")) + quantity
+
+        items = self.posting_engine.get_items_for_transaction(transaction, list(needed))
+        for item_id in needed:
+            item = items.get(item_id)
+            if not item or (self.company_id and item.get("company_id") != self.company_id):
+                raise ValueError(f"Product {item_id} not found")
+
+        levels = self.levels.batches_in(transaction, from_warehouse_id, needed)
+        in_warehouse: Dict[str, Decimal] = {}
+        for (item_id, _), quantity in levels.items():
+            in_warehouse[item_id] = in_warehouse.get(item_id, Decimal("0")) + quantity
+        for item_id, batch_number, quantity in chunk:
+            if batch_number:
+                available, requested = levels.get((item_id, batch_number), Decimal("0")), quantity
+            else:
+                available, requested = in_warehouse.get(item_id, Decimal("0")), needed[item_id]
+            if requested > available:
+                name = items[item_id].get("name", item_id)
+                raise ValueError(
+                    f"Insufficient stock for {name}"
+                    + (f" batch {batch_number}" if batch_number else "")
+                    + f" in warehouse {from_warehouse_id}. "
+                    f"Available: {available}, Requested: {requested}"
+                )
+        return items
+
+    def _post_chunk(
+        self,
+        transaction,
+        doc_id: str,
+        from_warehouse_id: str,
+        to_warehouse_id: str,
+        chunk: List[TransferLine],
+        items: Dict[str, Dict[str, Any]],
+    ) -> int:
+        writes = 0
+        for item_id, batch_number, quantity in chunk:
+            writes += self.posting_engine.record_stock_transfer(
+                transaction,
+                item_id,
+                from_warehouse_id,
+                to_warehouse_id,
+                quantity,
+                doc_id,
+                items[item_id],
+                batch_number=batch_number,
+            )
+        return writes
+
+    @staticmethod
+    def _check_warehouses(from_warehouse_id: Optional[str], to_warehouse_id: Optional[str]):
+        if not from_warehouse_id or not to_warehouse_id:
+            raise ValueError("Source and destination warehouses are required")
+        if from_warehouse_id == to_warehouse_id:
+            raise ValueError("Source and destination warehouses must differ")
+
+    # ------------------------------------------------------------------
+    # Entry points
+    # ------------------------------------------------------------------
+    def post_transfer(
+        self,
+        doc_id: str,
+        from_warehouse_id: str,
+        to_warehouse_id: str,
+        lines: List[Dict[str, Any]],
+    ) -> int:
+        """
+        Post a transfer that has no transfer document (ERP transfers).
+        Returns the number of transactions used.
+        """
+        self._check_warehouses(from_warehouse_id, to_warehouse_id)
+        chunks = self.chunk_lines(self.aggregate_lines(lines), reserved=0)
+
+        @firestore.transactional
+        def _apply(transaction, chunk):
+            items = self._prefetch_items(transaction, from_warehouse_id, chunk)
+            self._post_chunk(transaction, doc_id, from_warehouse_id, to_warehouse_id, chunk, items)
+
+        for chunk in chunks:
+            _apply(self.db.transaction(), chunk)
+        return len(chunks)
+
+    def receive(self, transfer_id: str, user: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Apply the ``in_transit -> received`` transition: move every line from
+        the source to the destination warehouse.
+
+        Each chunk re-reads the transfer and skips itself if already applied,
+        so a receipt interrupted part-way can simply be retried.
+        """
+        transfer_ref = self.db.collection(self.TRANSFERS).document(transfer_id)
+        snap = transfer_ref.get()
+        if not snap.exists or snap.get("company_id") != self.company_id:
+            raise ValueError("Transfer not found")
+        transfer = snap.to_dict()
+        if transfer.get("status") not in ("in_transit", "receiving"):
+            raise ValueError(
+                f"Invalid status transition from {transfer.get('status')} to received"
+            )
+
+        from_warehouse_id = transfer.get("from_warehouse")
+        to_warehouse_id = transfer.get("to_warehouse")
+        self._check_warehouses(from_warehouse_id, to_warehouse_id)
+        chunks = self.chunk_lines(self.aggregate_lines(transfer.get("items", []))) or [[]]
+
+        @firestore.transactional
+        def _apply(transaction, index, chunk):
+            # PHASE 1: reads (the transfer, then every item in one get_all)
+            current = transfer_ref.get(transaction=transaction).to_dict() or {}
+            status = current.get("status")
+            if status == "receiving" and current.get("chunks_applied", 0) > index:
+                return False
+            if status not in ("in_transit", "receiving"):
+                raise ValueError(f"Invalid status transition from {status} to received")
+            items = self._prefetch_items(transaction, from_warehouse_id, chunk)
+
+            # PHASE 2: writes
+            self._post_chunk(transaction, transfer_id, from_warehouse_id, to_warehouse_id, chunk, items)
+            is_last = index == len(chunks) - 1
+            update = {
+                "status": "received" if is_last else "receiving",
+                "chunks_applied": index + 1,
+                "chunk_count": len(chunks),
+                "updated_at": firestore.SERVER_TIMESTAMP,
+                "updated_by": user.get("uid"),
+            }
+            if is_last:
+                update["received_by"] = user.get("uid")
+                update["received_at"] = firestore.SERVER_TIMESTAMP
+            transaction.update(transfer_ref, update)
+            return True
+
+        for index, chunk in enumerate(chunks):
+            _apply(self.db.transaction(), index, chunk)
+
+        return {
+            "id": transfer_id,
+            "status": "received",
+            "lines": sum(len(chunk) for chunk in chunks),
+            "chunks": len(chunks),
+        }
+
+
+def get_transfer_service(company_id: Optional[str] = "default") -> TransferService:
+    """Factory function to get a transfer service instance."""
+    return TransferService(company_id=company_id)
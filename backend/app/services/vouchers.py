@@ -6,6 +6,7 @@ from app.schemas.accounting import (
     CreditNoteCreate, JournalEntryCreate, JournalLineBase
 )
 from .accounting import AccountingService
+from .chart_of_accounts import resolve_account_id
 from decimal import Decimal
 
 class VoucherService:
@@ -61,7 +62,7 @@ class VoucherService:
             je_ref = db.collection("journal_entries").document()
             je_lines_dict = [line.model_dump() for line in lines]
             
-            transaction.set(je_ref, {
+            je_data = {
                 "number": f"JE-PV-{data.voucher_number}",
                 "date": firestore.SERVER_TIMESTAMP,
                 "description": f"Payment Voucher {data.voucher_number} - {data.payee}",
@@ -70,10 +71,11 @@ class VoucherService:
                 "company_id": data.company_id,
                 "source_doc_id": pv_ref.id,
                 "source_doc_type": "PV"
-            })
+            }
+            transaction.set(je_ref, je_data)
 
             # Post using account data fetched earlier
-            engine.post_journal_entry(transaction, je_ref.id, je_lines_dict, accounts_data)
+            engine.post_journal_entry(transaction, je_ref.id, je_lines_dict, accounts_data, entry=je_data)
             
             # AP Settlement Logic
             from .bills import BillService
@@ -126,6 +128,9 @@ class VoucherService:
         Dr: Cash/Bank Account
         Cr: Accounts Receivable / Customer Account
         """
+        # Default AR account, resolved from the cached chart
+        default_ar_id = resolve_account_id(data.company_id, "122", "122")
+
         transaction = self.db.transaction()
         
         @firestore.transactional
@@ -136,28 +141,7 @@ class VoucherService:
             if not customer:
                 raise ValueError("Customer not found")
             
-            ar_account_id = customer.get("ar_account_id")
-            if not ar_account_id:
-                # Resolve code "122" to ID within transaction
-                ar_query = db.collection("accounts")\
-                    .where("company_id", "==", data.company_id)\
-                    .where("code", "==", "122")\
-                    .limit(1)
-                ar_snaps = ar_query.get(transaction=transaction)
-                if ar_snaps:
-                    ar_account_id = ar_snaps[0].id
-                else:
-                    ar_account_id = "122" # Final fallback (still risky if ID != code)
-                    # Raising error is safer but maybe 122 IS the ID in some seeds?
-                    # The user error suggests it is NOT.
-                    # Let's check the diag output again. Code 122 has ID PCt55l6cIsbQcpJUcz7S.
-                    # So we MUST find it.
-            
-            if not ar_account_id or ar_account_id == "122":
-                # If we still have 122 or None, and it wasn't found by code
-                # we should try one more thing: checking if an account with ID "122" exists?
-                # No, let's just use the result of the query.
-                pass
+            ar_account_id = customer.get("ar_account_id") or default_ar_id
 
             account_ids = [data.cash_bank_account_id, ar_account_id]
             from .posting import PostingEngine
@@ -196,7 +180,7 @@ class VoucherService:
             je_ref = db.collection("journal_entries").document()
             je_lines_dict = [line.model_dump() for line in lines]
 
-            transaction.set(je_ref, {
+            je_data = {
                 "number": f"JE-RV-{data.receipt_number}",
                 "date": firestore.SERVER_TIMESTAMP,
                 "description": f"Receipt Voucher {data.receipt_number}",
@@ -205,10 +189,11 @@ class VoucherService:
                 "company_id": data.company_id,
                 "source_doc_id": rv_ref.id,
                 "source_doc_type": "RV"
-            })
+            }
+            transaction.set(je_ref, je_data)
 
             # Post using account data
-            engine.post_journal_entry(transaction, je_ref.id, je_lines_dict, accounts_data)
+            engine.post_journal_entry(transaction, je_ref.id, je_lines_dict, accounts_data, entry=je_data)
             
             # Settlement Logic: Update linked invoices
             for settlement in data.linked_invoices:
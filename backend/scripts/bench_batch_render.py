@@ -0,0 +1,105 @@
+"""
+Batch PDF rendering throughput benchmark.
+
+Renders synthetic invoices, bills and vouchers one at a time in this process
+(as the per-invoice endpoint does) and across a spawn-context process pool
+(as POST /documents/print-batch does), then merges the pool output into one
+PDF, and reports documents per second for each. No Firestore access needed.
+
+    python scripts/bench_batch_render.py --documents 200 --lines 15
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from pypdf import PdfReader, PdfWriter  # noqa: E402
+
+from app.services.pdf import render_document  # noqa: E402
+
+BRANDING = {
+    "company_name": "Bench Trading Co.",
+    "location": "Erbil",
+    "phone": "+964 750 000 0000",
+    "invoice_note": "Goods sold are not returnable after 7 days.",
+}
+
+
+def _jobs(count: int, lines: int):
+    jobs = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            data = {
+                "invoice_number": f"INV-{i:05d}",
+                "customer_name": f"Customer {i}",
+                "issue_date": "2026-01-15",
+                "items": [
+                    {"product_name": f"Product {n}", "quantity": n + 1, "price": 1250 * (n + 1)}
+                    for n in range(lines)
+                ],
+            }
+            jobs.append((data, "INVOICE", BRANDING))
+        elif kind == 1:
+            data = {
+                "bill_number": f"BILL-{i:05d}",
+                "supplier_name": f"Supplier {i}",
+                "date": "2026-01-15",
+                "lines": [
+                    {"description": f"Material {n}", "quantity": n + 2, "unit_cost": 900}
+                    for n in range(lines)
+                ],
+            }
+            jobs.append((data, "BILL", BRANDING))
+        else:
+            data = {"voucher_number": f"PV-{i:05d}", "payee": f"Payee {i}", "amount": "250000"}
+            jobs.append((data, "PAYMENT VOUCHER", BRANDING))
+    return jobs
+
+
+def _report(label: str, count: int, elapsed: float, size: int):
+    print(f"{label:>22}: {count} docs in {elapsed:.2f}s ({count / elapsed:.1f} docs/s, {size / 1024:.0f} KiB)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=15, help="lines per invoice/bill")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    jobs = _jobs(args.documents, args.lines)
+
+    started = time.perf_counter()
+    serial = [render_document(job) for job in jobs]
+    _report("serial (1 thread)", len(jobs), time.perf_counter() - started, sum(map(len, serial)))
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        # Warm the workers so spawn/import cost is not counted per batch
+        list(pool.map(render_document, jobs[: args.workers]))
+
+        chunksize = max(1, len(jobs) // (args.workers * 4))
+        started = time.perf_counter()
+        pooled = list(pool.map(render_document, jobs, chunksize=chunksize))
+        rendered = time.perf_counter() - started
+        _report(f"pool ({args.workers} workers)", len(jobs), rendered, sum(map(len, pooled)))
+
+        started = time.perf_counter()
+        writer = PdfWriter()
+        for content in pooled:
+            writer.append(PdfReader(io.BytesIO(content)))
+        merged = io.BytesIO()
+        writer.write(merged)
+        _report("pool + merged PDF", len(jobs), rendered + time.perf_counter() - started, merged.tell())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Customer search benchmark (Firestore emulator only).
+
+Seeds a company with synthetic customers and compares the indexed
+search_keys lookup against the old full-scan substring filter.
+
+    export FIRESTORE_EMULATOR_HOST=localhost:8080
+    python scripts/bench_customer_search.py --customers 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from google.cloud import firestore
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.services.customer_search import build_search_fields, search_customers  # noqa: E402
+
+FIRST_NAMES = ["Ahmed", "أحمد", "Ali", "علي", "Zainab", "زينب", "Hussein", "Fatima", "Omar", "Noor"]
+LAST_NAMES = ["Al-Jubouri", "الربيعي", "Kareem", "Hassan", "العبيدي", "Saleh", "Mahdi", "Jaber"]
+
+
+def seed(db, company_id: str, count: int):
+    batch = db.batch()
+    pending = 0
+    phones = []
+    for i in range(count):
+        phone = f"077{random.randint(0, 99999999):08d}"
+        phones.append(phone)
+        customer = {
+            "company_id": company_id,
+            "first_name": random.choice(FIRST_NAMES),
+            "last_name": random.choice(LAST_NAMES),
+            "phone": phone,
+            "email": f"customer{i}@example.com",
+            "balance": "0.00",
+        }
+        customer.update(build_search_fields(customer))
+        batch.set(db.collection("customers").document(), customer)
+        pending += 1
+        if pending >= 400:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    return phones
+
+
+def legacy_scan(db, company_id: str, query: str):
+    query_lower = query.lower()
+    results = []
+    for doc in db.collection("customers").where("company_id", "==", company_id).stream():
+        data = doc.to_dict()
+        name = f"{data.get('first_name', '')} {data.get('last_name', '')}".lower()
+        if query_lower in name or query_lower in str(data.get("phone") or "").lower():
+            results.append(doc)
+    return results
+
+
+def timed(fn, runs: int):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 1),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--legacy-runs", type=int, default=3)
+    parser.add_argument("--company", default="bench_customer_search")
+    parser.add_argument("--skip-seed", action="store_true")
+    args = parser.parse_args()
+
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        raise SystemExit("FIRESTORE_EMULATOR_HOST is not set; refusing to seed a real project")
+
+    db = firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "demo-bench"))
+
+    if args.skip_seed:
+        phones = ["07701234567"]
+    else:
+        print(f"Seeding {args.customers} customers...")
+        phones = seed(db, args.company, args.customers)
+
+    queries = [random.choice(phones)[:7], random.choice(phones), "ahm", "زين"]
+    for query in queries:
+        indexed = timed(lambda: search_customers(db, args.company, query), args.runs)
+        legacy = timed(lambda: legacy_scan(db, args.company, query), args.legacy_runs)
+        print(f"{query!r:>16}  indexed {indexed}  legacy scan {legacy}")
+
+
+if __name__ == "__main__":
+    main()
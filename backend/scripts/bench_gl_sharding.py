@@ -0,0 +1,147 @@
+"""
+GL posting throughput benchmark, with and without sharded balances
+(Firestore emulator only).
+
+Seeds a cash and a revenue account, then has many concurrent posters
+(processes x threads) create sale-like journal entries against them for a
+fixed time: once with both accounts unsharded (every posting rewrites the
+two account documents) and once with both promoted to shards. Reports
+postings per second, latency, and whether the summed balances match.
+
+    export FIRESTORE_EMULATOR_HOST=localhost:8080
+    python scripts/bench_gl_sharding.py --processes 4 --threads 8 --seconds 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+AMOUNT = Decimal("1250.5000")
+
+
+def _configure_db():
+    from google.cloud import firestore
+    from app.core import firebase
+
+    firebase._db = firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "demo-bench"))
+    firebase._initialized = True
+    return firebase._db
+
+
+def _seed(company_id: str, shards: int):
+    db = _configure_db()
+    ids = {}
+    for code, name, acct_type in (("1101", "Cash", "ASSET"), ("41", "Sales", "REVENUE")):
+        ref = db.collection("accounts").document(f"{company_id}_{code}")
+        account = {
+            "company_id": company_id,
+            "code": code,
+            "name_en": name,
+            "type": acct_type,
+            "total_debit": "0",
+            "total_credit": "0",
+            "balance": "0",
+        }
+        if shards:
+            account["balance_shards"] = shards
+        ref.set(account)
+        ids[code] = ref.id
+    return ids["1101"], ids["41"]
+
+
+def _post(company_id: str, cash_id: str, revenue_id: str, deadline: float, shards: int):
+    from app.schemas.accounting import JournalEntryCreate, JournalLineBase
+    from app.services.accounting import AccountingService
+
+    service = AccountingService()
+    # Keep the unsharded run unsharded, and stop promotion from skewing it
+    service.posting_engine.gl_balances.shard_count = shards
+    samples, failures = [], 0
+    while time.time() < deadline:
+        entry = JournalEntryCreate(
+            number="JE-BENCH",
+            description="bench sale",
+            company_id=company_id,
+            lines=[
+                JournalLineBase(account_id=cash_id, debit=str(AMOUNT)),
+                JournalLineBase(account_id=revenue_id, credit=str(AMOUNT)),
+            ],
+        )
+        started = time.perf_counter()
+        try:
+            service.create_journal_entry(entry)
+        except Exception:
+            failures += 1
+            continue
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples, failures
+
+
+def _run_process(args):
+    company_id, cash_id, revenue_id, deadline, shards, threads = args
+    _configure_db()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(
+            pool.map(
+                lambda _: _post(company_id, cash_id, revenue_id, deadline, shards),
+                range(threads),
+            )
+        )
+    return [s for samples, _ in results for s in samples], sum(f for _, f in results)
+
+
+def _balance(account_id: str) -> Decimal:
+    from app.services.gl_balances import get_gl_balance_service
+
+    db = _configure_db()
+    account = db.collection("accounts").document(account_id).get().to_dict()
+    return get_gl_balance_service().account_balance(account_id, account)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--shards", type=int, default=10)
+    args = parser.parse_args()
+
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        raise SystemExit("FIRESTORE_EMULATOR_HOST is not set; refusing to write to a real project")
+
+    run_id = int(time.time())
+    for mode, shards in (("unsharded", 0), (f"{args.shards} shards", args.shards)):
+        company_id = f"bench_gl_{run_id}_{shards}"
+        cash_id, revenue_id = _seed(company_id, shards)
+        deadline = time.time() + args.seconds
+        jobs = [(company_id, cash_id, revenue_id, deadline, shards, args.threads)] * args.processes
+
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            results = list(pool.map(_run_process, jobs))
+        elapsed = time.perf_counter() - started
+
+        samples = sorted(s for smp, _ in results for s in smp)
+        failures = sum(f for _, f in results)
+        if not samples:
+            print(f"{mode:>10}: no postings committed ({failures} failed)")
+            continue
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        expected = AMOUNT * len(samples)
+        consistent = _balance(cash_id) == expected and _balance(revenue_id) == -expected
+        print(
+            f"{mode:>10}: {len(samples)} postings from {args.processes * args.threads} posters "
+            f"in {elapsed:.2f}s ({len(samples) / elapsed:.1f}/s)  "
+            f"p50 {statistics.median(samples):.1f} ms  p99 {p99:.1f} ms  "
+            f"failed={failures} balances_match={consistent}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Offline invoice replay benchmark (Firestore emulator only).
+
+Seeds products and a customer, then replays a backlog of POS invoices three
+ways: one POST /invoices call per invoice, one POST /invoices/bulk call, and
+the same bulk call again (every key already processed). Reports invoices per
+second for each.
+
+    export FIRESTORE_EMULATOR_HOST=localhost:8080
+    python scripts/bench_invoice_bulk.py --invoices 500 --lines 5
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+from google.cloud import firestore
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.core import firebase  # noqa: E402
+from bench_invoice_create import invoice_payload, seed  # noqa: E402
+
+PRODUCTS = 50
+
+
+def backlog(count: int, lines: int):
+    invoices = []
+    for i in range(count):
+        payload = invoice_payload(lines)
+        # Spread lines over the catalogue so chunks share products
+        for n, item in enumerate(payload["items"]):
+            product = (i + n) % PRODUCTS
+            item["product_id"] = f"bench_product_{product}"
+            item["product_name"] = f"Bench product {product}"
+        payload["idempotency_key"] = f"pos-1-{uuid.uuid4()}"
+        invoices.append(payload)
+    return invoices
+
+
+def _report(label: str, count: int, elapsed: float):
+    print(f"{label:>18}: {count} invoices in {elapsed:.2f}s ({count / elapsed:.1f}/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--invoices", type=int, default=500)
+    parser.add_argument("--lines", type=int, default=5)
+    parser.add_argument("--sequential", type=int, default=50, help="invoices posted one at a time")
+    parser.add_argument("--company", default="bench_invoice_bulk")
+    args = parser.parse_args()
+
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        raise SystemExit("FIRESTORE_EMULATOR_HOST is not set; refusing to seed a real project")
+
+    db = firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "demo-bench"))
+    firebase._db = db
+    firebase._initialized = True
+
+    from app.api import create_invoice, create_invoices_bulk
+
+    user = {"uid": "bench", "role": "admin", "company_id": args.company}
+    stock = (args.invoices + args.sequential) * args.lines + 10
+    seed(db, args.company, PRODUCTS, stock=stock)
+
+    started = time.perf_counter()
+    for payload in backlog(args.sequential, args.lines):
+        create_invoice(payload, user)
+    _report("one POST each", args.sequential, time.perf_counter() - started)
+
+    invoices = backlog(args.invoices, args.lines)
+    for label in ("bulk", "bulk replay"):
+        started = time.perf_counter()
+        response = create_invoices_bulk({"invoices": invoices}, user)
+        _report(label, len(invoices), time.perf_counter() - started)
+        print(f"{'':>20}{response['counts']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Invoice creation latency benchmark (Firestore emulator only).
+
+Seeds products with stock and a customer, then calls the POST /invoices
+handler directly and reports p50/p99 latency for 1, 10 and 50 line invoices.
+
+    export FIRESTORE_EMULATOR_HOST=localhost:8080
+    python scripts/bench_invoice_create.py --runs 100
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from google.cloud import firestore
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.core import firebase  # noqa: E402
+
+LINE_COUNTS = (1, 10, 50)
+
+
+def seed(db, company_id: str, product_count: int, stock: int):
+    batch = db.batch()
+    for i in range(product_count):
+        product_id = f"bench_product_{i}"
+        batch.set(
+            db.collection("items").document(product_id),
+            {
+                "company_id": company_id,
+                "name": f"Bench product {i}",
+                "sku": f"BENCH-{i:04d}",
+                "cost_price": "1.00",
+                "current_qty": str(stock),
+                "current_wac": "1.00",
+                "total_value": str(stock),
+            },
+        )
+        batch.set(
+            db.collection("stock_cost_layers").document(f"bench_layer_{i}"),
+            {
+                "company_id": company_id,
+                "product_id": product_id,
+                "unit_cost": "1.00",
+                "qty_on_hand": str(stock),
+                "qty_received_total": str(stock),
+                "created_at": firestore.SERVER_TIMESTAMP,
+            },
+        )
+    batch.set(
+        db.collection("customers").document("bench_customer"),
+        {"company_id": company_id, "first_name": "Bench", "balance": "0.00"},
+    )
+    batch.commit()
+
+
+def invoice_payload(line_count: int):
+    items = [
+        {
+            "product_id": f"bench_product_{i}",
+            "product_name": f"Bench product {i}",
+            "quantity": 1,
+            "price": 2,
+        }
+        for i in range(line_count)
+    ]
+    return {
+        "customer_id": "bench_customer",
+        "customer_name": "Bench",
+        "items": items,
+        "subtotal": 2 * line_count,
+        "total_amount": 2 * line_count,
+        "amount_paid": 2 * line_count,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--company", default="bench_invoice_create")
+    args = parser.parse_args()
+
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        raise SystemExit("FIRESTORE_EMULATOR_HOST is not set; refusing to seed a real project")
+
+    db = firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "demo-bench"))
+    firebase._db = db
+    firebase._initialized = True
+
+    from app.api import create_invoice
+
+    user = {"uid": "bench", "role": "admin", "company_id": args.company}
+    seed(db, args.company, max(LINE_COUNTS), stock=args.runs * len(LINE_COUNTS) + 10)
+
+    for line_count in LINE_COUNTS:
+        samples = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            create_invoice(invoice_payload(line_count), user)
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        print(
+            f"{line_count:>3} lines  p50 {statistics.median(samples):7.1f} ms"
+            f"  p99 {p99:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
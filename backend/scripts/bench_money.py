@@ -0,0 +1,148 @@
+"""
+Amount arithmetic benchmark: decimal strings vs native fixed-point integers
+(pure CPU, no Firestore needed).
+
+Replays the two hot loops that touch stored amounts:
+
+- posting: per line, read an account's total_debit / total_credit, add the
+  line and write the new totals back (plus the item qty/WAC/value update of
+  a stock movement);
+- reporting: sum balances of every account for a trial balance.
+
+Each loop runs once on documents holding decimal strings (parsed with
+Decimal(str()) and re-stringified, as before) and once on documents holding
+``_units`` integers through app.core.money. Reports ops per second and
+checks both paths produce the same totals.
+
+    python scripts/bench_money.py --lines 200000 --accounts 5000
+"""
+import argparse
+import random
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.core.money import Money, Quantity, Rate, rate_of, value_of  # noqa: E402
+
+
+def _amounts(count: int, seed: int):
+    rng = random.Random(seed)
+    return [f"{rng.randint(1, 5_000_000) / 10_000:.4f}" for _ in range(count)]
+
+
+def _posting_decimal(account: dict, debits, quantities, wacs):
+    for amount, qty, wac in zip(debits, quantities, wacs):
+        total_debit = Decimal(str(account["total_debit"])) + Decimal(amount)
+        total_credit = Decimal(str(account["total_credit"]))
+        account["total_debit"] = str(total_debit)
+        account["balance"] = str(total_debit - total_credit)
+
+        current_qty = Decimal(str(account["qty"])) + Decimal(qty)
+        total_value = Decimal(str(account["value"])) + Decimal(qty) * Decimal(wac)
+        account["qty"] = str(current_qty)
+        account["value"] = str(total_value)
+        account["wac"] = str(total_value / current_qty)
+    return Decimal(account["balance"])
+
+
+def _posting_units(account: dict, debits, quantities, wacs):
+    for amount, qty, wac in zip(debits, quantities, wacs):
+        total_debit = Money(account["total_debit_units"]) + amount
+        total_credit = Money(account["total_credit_units"])
+        account["total_debit_units"] = total_debit.units
+        account["balance_units"] = (total_debit - total_credit).units
+
+        current_qty = Quantity(account["qty_units"]) + qty
+        total_value = Money(account["value_units"]) + value_of(qty, wac)
+        account["qty_units"] = current_qty.units
+        account["value_units"] = total_value.units
+        account["wac_units"] = rate_of(total_value, current_qty).units
+    return Money(account["balance_units"]).to_decimal()
+
+
+def _report_decimal(accounts):
+    debit = credit = Decimal("0")
+    for account in accounts:
+        balance = Decimal(str(account["balance"]))
+        if balance > 0:
+            debit += balance
+        else:
+            credit += -balance
+    return debit, credit
+
+
+def _report_units(accounts):
+    debit = credit = 0
+    for account in accounts:
+        balance = account["balance_units"]
+        if balance > 0:
+            debit += balance
+        else:
+            credit -= balance
+    return Money(debit).to_decimal(), Money(credit).to_decimal()
+
+
+def _timed(label: str, ops: int, fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - started
+    print(f"{label:>22}: {ops} ops in {elapsed:.3f}s ({ops / elapsed:,.0f}/s)")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=200_000)
+    parser.add_argument("--accounts", type=int, default=5_000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    debits = _amounts(args.lines, args.seed)
+    quantities = [str(random.Random(args.seed + i).randint(1, 50)) for i in range(args.lines)]
+    wacs = _amounts(args.lines, args.seed + 1)
+    balances = [a if i % 2 else "-" + a for i, a in enumerate(_amounts(args.accounts, args.seed + 2))]
+
+    # Parsing happens once at the edge (request bodies); stored values are already native
+    parsed = (
+        [Money.parse(a) for a in debits],
+        [Quantity.parse(q) for q in quantities],
+        [Rate.parse(w) for w in wacs],
+    )
+
+    legacy, legacy_s = _timed(
+        "posting / decimal str",
+        args.lines,
+        _posting_decimal,
+        {"total_debit": "0", "total_credit": "0", "balance": "0", "qty": "0", "value": "0", "wac": "0"},
+        debits,
+        quantities,
+        wacs,
+    )
+    native, native_s = _timed(
+        "posting / fixed int",
+        args.lines,
+        _posting_units,
+        {"total_debit_units": 0, "total_credit_units": 0, "balance_units": 0, "qty_units": 0, "value_units": 0},
+        *parsed,
+    )
+    print(f"{'':>22}  speed-up x{legacy_s / native_s:.2f}  balances_match={legacy == native}")
+
+    legacy_docs = [{"balance": b} for b in balances]
+    native_docs = [{"balance_units": Money.parse(b).units} for b in balances]
+    rounds = max(1, args.lines // args.accounts)
+    legacy_tb, legacy_s = _timed(
+        "trial balance / str", args.accounts * rounds,
+        lambda: [_report_decimal(legacy_docs) for _ in range(rounds)][-1],
+    )
+    native_tb, native_s = _timed(
+        "trial balance / int", args.accounts * rounds,
+        lambda: [_report_units(native_docs) for _ in range(rounds)][-1],
+    )
+    print(f"{'':>22}  speed-up x{legacy_s / native_s:.2f}  totals_match={legacy_tb == native_tb}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Document number contention benchmark (Firestore emulator only).
+
+Runs many concurrent creators (processes x threads) drawing numbers from one
+sequence, in block-allocated and gapless mode, and reports throughput,
+latency and whether every number was unique.
+
+    export FIRESTORE_EMULATOR_HOST=localhost:8080
+    python scripts/bench_sequences.py --processes 4 --threads 8 --numbers 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def _configure_db():
+    from google.cloud import firestore
+    from app.core import firebase
+
+    firebase._db = firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "demo-bench"))
+    firebase._initialized = True
+
+
+def _draw(company_id: str, doc_type: str, gapless: bool, block_size: int, count: int):
+    from app.services.numbering import NumberingService
+
+    service = NumberingService(company_id, block_size=block_size)
+    service.gapless_types = {doc_type} if gapless else set()
+
+    numbers, samples = [], []
+    for _ in range(count):
+        start = time.perf_counter()
+        numbers.append(service.get_next_number(doc_type))
+        samples.append((time.perf_counter() - start) * 1000)
+    return numbers, samples
+
+
+def _run_process(args):
+    company_id, doc_type, gapless, block_size, threads, count = args
+    _configure_db()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(
+            pool.map(
+                lambda _: _draw(company_id, doc_type, gapless, block_size, count),
+                range(threads),
+            )
+        )
+    numbers = [n for nums, _ in results for n in nums]
+    samples = [s for _, smp in results for s in smp]
+    return numbers, samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--numbers", type=int, default=50, help="numbers per creator")
+    parser.add_argument("--block-size", type=int, default=50)
+    args = parser.parse_args()
+
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        raise SystemExit("FIRESTORE_EMULATOR_HOST is not set; refusing to write to a real project")
+
+    run_id = int(time.time())
+    for mode, gapless in (("block", False), ("gapless", True)):
+        doc_type = f"bench_{mode}_{run_id}"
+        jobs = [
+            ("bench_sequences", doc_type, gapless, args.block_size, args.threads, args.numbers)
+        ] * args.processes
+
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            results = list(pool.map(_run_process, jobs))
+        elapsed = time.perf_counter() - started
+
+        numbers = [n for nums, _ in results for n in nums]
+        samples = sorted(s for _, smp in results for s in smp)
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        print(
+            f"{mode:>8}: {len(numbers)} numbers from {args.processes * args.threads} creators "
+            f"in {elapsed:.2f}s ({len(numbers) / elapsed:.0f}/s)  "
+            f"p50 {statistics.median(samples):.1f} ms  p99 {p99:.1f} ms  "
+            f"unique={len(set(numbers)) == len(numbers)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
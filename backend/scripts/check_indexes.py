@@ -0,0 +1,71 @@
+"""
+Composite index check for CI.
+
+Fails when a query shape declared in app/core/indexes.py has no matching
+index in firestore.indexes.json. With --emulator it also runs every shape
+against the Firestore emulator, which catches shapes Firestore rejects
+outright (e.g. an inequality not matching the first order_by). The
+emulator does not enforce composite indexes, so coverage itself is always
+checked against the manifest.
+
+    python scripts/check_indexes.py
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python scripts/check_indexes.py --emulator
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.core.indexes import QUERY_SHAPES, missing_indexes  # noqa: E402
+
+
+def run_against_emulator() -> int:
+    from google.cloud import firestore
+
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        print("FIRESTORE_EMULATOR_HOST is not set")
+        return 1
+
+    db = firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "demo-index-check"))
+    failures = 0
+    for label, collection, equality, ordered in QUERY_SHAPES:
+        query = db.collection(collection)
+        for field in equality:
+            query = query.where(field, "==", "index-check")
+        for field, order in ordered:
+            if order == "CONTAINS":
+                query = query.where(field, "array_contains", "index-check")
+            else:
+                direction = (
+                    firestore.Query.DESCENDING if order == "DESC" else firestore.Query.ASCENDING
+                )
+                query = query.where(field, ">=", "").order_by(field, direction=direction)
+        try:
+            query.limit(1).get()
+        except Exception as e:
+            failures += 1
+            print(f"FAIL {label} ({collection}): {e}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emulator", action="store_true")
+    args = parser.parse_args()
+
+    missing = missing_indexes()
+    for label, collection, fields in missing:
+        spec = ", ".join(f"{f['fieldPath']} {f.get('order') or f.get('arrayConfig')}" for f in fields)
+        print(f"MISSING {label}: {collection} ({spec})")
+
+    failures = run_against_emulator() if args.emulator else 0
+
+    if missing or failures:
+        raise SystemExit(1)
+    print(f"OK: {len(QUERY_SHAPES)} query shapes covered by firestore.indexes.json")
+
+
+if __name__ == "__main__":
+    main()
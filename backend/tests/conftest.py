@@ -0,0 +1,204 @@
+"""
+In-memory Firestore stand-in for service tests.
+
+Covers the client surface the services use: documents, batches,
+transactions (``firestore.transactional`` runs the function once and commits
+or discards its writes), get_all and simple where/order_by/limit/start_after queries.
+"""
+import sys
+from datetime import datetime, timezone
+from itertools import count
+
+import pytest
+
+try:
+    import firebase_admin  # noqa: F401
+    from google.cloud import firestore
+except ImportError:  # Firestore client not installed: nothing to run
+    firestore = None
+    collect_ignore_glob = ["test_*.py"]
+
+_ids = count(1)
+
+_OPS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "in": lambda a, b: a in b,
+    "array_contains": lambda a, b: b in (a or []),
+    "array_contains_any": lambda a, b: any(value in (a or []) for value in b),
+}
+
+
+def _resolve(current, value):
+    if value is firestore.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, firestore.Increment):
+        return (current or 0) + value.value
+    if isinstance(value, dict):
+        base = current if isinstance(current, dict) else {}
+        return {**base, **{k: _resolve(base.get(k), v) for k, v in value.items()}}
+    return value
+
+
+class FakeSnapshot:
+    def __init__(self, ref, data):
+        self.reference = ref
+        self.id = ref.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocument:
+    def __init__(self, db, collection, doc_id):
+        self._db = db
+        self.id = doc_id
+        self.path = f"{collection}/{doc_id}"
+
+    def get(self, transaction=None):
+        return FakeSnapshot(self, self._db.docs.get(self.path))
+
+    def set(self, data, merge=False):
+        self._db.write(self, data, merge)
+
+    def update(self, data):
+        if self.path not in self._db.docs:
+            raise KeyError(f"No document to update: {self.path}")
+        self._db.write(self, data, True)
+
+
+class FakeQuery:
+    def __init__(self, db, collection, filters=(), order=(), limit=None, cursor=None):
+        self._db = db
+        self._collection = collection
+        self._filters = list(filters)
+        self._order = list(order)
+        self._limit = limit
+        self._cursor = cursor
+
+    def _copy(self, **changes):
+        query = FakeQuery(self._db, self._collection, self._filters, self._order, self._limit, self._cursor)
+        for name, value in changes.items():
+            setattr(query, name, value)
+        return query
+
+    def where(self, field, op, value):
+        return self._copy(_filters=self._filters + [(field, op, value)])
+
+    def order_by(self, field, direction=None):
+        return self._copy(_order=self._order + [(field, direction == "DESCENDING")])
+
+    def limit(self, limit):
+        return self._copy(_limit=limit)
+
+    def start_after(self, snapshot):
+        return self._copy(_cursor=snapshot.reference.path)
+
+    def select(self, fields):
+        return self
+
+    def stream(self, transaction=None):
+        prefix = self._collection + "/"
+        docs = [
+            FakeSnapshot(FakeDocument(self._db, self._collection, path[len(prefix):]), data)
+            for path, data in self._db.docs.items()
+            if path.startswith(prefix)
+            and all(_OPS[op](data.get(field), value) for field, op, value in self._filters)
+        ]
+        for field, descending in reversed(self._order):
+            docs.sort(key=lambda snap: snap.get(field), reverse=descending)
+        if self._cursor is not None:
+            paths = [snap.reference.path for snap in docs]
+            docs = docs[paths.index(self._cursor) + 1 :]
+        return docs[: self._limit] if self._limit is not None else docs
+
+    get = stream
+
+
+class FakeCollection(FakeQuery):
+    def document(self, doc_id=None):
+        return FakeDocument(self._db, self._collection, doc_id or f"auto{next(_ids)}")
+
+
+class FakeWriter:
+    """A write batch, or a transaction when ``transactional`` is patched in."""
+
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append(("set", ref, data, merge))
+
+    def update(self, ref, data):
+        self._writes.append(("update", ref, data, True))
+
+    def delete(self, ref):
+        self._writes.append(("delete", ref, None, False))
+
+    def commit(self):
+        for kind, ref, data, merge in self._writes:
+            if kind == "delete":
+                self._db.docs.pop(ref.path, None)
+            elif kind == "update":
+                ref.update(data)
+            else:
+                ref.set(data, merge)
+        self._writes = []
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.docs = {}
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeWriter(self)
+
+    def transaction(self, **kwargs):
+        return FakeWriter(self)
+
+    def get_all(self, refs, transaction=None):
+        return [ref.get() for ref in refs]
+
+    def write(self, ref, data, merge):
+        current = self.docs.get(ref.path) if merge else None
+        self.docs[ref.path] = _resolve(current, data)
+
+    def rows(self, collection):
+        prefix = collection + "/"
+        return [data for path, data in self.docs.items() if path.startswith(prefix)]
+
+
+def _transactional(fn):
+    def run(transaction, *args, **kwargs):
+        result = fn(transaction, *args, **kwargs)
+        transaction.commit()
+        return result
+
+    return run
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A fresh fake database behind ``get_db`` in every loaded app module."""
+    fake = FakeFirestore()
+    for name, module in list(sys.modules.items()):
+        if name.startswith("app.") and hasattr(module, "get_db"):
+            monkeypatch.setattr(module, "get_db", lambda: fake)
+    monkeypatch.setattr(firestore, "transactional", _transactional)
+    return fake
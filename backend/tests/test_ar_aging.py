@@ -0,0 +1,42 @@
+from decimal import Decimal
+
+from app.services.ar_aging import ARAgingService, today_utc
+
+COMPANY = "acme"
+
+
+def test_company_total_is_spread_over_shards_and_summed_on_read(db):
+    aging = ARAgingService(COMPANY, shards=4)
+    for _ in range(20):
+        batch = db.batch()
+        aging.apply_many(batch, {"c1": {"current": Decimal("10")}, "c2": {"1_30": Decimal("2.5")}})
+        batch.commit()
+
+    shard_docs = [path for path in db.docs if path.startswith("ar_aging_totals/")]
+    assert len(shard_docs) > 1
+    assert f"ar_aging_totals/{COMPANY}" not in db.docs
+
+    report = aging.get_report()
+    assert Decimal(report["buckets"]["current"]) == 200
+    assert Decimal(report["buckets"]["1_30"]) == 50
+    assert Decimal(report["total"]) == 250
+
+
+def test_rebuild_replaces_legacy_company_document(db):
+    db.collection("ar_aging_totals").document(COMPANY).set(
+        {"company_id": COMPANY, "buckets_units": {"current": 999}, "total_units": 999}
+    )
+    db.collection("invoices").document("inv1").set(
+        {
+            "company_id": COMPANY,
+            "customer_id": "c1",
+            "payment_status": "partial",
+            "due_amount": "40",
+            "due_date": today_utc().isoformat(),
+        }
+    )
+    aging = ARAgingService(COMPANY, shards=3)
+
+    assert Decimal(aging.rebuild()["total"]) == 40
+    assert f"ar_aging_totals/{COMPANY}" not in db.docs
+    assert Decimal(aging.get_report()["total"]) == 40
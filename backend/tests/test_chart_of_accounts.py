@@ -0,0 +1,41 @@
+import pytest
+
+from app.services.accounting import AccountingService
+from app.services.chart_of_accounts import (
+    get_chart_of_accounts,
+    invalidate_chart_of_accounts,
+    resolve_account_id,
+)
+
+COMPANY = "acme"
+
+
+@pytest.fixture
+def accounting(db):
+    invalidate_chart_of_accounts()
+    yield AccountingService()
+    invalidate_chart_of_accounts()
+
+
+def test_account_changes_are_visible_through_the_cached_chart(accounting):
+    cash = accounting.create_account(COMPANY, {"code": "181", "name_en": "Cash", "type": "ASSET"})
+    assert resolve_account_id(COMPANY, "181") == cash["id"]
+
+    accounting.update_account(COMPANY, cash["id"], {"name_en": "Cash on hand", "code": "1811"})
+    chart = get_chart_of_accounts(COMPANY)
+    assert chart.account(cash["id"])["name_en"] == "Cash on hand"
+    assert chart.id_for("181") is None
+    assert chart.id_for("1811") == cash["id"]
+
+    accounting.deactivate_account(COMPANY, cash["id"])
+    assert get_chart_of_accounts(COMPANY).account(cash["id"])["active"] is False
+
+
+def test_account_codes_are_unique_per_company(accounting):
+    accounting.create_account(COMPANY, {"code": "41", "name_en": "Sales", "type": "REVENUE"})
+    accounting.create_account("globex", {"code": "41", "name_en": "Sales", "type": "REVENUE"})
+
+    with pytest.raises(ValueError, match="already exists"):
+        accounting.create_account(COMPANY, {"code": "41", "name_en": "Other", "type": "REVENUE"})
+    with pytest.raises(ValueError):
+        accounting.create_account(COMPANY, {"code": "42", "name_en": "Bad", "type": "INCOME"})
@@ -0,0 +1,37 @@
+from app.services.customer_search import build_search_fields, phone_search_keys, search_customers
+
+COMPANY = "acme"
+
+
+def _customer(db, doc_id, **fields):
+    customer = {"company_id": COMPANY, **fields}
+    db.collection("customers").document(doc_id).set({**customer, **build_search_fields(customer)})
+
+
+def test_partial_international_numbers_match_local_prefixes():
+    assert phone_search_keys("+964 770") == ["p:0770"]
+    assert phone_search_keys("00964 0770 12") == ["p:077012"]
+    assert phone_search_keys("964770") == ["p:0964770", "p:0770"]
+    assert phone_search_keys("+964") == []
+
+
+def test_search_by_partial_international_phone(db):
+    _customer(db, "ali", first_name="Ali", phone="0770 123 4567")
+    _customer(db, "omar", first_name="Omar", phone="0780 123 4567")
+
+    assert [doc.id for doc in search_customers(db, COMPANY, "+964 7701")] == ["ali"]
+    assert [doc.id for doc in search_customers(db, COMPANY, "9647701")] == ["ali"]
+    assert "phone_variants" not in db.docs["customers/ali"]
+
+
+def test_filtered_search_fills_the_page_past_non_matching_candidates(db):
+    for i in range(120):
+        _customer(db, f"a{i:03d}", first_name="Ahmed", last_name="Saleh")
+    for i in range(3):
+        _customer(db, f"b{i}", first_name="Ahmed", last_name="Kareem", status="active")
+
+    found = search_customers(db, COMPANY, "ahmed kareem", limit=2)
+    assert [doc.id for doc in found] == ["b0", "b1"]
+
+    active = search_customers(db, COMPANY, "ahmed", limit=5, keep=lambda data: data.get("status") == "active")
+    assert [doc.id for doc in active] == ["b0", "b1", "b2"]
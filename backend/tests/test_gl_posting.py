@@ -0,0 +1,121 @@
+import asyncio
+from datetime import date, datetime, timezone
+
+import pytest
+
+from app.core.config import settings
+from app.core.money import Money
+from app.schemas.accounting import JournalEntryCreate, JournalLineBase
+from app.services.accounting import AccountingService
+from app.services.chart_of_accounts import invalidate_chart_of_accounts
+from app.services.gl_balances import get_gl_balance_service
+from app.services.gl_cube import get_gl_cube_service
+from app.services.gl_outbox import get_gl_outbox_service
+from app.services.gl_snapshots import get_gl_snapshot_service
+from app.services.reporting import ReportingService
+
+COMPANY = "acme"
+
+
+@pytest.fixture
+def accounting(db):
+    invalidate_chart_of_accounts()
+    yield AccountingService()
+    invalidate_chart_of_accounts()
+
+
+def _accounts(accounting, *specs):
+    return [
+        accounting.create_account(COMPANY, {"code": code, "name_en": code, "type": kind})["id"]
+        for code, kind in specs
+    ]
+
+
+def _post(accounting, number, lines, on=None):
+    accounting.create_journal_entry(
+        JournalEntryCreate(
+            number=number,
+            date=on or datetime.now(timezone.utc),
+            lines=[
+                JournalLineBase(account_id=account_id, debit=debit, credit=credit)
+                for account_id, debit, credit in lines
+            ],
+            company_id=COMPANY,
+        )
+    )
+
+
+def _balance(db, account_id):
+    account = db.docs[f"accounts/{account_id}"]
+    return Money.parse(get_gl_balance_service().account_balance(account_id, account))
+
+
+def test_sharded_balance_equals_direct_balance(db, accounting):
+    sharded, direct, sales = _accounts(
+        accounting, ("1101", "ASSET"), ("1102", "ASSET"), ("4101", "REVENUE")
+    )
+    lines = [(sharded, "25.5", "0"), (direct, "25.5", "0"), (sales, "0", "51")]
+
+    _post(accounting, "JE-1", lines)
+    assert get_gl_balance_service().promote(sharded, shards=4) == 4
+    for number in ("JE-2", "JE-3", "JE-4"):
+        _post(accounting, number, lines)
+
+    # Balance as of promotion stays on the account; later postings are on shards
+    assert Money.read(db.docs[f"accounts/{sharded}"], "balance") == Money.parse("25.5")
+    assert db.rows("account_balance_shards")
+    assert _balance(db, sharded) == _balance(db, direct) == Money.parse("102")
+    assert _balance(db, sales) == Money.parse("-204")
+
+    report = asyncio.run(ReportingService().get_trial_balance(COMPANY))
+    nets = {row["account_id"]: Money.parse(row["net_balance"]) for row in report["rows"]}
+    assert nets[sharded] == nets[direct] == Money.parse("102")
+    assert report["total_debit"] == report["total_credit"]
+
+
+def test_outbox_drain_applies_each_entry_once(db, accounting, monkeypatch):
+    cash, sales = _accounts(accounting, ("1101", "ASSET"), ("4101", "REVENUE"))
+    monkeypatch.setattr(settings, "GL_POSTING_MODE", "outbox")
+    queued = AccountingService()
+
+    _post(queued, "JE-1", [(cash, "10", "0"), (sales, "0", "10")])
+    _post(queued, "JE-2", [(cash, "5", "0"), (sales, "0", "5")])
+    _post(queued, "JE-3", [(cash, "7", "0"), ("missing", "0", "7")])
+    assert _balance(db, cash) == Money()
+
+    outbox = get_gl_outbox_service()
+    first = outbox.drain_once()
+    assert (first["applied"], first["failed"]) == (2, 1)
+    assert outbox.drain_once()["applied"] == 0
+
+    assert _balance(db, cash) == Money.parse("15")
+    assert _balance(db, sales) == Money.parse("-15")
+    (failed,) = db.rows("gl_outbox")
+    assert failed["status"] == "failed"
+    assert failed["missing_accounts"] == ["missing"]
+
+
+def test_cube_totals_equal_trial_balance_for_a_period(db, accounting):
+    cash, stock, sales = _accounts(
+        accounting, ("1101", "ASSET"), ("1301", "ASSET"), ("4101", "REVENUE")
+    )
+    march = datetime(2026, 3, 10, tzinfo=timezone.utc)
+    _post(accounting, "JE-1", [(cash, "100", "0"), (sales, "0", "100")], march)
+    _post(accounting, "JE-2", [(stock, "40", "0"), (cash, "0", "40")], march.replace(day=31))
+    april = datetime(2026, 4, 2, tzinfo=timezone.utc)
+    _post(accounting, "JE-3", [(cash, "9", "0"), (sales, "0", "9")], april)
+
+    def cube_nets(first_day, last_day):
+        net = get_gl_cube_service(COMPANY).movements([(first_day, last_day)]).net()
+        return {account_id: Money(units) for account_id, (units,) in net.items()}
+
+    def trial_nets(rows):
+        nets = {row["account_id"]: Money.parse(row["net_balance"]) for row in rows}
+        return {account_id: net for account_id, net in nets.items() if net.units}
+
+    as_of_march = get_gl_snapshot_service(COMPANY).trial_balance_as_of(date(2026, 3, 31))
+    assert cube_nets("2026-03-01", "2026-03-31") == trial_nets(as_of_march["rows"])
+    assert cube_nets("2026-03-01", "2026-03-31")[cash] == Money.parse("60")
+
+    current = asyncio.run(ReportingService().get_trial_balance(COMPANY))
+    assert cube_nets("2026-03-01", "2026-04-30") == trial_nets(current["rows"])
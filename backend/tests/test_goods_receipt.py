@@ -0,0 +1,51 @@
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+import app.api as api  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+COMPANY = "acme"
+USER = {"uid": "u1", "company_id": COMPANY}
+
+
+def _item(db, item_id):
+    db.collection("items").document(item_id).set(
+        {"company_id": COMPANY, "current_qty": "0", "current_wac": "0"}
+    )
+
+
+def test_failed_chunk_leaves_receipt_resumable_without_double_counting(db, monkeypatch):
+    # Room for one product per chunk
+    monkeypatch.setattr(api, "FIRESTORE_WRITE_LIMIT", 6)
+    _item(db, "bolt")
+    receipt = {
+        "warehouse_id": "north",
+        "items": [
+            {"product_id": "bolt", "quantity": "10", "cost_price": "2"},
+            {"product_id": "nut", "quantity": "5", "cost_price": "1"},
+        ],
+    }
+
+    with pytest.raises(HTTPException) as failed:
+        api.create_goods_receipt(receipt, user=USER)
+    assert "resume" in failed.value.detail
+
+    (receipt_id,) = [path.split("/")[1] for path in db.docs if path.startswith("goods_receipts/")]
+    stored = db.docs[f"goods_receipts/{receipt_id}"]
+    assert (stored["status"], stored["chunks_applied"], stored["chunk_count"]) == ("receiving", 1, 2)
+    assert Decimal(db.docs["items/bolt"]["current_qty"]) == 10
+
+    _item(db, "nut")
+    assert api.resume_goods_receipt(receipt_id, user=USER)["status"] == "received"
+
+    assert db.docs[f"goods_receipts/{receipt_id}"]["status"] == "received"
+    assert Decimal(db.docs["items/bolt"]["current_qty"]) == 10
+    assert Decimal(db.docs["items/nut"]["current_qty"]) == 5
+    assert sorted(row["item_id"] for row in db.rows("stock_ledger")) == ["bolt", "nut"]
+    assert {row["warehouse_id"] for row in db.rows("stock_levels")} == {"north"}
+
+    with pytest.raises(HTTPException):
+        api.resume_goods_receipt(receipt_id, user=USER)
@@ -0,0 +1,73 @@
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+import app.api as api  # noqa: E402
+from app.services.stock_levels import get_stock_level_service  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+COMPANY = "acme"
+USER = {"uid": "u1", "company_id": COMPANY}
+
+
+def _invoice(warehouse_id):
+    return {
+        "customer_id": "c1",
+        "warehouse_id": warehouse_id,
+        "items": [{"product_id": "widget", "product_name": "Widget", "quantity": "4", "price": "8"}],
+        "total_amount": "32",
+        "amount_paid": "0",
+    }
+
+
+def _stock(db, warehouse_id):
+    db.collection("items").document("widget").set(
+        {"company_id": COMPANY, "name": "Widget", "current_qty": "0", "current_wac": "0"}
+    )
+    db.collection("customers").document("c1").set({"company_id": COMPANY, "balance": "0"})
+    api.create_goods_receipt(
+        {
+            "warehouse_id": warehouse_id,
+            "items": [{"product_id": "widget", "quantity": "10", "cost_price": "5"}],
+        },
+        user=USER,
+    )
+
+
+def test_invoice_rejects_stock_held_in_another_warehouse(db):
+    _stock(db, "north")
+
+    with pytest.raises(HTTPException) as rejected:
+        api.create_invoice(_invoice("main"), user=USER)
+    assert rejected.value.status_code == 400
+    assert "in warehouse main" in rejected.value.detail
+    assert db.rows("invoices") == []
+    assert Decimal(db.docs["items/widget"]["current_qty"]) == 10
+    assert Decimal(db.docs["customers/c1"]["balance"]) == 0
+
+    api.create_invoice(_invoice("north"), user=USER)
+    assert Decimal(db.docs["items/widget"]["current_qty"]) == 6
+    assert Decimal(db.docs["customers/c1"]["balance"]) == 32
+    locations = get_stock_level_service(COMPANY).item_locations("widget")
+    assert {row["warehouse_id"]: row["quantity"] for row in locations} == {"north": "6"}
+
+
+def test_bulk_replay_creates_each_invoice_once(db):
+    _stock(db, "main")
+    queued = [
+        {**_invoice("main"), "idempotency_key": "pos1-1"},
+        {**_invoice("main"), "idempotency_key": "pos1-2"},
+        {**_invoice("main"), "idempotency_key": "pos1-1"},
+    ]
+
+    first = api.create_invoices_bulk({"invoices": queued}, user=USER)
+    assert [r["status"] for r in first["results"]] == ["created", "created", "duplicate"]
+    replay = api.create_invoices_bulk({"invoices": queued[:2]}, user=USER)
+    assert [r["status"] for r in replay["results"]] == ["duplicate", "duplicate"]
+    assert replay["results"][0]["id"] == first["results"][0]["id"]
+
+    assert len(db.rows("invoices")) == 2
+    assert Decimal(db.docs["items/widget"]["current_qty"]) == 2
+    assert Decimal(db.docs["customers/c1"]["balance"]) == 64
@@ -0,0 +1,53 @@
+import pytest
+from google.cloud import firestore
+
+pytest.importorskip("pydantic_settings")
+
+from app.core.config import Settings, settings  # noqa: E402
+from app.services.numbering import NumberingService, get_numbering_service  # noqa: E402
+
+COMPANY = "acme"
+
+
+def _create_document(db, numbering, fail=False):
+    """A document transaction claiming its number the way credit notes do."""
+
+    @firestore.transactional
+    def _execute(transaction):
+        snapshots = {
+            snap.reference.path: snap
+            for snap in db.get_all(numbering.transaction_refs("credit_note", 2026), transaction=transaction)
+        }
+        number = numbering.claim(transaction, "credit_note", snapshots, 2026)
+        if fail:
+            raise ValueError("posting failed")
+        transaction.set(db.collection("credit_notes").document(), {"number": number})
+        return number
+
+    return _execute(db.transaction())
+
+
+def test_aborted_document_does_not_consume_a_number(db):
+    numbering = get_numbering_service(COMPANY)
+
+    assert _create_document(db, numbering) == "CN-2026-000001"
+    with pytest.raises(ValueError):
+        _create_document(db, numbering, fail=True)
+    assert _create_document(db, numbering) == "CN-2026-000002"
+
+    assert numbering.get_current_number("credit_note", 2026) == 2
+    assert sorted(row["number"] for row in db.rows("credit_notes")) == ["CN-2026-000001", "CN-2026-000002"]
+
+
+def test_default_gapless_sequences_never_use_blocks(db, monkeypatch):
+    default = Settings.model_fields["GAPLESS_SEQUENCES"].default
+    monkeypatch.setattr(settings, "GAPLESS_SEQUENCES", default)
+    monkeypatch.setattr(NumberingService, "_blocks", {})
+    numbering = NumberingService(COMPANY, block_size=50)
+
+    assert "sales_invoice" in numbering.gapless_types
+    for doc_type in numbering.gapless_types:
+        numbering.get_next_number(doc_type)
+        numbering.get_next_number(doc_type)
+        assert numbering.get_current_number(doc_type) == 2
+    assert NumberingService._blocks == {}
@@ -0,0 +1,20 @@
+import pytest
+
+pytest.importorskip("pypdf")
+pytest.importorskip("reportlab")
+
+from app.services.rendering import get_batch_renderer  # noqa: E402
+
+COMPANY = "acme"
+
+
+def test_fetch_rejects_other_and_unstamped_companies(db):
+    db.collection("invoices").document("own").set({"company_id": COMPANY})
+    db.collection("invoices").document("other").set({"company_id": "globex"})
+    db.collection("invoices").document("legacy").set({"invoice_number": "INV-1"})
+    renderer = get_batch_renderer(COMPANY)
+
+    assert [doc_id for _, doc_id, _ in renderer.fetch([("invoice", "own")])] == ["own"]
+    for doc_id in ("other", "legacy"):
+        with pytest.raises(ValueError, match="Not found"):
+            renderer.fetch([("invoice", doc_id)])
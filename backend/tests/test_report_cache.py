@@ -0,0 +1,30 @@
+from app.services.report_cache import MISS, ReportCache
+
+
+def test_scopes_are_bounded_by_the_larger_tier():
+    cache = ReportCache(memory_entries=4, directory=None, disk_entries=0)
+    for day in range(100):
+        cache.put("acme", "trial_balance", {"as_of": f"2026-01-{day}"}, "1:1", day)
+
+    assert cache.stats()["tracked_scopes"] == 4
+    assert cache.stats()["memory_entries"] == 4
+    assert cache.get("acme", "trial_balance", {"as_of": "2026-01-99"}, "1:1") == 99
+
+
+def test_newer_result_replaces_older_on_disk(tmp_path):
+    cache = ReportCache(memory_entries=0, directory=str(tmp_path), disk_entries=10)
+    params = {"period": "2026-01"}
+    cache.put("acme", "income_statement", params, "1:1", "old")
+    cache.put("acme", "income_statement", params, "1:2", "new")
+
+    assert len(list(tmp_path.glob("*.pkl"))) == 1
+    assert cache.get("acme", "income_statement", params, "1:1") is MISS
+    assert cache.get("acme", "income_statement", params, "1:2") == "new"
+
+    cache.invalidate("acme")
+    assert cache.stats()["tracked_scopes"] == 0
+
+
+def test_relative_directory_turns_the_disk_tier_off():
+    cache = ReportCache(memory_entries=4, directory=".report_cache", disk_entries=10)
+    assert cache.stats()["disk_dir"] is None
@@ -0,0 +1,66 @@
+from decimal import Decimal
+
+import pytest
+
+from app.services.returns import get_return_service
+
+COMPANY = "acme"
+
+
+def _seed(db, due):
+    db.collection("items").document("widget").set(
+        {"company_id": COMPANY, "current_qty": "6", "current_wac": "5", "total_value": "30"}
+    )
+    db.collection("stock_cost_layers").document("layer5").set(
+        {"company_id": COMPANY, "product_id": "widget", "unit_cost": "5.00", "qty_on_hand": "6"}
+    )
+    db.collection("invoices").document("inv1").set(
+        {
+            "company_id": COMPANY,
+            "customer_id": "c1",
+            "items": [
+                {"product_id": "widget", "quantity": "2", "price": "8"},
+                {"product_id": "widget", "quantity": "2", "price": "8"},
+            ],
+            "cost_consumption": [],
+            "total_amount": "32",
+            "amount_paid": str(32 - due),
+            "due_amount": str(due),
+            "payment_status": "partial",
+            "aging_bucket": "current",
+        }
+    )
+
+
+def test_settling_return_marks_invoice_paid_and_joins_existing_layer(db):
+    _seed(db, due=16)
+
+    get_return_service(COMPANY).process_return(
+        "inv1",
+        {
+            "items": [
+                {"product_id": "widget", "quantity": "2", "line_index": 0},
+                {"product_id": "widget", "quantity": "2", "line_index": 1},
+            ],
+            "total_refund": "32",
+        },
+        {"uid": "u1"},
+    )
+
+    invoice = db.docs["invoices/inv1"]
+    assert invoice["payment_status"] == "paid"
+    assert invoice["aging_bucket"] is None
+    assert Decimal(invoice["due_amount"]) == 0
+
+    layers = db.rows("stock_cost_layers")
+    assert len(layers) == 1
+    assert Decimal(layers[0]["qty_on_hand"]) == Decimal("10")
+
+
+def test_unparseable_quantity_is_a_value_error(db):
+    _seed(db, due=16)
+
+    with pytest.raises(ValueError):
+        get_return_service(COMPANY).process_return(
+            "inv1", {"items": [{"product_id": "widget", "quantity": "two"}]}, {"uid": "u1"}
+        )
@@ -0,0 +1,36 @@
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from app.api import adjust_stock, create_product_inbound  # noqa: E402
+from app.services.stock_levels import get_stock_level_service  # noqa: E402
+
+COMPANY = "acme"
+USER = {"uid": "u1", "company_id": COMPANY}
+
+
+def test_rebuild_keeps_api_movements_in_their_warehouse(db):
+    db.collection("items").document("widget").set(
+        {"company_id": COMPANY, "name": "Widget", "current_qty": "0", "current_wac": "5"}
+    )
+    create_product_inbound(
+        {"product_id": "widget", "quantity": "10", "unit_cost": "5", "warehouse_id": "north"},
+        user=USER,
+    )
+    adjust_stock("widget", -3, "damaged", None, "north", None, user=USER)
+    adjust_stock("widget", 2, "count", None, None, None, user=USER)
+
+    levels = get_stock_level_service(COMPANY)
+    before = {row["warehouse_id"]: row["quantity"] for row in levels.item_locations("widget")}
+    assert before == {"main": "2", "north": "7"}
+
+    result = levels.rebuild()
+    assert result["adjustment_rows"] == 3
+    assert result["items_reconciled"] == 0
+    after = {row["warehouse_id"]: row["quantity"] for row in levels.item_locations("widget")}
+    assert after == before
+
+    transaction = db.transaction()
+    assert levels.available_in(transaction, "north", ["widget"]) == {"widget": Decimal("7")}
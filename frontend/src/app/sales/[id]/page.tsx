@@ -5,7 +5,7 @@ import { onAuthStateChanged, User } from "firebase/auth";
 import { useRouter, useParams } from "next/navigation";
 import { ArrowLeft, Printer, Download, CreditCard, CheckCircle, Ban, AlertCircle, Calendar, User as UserIcon, Phone, MapPin, Receipt } from "lucide-react";
 import { auth } from "@/lib/firebase";
-import { fetchWithAuth } from "@/lib/api";
+import { fetchWithAuth, openWithAuth } from "@/lib/api";
 
 function formatIQD(val: any): string {
     const n = Number(val || 0);
@@ -154,7 +154,7 @@ export default function InvoiceDetailsPage() {
                         <Phone size={18} /> WhatsApp
                     </button>
                     <button
-                        onClick={() => window.open(`/api/sales/invoices/${id}/pdf`, '_blank')}
+                        onClick={() => openWithAuth(`/api/sales/invoices/${id}/pdf`).catch(() => alert("Could not open invoice"))}
                         className="flex items-center gap-2 px-4 py-2 bg-slate-100 text-slate-700 rounded-xl font-bold hover:bg-slate-200 transition-colors"
                     >
                         <Printer size={18} /> Print
@@ -8,7 +8,7 @@ import { Plus, TrendingUp, CheckCircle, Clock } from "lucide-react";
 import { useLanguage } from "@/contexts/LanguageContext";
 import { auth } from "@/lib/firebase";
 import { useRouter } from "next/navigation";
-import { fetchWithAuth } from "@/lib/api";
+import { fetchWithAuth, openWithAuth } from "@/lib/api";
 
 export default function InvoicesPage() {
     const [invoices, setInvoices] = useState<any[]>([]);
@@ -85,7 +85,7 @@ export default function InvoicesPage() {
         if (action === 'view') {
             router.push(`/sales/${invoice.id}`);
         } else if (action === 'print') {
-            window.open(`/api/sales/invoices/${invoice.id}/pdf`, '_blank');
+            openWithAuth(`/api/sales/invoices/${invoice.id}/pdf`).catch(() => alert("Could not open invoice"));
         } else if (action === 'whatsapp') {
             const text = `Hello ${invoice.customer_name || 'Valued Customer'},%0A%0AHere is your invoice *${invoice.invoice_number}* for *${Number(invoice.total).toLocaleString()} IQD*.%0A%0AThank you for your business!`;
             const phone = invoice.customer_phone || prompt("Enter customer phone number (e.g., 9647xxxxxxxxx):");
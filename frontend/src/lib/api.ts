@@ -74,3 +74,26 @@ export async function fetchJsonWithAuth<T>(url: string, options: RequestInit = {
     }
     return response.json() as Promise<T>;
 }
+
+// Opens an authenticated document (e.g. an invoice print view) in a new tab.
+// The tab is opened synchronously so popup blockers tie it to the click, then
+// filled with the response as a blob URL once the request completes.
+export async function openWithAuth(url: string) {
+    const popup = window.open("", "_blank");
+    try {
+        const response = await fetchWithAuth(url);
+        if (!response.ok) {
+            throw new Error(`Request failed: ${response.status}`);
+        }
+        const blobUrl = URL.createObjectURL(await response.blob());
+        if (popup) {
+            popup.location.href = blobUrl;
+        } else {
+            window.open(blobUrl, "_blank");
+        }
+        setTimeout(() => URL.revokeObjectURL(blobUrl), 60000);
+    } catch (error) {
+        popup?.close();
+        throw error;
+    }
+}